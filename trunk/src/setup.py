@@ -977,12 +977,14 @@ if 'clean' in sys.argv or 'sdist' in sys.argv:
                    "xpra/codecs/csc_swscale/colorspace_converter.c",
                    "xpra/codecs/xor/cyxor.c",
                    "xpra/codecs/argb/argb.c",
+                   "xpra/codecs/palette/palette.c",
                    "xpra/codecs/nvapi_version.c",
                    "xpra/gtk_common/gdk_atoms.c",
                    "xpra/client/gtk3/cairo_workaround.c",
                    "xpra/server/cystats.c",
                    "xpra/server/window/region.c",
                    "xpra/server/window/motion.c",
+                   "xpra/server/window/tiles.c",
                    "xpra/server/pam.c",
                    "etc/xpra/xpra.conf",
                    #special case for the generated xpra conf files in build (see #891):
@@ -2001,6 +2003,12 @@ if clipboard_ENABLED:
                              **pkgconfig(*PYGTK_PACKAGES, ignored_tokens=gtk2_ignored_tokens)
                              ))
 
+toggle_packages(server_ENABLED or shadow_ENABLED, "xpra.codecs.palette")
+if server_ENABLED or shadow_ENABLED:
+    cython_add(Extension("xpra.codecs.palette.palette",
+                ["xpra/codecs/palette/palette.pyx"],
+                **pkgconfig(optimize=3)))
+
 toggle_packages(client_ENABLED or server_ENABLED, "xpra.codecs.xor")
 if client_ENABLED or server_ENABLED:
     cython_add(Extension("xpra.codecs.xor.cyxor",
@@ -2018,6 +2026,9 @@ if server_ENABLED or shadow_ENABLED:
     cython_add(Extension("xpra.server.window.motion",
                 ["xpra/server/window/motion.pyx"],
                 **O3_pkgconfig))
+    cython_add(Extension("xpra.server.window.tiles",
+                ["xpra/server/window/tiles.pyx"],
+                **O3_pkgconfig))
 
 if sd_listen_ENABLED:
     sdp = pkgconfig("libsystemd")
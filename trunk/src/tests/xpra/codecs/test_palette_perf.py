@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+#compares the exact palette encoder with the Pillow png and webp encoders,
+#using the frames captured in damage traces (see XPRA_DAMAGE_TRACE),
+#or a generated terminal window if no trace files are specified:
+#python ./tests/xpra/codecs/test_palette_perf.py [damage-trace-files]
+
+import sys
+import time
+
+from xpra.codecs.image_wrapper import ImageWrapper
+
+
+def make_terminal_image(w=1280, h=800):
+    from PIL import Image, ImageDraw    #@UnresolvedImport
+    img = Image.new("RGB", (w, h), (30, 30, 30))
+    draw = ImageDraw.Draw(img)
+    #no anti-aliasing, like most terminal fonts:
+    draw.fontmode = "1"
+    colors = ((220, 220, 220), (80, 200, 80), (90, 140, 250), (230, 200, 60), (240, 80, 80))
+    words = ("def", "return", "self", "import", "xpra", "window", "encode", "palette", "=", "(", ")", ":")
+    y = 2
+    i = 0
+    while y<h-12:
+        x = 4+(i%4)*16
+        while x<w-80:
+            word = words[(i*7+x) % len(words)]
+            draw.text((x, y), word, fill=colors[(i+x//50) % len(colors)])
+            x += 8*len(word)+8
+            i += 1
+        y += 14
+    rgbx = img.convert("RGBX").tobytes("raw", "BGRX")
+    return ImageWrapper(0, 0, w, h, rgbx, "BGRX", 24, w*4, 4)
+
+def load_trace_images(filename):
+    from xpra.server.window.damage_trace import load_damage_trace
+    images = []
+    for record in load_damage_trace(filename):
+        if record[0]=="pixels":
+            x, y, w, h, pixel_format, depth, bpp, rowstride, data = record[2:]
+            images.append(ImageWrapper(x, y, w, h, data, pixel_format, depth, rowstride, bpp))
+    return images
+
+def test_encoders(images, N=3):
+    from xpra.codecs.palette.encode import encode as palette_encode
+    from xpra.codecs.pillow.encode import encode as pillow_encode, get_encodings
+    def palette(image):
+        return palette_encode(image, 50, False)
+    encoders = [("palette", palette)]
+    for coding in ("png", "png/P", "webp"):
+        if coding in get_encodings():
+            def pillow(image, coding=coding):
+                return pillow_encode(coding, image, 100, 50, False)
+            encoders.append((coding, pillow))
+    pixels = sum(image.get_width()*image.get_height() for image in images)
+    print("%i frames, %.1f MPixels" % (len(images), pixels/1000.0/1000.0))
+    print(" %-8s %10s %10s %8s" % ("encoder", "KBytes", "cpu (ms)", "frames"))
+    for name, encode in encoders:
+        size = 0
+        frames = 0
+        start = time.clock() if sys.version_info[0]<3 else time.process_time()
+        for _ in range(N):
+            size = 0
+            frames = 0
+            for image in images:
+                ret = encode(image)
+                if ret:
+                    size += len(ret[1].data)
+                    frames += 1
+        end = time.clock() if sys.version_info[0]<3 else time.process_time()
+        #(the palette encoder skips the frames with too many colours)
+        print(" %-8s %10i %10i %8i" % (name, size//1024, (end-start)*1000/N, frames))
+
+
+def main():
+    images = []
+    for filename in sys.argv[1:]:
+        images += load_trace_images(filename)
+    if not images:
+        images = [make_terminal_image()]
+    test_encoders(images)
+
+
+if __name__ == "__main__":
+    main()
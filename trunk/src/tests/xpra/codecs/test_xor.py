@@ -7,7 +7,7 @@
 import time
 
 from tests.xpra.codecs.test_codec import get_source_data
-from xpra.codecs.xor.cyxor import xor_str     #@UnresolvedImport
+from xpra.codecs.xor.cyxor import xor_str, xor_into, xor_rows     #@UnresolvedImport
 
 N = 10
 
@@ -28,8 +28,18 @@ def test_xor_str():
     print("test_xor_str()")
     _test_functions(xor_str)
 
+def test_xor_into():
+    print("test_xor_into()")
+    out = bytearray(1024*1024*4)
+    def xor_into_buffer(s1, s2):
+        return xor_into(s1, s2, out)
+    def xor_rows_buffer(s1, s2):
+        return xor_rows(s1, s2, out, 1024*4)
+    _test_functions(xor_into_buffer, xor_rows_buffer)
+
 def main():
     test_xor_str()
+    test_xor_into()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+# Measures how many 3840x2160 frames per second can be sent through the mmap path,
+# copying the pixels via an intermediate buffer (XPRA_MMAP_DIRECT=0)
+# versus copying the rows straight into the mmap area.
+
+import mmap
+import time
+
+from xpra.codecs.image_wrapper import ImageWrapper
+from xpra.net.mmap_pipe import int_from_buffer
+from xpra.server import picture_encode
+
+N = 100
+MMAP_SIZE = 256*1024*1024
+WIDTH, HEIGHT = 3840, 2160
+#full screen capture, and a window in the middle of the screen
+#(a sub-image of the XShm capture, so the rows are padded):
+CAPTURES = {
+    "full-screen"   : (WIDTH, HEIGHT, WIDTH*4),
+    "window"        : (WIDTH-512, HEIGHT-256, WIDTH*4),
+    }
+
+
+def measure(name, width, height, rowstride, direct):
+    picture_encode.MMAP_DIRECT = direct
+    area = mmap.mmap(-1, MMAP_SIZE)
+    data_start = int_from_buffer(area, 0)
+    pixels = bytearray(rowstride*height)
+    start = time.time()
+    for _ in range(N):
+        image = ImageWrapper(0, 0, width, height, memoryview(pixels), "BGRX", 24, rowstride, 4)
+        mmap_data, _, _, _ = picture_encode.mmap_send(area, MMAP_SIZE, image, ("BGRX", ), False)
+        assert mmap_data
+        #the client has read the frame:
+        offset, length = mmap_data[-1]
+        data_start.value = offset+length
+    elapsed = max(0.000001, time.time()-start)
+    mode = ["copy", "direct"][int(direct)]
+    print("%-12s %-6s: %6.1f fps, %8.1fMB/s" % (name, mode, N/elapsed, N*width*height*4/elapsed/1024/1024))
+    del data_start
+    area.close()
+
+
+def main():
+    for name, (width, height, rowstride) in CAPTURES.items():
+        for direct in (False, True):
+            measure(name, width, height, rowstride, direct)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+# Measures the CPU time the proxy spends per megabyte of server packets,
+# when it decodes and re-encodes every packet,
+# and when it forwards them without decoding them (Protocol.forward_filter).
+
+import os
+import sys
+import time
+import random
+
+from xpra.os_util import Queue
+from xpra.net.protocol import Protocol, RawPacket
+from xpra.net.compression import Compressed
+#the test doubles are shared with the unit tests:
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "unittests"))
+from unit.net.protocol_test_util import make_protocol, make_stream   #@UnresolvedImport
+
+READ_SIZE = 65536
+TOTAL_MB = 64
+
+
+def session_packets(size):
+    """ a mix of screen updates, cursors and small control packets, about 'size' bytes """
+    r = random.Random(0)
+    packets = []
+    total = 0
+    seq = 0
+    while total<size:
+        seq += 1
+        w, h = r.choice(((64, 16), (640, 32), (1280, 720)))
+        pixels = bytes(bytearray(r.getrandbits(8) for _ in range(256)))*(w*h*4//256)
+        packets.append(["draw", 1, 0, 0, w, h, "rgb32", Compressed("rgb32", pixels), seq, w*4, {}])
+        packets.append(["cursor", "png", 10, 10, 32, 32, 4, 4, seq, b"\0"*400, "xterm"])
+        packets.append(["window-metadata", 1, {"title" : "terminal %i" % seq}])
+        packets.append(["ping", seq, seq])
+        total += len(pixels)+600
+    return packets
+
+def make_chunks(packets):
+    stream = make_stream(make_protocol(None, "zlib"), packets)
+    return [stream[i:i+READ_SIZE] for i in range(0, len(stream), READ_SIZE)]
+
+
+def proxy(chunks, forward):
+    #the client side protocol, we just discard what it would write:
+    client = make_protocol(None, "zlib")
+    written = []
+    def raw_write(items, *_args):
+        written.append(sum(len(x) for x in items))
+    client.raw_write = raw_write
+    def process_packet(_proto, packet):
+        if packet[0]==Protocol.CONNECTION_LOST:
+            return
+        if packet[0]==b"draw" and not isinstance(packet, RawPacket):
+            #what the proxy does with the pixels it does not re-encode:
+            packet[7] = Compressed("pixels", packet[7])
+        client._add_packet_to_queue(packet)
+    server = make_protocol(process_packet, "zlib")
+    if forward:
+        server.forward_filter = lambda packet_type, _flags, _levels : packet_type!=b"hello"
+    server._read_queue = Queue()
+    for chunk in chunks:
+        server._read_queue.put(chunk)
+    server._read_queue.put(None)
+    start = time.process_time()
+    server.do_read_parse_thread_loop()
+    return time.process_time()-start, sum(written)
+
+
+def main():
+    chunks = make_chunks(session_packets(TOTAL_MB*1024*1024))
+    mb = sum(len(x) for x in chunks)/1024.0/1024
+    print("%.1fMB of server packets" % mb)
+    for name, forward in (("decode", False), ("forward", True)):
+        elapsed, written = proxy(chunks, forward)
+        print("%-8s: %6.2fms CPU per MB, %.1fMB sent to the client" % (name, 1000*elapsed/mb, written/1024.0/1024))
+
+
+if __name__ == "__main__":
+    main()
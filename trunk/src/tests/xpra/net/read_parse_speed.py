@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+# Feeds synthetic chunked packet streams through Protocol.do_read_parse_thread_loop
+# and reports the parsing throughput and the memory allocated while parsing.
+# The old concatenating read buffer is emulated for comparison.
+
+import os
+import sys
+import time
+import tracemalloc
+
+from xpra.os_util import Queue
+from xpra.net.compression import Compressed
+from xpra.net.header import unpack_header
+#the test doubles are shared with the unit tests:
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "unittests"))
+from unit.net.protocol_test_util import make_protocol, make_stream   #@UnresolvedImport
+
+READ_SIZE = 65536
+SIZES_MB = (1, 4, 16, 64)
+
+
+def make_chunks(size):
+    pixels = b"\x80"*size
+    stream = make_stream(make_protocol(), [["draw", 1, 0, 0, 1024, 1024, "rgb32", Compressed("rgb32", pixels), 1, 4096, {}]])
+    return [stream[i:i+READ_SIZE] for i in range(0, len(stream), READ_SIZE)]
+
+
+def ringbuffer_parse(chunks):
+    count = []
+    def process_packet(_proto, packet):
+        count.append(packet[0])
+    p = make_protocol(process_packet)
+    p._read_queue = Queue()
+    for chunk in chunks:
+        p._read_queue.put(chunk)
+    p._read_queue.put(None)
+    p.do_read_parse_thread_loop()
+    return len(count)-1     #ignore connection-lost
+
+def concat_parse(chunks):
+    #the old code path: read_buffer = read_buffer + buf, read_buffer = read_buffer[8:]
+    count = 0
+    read_buffer = b""
+    payload_size = -1
+    for buf in chunks:
+        read_buffer = read_buffer + buf
+        while True:
+            if payload_size<0:
+                if len(read_buffer)<8:
+                    break
+                payload_size = unpack_header(read_buffer[:8])[-1]
+                read_buffer = read_buffer[8:]
+            if len(read_buffer)<payload_size:
+                break
+            _raw = read_buffer[:payload_size]
+            read_buffer = read_buffer[payload_size:]
+            payload_size = -1
+            count += 1
+    return count
+
+
+def measure(name, fn, chunks, size):
+    tracemalloc.start()
+    start = time.time()
+    fn(chunks)
+    end = time.time()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    elapsed = max(0.000001, end-start)
+    print("%-12s %3iMB: %7.1fMB/s, peak allocation %7.1fMB" % (name, size//1024//1024, size/elapsed/1024/1024, peak/1024.0/1024))
+
+
+def main():
+    for mb in SIZES_MB:
+        size = mb*1024*1024
+        chunks = make_chunks(size)
+        measure("ring-buffer", ringbuffer_parse, chunks, size)
+        measure("concatenate", concat_parse, chunks, size)
+
+
+if __name__ == "__main__":
+    main()
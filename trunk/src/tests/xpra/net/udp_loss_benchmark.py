@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+# Measures the latency of pixel packets sent over the UDP transport
+# through an in-process lossy link (like netem: loss, delay and jitter),
+# the protocols on both ends are real, only the sockets are simulated.
+# XPRA_UDP_FEC=1 python ./tests/xpra/net/udp_loss_benchmark.py
+
+import os
+import sys
+import time
+import heapq
+import random
+import itertools
+from threading import Thread, Condition
+
+from xpra.os_util import monotonic_time, memoryview_to_bytes, bytestostr, Queue
+from xpra.net.udp_protocol import UDPClientProtocol
+
+FRAMES = int(os.environ.get("FRAMES", 150))
+FPS = int(os.environ.get("FPS", 30))
+FRAME_SIZE = int(os.environ.get("FRAME_SIZE", 64*1024))
+DELAY = int(os.environ.get("DELAY", 20))        #one way, in milliseconds
+JITTER = int(os.environ.get("JITTER", 2))
+MTU = 1400
+LOSS = (0, 1, 5, 10)
+
+
+class Scheduler(object):
+    """ a minimal main loop: runs the timers in a single thread """
+
+    def __init__(self):
+        self.timers = []
+        self.cancelled = set()
+        self.counter = itertools.count(1)
+        self.cond = Condition()
+        t = Thread(target=self.run, name="main-loop")
+        t.daemon = True
+        t.start()
+
+    def timeout_add(self, delay, fn, *args):
+        tid = next(self.counter)
+        with self.cond:
+            heapq.heappush(self.timers, (monotonic_time()+delay/1000.0, tid, fn, args))
+            self.cond.notify()
+        return tid
+
+    def idle_add(self, fn, *args):
+        return self.timeout_add(0, fn, *args)
+
+    def source_remove(self, tid):
+        with self.cond:
+            self.cancelled.add(tid)
+
+    def run(self):
+        while True:
+            with self.cond:
+                while True:
+                    wait = None
+                    if self.timers:
+                        wait = self.timers[0][0]-monotonic_time()
+                        if wait<=0:
+                            _, tid, fn, args = heapq.heappop(self.timers)
+                            break
+                    self.cond.wait(wait)
+                if tid in self.cancelled:
+                    self.cancelled.remove(tid)
+                    continue
+            fn(*args)
+
+
+class LossyLink(object):
+    """ drops, delays and jitters the datagrams sent through it, in one direction """
+
+    def __init__(self, deliver, loss=0, delay=0, jitter=0):
+        self.deliver = deliver
+        self.loss = loss
+        self.delay = delay
+        self.jitter = jitter
+        self.sent = 0
+        self.dropped = 0
+        self.queue = []
+        self.counter = itertools.count()
+        self.cond = Condition()
+        t = Thread(target=self.run, name="link")
+        t.daemon = True
+        t.start()
+
+    def send(self, data):
+        self.sent += 1
+        if random.random()*100<self.loss:
+            self.dropped += 1
+            return len(data)
+        due = monotonic_time() + max(0, self.delay+random.uniform(-self.jitter, self.jitter))/1000.0
+        with self.cond:
+            heapq.heappush(self.queue, (due, next(self.counter), data))
+            self.cond.notify()
+        return len(data)
+
+    def run(self):
+        while True:
+            with self.cond:
+                while True:
+                    wait = None
+                    if self.queue:
+                        wait = self.queue[0][0]-monotonic_time()
+                        if wait<=0:
+                            data = heapq.heappop(self.queue)[2]
+                            break
+                    self.cond.wait(wait)
+            self.deliver(data)
+
+
+class LinkConnection(object):
+    """ the minimal connection interface used by the protocol, backed by a link """
+    can_writev = False
+
+    def __init__(self, name):
+        self.name = name
+        self.link = None
+        self.queue = Queue()
+        self.input_bytecount = 0
+        self.output_bytecount = 0
+
+    def __repr__(self):
+        return "LinkConnection(%s)" % self.name
+
+    def write(self, buf):
+        buf = memoryview_to_bytes(buf)
+        self.output_bytecount += len(buf)
+        return self.link.send(buf)
+
+    def read(self, _n):
+        buf = self.queue.get()
+        self.input_bytecount += len(buf)
+        return buf
+
+    def set_nodelay(self, _nodelay):
+        pass
+
+    def close(self):
+        self.queue.put(b"")
+
+    def get_info(self):
+        return {}
+
+
+def run(loss):
+    scheduler = Scheduler()
+    received = {}
+    sent = {}
+    def process_packet(proto, packet):
+        packet_type = bytestostr(packet[0])
+        if packet_type=="udp-control":
+            scheduler.idle_add(proto.process_control, *packet[1:])
+        elif packet_type=="draw":
+            frame = packet[1]
+            if frame not in received:
+                received[frame] = monotonic_time()-sent[frame]
+    server_conn, client_conn = LinkConnection("server"), LinkConnection("client")
+    server_conn.link = LossyLink(client_conn.queue.put, loss, DELAY, JITTER)
+    client_conn.link = LossyLink(server_conn.queue.put, loss, DELAY, JITTER)
+    server = UDPClientProtocol(scheduler, server_conn, process_packet)
+    client = UDPClientProtocol(scheduler, client_conn, process_packet)
+    for p in (server, client):
+        p.mtu = MTU
+        #normally negotiated in the hello packet:
+        p.remote_sack = True
+        p.large_packets.append(b"draw")
+        p.start()
+    payload = os.urandom(FRAME_SIZE)
+    def send_frame(frame):
+        def fail_cb():
+            #the server would encode this region again:
+            scheduler.idle_add(send_frame, frame)
+        server._add_packet_to_queue(["draw", frame, payload], fail_cb=fail_cb)
+    def send_new_frame(frame):
+        sent[frame] = monotonic_time()
+        send_frame(frame)
+        if frame+1<FRAMES:
+            scheduler.timeout_add(1000//FPS, send_new_frame, frame+1)
+    scheduler.idle_add(send_new_frame, 0)
+    end = monotonic_time()+FRAMES/FPS+20
+    while len(received)<FRAMES and monotonic_time()<end:
+        time.sleep(0.1)
+    latencies = sorted(v*1000 for v in received.values())
+    server_info, client_info = server.get_info(), client.get_info()
+    for p in (server, client):
+        p.close()
+    return latencies, server_conn.link, server_info, client_info
+
+
+def main():
+    print("%i frames of %iKB at %ifps, %ims delay, +-%ims jitter" % (FRAMES, FRAME_SIZE//1024, FPS, DELAY, JITTER))
+    print("%5s  %6s  %6s  %6s  %6s  %8s  %s" % ("loss", "frames", "median", "95%", "max", "packets", "resent"))
+    for loss in LOSS:
+        latencies, link, info, client_info = run(loss)
+        if not latencies:
+            print("%4i%%  no frames received" % loss)
+            continue
+        def pct(p):
+            return latencies[min(len(latencies)-1, len(latencies)*p//100)]
+        resent = info.get("resent", {})
+        fec = client_info.get("fec", {})
+        print("%4i%%  %6i  %5ims  %5ims  %5ims  %8i  nack=%s rto=%s fec=%s" % (
+            loss, len(latencies), pct(50), pct(95), latencies[-1], link.sent,
+            resent.get("nack", "?"), resent.get("rto", "?"), fec.get("recovered", "?")))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
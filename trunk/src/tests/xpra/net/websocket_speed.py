@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+# Compares the cost of the websocket framing done by websockify
+# with our own WebSocketProtocol, for the kind of traffic a 4K html5 client sees:
+# - sending: large draw packets, framed and written to a real socket
+# - receiving: masked frames, decoded and unmasked into the read buffer
+# python ./tests/xpra/net/websocket_speed.py
+
+import os
+import time
+import socket
+from threading import Thread
+
+from xpra.os_util import memoryview_to_bytes
+from xpra.net.header import pack_header
+from xpra.net.read_buffer import ReadBuffer
+from xpra.net.websocket_header import encode_hybi_header, OPCODE_BINARY
+from xpra.net.websocket_protocol import WebSocketProtocol
+from xpra.codecs.xor.cyxor import hybi_unmask
+
+N = 20
+#a lossy 4K frame, an uncompressed 4K frame:
+PACKET_SIZES = (1024*1024, 3840*2160*4)
+READ_SIZE = 65536
+
+
+def get_websockify_codec():
+    try:
+        #websockify 0.8.0 and earlier:
+        from websockify.websocket import WebSocketRequestHandler
+        def encode(buf):
+            return WebSocketRequestHandler.encode_hybi(buf, opcode=OPCODE_BINARY)[0]
+        def decode(buf):
+            f = WebSocketRequestHandler.decode_hybi(buf)
+            if f.get("payload") is None:
+                return None, buf
+            return f["payload"], buf[len(buf)-f["left"]:]
+    except ImportError:
+        from websockify.websocket import WebSocket
+        ws = WebSocket()
+        #same as what xpra.server.websocket does:
+        ws._unmask = lambda buf, mask: hybi_unmask(mask, buf)
+        def encode(buf):
+            return ws._encode_hybi(OPCODE_BINARY, buf)
+        def decode(buf):
+            f = ws._decode_hybi(buf)
+            if not f:
+                return None, buf
+            return f["payload"], buf[f["length"]:]
+    return encode, decode
+
+
+def drain(sock):
+    while sock.recv(1024*1024):
+        pass
+
+def timed_send(send_packet, packet, n=N):
+    a, b = socket.socketpair()
+    t = Thread(target=drain, args=(b,))
+    t.daemon = True
+    t.start()
+    start = time.process_time()
+    for _ in range(n):
+        send_packet(a, packet)
+    elapsed = time.process_time()-start
+    a.close()
+    t.join()
+    b.close()
+    return elapsed/n
+
+def websockify_send(encode):
+    #the previous WebSocketConnection.write() code path, called once for each item:
+    def send_packet(sock, items):
+        for item in items:
+            sock.sendall(encode(memoryview_to_bytes(item)))
+    return send_packet
+
+def native_send(sock, items):
+    #what WebSocketProtocol.raw_write + Protocol.writev_buffers do:
+    header = encode_hybi_header(OPCODE_BINARY, sum(len(x) for x in items))
+    buffers = [memoryview(header)]+[memoryview(x) for x in items]
+    while buffers:
+        written = sock.sendmsg(buffers)
+        while written>0:
+            l = len(buffers[0])
+            if written<l:
+                buffers[0] = buffers[0][written:]
+                break
+            written -= l
+            buffers.pop(0)
+
+
+def make_masked_stream(size):
+    #a browser sends masked frames, which we receive in READ_SIZE chunks:
+    mask = os.urandom(4)
+    payload = os.urandom(size)
+    frame = encode_hybi_header(OPCODE_BINARY, size, True) + mask + memoryview_to_bytes(hybi_unmask(mask, payload))
+    return [frame[i:i+READ_SIZE] for i in range(0, len(frame), READ_SIZE)]
+
+def websockify_receive(decode, chunks):
+    recv_part = b""
+    rb = ReadBuffer()
+    for chunk in chunks:
+        buf = recv_part+chunk
+        while buf:
+            payload, buf = decode(buf)
+            if payload is None:
+                break
+            rb.append(payload)
+        recv_part = buf
+    return len(rb)
+
+def native_receive(chunks):
+    class FakeScheduler(object):
+        def idle_add(self, fn, *args):
+            fn(*args)
+        timeout_add = source_remove = idle_add
+    p = WebSocketProtocol(FakeScheduler(), object(), None)
+    rb = ReadBuffer()
+    for chunk in chunks:
+        p.append_read_data(rb, chunk)
+    return len(rb)
+
+def timed_receive(fn, *args):
+    fn(*args)
+    start = time.process_time()
+    for _ in range(N):
+        fn(*args)
+    return (time.process_time()-start)/N
+
+
+def main():
+    encode, decode = get_websockify_codec()
+    for size in PACKET_SIZES:
+        packet = [pack_header(0, 0, 0, size), os.urandom(size)]
+        mb = size/1024.0/1024.0
+        print("sending %.1fMB packets:" % mb)
+        for name, send_packet in (("websockify", websockify_send(encode)), ("native", native_send)):
+            elapsed = timed_send(send_packet, packet)
+            print(" %-12s %6.1fms, %6iMB/s" % (name, elapsed*1000, mb/elapsed))
+        chunks = make_masked_stream(size)
+        print("receiving %.1fMB frames:" % mb)
+        for name, fn, args in (("websockify", websockify_receive, (decode, chunks)), ("native", native_receive, (chunks, ))):
+            elapsed = timed_receive(fn, *args)
+            print(" %-12s %6.1fms, %6iMB/s" % (name, elapsed*1000, mb/elapsed))
+
+
+if __name__ == "__main__":
+    main()
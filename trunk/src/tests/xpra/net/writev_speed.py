@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+# Compares the throughput of Protocol.write_buffers over a local socketpair
+# with one write() per buffer versus a single sendmsg() per packet.
+
+import os
+import sys
+import time
+import socket
+from threading import Thread
+
+from xpra.net.protocol import Protocol
+from xpra.net.bytestreams import SocketConnection
+from xpra.net.header import pack_header
+#the test doubles are shared with the unit tests:
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "unittests"))
+from unit.net.protocol_test_util import FakeScheduler   #@UnresolvedImport
+
+N = 20000
+#header, main packet and compressed pixel chunks:
+PACKET_SIZES = {
+    "small"  : (1024, ),
+    "pixels" : (8*1024, 64*1024, 64*1024),
+    "large"  : (256*1024, 1024*1024),
+    }
+
+
+def drain(sock, total):
+    received = 0
+    while received<total:
+        data = sock.recv(1024*1024)
+        if not data:
+            break
+        received += len(data)
+
+def make_buffers(sizes):
+    buffers = []
+    for i, size in enumerate(sizes):
+        buffers.append(pack_header(0, 0, len(sizes)-1-i, size))
+        buffers.append(b"\0"*size)
+    return buffers
+
+def measure(name, sizes, writev, count):
+    s1, s2 = socket.socketpair()
+    conn = SocketConnection(s1, "local", "remote", "target", "unix-domain")
+    conn.can_writev = writev and conn.can_writev
+    protocol = Protocol(FakeScheduler(), conn, None)
+    buffers = make_buffers(sizes)
+    total = sum(len(x) for x in buffers)*count
+    t = Thread(target=drain, args=(s2, total))
+    t.start()
+    start = time.time()
+    for _ in range(count):
+        protocol.write_buffers(buffers, None, True)
+    t.join()
+    end = time.time()
+    elapsed = max(0.000001, end-start)
+    mode = ["write", "writev"][int(conn.can_writev)]
+    print("%-8s %-6s: %8.1fMB/s, %6i packets/s, %.1f system calls per packet" % (
+        name, mode, total/elapsed/1024/1024, count/elapsed, float(conn.output_writecount)/count))
+    s1.close()
+    s2.close()
+
+
+def main():
+    for name, sizes in PACKET_SIZES.items():
+        count = max(100, N*1024//sum(sizes))
+        for writev in (False, True):
+            measure(name, sizes, writev, count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+# Measures the bytes on the wire per second of a simulated interactive session
+# (mostly small control packets) with each compressor,
+# and with zstd using a dictionary trained on a different part of the session.
+
+import random
+
+from xpra.net.bencode import bencode
+from xpra.net.compression import zcompress, lz4_compress, has_lz4, has_zstd
+from xpra.net.protocol import MIN_COMPRESS_SIZE, ZSTD_DICT_MIN_COMPRESS_SIZE
+
+SECONDS = 60
+LEVEL = 1
+
+
+def session_packets(seconds, seed):
+    """ the packets sent by a client and a server during 'seconds' of interactive use """
+    r = random.Random(seed)
+    packets = []
+    seq = 0
+    for t in range(seconds*60):
+        now = t*16
+        wid = r.randint(1, 6)
+        x, y = r.randint(0, 3839), r.randint(0, 2159)
+        #pointer motion, every frame:
+        packets.append(["pointer-position", wid, (x, y), ["mod2"], []])
+        if t%2==0:
+            #a screen update and its acknowledgement:
+            seq += 1
+            packets.append(["damage-sequence", seq, wid, r.randint(10, 1920), r.randint(10, 1080), r.randint(1, 40), ""])
+        if t%12==0:
+            packets.append(["key-action", wid, "a", True, ["mod2"], 38, "a", 38, 0])
+        if t%60==0:
+            packets.append(["cursor", "png", x, y, 32, 32, 4, 4, seq, b"\0"*r.randint(200, 600), "xterm"])
+            packets.append(["ping", now, now+r.randint(0, 1000)])
+        if t%300==0:
+            packets.append(["window-metadata", wid, {"title" : "terminal %i: ~/src/xpra" % r.randint(0, 100), "class-instance" : ("xterm", "XTerm")}])
+    return [bencode(x) for x in packets]
+
+
+def wire_size(packets, compress, min_size):
+    total = 0
+    for p in packets:
+        if compress and len(p)>min_size:
+            p = compress(p, LEVEL)[1]
+        total += 8+len(p)
+    return total
+
+
+def main():
+    training = session_packets(SECONDS, 0)
+    packets = session_packets(SECONDS, 1)
+    modes = [
+        ("none", None, 0),
+        ("zlib", zcompress, MIN_COMPRESS_SIZE),
+        ]
+    if has_lz4:
+        modes.append(("lz4", lz4_compress, MIN_COMPRESS_SIZE))
+    if has_zstd:
+        import zstandard
+        plain = zstandard.ZstdCompressor(level=LEVEL)
+        modes.append(("zstd", lambda p, _level : (0, plain.compress(p)), MIN_COMPRESS_SIZE))
+        d = zstandard.train_dictionary(16*1024, training)
+        dcomp = zstandard.ZstdCompressor(level=LEVEL, dict_data=d)
+        modes.append(("zstd+dict", lambda p, _level : (0, dcomp.compress(p)), ZSTD_DICT_MIN_COMPRESS_SIZE))
+    else:
+        print("zstandard module not found, zstd tests skipped")
+    print("%i packets, %i per second" % (len(packets), len(packets)//SECONDS))
+    for name, compress, min_size in modes:
+        print("%-10s: %6i bytes per second" % (name, wire_size(packets, compress, min_size)//SECONDS))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,463 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+# Replays a damage trace through the server's encoding pipeline (WindowVideoSource),
+# the packets are sent to a simulated client over a link with the given bandwidth and latency.
+# Reports the encoding cpu time, bytes sent, frame latency and quality for each encoding.
+# No display is needed.
+#
+# To record a trace, start the server with:
+#  XPRA_DAMAGE_TRACE=/tmp/traces xpra start ...
+# (one file is saved per window and client: damage-$PID-$WID-$N.trace)
+# Then replay it with:
+#  ./tests/xpra/server/damage_replay.py --bandwidth=10 --latency=50 /tmp/traces/damage-1234-1-1.trace
+
+import sys
+import time
+import heapq
+import argparse
+from threading import Lock, Condition
+
+from xpra.util import typedict
+from xpra.os_util import Queue, monotonic_time, bytestostr
+from xpra.make_thread import start_thread
+from xpra.codecs.image_wrapper import ImageWrapper
+from xpra.server.window.damage_trace import load_damage_trace
+from xpra.log import Logger
+
+log = Logger("damage")
+
+thread_time = getattr(time, "thread_time", None) or time.clock
+
+
+class ReplayLoop(object):
+    """
+        A minimal main loop, with the timer functions of the glib one used by the server.
+        Timers can be added from any thread.
+    """
+
+    def __init__(self):
+        self.cond = Condition(Lock())
+        self.timers = []
+        self.cancelled = set()
+        self.counter = 0
+
+    def add_at(self, due, delay, fn, *args):
+        with self.cond:
+            self.counter += 1
+            heapq.heappush(self.timers, (due, self.counter, delay, fn, args))
+            self.cond.notify()
+            return self.counter
+
+    def timeout_add(self, delay, fn, *args):
+        return self.add_at(monotonic_time()+delay/1000.0, delay, fn, *args)
+
+    def idle_add(self, fn, *args):
+        return self.add_at(monotonic_time(), 0, fn, *args)
+
+    def source_remove(self, tid):
+        with self.cond:
+            self.cancelled.add(tid)
+
+    def run(self, until):
+        while not until():
+            with self.cond:
+                if not self.timers:
+                    self.cond.wait(0.1)
+                    continue
+                due, tid, delay, fn, args = self.timers[0]
+                wait = due-monotonic_time()
+                if wait>0:
+                    self.cond.wait(min(0.1, wait))
+                    continue
+                heapq.heappop(self.timers)
+                if tid in self.cancelled:
+                    self.cancelled.discard(tid)
+                    continue
+            try:
+                if fn(*args) is True:
+                    #glib semantics: re-schedule with the same id
+                    with self.cond:
+                        heapq.heappush(self.timers, (monotonic_time()+delay/1000.0, tid, delay, fn, args))
+            except Exception:
+                log.error("Error calling %s%s", fn, args, exc_info=True)
+
+
+class ReplayEncoder(object):
+    """
+        The encode thread, which also measures the cpu time used for each packet.
+    """
+
+    def __init__(self):
+        self.queue = Queue()
+        self.mark = 0
+        self.thread = start_thread(self.run, "encode", daemon=True)
+
+    def call_in_encode_thread(self, _optional, fn, *args):
+        self.queue.put((fn, args))
+
+    def qsize(self):
+        return self.queue.qsize()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            fn, args = item
+            self.mark = thread_time()
+            try:
+                fn(*args)
+            except Exception:
+                log.error("Error calling %s%s", fn, args, exc_info=True)
+
+    def take_cpu_time(self):
+        #this runs in the encode thread:
+        now = thread_time()
+        cpu = now-self.mark
+        self.mark = now
+        return cpu
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+class ReplayWindow(object):
+    """
+        A window model which returns the pixels from the trace.
+    """
+
+    def __init__(self, wid, width, height, info):
+        self.wid = wid
+        self.info = info
+        self.pixel_format = "BGRX"
+        self.depth = 24
+        self.width = self.height = 0
+        self.pixels = bytearray()
+        self.skipped = 0
+        self.resize(width, height)
+
+    def resize(self, width, height):
+        pixels = bytearray(width*height*4)
+        rowlen = min(width, self.width)*4
+        for y in range(min(height, self.height)):
+            pixels[y*width*4:y*width*4+rowlen] = self.pixels[y*self.width*4:y*self.width*4+rowlen]
+        self.width, self.height = width, height
+        self.pixels = pixels
+
+    def update(self, x, y, w, h, pixel_format, depth, bpp, rowstride, data):
+        if bpp!=4:
+            self.skipped += 1
+            return
+        self.pixel_format = pixel_format
+        self.depth = depth
+        rowlen = max(0, min(w, self.width-x))*4
+        for i in range(max(0, min(h, self.height-y))):
+            start = ((y+i)*self.width+x)*4
+            self.pixels[start:start+rowlen] = data[i*rowstride:i*rowstride+rowlen]
+
+    def get_image(self, x, y, w, h):
+        w = max(0, min(w, self.width-x))
+        h = max(0, min(h, self.height-y))
+        if w==0 or h==0:
+            return None
+        data = bytearray(w*h*4)
+        for i in range(h):
+            start = ((y+i)*self.width+x)*4
+            data[i*w*4:(i+1)*w*4] = self.pixels[start:start+w*4]
+        return ImageWrapper(x, y, w, h, bytes(data), self.pixel_format, self.depth, w*4, 4)
+
+    def get_dimensions(self):
+        return self.width, self.height
+
+    def get(self, name, default_value=None):
+        if name=="content-type":
+            return self.info.get("content-type") or default_value
+        return default_value
+
+    def get_property(self, name):
+        if name=="depth":
+            return self.depth
+        return None
+
+    def get_property_names(self):
+        return ()
+
+    def get_dynamic_property_names(self):
+        return ()
+
+    def is_managed(self):
+        return True
+
+    def is_tray(self):
+        return False
+
+    def is_OR(self):
+        return False
+
+    def is_shadow(self):
+        return False
+
+    def has_alpha(self):
+        return self.pixel_format=="BGRA"
+
+    def acknowledge_changes(self):
+        pass
+
+    def connect(self, *_args):
+        return 0
+
+    def disconnect(self, *_args):
+        pass
+
+
+def packet_size(packet):
+    size = 0
+    for x in packet:
+        x = getattr(x, "data", x)
+        if isinstance(x, (bytes, bytearray, memoryview)):
+            size += len(x)
+        else:
+            size += 8
+    return size
+
+
+class SimulatedClient(object):
+    """
+        Sends the packets over a link with a fixed bandwidth and latency,
+        then acknowledges the draw packets as a client would.
+    """
+
+    def __init__(self, loop, encoder, bandwidth, latency, decode_speed):
+        self.loop = loop
+        self.encoder = encoder
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.decode_speed = decode_speed
+        self.lock = Lock()
+        self.link_free = 0
+        self.bytes_sent = 0
+        self.window_source = None
+        self.damage_times = {}
+        #encoding -> [frames, pixels, bytes, cpu time, latency, quality]
+        self.stats = {}
+        self.pending = 0
+
+    def queue_packet(self, packet, _wid=0, pixels=0, start_send_cb=None, end_send_cb=None, _fail_cb=None, _wait_for_more=False):
+        #this runs in the encode thread:
+        cpu = self.encoder.take_cpu_time()
+        size = packet_size(packet)
+        with self.lock:
+            start = max(monotonic_time(), self.link_free)
+            end = start
+            if self.bandwidth>0:
+                end += size*8.0/self.bandwidth
+            self.link_free = end
+            start_bytes = self.bytes_sent
+            self.bytes_sent += size
+            if packet[0]=="draw":
+                self.pending += 1
+        if start_send_cb:
+            self.loop.add_at(start, 0, start_send_cb, start_bytes)
+        if end_send_cb:
+            self.loop.add_at(end, 0, end_send_cb, start_bytes+size)
+        if packet[0]=="draw":
+            decode_time = int(pixels*1000*1000//self.decode_speed)
+            self.loop.add_at(end+self.latency+decode_time/1000.0/1000.0, 0, self.ack, packet, size, cpu, decode_time)
+
+    def ack(self, packet, size, cpu, decode_time):
+        coding, _, sequence, _, client_options = packet[6:11]
+        coding = bytestostr(coding)
+        width, height = packet[4:6]
+        damage_time = self.damage_times.pop(sequence, 0)
+        latency = 0
+        if damage_time:
+            latency = monotonic_time()-damage_time
+        s = self.stats.setdefault(coding, [0, 0, 0, 0, 0, 0])
+        s[0] += 1
+        s[1] += width*height
+        s[2] += size
+        s[3] += cpu
+        s[4] += latency
+        s[5] += client_options.get("quality", 100)
+        self.pending -= 1
+        self.window_source.damage_packet_acked(sequence, width, height, decode_time, "")
+
+
+def make_window_source(loop, encoder, client, window, args):
+    from xpra.server.mixins.encoding_server import EncodingServer
+    from xpra.server.window.batch_config import DamageBatchConfig
+    from xpra.server.window.window_video_source import WindowVideoSource
+    from xpra.server.source.source_stats import GlobalPerformanceStatistics
+    from xpra.codecs.video_helper import getVideoHelper
+    server = EncodingServer()
+    server.encoding = args.encoding
+    server.threaded_setup()
+    encodings = [x for x in server.encodings if not args.encodings or x in args.encodings]
+    core_encodings = [x for x in server.core_encodings if not args.encodings or x in args.encodings or x in ("rgb24", "rgb32")]
+    encoding = args.encoding or window.info.get("encoding") or "auto"
+    if encoding not in encodings:
+        encoding = "auto"
+    encoding_options = typedict({
+        "rgb_zlib"          : True,
+        "rgb_lz4"           : True,
+        "flush"             : True,
+        "transparency"      : True,
+        "video_scaling"     : True,
+        "scrolling"         : True,
+        })
+    default_encoding_options = typedict()
+    if args.quality>=0:
+        default_encoding_options["quality"] = args.quality
+    if args.speed>=0:
+        default_encoding_options["speed"] = args.speed
+    class WindowReplaySource(WindowVideoSource):
+        def queue_damage_packet(self, packet, damage_time=0, process_damage_time=0, options={}):
+            client.damage_times[packet[8]] = damage_time
+            WindowVideoSource.queue_damage_packet(self, packet, damage_time, process_damage_time, options)
+    ww, wh = window.get_dimensions()
+    batch_config = DamageBatchConfig()
+    statistics = GlobalPerformanceStatistics()
+    congestion = []
+    def record_congestion_event(source, late_pct=0, send_speed=0):
+        now = monotonic_time()
+        congestion.append((now, source, late_pct, send_speed))
+        statistics.last_congestion_time = now
+        statistics.congestion_send_speed.append((now, late_pct, send_speed))
+    def compressed_wrapper(datatype, data, _min_saving=128):
+        from xpra.net.compression import compressed_wrapper as cw
+        return cw(datatype, data, zlib=True, can_inline=False)
+    ws = WindowReplaySource(loop.idle_add, loop.timeout_add, loop.source_remove,
+                            ww, wh,
+                            record_congestion_event, encoder.qsize, encoder.call_in_encode_thread, client.queue_packet, compressed_wrapper,
+                            statistics,
+                            window.wid, window, batch_config, args.auto_refresh_delay,
+                            False, 0,
+                            getVideoHelper(),
+                            server.core_encodings, server.encodings,
+                            encoding, encodings, core_encodings, (), encoding_options, typedict(),
+                            ("RGB", "RGBA", "RGBX", "BGRA", "BGRX"),
+                            default_encoding_options,
+                            None, 0, int(args.bandwidth*1000*1000), 0)
+    client.window_source = ws
+    def recalculate_delays():
+        now = monotonic_time()
+        statistics.bytes_sent.append((now, client.bytes_sent))
+        statistics.update_averages()
+        ws.statistics.update_averages()
+        ws.calculate_batch_delay(True, False, False)
+        ws.reconfigure()
+        return True
+    loop.timeout_add(1000, recalculate_delays)
+    return ws, congestion
+
+
+def replay(filename, args):
+    records = load_damage_trace(filename)
+    header = next(records)
+    assert header[0]=="window", "invalid trace header: %s" % (header, )
+    _, _, wid, width, height, info = header
+    window = ReplayWindow(wid, width, height, info)
+    #group the pixels captured with the damage event they follow,
+    #so that replaying with a different batch delay still finds them:
+    steps = []
+    for record in records:
+        if record[0]=="damage":
+            steps.append((record, []))
+        elif record[0]=="pixels":
+            if steps:
+                steps[-1][1].append(record)
+            else:
+                window.update(*record[2:])
+    if not steps:
+        print("no damage events found in '%s'" % filename)
+        return None
+    for _, pixels in steps:
+        if pixels:
+            #start with the pixel format of the first capture:
+            window.pixel_format, window.depth = pixels[0][6:8]
+            break
+    loop = ReplayLoop()
+    encoder = ReplayEncoder()
+    try:
+        client = SimulatedClient(loop, encoder, args.bandwidth*1000*1000, args.latency/1000.0, args.decode_speed*1000*1000)
+        ws, congestion = make_window_source(loop, encoder, client, window, args)
+        speed = max(0.01, args.time_scale)
+        start = monotonic_time()
+        first = steps[0][0][1]
+        done = []
+        def damage(record, pixels):
+            _, _, ww, wh, x, y, w, h, options = record
+            if (ww, wh)!=window.get_dimensions():
+                window.resize(ww, wh)
+            for p in pixels:
+                window.update(*p[2:])
+            ws.damage(x, y, w, h, options)
+        def replay_done():
+            done.append(monotonic_time())
+        for record, pixels in steps:
+            loop.add_at(start+(record[1]-first)/1000.0/1000.0/speed, 0, damage, record, pixels)
+        end = start+(steps[-1][0][1]-first)/1000.0/1000.0/speed
+        loop.add_at(end, 0, replay_done)
+        def finished():
+            if not done:
+                return False
+            #wait for the last packets to be acknowledged, or give up after a few seconds:
+            return (client.pending==0 and encoder.qsize()==0 and monotonic_time()-done[0]>1) or monotonic_time()-done[0]>10
+        loop.run(finished)
+        elapsed = monotonic_time()-start
+        ws.cleanup()
+        return {
+            "window"        : (wid, width, height),
+            "events"        : len(steps),
+            "elapsed"       : elapsed,
+            "bytes"         : client.bytes_sent,
+            "encodings"     : client.stats,
+            "congestion"    : len(congestion),
+            "batch-delay"   : ws.batch_config.delay,
+            "skipped"       : window.skipped,
+            }
+    finally:
+        #don't leave the encode thread running if the replay fails:
+        encoder.stop()
+
+
+def print_results(filename, results):
+    print("%s: window %s, %i damage events replayed in %.1fs" % (filename, results["window"], results["events"], results["elapsed"]))
+    print(" %-12s %8s %12s %10s %10s %10s %8s" % ("encoding", "frames", "MPixels", "KBytes", "cpu (ms)", "latency", "quality"))
+    for coding, (frames, pixels, size, cpu, latency, quality) in sorted(results["encodings"].items()):
+        print(" %-12s %8i %12.1f %10i %10i %8ims %8i" % (coding, frames, pixels/1000.0/1000.0, size//1024, cpu*1000,
+                                                         latency*1000//frames, quality//frames))
+    print(" total sent: %iKB, congestion events: %i, final batch delay: %ims" % (results["bytes"]//1024, results["congestion"], results["batch-delay"]))
+    if results["skipped"]:
+        print(" %i captures skipped (unsupported pixel format)" % results["skipped"])
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="replay damage traces through the encoding pipeline")
+    parser.add_argument("traces", nargs="+", help="damage trace files")
+    parser.add_argument("--bandwidth", type=float, default=0, help="link bandwidth in Mbps (0 for unlimited)")
+    parser.add_argument("--latency", type=int, default=0, help="link latency in milliseconds")
+    parser.add_argument("--decode-speed", type=float, default=100, help="client decoding speed in MPixels per second")
+    parser.add_argument("--encoding", default=None, help="encoding to use (default: the one in the trace)")
+    parser.add_argument("--encodings", default="", help="comma separated list of encodings the client supports")
+    parser.add_argument("--quality", type=int, default=-1, help="fixed quality")
+    parser.add_argument("--speed", type=int, default=-1, help="fixed speed")
+    parser.add_argument("--auto-refresh-delay", type=int, default=150, help="auto refresh delay in milliseconds")
+    parser.add_argument("--time-scale", type=float, default=1, help="replay speed, 2 replays twice as fast")
+    args = parser.parse_args(argv[1:])
+    args.encodings = [x for x in args.encodings.split(",") if x]
+    for filename in args.traces:
+        results = replay(filename, args)
+        if results:
+            print_results(filename, results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -5,10 +5,8 @@
 # later version. See the file COPYING for details.
 
 import time
-import gobject
-gobject.threads_init()
 
-from xpra.server.window.region import rectangle, add_rectangle, remove_rectangle, merge_all, contains_rect #@UnresolvedImport (cython)
+from xpra.server.window.region import rectangle, region_set, add_rectangle, remove_rectangle, merge_all, contains_rect #@UnresolvedImport (cython)
 
 
 #collected with the server "-d encoding"
@@ -565,6 +563,54 @@ def test_gvim_damage_performance(rectangles):
     print("contains_rect %s rectangles %s times in %.2fms" % (len(rectangles), n, (end-start)*1000.0/N))
 
 
+def test_region_set_performance(rectangles):
+    #same operations as above, using a region set:
+    start = time.time()
+    for _ in range(N):
+        rs = region_set()
+        for x,y,width,height in rectangles:
+            rs.add(x, y, width, height)
+        rects = tuple(rs)
+    end = time.time()
+    print("region_set.add %s rectangles %s times in %.2fms, %i rectangles" % (len(rectangles), N, (end-start)*1000.0/N, len(rects)))
+    start = time.time()
+    for _ in range(N):
+        c = rs.copy()
+        for x,y,width,height in rectangles:
+            c.subtract(x+width//4, y+height//3, width//2, height//2)
+    end = time.time()
+    print("region_set.subtract %s rectangles %s times in %.2fms" % (len(rectangles), N, (end-start)*1000.0/N))
+    start = time.time()
+    for _ in range(N):
+        for r in rects:
+            rs.contains_rect(r)
+    end = time.time()
+    print("region_set.contains_rect %s rectangles %s times in %.2fms" % (len(rects), N, (end-start)*1000.0/N))
+
+
+def test_text_damage_performance():
+    #the text updates only (no large areas that would swallow everything else),
+    #painted twice, one line apart, as happens when a terminal scrolls:
+    text = [v for v in R1+R2 if v[2]*v[3]<=64*1024]
+    rectangles = text + [(x, y+15, width, height) for x,y,width,height in text]
+    n = N//10
+    start = time.time()
+    for _ in range(n):
+        rects = []
+        for x,y,width,height in rectangles:
+            add_rectangle(rects, rectangle(x, y, width, height))
+    end = time.time()
+    print("text: add_rectangle %s rectangles %s times in %.2fms, %i rectangles" % (len(rectangles), n, (end-start)*1000.0/n, len(rects)))
+    start = time.time()
+    for _ in range(n):
+        rs = region_set()
+        for x,y,width,height in rectangles:
+            rs.add(x, y, width, height)
+        rects = tuple(rs)
+    end = time.time()
+    print("text: region_set.add %s rectangles %s times in %.2fms, %i rectangles" % (len(rectangles), n, (end-start)*1000.0/n, len(rects)))
+
+
 def test_merge_all():
     start = time.time()
     R = [rectangle(*v) for v in R1+R2]
@@ -578,10 +624,14 @@ def test_merge_all():
 def main():
     print("R1:")
     test_gvim_damage_performance(R1)
+    test_region_set_performance(R1)
     print("")
     print("R2:")
     test_gvim_damage_performance(R2)
+    test_region_set_performance(R2)
 
+    print("")
+    test_text_damage_performance()
     print("")
     test_merge_all()
 
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+#measures how long a full window refresh takes to encode,
+#depending on the number of strips we split it into:
+#python ./tests/xpra/server/test_strip_encode.py [WIDTH HEIGHT]
+
+import sys
+import time
+from multiprocessing import cpu_count
+
+from xpra.codecs.image_wrapper import ImageWrapper
+from xpra.server.window.strip_encode import StripEncodePool, split_image
+
+
+def make_image(w, h):
+    #a gradient background with some text-like noise,
+    #which is representative of what we refresh losslessly:
+    rowstride = w*4
+    pixels = bytearray(rowstride*h)
+    for y in range(h):
+        row = bytearray(rowstride)
+        v = y*255//h
+        row[0::4] = bytearray([v])*w
+        row[1::4] = bytearray([(v+x//16) & 0xff for x in range(w)])
+        row[2::4] = bytearray([255-v])*w
+        if y%20<12:
+            #'glyphs':
+            for x in range((y*7)%13, w, 9):
+                row[x*4:x*4+4] = b"\0\0\0\xff"
+        pixels[y*rowstride:(y+1)*rowstride] = row
+    return ImageWrapper(0, 0, w, h, bytes(pixels), "BGRX", 24, rowstride, 4, thread_safe=True)
+
+def test_strip_encode(w=3840, h=2160, N=3, strip_counts=(1, 2, 4, 8)):
+    from xpra.codecs.pillow.encode import encode, get_encodings
+    image = make_image(w, h)
+    encodings = [x for x in ("png", "webp", "jpeg") if x in get_encodings()]
+    print("encoding a %ix%i image using %i cpus:" % (w, h, cpu_count()))
+    for coding in encodings:
+        for count in strip_counts:
+            if count>1:
+                pool = StripEncodePool(count-1)
+                pool.start()
+            else:
+                pool = None
+            start = time.time()
+            for _ in range(N):
+                if pool:
+                    strips = split_image(image, count, 16)
+                    results = pool.encode(encode, [(coding, strip, 100, 50, False) for strip in strips])
+                else:
+                    results = [encode(coding, image, 100, 50, False)]
+            elapsed = (time.time()-start)/N
+            if pool:
+                pool.stop()
+            size = sum(len(r[1].data) for r in results)
+            print(" %-5s with %i strips: %5ims, %6iKB" % (coding, count, elapsed*1000, size//1024))
+
+
+def main():
+    if len(sys.argv)==3:
+        test_strip_encode(int(sys.argv[1]), int(sys.argv[2]))
+    else:
+        test_strip_encode()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import time
+import unittest
+from threading import Event, Lock
+
+from xpra.client.draw_pool import DrawPool
+
+
+class TestDrawPool(unittest.TestCase):
+
+    def test_ordering(self):
+        lock = Lock()
+        results = {}
+        done = Event()
+        def process(packet):
+            _, wid, i = packet
+            time.sleep(0.001*(i%3))
+            with lock:
+                results.setdefault(wid, []).append(i)
+                if sum(len(x) for x in results.values())==60:
+                    done.set()
+        pool = DrawPool(process, size=2)
+        pool.start()
+        try:
+            for i in range(20):
+                for wid in (1, 2, 3):
+                    pool.add(wid, ("draw", wid, i))
+            assert done.wait(10), "timeout waiting for the draw packets"
+            for wid in (1, 2, 3):
+                assert results[wid]==list(range(20)), "packets for window %i were processed out of order: %s" % (wid, results[wid])
+            #the last packet may still be accounted for:
+            for _ in range(100):
+                if pool.qsize()==0:
+                    break
+                time.sleep(0.01)
+            assert pool.qsize()==0
+            info = pool.get_info()
+            assert info.get("threads")==2
+            assert sorted(info.get("window", {}).keys())==[1, 2, 3]
+        finally:
+            pool.stop()
+
+    def test_parallel(self):
+        blocked = Event()
+        unblock = Event()
+        other = Event()
+        ran = Event()
+        def process(packet):
+            packet[2]()
+        pool = DrawPool(process, size=2)
+        pool.start()
+        try:
+            #a slow decode in window 1 must not delay window 2:
+            def block():
+                blocked.set()
+                unblock.wait(10)
+            pool.add(1, ("draw", 1, block))
+            pool.add(1, ("draw", 1, ran.set))
+            assert blocked.wait(10)
+            pool.add(2, ("draw", 2, other.set))
+            assert other.wait(10), "window 2 was blocked by window 1"
+            assert not ran.is_set(), "window 1 packets must be processed in sequence"
+            assert pool.qsize(1)==2
+            unblock.set()
+            assert ran.wait(10)
+        finally:
+            pool.stop()
+
+    def test_coalesce(self):
+        processed = []
+        skipped = []
+        done = Event()
+        unblock = Event()
+        def process(packet):
+            if packet[2]=="block":
+                unblock.wait(10)
+            processed.append(packet[2])
+            if packet[2]=="last":
+                done.set()
+        def coalesce(packet, later):
+            #skip the packets followed by a "full" one:
+            if packet[2]!="partial" or not any(p[2] in ("full", "last") for p in later):
+                return False
+            skipped.append(packet[2])
+            return True
+        pool = DrawPool(process, coalesce, size=1)
+        pool.start()
+        try:
+            pool.add(1, ("draw", 1, "block"))
+            for _ in range(5):
+                pool.add(1, ("draw", 1, "partial"))
+            pool.add(1, ("draw", 1, "full"))
+            pool.add(1, ("draw", 1, "partial"))
+            pool.add(1, ("draw", 1, "last"))
+            unblock.set()
+            assert done.wait(10), "timeout waiting for the draw packets"
+            assert processed==["block", "full", "last"], "processed: %s" % (processed,)
+            assert len(skipped)==6
+        finally:
+            pool.stop()
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -20,6 +20,7 @@ class MixinsTest(unittest.TestCase):
 		x = NetworkState()
 		fake_protocol = AdHocStruct()
 		fake_protocol.get_info = lambda : {}
+		fake_protocol.set_bandwidth_limit = lambda _bandwidth : None
 		x._protocol = fake_protocol
 		opts = AdHocStruct()
 		opts.pings = True
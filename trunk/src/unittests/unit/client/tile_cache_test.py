@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import random
+import unittest
+
+from xpra.client.tile_cache import TileCache, tile_hash, tile_cost
+
+
+class TestTileCache(unittest.TestCase):
+
+    def test_hash(self):
+        pixels = b"\x01\x02\x03\x04"*64*64
+        k = tile_hash(pixels, 64, 64, "BGRX")
+        assert 0<=k<2**63
+        assert tile_hash(bytearray(pixels), 64, 64, "BGRX")==k
+        assert tile_hash(pixels, 32, 128, "BGRX")!=k
+        assert tile_hash(pixels, 64, 64, "RGBX")!=k
+        assert tile_hash(b"\x00"+pixels[1:], 64, 64, "BGRX")!=k
+
+    def test_lru(self):
+        tc = TileCache(tile_cost(10, 10)*4)
+        for key in range(4):
+            tc.add(key, tile_cost(10, 10), key)
+        assert tc.get(0)==0
+        #evicts the least recently used: 1
+        tc.add(4, tile_cost(10, 10), 4)
+        assert 1 not in tc and 0 in tc
+        assert tc.get(1) is None
+        info = tc.get_info()
+        assert info.get("evictions")==1
+        assert info.get("hits")==1 and info.get("misses")==1
+        assert info.get("size")==tile_cost(10, 10)*4
+        assert not tc.can_store(tile_cost(20, 20)+1)
+        tc.clear()
+        assert len(tc)==0 and tc.size==0
+
+    def test_mirror(self):
+        #the server's copy must always agree with the client's:
+        size = tile_cost(64, 64)*16
+        server = TileCache(size)
+        client = TileCache(size)
+        r = random.Random(0)
+        for _ in range(2000):
+            w = r.randint(1, 128)
+            key = r.randint(0, 50)*1000+w
+            if key in server:
+                server.get(key)
+                assert client.get(key)==w
+            elif server.can_store(tile_cost(w, w)):
+                server.add(key, tile_cost(w, w))
+                client.add(key, tile_cost(w, w), w)
+            assert list(server.tiles.keys())==list(client.tiles.keys())
+        assert server.evictions>0 and server.hits>0
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
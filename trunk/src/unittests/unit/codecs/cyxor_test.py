@@ -8,7 +8,7 @@ import unittest
 
 from xpra.os_util import strtobytes, monotonic_time
 try:
-    from xpra.codecs.xor.cyxor import xor_str       #@UnresolvedImport
+    from xpra.codecs.xor.cyxor import xor_str, xor_into, xor_rows       #@UnresolvedImport
 except:
     xor_str = None
 import binascii
@@ -52,6 +52,45 @@ class TestHMAC(unittest.TestCase):
             self.fail_xor(bool, int)
 
 
+    def test_xor_into(self):
+        for i in range(10):
+            l = 64*3+i
+            a = strtobytes(chr(0x55)*l)
+            b = bytearray(a)
+            out = bytearray(l)
+            assert not xor_into(a, b, out)
+            assert out==bytearray(l)
+            b[i] = 0x54
+            b[-1] = 0xff
+            assert xor_into(a, b, out)
+            assert out[i]==1 and out[-1]==0xaa
+            #in place:
+            c = bytearray(b)
+            xor_into(c, a, c)
+            assert c==out
+            #unaligned:
+            unaligned = bytearray(l-i)
+            xor_into(memoryview(a)[i:], memoryview(b)[i:], unaligned)
+            assert unaligned==out[i:]
+
+    def test_xor_rows(self):
+        rowstride = 4*17
+        a = strtobytes(chr(0)*rowstride*10)
+        b = bytearray(a)
+        b[rowstride*3+5] = 1
+        b[rowstride*9] = 2
+        out = bytearray(len(a))
+        changed = xor_rows(a, b, out, rowstride)
+        assert list(changed)==[0, 0, 0, 1, 0, 0, 0, 0, 0, 1], "got %s" % list(changed)
+        assert out==b
+        #output buffer too small:
+        try:
+            xor_rows(a, b, bytearray(10), rowstride)
+        except Exception:
+            pass
+        else:
+            raise Exception("xor_rows should fail with a small output buffer")
+
     def test_large_xor_speed(self):
         start = monotonic_time()
         size = 1*1024*1024       #1MB
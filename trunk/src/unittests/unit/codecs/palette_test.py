@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import unittest
+from io import BytesIO
+
+from xpra.codecs.image_wrapper import ImageWrapper
+try:
+    from xpra.codecs.palette.encode import encode   #@UnresolvedImport
+except ImportError:
+    encode = None
+
+
+def make_image(w, h, ncolors, pixel_format="BGRX", padding=0):
+    #ncolors distinct colours, with long runs like text would have:
+    bpp = len(pixel_format)
+    rowstride = w*bpp+padding
+    pixels = bytearray(rowstride*h)
+    for y in range(h):
+        for x in range(w):
+            c = ((x//3)+y*7) % ncolors
+            offset = y*rowstride+x*bpp
+            pixels[offset:offset+bpp] = bytearray([c & 0xff, c>>8, (c*3) & 0xff, 255][:bpp])
+    return ImageWrapper(0, 0, w, h, bytes(pixels), pixel_format, 24, rowstride, bpp)
+
+
+class TestPaletteEncoder(unittest.TestCase):
+
+    def check(self, image):
+        from PIL import Image   #@UnresolvedImport
+        w = image.get_width()
+        h = image.get_height()
+        ret = encode(image, 50, False)
+        assert ret, "%s should fit in a palette" % image
+        coding, data, _, outw, outh, _, bpp = ret
+        assert coding=="png/P" and (outw, outh)==(w, h) and bpp==8
+        img = Image.open(BytesIO(data.data)).convert("RGB")
+        pixel_format = image.get_pixel_format()
+        bpp = len(pixel_format)
+        rowstride = image.get_rowstride()
+        pixels = image.get_pixels()
+        expected = bytearray()
+        for y in range(h):
+            for x in range(w):
+                offset = y*rowstride+x*bpp
+                px = bytearray(pixels[offset:offset+bpp])
+                expected += bytearray(px[pixel_format.index(c)] for c in "RGB")
+        assert img.tobytes()==bytes(expected), "pixels differ for %s" % image
+
+    def test_colors(self):
+        for ncolors in (1, 2, 3, 4, 5, 16, 17, 256):
+            for w in (1, 7, 8, 9, 64):
+                self.check(make_image(w, 9, ncolors))
+
+    def test_formats(self):
+        for pixel_format in ("BGRX", "RGBX", "BGR", "RGB"):
+            self.check(make_image(20, 10, 12, pixel_format, padding=4))
+
+    def test_too_many_colors(self):
+        assert encode(make_image(3*300, 2, 300), 50, False) is None
+
+    def test_unsupported_format(self):
+        image = ImageWrapper(0, 0, 4, 4, b"\0"*32, "BGR565", 16, 8, 2)
+        assert encode(image, 50, False) is None
+
+    def test_transparency(self):
+        from PIL import Image   #@UnresolvedImport
+        pixels = b"\x10\x20\x30\xff"*8 + b"\x00\x00\x00\x00"*8
+        image = ImageWrapper(0, 0, 4, 4, pixels, "BGRA", 32, 16, 4)
+        coding, data, client_options = encode(image, 50, True)[:3]
+        assert coding=="png/P" and client_options.get("transparency")==1
+        img = Image.open(BytesIO(data.data)).convert("RGBA")
+        assert img.tobytes()==b"\x30\x20\x10\xff"*8 + b"\x00\x00\x00\x00"*8
+
+
+def main():
+    if encode:
+        unittest.main()
+    else:
+        print("no palette encoder found, test skipped")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import socket
+import unittest
+
+from xpra.os_util import memoryview_to_bytes
+from xpra.net.bytestreams import SocketConnection
+from unit.net.protocol_test_util import FakeScheduler
+
+class PartialWriteConnection(object):
+    """ only ever writes 'size' bytes at a time """
+    can_writev = True
+    output_bytecount = 0
+    def __init__(self, size):
+        self.size = size
+        self.data = b""
+        self.calls = 0
+    def writev(self, buffers):
+        self.calls += 1
+        b = b"".join(memoryview_to_bytes(x) for x in buffers)[:self.size]
+        self.data += b
+        return len(b)
+
+
+class TestBytestreams(unittest.TestCase):
+
+    def test_socket_writev(self):
+        if not hasattr(socket.socket, "sendmsg"):
+            return
+        s1, s2 = socket.socketpair()
+        try:
+            conn = SocketConnection(s1, "local", "remote", "target", "unix-domain")
+            assert conn.can_writev
+            assert conn.get_info().get("writev") is True
+            w = conn.writev([b"header", b"", b"payload"])
+            assert w==13
+            assert s2.recv(1024)==b"headerpayload"
+        finally:
+            s1.close()
+            s2.close()
+
+    def test_protocol_partial_writev(self):
+        from xpra.net.protocol import Protocol
+        conn = PartialWriteConnection(5)
+        p = Protocol(FakeScheduler(), conn, None)
+        buffers = [b"P"*8, b"0123456789", memoryview(b"abcdefghijklmnopq")]
+        p.write_buffers(buffers, None, True)
+        assert conn.data==b"PPPPPPPP0123456789abcdefghijklmnopq"
+        assert conn.calls==7
+        assert p.output_packetcount==1
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
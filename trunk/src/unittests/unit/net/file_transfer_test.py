@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from xpra.util import typedict
+from xpra.os_util import strtobytes
+from xpra.net import file_transfer
+from xpra.net.file_transfer import FileTransferHandler
+
+
+class FakeHandler(FileTransferHandler):
+
+    def __init__(self):
+        self.timeout_add = self.fake_timeout_add
+        self.idle_add = None
+        self.source_remove = self.fake_source_remove
+        self.timers = {}
+        FileTransferHandler.__init__(self)
+        self.peer = None
+        self.queue = []
+        self.sent = []
+        self.downloaded = []
+
+    def fake_timeout_add(self, *args):
+        tid = len(self.timers)+1
+        self.timers[tid] = args
+        return tid
+
+    def fake_source_remove(self, tid):
+        self.timers.pop(tid, None)
+
+    def compressed_wrapper(self, _datatype, data):
+        return data
+
+    def send(self, *packet):
+        #strings are received as bytes:
+        packet = tuple(strtobytes(x) if isinstance(x, str) else x for x in packet)
+        self.sent.append(packet)
+        self.peer.queue.append(packet)
+
+    def process_queue(self):
+        handlers = {
+            b"send-file"        : self._process_send_file,
+            b"send-file-chunk"  : self._process_send_file_chunk,
+            b"ack-file-chunk"   : self._process_ack_file_chunk,
+            }
+        processed = 0
+        while self.queue:
+            packet = self.queue.pop(0)
+            handlers[packet[0]](packet)
+            processed += 1
+        return processed
+
+    def do_process_downloaded_file(self, filename, *_args):
+        self.downloaded.append(filename)
+
+
+class TestFileTransfer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.saved_open = file_transfer.safe_open_download_file
+        def safe_open_download_file(basefilename, _mimetype):
+            filename = os.path.join(self.tmpdir, "received-%s" % basefilename)
+            return filename, os.open(filename, os.O_CREAT | os.O_RDWR | os.O_EXCL)
+        file_transfer.safe_open_download_file = safe_open_download_file
+
+    def tearDown(self):
+        file_transfer.safe_open_download_file = self.saved_open
+        shutil.rmtree(self.tmpdir)
+
+    def make_peers(self, digest_last=True):
+        sender = FakeHandler()
+        receiver = FakeHandler()
+        sender.peer = receiver
+        receiver.peer = sender
+        caps = receiver.get_file_transfer_features()
+        caps["file-chunks"] = 1024
+        caps["file-chunks-digest"] = digest_last
+        sender.parse_file_transfer_caps(typedict(caps))
+        sender.file_chunks = 1024
+        return sender, receiver
+
+    def transfer(self, data, from_disk=True, digest_last=True):
+        sender, receiver = self.make_peers(digest_last)
+        filename = os.path.join(self.tmpdir, "file.bin")
+        with open(filename, "wb") as f:
+            f.write(data)
+        assert sender.send_file(filename, "", None if from_disk else data, len(data))
+        #the chunks are sent as soon as the receiver acknowledges the file:
+        max_in_flight = 0
+        while receiver.process_queue():
+            max_in_flight = max(max_in_flight, len(sender.queue))
+            info = sender.get_info().get("sending")
+            for v in info.values():
+                assert v.get("size")==len(data)
+            sender.process_queue()
+        assert receiver.downloaded, "file was not received"
+        with open(receiver.downloaded[0], "rb") as f:
+            assert f.read()==data
+        assert not sender.send_chunks_in_progress and not receiver.receive_chunks_in_progress
+        return sender, receiver, max_in_flight
+
+    def test_window(self):
+        data = os.urandom(100*1024+17)
+        sender, _, max_in_flight = self.transfer(data)
+        chunks = [p for p in sender.sent if p[0]==b"send-file-chunk"]
+        assert len(chunks)==101
+        #the digest is sent with the last chunk:
+        assert len(chunks[-1])==6 and chunks[-1][5].get("sha1")
+        assert "sha1" not in sender.sent[0][7]
+        #more than one chunk is sent per acknowledgement:
+        assert max_in_flight>1
+
+    def test_legacy_digest(self):
+        data = os.urandom(10*1024)
+        sender, _, _ = self.transfer(data, digest_last=False)
+        assert sender.sent[0][7].get("sha1")
+
+    def test_from_memory(self):
+        self.transfer(os.urandom(5*1024+1), from_disk=False)
+
+    def test_small_file(self):
+        sender, _, _ = self.transfer(b"hello", from_disk=True)
+        assert sender.sent[0][6]==b"hello"
+
+    def test_corrupted(self):
+        sender, receiver = self.make_peers()
+        filename = os.path.join(self.tmpdir, "file.bin")
+        with open(filename, "wb") as f:
+            f.write(os.urandom(4096))
+        assert sender.send_file(filename, "", None, 4096)
+        receiver.process_queue()
+        sender.process_queue()
+        #tamper with the last chunk's digest:
+        last = receiver.queue[-1]
+        receiver.queue[-1] = last[:5]+({"sha1" : "0"*40},)
+        with self.assertRaises(Exception):
+            receiver.process_queue()
+        assert not receiver.downloaded
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
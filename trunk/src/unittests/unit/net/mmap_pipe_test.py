@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import mmap
+import unittest
+
+from xpra.os_util import PYTHON3, memoryview_to_bytes
+from xpra.net.mmap_pipe import mmap_write, mmap_write_rows, mmap_read, int_from_buffer
+
+MMAP_SIZE = 1024*1024
+
+
+def make_area(start=0, end=0):
+    area = mmap.mmap(-1, MMAP_SIZE)
+    int_from_buffer(area, 0).value = start
+    int_from_buffer(area, 4).value = end
+    return area
+
+def read(area, chunks):
+    #a single chunk is returned as a ctypes array:
+    data = mmap_read(area, *chunks)
+    return memoryview_to_bytes(getattr(data, "raw", data))
+
+def make_pixels(width, height, Bpp, rowstride):
+    rows = []
+    for y in range(height):
+        row = bytes(bytearray((x+y) % 256 for x in range(width*Bpp)))
+        rows.append(row+b"\xff"*(rowstride-width*Bpp))
+    return b"".join(rows)
+
+def strip_rows(pixels, row_length, height, rowstride):
+    return b"".join(pixels[y*rowstride:y*rowstride+row_length] for y in range(height))
+
+
+class TestMmapPipe(unittest.TestCase):
+
+    def test_write_read(self):
+        area = make_area()
+        data = b"0123456789"*1000
+        chunks, free = mmap_write(area, MMAP_SIZE, data)
+        assert chunks==[(8, len(data))], "unexpected chunks: %s" % (chunks,)
+        assert free==MMAP_SIZE-8-len(data)
+        assert read(area, chunks)==data
+
+    def test_write_wraparound(self):
+        #we have written up to near the end,
+        #and the client has read the start of the area:
+        end = MMAP_SIZE-1000
+        area = make_area(2500, end)
+        data = b"x"*3000
+        chunks, _ = mmap_write(area, MMAP_SIZE, data)
+        assert chunks==[(end, 1000), (8, 2000)], "unexpected chunks: %s" % (chunks,)
+        assert read(area, chunks)==data
+
+    def test_full(self):
+        area = make_area(100, 90)
+        chunks, _ = mmap_write(area, MMAP_SIZE, b"x"*100)
+        assert chunks is None
+
+    def test_write_rows(self):
+        if not PYTHON3:
+            return
+        for width, height, Bpp, rowstride in (
+            (64, 32, 4, 256),       #padded rows
+            (64, 32, 4, 64*4),      #contiguous
+            (33, 17, 3, 100),       #newstride rounded up
+            ):
+            area = make_area()
+            pixels = make_pixels(width, height, Bpp, rowstride)
+            row_length = width*Bpp
+            newstride = (row_length+3) & ~3
+            chunks, _ = mmap_write_rows(area, MMAP_SIZE, pixels, rowstride, row_length, height, newstride)
+            assert chunks==[(8, newstride*height)]
+            data = read(area, chunks)
+            assert strip_rows(data, row_length, height, newstride)==strip_rows(pixels, row_length, height, rowstride)
+
+    def test_write_rows_wraparound(self):
+        if not PYTHON3:
+            return
+        width, height, rowstride = 100, 50, 512
+        row_length = width*4
+        #leave space for 10.5 rows before the end of the mmap area:
+        end = MMAP_SIZE-row_length*21//2
+        area = make_area(row_length*40, end)
+        pixels = make_pixels(width, height, 4, rowstride)
+        chunks, _ = mmap_write_rows(area, MMAP_SIZE, pixels, rowstride, row_length, height, row_length)
+        assert len(chunks)==2, "expected the data to wrap around: %s" % (chunks,)
+        data = read(area, chunks)
+        assert data==strip_rows(pixels, row_length, height, rowstride)
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
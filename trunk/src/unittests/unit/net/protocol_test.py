@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import os
+import time
+import unittest
+from threading import Thread
+
+from xpra.os_util import Empty
+from xpra.net.protocol import ByteQueue, write_item_size
+from unit.net.protocol_test_util import FakeScheduler, FakeConnection, make_protocol, make_stream
+
+
+class TestByteQueue(unittest.TestCase):
+
+    def test_limit(self):
+        q = ByteQueue(100)
+        assert q.empty()
+        #an item larger than the limit is accepted when the queue is empty:
+        q.put(b"x"*200)
+        assert q.qsize()==1
+        added = []
+        def add():
+            q.put(b"y"*10)
+            added.append(True)
+        t = Thread(target=add)
+        t.daemon = True
+        t.start()
+        time.sleep(0.1)
+        assert not added, "put should block until there is enough room"
+        assert q.get()==b"x"*200
+        t.join(5)
+        assert added
+        assert q.get_info().get("bytes")==10
+        q.put(b"z"*50)
+        q.put(b"z"*40)
+        assert q.qsize()==3
+        assert q.get()==b"y"*10
+
+    def test_write_items(self):
+        q = ByteQueue(1024, write_item_size)
+        q.put(([b"header", b"payload"], None, None, None, True, False))
+        q.put_nowait(None)
+        assert q.get_info().get("bytes")==13
+        assert q.get()[0]==[b"header", b"payload"]
+        assert q.get() is None
+        assert q.empty()
+        #udp packets are queued as a single buffer:
+        q.put((b"header-and-data", None, None, None, True))
+        assert q.get_info().get("bytes")==15
+        q.get()
+        try:
+            q.get(False)
+        except Empty:
+            pass
+        else:
+            raise Exception("get(False) should raise Empty on an empty queue")
+
+
+class TestAdaptiveCompression(unittest.TestCase):
+
+    def test_choose_compressor(self):
+        from xpra.net.compression import choose_compressor, sample_compressibility
+        random_data = os.urandom(256*1024)
+        text = b"".join(b"line %i: some repetitive terminal output\n" % i for i in range(8192))
+        assert sample_compressibility(random_data)>0.9
+        assert sample_compressibility(text)<0.5
+        #never compress random data:
+        assert choose_compressor(random_data, 5, 1000*1000)[0]=="none"
+        #compress text on slow links:
+        algo, level = choose_compressor(text, 5, 1000*1000, ["zlib"])
+        assert algo=="zlib" and 1<=level<=5
+        #but not on very fast links:
+        assert choose_compressor(text, 5, 10*1000*1000*1000, ["zlib"])[0]=="none"
+        #compression disabled:
+        assert choose_compressor(text, 0, 1000*1000)==("none", 0)
+
+    def test_bandwidth_estimate(self):
+        from xpra.net import protocol
+        saved = protocol.ADAPTIVE_COMPRESSION
+        protocol.ADAPTIVE_COMPRESSION = True
+        try:
+            p = protocol.Protocol(FakeScheduler(), FakeConnection(), None)
+            p.enable_compressor("zlib")
+            p.compressors = ["zlib"]
+            text = b"".join(b"line %i: some repetitive terminal output\n" % i for i in range(8192))
+            #unknown bandwidth: use the default compressor, but not for random data
+            assert p.get_bandwidth_estimate() is None
+            assert p.compress(text, 5)[0]>0
+            assert p.compress(os.urandom(64*1024), 5)[0]==0
+            assert p.adaptive_stats=={"zlib" : 1, "none" : 1}
+            #measured on a very fast link, don't bother compressing:
+            for _ in range(protocol.THROUGHPUT_MIN_RECORDS):
+                p.write_throughput.append((1024*1024*1024, 0.1))
+            assert p.get_bandwidth_estimate()>10*1000*1000*1000
+            assert p.compress(text, 5)[0]==0
+            #but a configured limit takes precedence:
+            p.set_bandwidth_limit(1000*1000)
+            assert p.get_bandwidth_estimate()==1000*1000
+            assert p.compress(text, 5)[0]>0
+        finally:
+            protocol.ADAPTIVE_COMPRESSION = saved
+
+
+class TestZstd(unittest.TestCase):
+
+    def test_capture(self):
+        import tempfile
+        from xpra.net import protocol
+        from xpra.net.zstd_dictionary import read_capture
+        tmpdir = tempfile.mkdtemp()
+        saved = protocol.PACKET_CAPTURE
+        protocol.PACKET_CAPTURE = os.path.join(tmpdir, "capture")
+        try:
+            p = protocol.Protocol(FakeScheduler(), FakeConnection(), None)
+            p.enable_encoder("bencode")
+            p.enable_compressor("zlib")
+            p.set_compression_level(1)
+            p.encode(["ping", 1000])
+            #not recorded: may contain credentials
+            p.encode(["hello", {"foo" : "bar"*1000}])
+            p.encode(["window-metadata", 1, {"title" : "foo"*1000}])
+            filename = p._capture.name
+            p._capture.close()
+            samples = read_capture(filename)
+            assert len(samples)==2
+            assert samples[0].startswith(b"l4:ping")
+            assert samples[1].startswith(b"l15:window-metadata")
+            #nothing is recorded when the connection is encrypted:
+            p = protocol.Protocol(FakeScheduler(), FakeConnection(), None)
+            p.enable_encoder("bencode")
+            p.cipher_out = object()
+            p.encode(["ping", 1000])
+            assert p._capture is None
+            os.unlink(filename)
+        finally:
+            protocol.PACKET_CAPTURE = saved
+            os.rmdir(tmpdir)
+
+    def test_compress(self):
+        from xpra.net import compression
+        if not compression.has_zstd:
+            print("zstandard not found, test skipped")
+            return
+        data = b"l15:pointer-positioni1eli100ei200eel4:mod2elee"*10
+        level, compressed = compression.zstd_compress(data, 1)
+        assert level & compression.ZSTD_FLAG
+        assert compression.get_compression_type(level)=="zstd"
+        assert compression.decompress(compressed, level)==data
+
+
+class TestForward(unittest.TestCase):
+
+    def parse(self, packets, forward_filter):
+        from xpra.os_util import Queue
+        stream = make_stream(make_protocol(None, "zlib"), packets)
+        received = []
+        def process_packet(_proto, packet):
+            received.append(packet)
+        p = make_protocol(process_packet)
+        p.forward_filter = forward_filter
+        p._read_queue = Queue()
+        p._read_queue.put(stream)
+        p._read_queue.put(None)
+        p.do_read_parse_thread_loop()
+        return received
+
+    def test_forward(self):
+        from xpra.net.protocol import RawPacket
+        from xpra.net.packet_encoding import decode
+        pixels = b"\x80"*100000
+        from xpra.net.compression import compressed_wrapper
+        draw = ["draw", 1, 0, 0, 100, 250, "rgb32", compressed_wrapper("rgb32", pixels, zlib=True, can_inline=False), 1, 400, {}]
+        hello = ["hello", {"foo" : "bar"*1000}]
+        filtered = []
+        def forward_filter(packet_type, _flags, levels):
+            filtered.append((packet_type, levels))
+            return packet_type!=b"hello"
+        received = self.parse([hello, draw], forward_filter)
+        assert received[0][0]==b"hello" and not isinstance(received[0], RawPacket)
+        raw = received[1]
+        assert isinstance(raw, RawPacket) and raw[0]==b"draw"
+        #the filter sees the compression level of every chunk:
+        assert filtered[1][0]==b"draw" and len(filtered[1][1])==2
+        #the chunks are forwarded as they were received,
+        #and can be decoded by the receiver:
+        chunks = dict((index, (flags, level, data)) for flags, index, level, data in raw.chunks)
+        from xpra.net.compression import decompress
+        level, data = chunks[7][1:]
+        assert level>0 and len(data)<len(pixels)
+        assert decompress(data, level)==pixels
+        flags, level, data = chunks[0]
+        if level:
+            data = decompress(data, level)
+        packet = decode(data, flags)
+        assert packet[0]==b"draw" and packet[5]==250
+        #without a filter, everything is decoded:
+        received = self.parse([hello, draw], None)
+        assert not [x for x in received if isinstance(x, RawPacket)]
+        assert received[1][7]==pixels
+
+    def test_peek(self):
+        from xpra.net.packet_encoding import peek_packet_type
+        from xpra.net.header import FLAGS_RENCODE, FLAGS_YAML
+        assert peek_packet_type(b"l4:drawi1ee", 0)==b"draw"
+        assert peek_packet_type(memoryview(b"l11:lost-windowi1ee"), 0)==b"lost-window"
+        assert peek_packet_type(b"li1ei2ee", 0) is None
+        assert peek_packet_type(bytearray([193, 132])+b"draw", FLAGS_RENCODE)==b"draw"
+        assert peek_packet_type(b"- draw", FLAGS_YAML) is None
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
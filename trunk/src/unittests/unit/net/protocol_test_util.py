@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+# Minimal stand-ins for the main loop and the connection,
+# so that the network protocols can be exercised without sockets or threads.
+
+from xpra.os_util import memoryview_to_bytes
+from xpra.net.protocol import Protocol
+from xpra.net.header import pack_header
+
+
+class FakeScheduler(object):
+    """
+        Idle callbacks run immediately,
+        timers are recorded but never fire.
+    """
+    def __init__(self):
+        self.timers = {}
+    def idle_add(self, fn, *args):
+        fn(*args)
+    def timeout_add(self, delay, fn, *args):
+        tid = len(self.timers)+1
+        self.timers[tid] = (delay, fn, args)
+        return tid
+    def source_remove(self, tid):
+        self.timers.pop(tid, None)
+
+class FakeConnection(object):
+    """ records the buffers written to it """
+    input_bytecount = 0
+    output_bytecount = 0
+    def __init__(self):
+        self.written = []
+    def write(self, buf):
+        self.written.append(buf)
+        return len(buf)
+    def close(self):
+        pass
+    def get_info(self):
+        return {}
+
+
+def make_protocol(process_packet=None, compressor=None, protocol_class=Protocol):
+    p = protocol_class(FakeScheduler(), FakeConnection(), process_packet)
+    p.enable_encoder("bencode")
+    if compressor:
+        p.enable_compressor(compressor)
+        p.set_compression_level(1)
+    p.max_packet_size = p.abs_max_packet_size
+    return p
+
+def make_stream(protocol, packets):
+    """ the bytes the other end would receive for these packets """
+    stream = []
+    for packet in packets:
+        for proto_flags, index, level, data in protocol.encode(packet):
+            stream.append(pack_header(proto_flags, level, index, len(data)))
+            stream.append(memoryview_to_bytes(data))
+    return b"".join(stream)
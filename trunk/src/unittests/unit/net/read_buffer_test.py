@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import unittest
+
+from xpra.os_util import PYTHON3, Queue, memoryview_to_bytes
+from xpra.net.read_buffer import ReadBuffer
+from unit.net.protocol_test_util import make_protocol, make_stream
+
+
+class TestReadBuffer(unittest.TestCase):
+
+    def test_append_read(self):
+        rb = ReadBuffer()
+        assert len(rb)==0
+        rb.append(b"hello")
+        rb.append(b" world")
+        assert len(rb)==11
+        assert rb.peek_byte(0)==ord("h")
+        assert memoryview_to_bytes(rb.peek(5))==b"hello"
+        assert len(rb)==11, "peek should not consume any data"
+        rb.skip(6)
+        assert rb.getvalue()==b"world"
+        assert memoryview_to_bytes(rb.read(3))==b"wor"
+        assert len(rb)==2
+        rb.append(b"!")
+        assert rb.getvalue()==b"ld!"
+        info = rb.get_info()
+        assert info.get("total")==12
+        assert info.get("size")==3
+
+    def test_views_stay_valid(self):
+        rb = ReadBuffer()
+        rb.append(b"0123456789")
+        v = rb.read(4)
+        #appending while a view is still in use must not corrupt it:
+        rb.append(b"abcdef")
+        assert memoryview_to_bytes(v)==b"0123"
+        assert rb.getvalue()==b"456789abcdef"
+        if PYTHON3:
+            assert rb.get_info().get("copies")==1
+        del v
+        rb.read(6)
+        rb.append(b"XYZ")
+        assert rb.getvalue()==b"abcdefXYZ"
+
+    def test_protocol_parse(self):
+        from xpra.net.protocol import Protocol
+        from xpra.net.compression import Compressed
+        received = []
+        def process_packet(_proto, packet):
+            received.append(packet)
+        p = make_protocol(process_packet, "zlib")
+        pixels = b"\x01\x02\x03\x04"*64*1024
+        packets = [
+            ["hello", {"foo" : "bar"}],
+            ["draw", 1, 0, 0, 256, 256, "rgb32", Compressed("rgb32", pixels), 1, 1024, {}],
+            ["ping", 1000],
+            ]
+        stream = make_stream(p, packets)
+        #feed the stream in small uneven chunks:
+        p._read_queue = Queue()
+        for i in range(0, len(stream), 1000):
+            p._read_queue.put(stream[i:i+1000])
+        p._read_queue.put(None)
+        p.do_read_parse_thread_loop()
+        types = [memoryview_to_bytes(x[0]) for x in received if x[0]!=Protocol.CONNECTION_LOST]
+        assert types==[b"hello", b"draw", b"ping"], "got %s" % (types,)
+        draw = received[1]
+        assert memoryview_to_bytes(draw[7])==pixels
+        assert len(p._read_buffer)==0
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import os
+import unittest
+
+from xpra.util import typedict
+from xpra.os_util import monotonic_time
+from xpra.net import udp_protocol
+from xpra.net.udp_protocol import (
+    UDPProtocol, _header_struct, _header_size,
+    FLAG_SYNCHRONOUS, FLAG_CONTROL, REORDER_THRESHOLD, MIN_RTO, MAX_RTO,
+    )
+from unit.net.protocol_test_util import FakeScheduler, FakeConnection
+
+
+def make_protocol(sack=True):
+    p = UDPProtocol(FakeScheduler(), FakeConnection(), None)
+    p.parse_remote_caps(typedict({"udp.sack" : sack}))
+    p.received = []
+    p._read_queue_put = p.received.append
+    return p
+
+def split(buf):
+    values = _header_struct.unpack_from(buf[:_header_size])
+    return list(values)+[buf[_header_size:], None]
+
+
+class TestUDPProtocol(unittest.TestCase):
+
+    def test_sack(self):
+        p = make_protocol()
+        #asynchronous packets 0, 2, 3 and 5:
+        for seqno in (0, 2, 3, 5):
+            p.process_udp_data(0, seqno, 0, 0, 1, b"data%i" % seqno, None)
+        assert p.received==[b"data0", b"data2", b"data3", b"data5"]
+        assert p.last_sequence==0
+        assert p._get_sack()==[[2, 3], [5, 5]]
+        #new data must be acknowledged promptly:
+        assert p.control_timer_due<=monotonic_time()+udp_protocol.ACK_DELAY/1000.0
+        #but control packets are not:
+        q = make_protocol()
+        q.process_udp_data(0, 0, FLAG_CONTROL, 0, 1, b"control", None)
+        assert not q.control_timer
+
+    def test_legacy_peer(self):
+        p = make_protocol(False)
+        controls = []
+        p._send_async = lambda packet, flags, _fail_cb : controls.append((packet, flags))
+        p.process_udp_data(0, 0, FLAG_SYNCHRONOUS, 0, 1, b"data", None)
+        #older peers don't expect prompt acknowledgements:
+        assert not p.control_timer
+        #and only understand the original control packet:
+        p.send_control()
+        packet, flags = controls[0]
+        assert len(packet)==7 and flags==0
+        #they won't acknowledge promptly, so we can't use timeouts:
+        p.write_buf(1, b"x", None, True)
+        assert not p.send_time and not p.rto_timer
+
+    def test_fast_retransmit(self):
+        p = make_protocol()
+        #chunk 1 is missing, we only need to wait for REORDER_THRESHOLD chunks after it:
+        chunks = REORDER_THRESHOLD+2
+        for chunk in range(chunks):
+            if chunk!=1:
+                p.process_udp_data(0, 0, FLAG_SYNCHRONOUS, chunk, chunks, b"x", None)
+        assert p._get_missing()=={0 : [1]}
+        p.process_udp_data(0, 0, FLAG_SYNCHRONOUS, 1, chunks, b"x", None)
+        assert p.received==[b"x"*chunks]
+        assert not p._get_missing()
+
+    def test_rtt(self):
+        p = make_protocol()
+        p.update_rtt(100)
+        assert p.srtt==100 and p.rttvar==50
+        assert p.rto==min(MAX_RTO, 100+200+udp_protocol.ACK_DELAY)
+        for _ in range(50):
+            p.update_rtt(1)
+        assert p.rto==MIN_RTO
+        #packets which have been re-sent are not used for rtt samples:
+        p.send_time = {1 : monotonic_time()-10, 2 : monotonic_time()-10}
+        p.retransmitted.add(2)
+        p.acknowledged((1, 2))
+        assert p.srtt>1000
+        assert not p.send_time and not p.retransmitted
+        #timestamps echoed by the other end:
+        q = make_protocol()
+        now = int(monotonic_time()*1000)
+        q.process_control_options(typedict({"echo" : (now-150, 50)}))
+        assert 100<=q.srtt<150
+
+    def test_resend(self):
+        sender = make_protocol()
+        sender.mtu = 600
+        data = os.urandom(2000)
+        sender.write_buf(0, data, None, True)
+        sent = sender._conn.written
+        assert len(sent)==4
+        assert sender.send_time and sender.rto_timer
+        receiver = make_protocol()
+        for i in (0, 1, 3):
+            receiver.process_udp_data(*split(sent[i]))
+        #not overdue yet:
+        assert not receiver._get_missing()
+        receiver.pending_packets[0].start_time -= 1
+        assert receiver._get_missing()=={0 : [2]}
+        #the sender only re-sends the chunk once per round trip:
+        for _ in range(2):
+            sender.process_control(600, False, -1, 0, {0 : [2]}, ())
+        assert len(sent)==5 and sent[4]==sent[2]
+        receiver.process_udp_data(*split(sent[4]))
+        assert receiver.received==[data]
+        #acknowledge it:
+        sender.process_control(600, False, 0, 0, {}, ())
+        assert not sender.resend_cache and not sender.send_time
+
+    def test_rto(self):
+        sender = make_protocol()
+        sender.mtu = 600
+        sender.write_buf(0, b"x"*2000, None, True)
+        sender.send_time[0] -= 10
+        rto = sender.rto
+        sender.check_rto()
+        #probes the last chunk and backs off:
+        sent = sender._conn.written
+        assert len(sent)==5 and sent[4]==sent[3]
+        assert sender.rto==min(MAX_RTO, rto*2)
+
+    def test_fec(self):
+        if not udp_protocol.xor_into:
+            print("cyxor is not available, FEC test skipped")
+            return
+        fec = udp_protocol.FEC
+        udp_protocol.FEC = True
+        try:
+            sender = make_protocol()
+            sender.mtu = 600
+            sender.remote_fec = True
+            data = os.urandom(20000)
+            sender.write_buf(0, data, lambda : None, True)
+        finally:
+            udp_protocol.FEC = fec
+        sent = sender._conn.written
+        chunks = _header_struct.unpack_from(sent[0])[4]
+        assert len(sent)==chunks+(chunks+udp_protocol.FEC_GROUP-1)//udp_protocol.FEC_GROUP
+        for lost in (0, chunks-1):
+            #drop one data chunk from the first and last group:
+            receiver = make_protocol()
+            for buf in sent:
+                if _header_struct.unpack_from(buf)[3]!=lost:
+                    receiver.process_udp_data(*split(buf))
+            assert receiver.received==[data], "failed to recover chunk %i" % lost
+            assert receiver.fec_recovered==1
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
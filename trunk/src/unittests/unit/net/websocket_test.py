@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import os
+import unittest
+
+from xpra.os_util import Queue, memoryview_to_bytes
+from xpra.net.protocol import Protocol
+from xpra.net.websocket_header import (
+    encode_hybi_header, decode_hybi_header,
+    OPCODE_BINARY, OPCODE_CONTINUATION, OPCODE_PING, OPCODE_PONG, OPCODE_CLOSE,
+    )
+try:
+    from xpra.net.websocket_protocol import WebSocketProtocol
+except ImportError:
+    WebSocketProtocol = None
+from unit.net.protocol_test_util import make_protocol
+
+
+def mask_frame(opcode, payload, fin=True):
+    mask = os.urandom(4)
+    masked = bytes(bytearray(b ^ bytearray(mask)[i%4] for i,b in enumerate(bytearray(payload))))
+    return encode_hybi_header(opcode, len(payload), True, fin) + mask + masked
+
+
+class TestWebSocketHeader(unittest.TestCase):
+
+    def test_roundtrip(self):
+        for size in (0, 1, 125, 126, 65535, 65536, 2**32+1):
+            for has_mask in (False, True):
+                header = encode_hybi_header(OPCODE_BINARY, size, has_mask)
+                mask = b"\1\2\3\4" if has_mask else None
+                if has_mask:
+                    header += mask
+                assert decode_hybi_header(header)==(OPCODE_BINARY, True, mask, size, len(header))
+                #incomplete headers:
+                for i in range(len(header)):
+                    assert decode_hybi_header(header[:i]) is None
+
+    def test_reserved_bits(self):
+        try:
+            decode_hybi_header(b"\xc2\x00")
+        except ValueError:
+            pass
+        else:
+            raise Exception("reserved bits should be rejected")
+
+
+class TestWebSocketProtocol(unittest.TestCase):
+
+    def make_protocol(self, received):
+        def process_packet(_proto, packet):
+            received.append(packet)
+        p = make_protocol(process_packet, protocol_class=WebSocketProtocol)
+        p._read_queue = Queue()
+        written = []
+        p._write_queue.put = lambda item: written.append(b"".join(memoryview_to_bytes(x) for x in item[0]))
+        return p, written
+
+    def test_parse(self):
+        received = []
+        p, written = self.make_protocol(received)
+        from xpra.net.header import pack_header
+        stream = b""
+        for packet in (["hello", {"version" : "3.0"}], ["draw", 1, 0, 0, 16, 16, "rgb32", b"\x80"*1024, 1, 64, {}]):
+            for proto_flags, index, level, data in p.encode(packet):
+                stream += pack_header(proto_flags, level, index, len(data)) + memoryview_to_bytes(data)
+        #split the stream into frames of various sizes, with a ping in the middle:
+        frames = mask_frame(OPCODE_BINARY, stream[:10], False)
+        frames += mask_frame(OPCODE_PING, b"ping!")
+        frames += mask_frame(OPCODE_CONTINUATION, stream[10:300], False)
+        frames += mask_frame(OPCODE_CONTINUATION, stream[300:])
+        #deliver it in awkward chunks, so headers and masks are split too:
+        for i in range(0, len(frames), 7):
+            p._read_queue.put(frames[i:i+7])
+        p._read_queue.put(None)
+        p.do_read_parse_thread_loop()
+        types = [memoryview_to_bytes(x[0]) for x in received if x[0]!=Protocol.CONNECTION_LOST]
+        assert types==[b"hello", b"draw"], "got %s" % (types,)
+        assert memoryview_to_bytes(received[1][7])==b"\x80"*1024
+        assert written==[encode_hybi_header(OPCODE_PONG, 5)+b"ping!"]
+        assert p.ws_frames_in==4
+
+    def test_close(self):
+        received = []
+        p, written = self.make_protocol(received)
+        p.append_read_data(p._read_buffer, mask_frame(OPCODE_CLOSE, b"\x03\xe8bye"))
+        assert written==[encode_hybi_header(OPCODE_CLOSE, 2)+b"\x03\xe8"]
+
+    def test_write(self):
+        p, written = self.make_protocol([])
+        p._write_thread = True
+        p.raw_write([b"header", b"x"*200000])
+        data = written[0]
+        assert decode_hybi_header(data)==(OPCODE_BINARY, True, None, 200006, 10)
+        assert data[10:]==b"header"+b"x"*200000
+
+
+def main():
+    if WebSocketProtocol:
+        unittest.main()
+    else:
+        print("cyxor is not available, websocket protocol test skipped")
+
+if __name__ == '__main__':
+    main()
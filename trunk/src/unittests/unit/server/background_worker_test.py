@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import unittest
+from threading import Event, Lock
+
+from xpra.server.background_worker import Worker, PRIORITY_HIGH, PRIORITY_LOW
+
+
+class TestWorker(unittest.TestCase):
+
+    def test_serial(self):
+        w = Worker(4)
+        w.start()
+        try:
+            lock = Lock()
+            results = []
+            done = Event()
+            def work(i):
+                with lock:
+                    results.append(i)
+                    if len(results)==50:
+                        done.set()
+            for i in range(50):
+                w.add(lambda i=i : work(i))
+            assert done.wait(10), "timeout waiting for the work items"
+            assert results==list(range(50)), "items ran out of order: %s" % (results, )
+        finally:
+            w.stop()
+
+    def test_parallel(self):
+        w = Worker(2)
+        w.start()
+        try:
+            blocked = Event()
+            unblock = Event()
+            def block():
+                blocked.set()
+                unblock.wait(10)
+            w.add(block)
+            assert blocked.wait(10)
+            #serial items must wait for the blocked one:
+            serial = Event()
+            w.add(serial.set)
+            #but parallel items can run:
+            parallel = Event()
+            w.add(parallel.set, parallel=True)
+            assert parallel.wait(10), "parallel item was blocked"
+            assert not serial.is_set()
+            unblock.set()
+            assert serial.wait(10)
+        finally:
+            w.stop()
+
+    def test_priority(self):
+        w = Worker(1)
+        w.start()
+        try:
+            blocked = Event()
+            unblock = Event()
+            def block():
+                blocked.set()
+                unblock.wait(10)
+            w.add(block, parallel=True)
+            assert blocked.wait(10)
+            results = []
+            done = Event()
+            w.add(lambda : results.append("low"), PRIORITY_LOW, True)
+            w.add(lambda : results.append("high"), PRIORITY_HIGH, True)
+            w.add(done.set, PRIORITY_LOW, True)
+            unblock.set()
+            assert done.wait(10)
+            assert results==["high", "low"], "wrong order: %s" % (results, )
+            info = w.get_info()
+            assert info.get("processed")>=3
+            assert sum(info.get("latency", {}).get("histogram", {}).values())>=3
+        finally:
+            w.stop()
+
+    def test_force_stop(self):
+        w = Worker(1)
+        w.start()
+        blocked = Event()
+        unblock = Event()
+        def block():
+            blocked.set()
+            unblock.wait(10)
+        w.add(block, parallel=True)
+        assert blocked.wait(10)
+        ran = []
+        for _ in range(5):
+            w.add(lambda : ran.append(True), PRIORITY_HIGH, True)
+        w.stop(True)
+        unblock.set()
+        for t in w.threads:
+            t.join(10)
+            assert not t.is_alive()
+        assert not ran, "%i items ran after a forced stop" % len(ran)
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
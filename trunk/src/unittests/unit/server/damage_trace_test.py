@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import os
+import unittest
+import tempfile
+
+from xpra.util import typedict
+from xpra.server.window.damage_trace import DamageTraceWriter, load_damage_trace
+from xpra.codecs.image_wrapper import ImageWrapper
+try:
+    from xpra.server.window.window_video_source import WindowVideoSource
+except ImportError:
+    WindowVideoSource = None
+
+
+class FakeWindow(object):
+    """ a window model with a solid color """
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+    def get_image(self, x, y, w, h):
+        return ImageWrapper(x, y, w, h, b"\x40\x80\xc0\xff"*w*h, "BGRX", 24, w*4, 4)
+    def get_dimensions(self):
+        return self.width, self.height
+    def get(self, _name, default_value=None):
+        return default_value
+    def get_property(self, _name):
+        return None
+    def get_property_names(self):
+        return ()
+    def get_dynamic_property_names(self):
+        return ()
+    def is_managed(self):
+        return True
+    def is_tray(self):
+        return False
+    def is_OR(self):
+        return False
+    def is_shadow(self):
+        return False
+    def has_alpha(self):
+        return False
+    def acknowledge_changes(self):
+        pass
+    def connect(self, *_args):
+        return 0
+    def disconnect(self, *_args):
+        pass
+
+
+class TestDamageTrace(unittest.TestCase):
+
+    def test_roundtrip(self):
+        f = tempfile.NamedTemporaryFile(prefix="damage", suffix=".trace", delete=False)
+        f.close()
+        try:
+            writer = DamageTraceWriter(f.name, 1, 640, 480, {"encoding" : "auto"})
+            writer.damage(640, 480, 10, 20, 4, 2, {"damage" : True, "ignored" : None})
+            pixels = b"\x01\x02\x03\xff"*4*2
+            writer.pixels(10, 20, ImageWrapper(10, 20, 4, 2, pixels, "BGRX", 24, 16, 4))
+            writer.close()
+            records = list(load_damage_trace(f.name))
+            assert len(records)==3, "expected 3 records but got %s" % (records, )
+            assert records[0]==["window", 1, 1, 640, 480, {"encoding" : b"auto"}], "invalid header: %s" % (records[0], )
+            damage = records[1]
+            assert damage[0]=="damage" and damage[2:8]==[640, 480, 10, 20, 4, 2]
+            assert damage[8]=={"damage" : True}
+            p = records[2]
+            assert p[0]=="pixels" and p[2:10]==[10, 20, 4, 2, "BGRX", 24, 4, 16]
+            assert p[10]==pixels
+        finally:
+            os.unlink(f.name)
+
+    def test_window_video_source(self):
+        #the server always uses a WindowVideoSource, which captures the pixels itself:
+        if not WindowVideoSource:
+            print("window video source not found, test skipped")
+            return
+        from xpra.server.window.batch_config import DamageBatchConfig
+        from xpra.server.source.source_stats import GlobalPerformanceStatistics
+        from xpra.codecs.video_helper import getVideoHelper
+        from xpra.codecs.loader import load_codecs
+        load_codecs(decoders=False)
+        f = tempfile.NamedTemporaryFile(prefix="damage", suffix=".trace", delete=False)
+        f.close()
+        encode_queue = []
+        def call_in_encode_thread(_optional, fn, *args):
+            encode_queue.append((fn, args))
+        def noop(*_args):
+            return 0
+        encodings = ["rgb24", "rgb32"]
+        ws = WindowVideoSource(noop, noop, noop,
+                               640, 480,
+                               noop, lambda : 0, call_in_encode_thread, noop, noop,
+                               GlobalPerformanceStatistics(),
+                               1, FakeWindow(640, 480), DamageBatchConfig(), 0,
+                               False, 0,
+                               getVideoHelper(),
+                               encodings, encodings,
+                               "rgb24", encodings, encodings, (), typedict(), typedict(),
+                               ("RGB", "RGBX", "BGRX"),
+                               typedict(),
+                               None, 0, 0, 0)
+        try:
+            ws.damage_trace = DamageTraceWriter(f.name, 1, 640, 480)
+            ws.process_damage_region(0, 10, 20, 32, 16, "rgb24", {})
+            assert encode_queue or ws.encode_queue, "the region was not queued for encoding"
+            ws.damage_trace.close()
+            records = list(load_damage_trace(f.name))
+            pixels = [r for r in records if r[0]=="pixels"]
+            assert len(pixels)==1, "expected one pixels record but got %s" % ([r[0] for r in records], )
+            assert pixels[0][2:10]==[10, 20, 32, 16, "BGRX", 24, 4, 128]
+            assert pixels[0][10]==b"\x40\x80\xc0\xff"*32*16
+        finally:
+            ws.cleanup()
+            os.unlink(f.name)
+
+    def test_invalid_file(self):
+        f = tempfile.NamedTemporaryFile(prefix="damage", suffix=".trace", delete=False)
+        try:
+            f.write(b"not a trace")
+            f.close()
+            try:
+                list(load_damage_trace(f.name))
+            except Exception:
+                pass
+            else:
+                raise Exception("invalid file should not have loaded")
+        finally:
+            os.unlink(f.name)
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
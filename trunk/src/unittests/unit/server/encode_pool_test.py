@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import time
+import unittest
+from threading import Event, Lock
+
+from xpra.server.encode_pool import EncodePool
+
+
+class TestEncodePool(unittest.TestCase):
+
+    def test_ordering(self):
+        pool = EncodePool(4)
+        pool.start()
+        try:
+            lock = Lock()
+            results = {}
+            done = Event()
+            def work(wid, i):
+                time.sleep(0.001*(i%3))
+                with lock:
+                    results.setdefault(wid, []).append(i)
+                    if sum(len(x) for x in results.values())==60:
+                        done.set()
+            for i in range(20):
+                for wid in (1, 2, 3):
+                    pool.add((0, wid), work, wid, i)
+            assert done.wait(10), "timeout waiting for the work items"
+            for wid in (1, 2, 3):
+                assert results[wid]==list(range(20)), "items for window %i ran out of order: %s" % (wid, results[wid])
+            info = pool.get_info(0)
+            assert info.get("items")==60
+            assert pool.qsize(0)==0
+        finally:
+            pool.stop()
+
+    def test_parallel(self):
+        pool = EncodePool(2)
+        pool.start()
+        try:
+            #the second window must be able to run while the first one is blocked:
+            blocked = Event()
+            unblock = Event()
+            ran = Event()
+            def block():
+                blocked.set()
+                unblock.wait(10)
+            pool.add((0, 1), block)
+            pool.add((0, 1), ran.set)
+            assert blocked.wait(10)
+            other = Event()
+            pool.add((0, 2), other.set)
+            assert other.wait(10), "window 2 was blocked by window 1"
+            assert not ran.is_set(), "window 1 items must run in sequence"
+            #the item running is not counted:
+            assert pool.qsize(0)==1
+            assert pool.get_info(0).get("queue")=={1 : 1}
+            unblock.set()
+            assert ran.wait(10)
+        finally:
+            pool.stop()
+
+    def test_barrier(self):
+        pool = EncodePool(4)
+        pool.start()
+        try:
+            lock = Lock()
+            results = []
+            done = Event()
+            def work(name, delay=0):
+                time.sleep(delay)
+                with lock:
+                    results.append(name)
+            #window items are not re-ordered around the non-window item (wid=0):
+            pool.add((0, 1), work, "w1-a", 0.05)
+            pool.add((0, 2), work, "w2-a", 0.02)
+            pool.add((0, 0), work, "clipboard")
+            pool.add((0, 1), work, "w1-b")
+            pool.add((0, 2), work, "w2-b")
+            pool.add((0, 0), done.set)
+            assert done.wait(10), "timeout waiting for the work items"
+            assert sorted(results[:2])==["w1-a", "w2-a"], "wrong order: %s" % (results, )
+            assert results[2]=="clipboard", "wrong order: %s" % (results, )
+            assert sorted(results[3:])==["w1-b", "w2-b"], "wrong order: %s" % (results, )
+            assert pool.qsize()==0
+        finally:
+            pool.stop()
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import os
+import zlib
+import shutil
+import unittest
+import tempfile
+
+from xpra.server.http_cache import StaticFileCache
+
+
+class TestStaticFileCache(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="http-cache")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, filename, data):
+        path = os.path.join(self.root, filename)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_gzip(self):
+        data = b"var x = 'hello';\n"*100
+        path = self.write("client.js", data)
+        cache = StaticFileCache()
+        sf = cache.get_file(path, ["gzip", ""])
+        assert sf.get_data()==data
+        gz = sf.get_data("gzip")
+        assert gz and len(gz)<len(data)
+        assert zlib.decompress(gz, zlib.MAX_WBITS | 16)==data
+        assert sf.get_etag("gzip")!=sf.get_etag()
+        #served from the cache:
+        assert cache.get_file(path, ["gzip", ""]) is sf
+        assert cache.hits==1 and cache.misses==1
+        #not worth compressing:
+        sf = cache.get_file(self.write("small.js", b"x"), ["gzip", ""])
+        assert sf.get_data("gzip") is None and sf.get_data()==b"x"
+
+    def test_precompressed(self):
+        data = b"<html></html>"*100
+        path = self.write("index.html", data)
+        self.write("index.html.br", b"brotli-data")
+        cache = StaticFileCache()
+        sf = cache.get_file(path, ["br", "gzip", ""])
+        assert sf.get_data("br")==b"brotli-data"
+        assert sf.get_data("gzip")
+        assert cache.size==len(data)+len(b"brotli-data")+len(sf.get_data("gzip"))
+
+    def test_modified(self):
+        path = self.write("index.html", b"version 1")
+        cache = StaticFileCache()
+        sf = cache.get_file(path, [""])
+        etag = sf.get_etag()
+        self.write("index.html", b"version 2 is longer")
+        sf = cache.get_file(path, [""])
+        assert sf.get_data()==b"version 2 is longer"
+        assert sf.get_etag()!=etag
+        assert len(cache.files)==1 and cache.size==len(sf.get_data())
+
+    def test_eviction(self):
+        cache = StaticFileCache(8*1024*8)
+        for i in range(16):
+            cache.get_file(self.write("file%i.png" % i, b"\0"*4096), [""])
+        assert cache.size<=cache.max_size
+        assert len(cache.files)==16
+        #too big to be cached:
+        cache.get_file(self.write("big.png", b"\0"*8193), [""])
+        assert len(cache.files)==16
+        #the least recently used file is evicted:
+        cache.get_file(os.path.join(self.root, "file0.png"), [""])
+        cache.get_file(self.write("file16.png", b"\0"*4096), [""])
+        filenames = [os.path.basename(x) for x in cache.files.keys()]
+        assert len(filenames)==16 and "file1.png" not in filenames and "file0.png" in filenames
+
+    def test_preload(self):
+        self.write("index.html", b"<html></html>"*100)
+        self.write("index.html.gz", b"not-really-gzip")
+        os.mkdir(os.path.join(self.root, "js"))
+        self.write("js/client.js", b"var x = 0;\n"*100)
+        cache = StaticFileCache()
+        cache.preload(self.root, ["gzip"])
+        assert len(cache.files)==2
+        sf = cache.get_file(os.path.join(self.root, "index.html"), ["gzip", ""])
+        assert sf.get_data("gzip")==b"not-really-gzip"
+        assert cache.hits==1
+
+    def test_missing(self):
+        cache = StaticFileCache()
+        try:
+            cache.get_file(os.path.join(self.root, "missing.html"), [""])
+        except (IOError, OSError):
+            pass
+        else:
+            raise Exception("missing file should raise an error")
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import time
+import socket
+import unittest
+from multiprocessing import Pipe
+
+from xpra.os_util import POSIX
+from xpra.net.bytestreams import SocketConnection, Connection
+
+
+class TestProxyPool(unittest.TestCase):
+
+    def test_connection_handover(self):
+        from multiprocessing.reduction import send_handle, recv_handle
+        from xpra.server.proxy.proxy_pool import get_connection_state, make_socket_connection
+        a, b = socket.socketpair()
+        conn = SocketConnection(a, "local", "remote", "target", "unix-domain")
+        conn.input_bytecount = 100
+        state = get_connection_state(conn)
+        assert state
+        parent, child = Pipe()
+        import os
+        send_handle(parent, a.fileno(), os.getpid())
+        fd = recv_handle(child)
+        copy = make_socket_connection(state, fd)
+        a.close()
+        assert copy.socktype=="unix-domain" and copy.remote=="remote" and copy.input_bytecount==100
+        copy.write(b"hello")
+        assert b.recv(5)==b"hello"
+        copy.close()
+        b.close()
+        #other types of connections cannot be passed on:
+        assert get_connection_state(Connection("target", "ssh")) is None
+
+    def test_pool(self):
+        from xpra.server.proxy.proxy_pool import ProxyPool
+        pool = ProxyPool([], size=1, max_sessions=2)
+        pool.start()
+        try:
+            deadline = time.time()+30
+            while not pool.get_worker() and time.time()<deadline:
+                time.sleep(0.1)
+            assert pool.get_worker(), "pool worker is not ready"
+            info = pool.get_info()
+            assert info.get("idle")==1 and info.get("size")==1
+            #connections which cannot be handed over use the fallback:
+            assert pool.start_session({}, Connection("target", "ssh"), Connection("target", "ssh")) is None
+            assert pool.get_info().get("fallbacks")==1
+        finally:
+            pool.cleanup()
+        worker = pool.workers[0].process if pool.workers else None
+        if worker:
+            worker.join(10)
+            assert not worker.is_alive()
+
+
+def main():
+    if POSIX:
+        unittest.main()
+
+if __name__ == '__main__':
+    main()
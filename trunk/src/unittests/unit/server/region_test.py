@@ -8,7 +8,7 @@
 import unittest
 
 try:
-    from xpra.server.region import rectangle        #@UnresolvedImport
+    from xpra.server.window.region import rectangle, region_set, add_rectangle, remove_rectangle   #@UnresolvedImport
 
     R1 = rectangle(0, 0, 20, 20)
     R2 = rectangle(0, 0, 20, 20)
@@ -16,7 +16,7 @@ try:
     R4 = rectangle(10, 10, 50, 50)
     R5 = rectangle(100, 100, 100, 100)
 except:
-    rectangle, R1, R2, R3, R4, R5 = None, None, None, None, None, None
+    rectangle, region_set, R1, R2, R3, R4, R5 = None, None, None, None, None, None, None
 
 
 class TestRegion(unittest.TestCase):
@@ -92,6 +92,98 @@ class TestRegion(unittest.TestCase):
         assert rectangle(0, 50, 50, 50) in l
         assert rectangle(200, 200, 0, 0) not in l
 
+    def test_hash(self):
+        assert hash(R1)==hash(R2)
+        assert len(set((R1, R2, R3)))==2
+        #transposed coordinates must not collide:
+        assert hash(rectangle(0, 10, 20, 30))!=hash(rectangle(10, 0, 30, 20))
+
+    def test_add_remove_rectangle(self):
+        l = []
+        assert add_rectangle(l, rectangle(0, 0, 100, 100))
+        #already contained:
+        assert not add_rectangle(l, rectangle(10, 10, 10, 10))
+        assert add_rectangle(l, rectangle(50, 50, 100, 100))
+        assert sum(r.width*r.height for r in l)==100*100*2-50*50
+        remove_rectangle(l, rectangle(0, 0, 150, 100))
+        assert l==[rectangle(50, 100, 100, 50)]
+
+
+class TestRegionSet(unittest.TestCase):
+
+    def area(self, rs):
+        return sum(r.width*r.height for r in rs)
+
+    def test_empty(self):
+        rs = region_set()
+        assert not rs
+        assert len(rs)==0
+        assert rs.get_extents() is None
+        rs.add(10, 10, 0, 10)
+        assert not rs
+
+    def test_union(self):
+        rs = region_set()
+        rs.add(0, 0, 100, 100)
+        rs.add(50, 50, 100, 100)
+        assert rs
+        assert rs.get_area()==100*100*2-50*50
+        assert self.area(rs)==rs.get_area()
+        #no overlapping rectangles:
+        rects = tuple(rs)
+        for i, r in enumerate(rects):
+            for o in rects[i+1:]:
+                assert not r.intersects_rect(o)
+        assert rs.get_extents()==rectangle(0, 0, 150, 150)
+        #adjacent rectangles are merged:
+        rs = region_set()
+        for x in range(0, 100, 10):
+            rs.add(x, 0, 10, 20)
+        rs.add(0, 20, 100, 20)
+        assert tuple(rs)==(rectangle(0, 0, 100, 40),)
+        other = region_set((rectangle(0, 40, 100, 10), rectangle(200, 200, 10, 10)))
+        rs.union(other)
+        assert len(rs)==2
+        assert rs.get_area()==100*50+10*10
+
+    def test_subtract(self):
+        rs = region_set((R3, ))
+        rs.subtract_rect(rectangle(10, 10, 20, 20))
+        assert len(rs)==4
+        assert rs.get_area()==40*40-20*20
+        assert not rs.intersects(10, 10, 20, 20)
+        assert rs.intersects(0, 0, 11, 11)
+        rs.subtract(0, 0, 40, 40)
+        assert not rs
+
+    def test_intersect(self):
+        rs = region_set((R3, R5))
+        rs.intersect_rect(R4)
+        assert tuple(rs)==(rectangle(10, 10, 30, 30), )
+        rs.intersect(100, 100, 10, 10)
+        assert not rs
+
+    def test_contains(self):
+        rs = region_set()
+        rs.add(0, 0, 50, 100)
+        rs.add(50, 0, 50, 50)
+        assert rs.contains(0, 0, 100, 50)
+        assert rs.contains_rect(R1)
+        assert R1 in rs
+        assert not rs.contains(0, 0, 100, 51)
+        assert not rs.contains(40, 40, 20, 20)
+        rs.add(0, 101, 100, 10)
+        #gap between the bands:
+        assert not rs.contains(0, 90, 10, 20)
+
+    def test_copy(self):
+        rs = region_set((R1, ))
+        c = rs.copy()
+        c.add_rect(R5)
+        assert len(rs)==1 and len(c)==2
+        c.clear()
+        assert not c and rs
+
 
 def main():
     #skip test if import failed (ie: not a server build)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import time
+import unittest
+from threading import Thread
+
+from xpra.server.window.shared_encode import SharedEncodeCache, get_shared_encode_cache, release_shared_encode_cache, caches
+
+
+def make_result(data):
+    return "png", data, {}, 10, 10, 0, 24
+
+
+class TestSharedEncode(unittest.TestCase):
+
+    def test_claim(self):
+        sec = SharedEncodeCache(1)
+        assert sec.claim("a") is None
+        sec.add("a", make_result(b"foo"))
+        r = sec.claim("a")
+        assert r[1]==b"foo"
+        #each client gets its own copy of the client options:
+        r[2]["delta"] = 1
+        assert sec.claim("a")[2]=={}
+        #failures are not recorded:
+        assert sec.claim("b") is None
+        sec.abort("b")
+        assert sec.claim("b") is None
+        info = sec.get_info()
+        assert info.get("hits")==2 and info.get("misses")==3 and info.get("ratio")==40
+
+    def test_wait(self):
+        sec = SharedEncodeCache(1, wait=10000)
+        assert sec.claim("a") is None
+        results = []
+        t = Thread(target=lambda : results.append(sec.claim("a")))
+        t.start()
+        time.sleep(0.1)
+        #the other client is waiting for us:
+        assert not results
+        sec.add("a", make_result(b"bar"))
+        t.join(10)
+        assert results and results[0][1]==b"bar"
+
+    def test_timeout(self):
+        sec = SharedEncodeCache(1, wait=10)
+        assert sec.claim("a") is None
+        #the other encoder is too slow, encode it ourselves:
+        start = time.time()
+        assert sec.claim("a") is None
+        assert time.time()-start<5
+        sec.add("a", make_result(b"late"))
+        assert sec.claim("a")[1]==b"late"
+        assert sec.get_info().get("timeouts")==1
+
+    def test_registry(self):
+        sec = get_shared_encode_cache(100)
+        assert get_shared_encode_cache(100) is sec and sec.users==2
+        release_shared_encode_cache(sec)
+        assert 100 in caches
+        release_shared_encode_cache(sec)
+        assert 100 not in caches
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import unittest
+
+from xpra.codecs.image_wrapper import ImageWrapper
+from xpra.server.window.strip_encode import StripEncodePool, get_strips, split_image
+
+
+class TestStripEncode(unittest.TestCase):
+
+    def test_get_strips(self):
+        assert get_strips(100, 4, 10)==[(0, 25), (25, 25), (50, 25), (75, 25)]
+        assert get_strips(10, 3, 1)==[(0, 4), (4, 3), (7, 3)]
+        #never smaller than the minimum height:
+        assert get_strips(100, 8, 40)==[(0, 50), (50, 50)]
+        assert get_strips(30, 4, 40)==[(0, 30)]
+
+    def test_split_image(self):
+        w, h = 16, 10
+        rowstride = w*4+8
+        pixels = bytes(bytearray(i & 0xff for i in range(rowstride*h)))
+        image = ImageWrapper(5, 20, w, h, pixels, "BGRX", 24, rowstride, 4)
+        image.set_target_y(30)
+        strips = split_image(image, 3, 1)
+        assert len(strips)==3
+        y = 0
+        for strip in strips:
+            assert strip.get_x()==5 and strip.get_y()==20+y
+            assert strip.get_target_y()==30+y
+            assert strip.get_width()==w and strip.get_rowstride()==rowstride
+            sh = strip.get_height()
+            assert strip.get_pixels().tobytes()==pixels[y*rowstride:(y+sh)*rowstride]
+            y += sh
+        assert y==h
+        assert split_image(image, 4, 5) is not None
+        assert split_image(image, 4, 6) is None
+
+    def test_pool(self):
+        pool = StripEncodePool(2)
+        pool.start()
+        try:
+            assert pool.encode(lambda a, b : a*b, [(i, 2) for i in range(7)])==[0, 2, 4, 6, 8, 10, 12]
+            def fail(i):
+                if i==3:
+                    raise ValueError("strip %i" % i)
+                return i
+            try:
+                pool.encode(fail, [(i, ) for i in range(5)])
+            except ValueError:
+                pass
+            else:
+                raise Exception("the error should have been raised by the pool")
+            #the pool is still usable:
+            assert pool.encode(fail, [(0, ), (1, )])==[0, 1]
+        finally:
+            pool.stop()
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
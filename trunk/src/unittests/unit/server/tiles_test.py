@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import unittest
+
+from xpra.codecs.image_wrapper import ImageWrapper
+try:
+    from xpra.server.window.tiles import TileChecksums, crop_image
+except ImportError:
+    TileChecksums = None
+
+
+W, H = 320, 200
+
+def make_image(pixels, x=0, y=0, w=W, h=H):
+    return ImageWrapper(x, y, w, h, pixels, "BGRX", 24, W*4, 4)
+
+
+class TestTiles(unittest.TestCase):
+
+    def test_update(self):
+        if not TileChecksums:
+            print("tiles module not found, test skipped")
+            return
+        tc = TileChecksums(64)
+        tc.resize(W, H)
+        pixels = bytearray(W*H*4)
+        #everything is new:
+        assert tc.update(make_image(pixels), 0, 0)==[(0, 0, W, H)]
+        #nothing has changed:
+        assert tc.update(make_image(pixels), 0, 0)==[]
+        #a pixel changed in the second row of tiles:
+        pixels[(100*W+200)*4] = 0xff
+        assert tc.update(make_image(pixels), 0, 0)==[(192, 64, 64, 64)]
+        #two adjacent rows of tiles are merged into one band:
+        pixels[(10*W+130)*4] = 0xff
+        pixels[(70*W+10)*4] = 0xff
+        assert tc.update(make_image(pixels), 0, 0)==[(0, 0, 192, 128)]
+        #the last row of tiles is partial:
+        pixels[(199*W+319)*4] = 0xff
+        assert tc.update(make_image(pixels), 0, 0)==[(256, 192, 64, 8)]
+        assert tc.skipped>0 and tc.sent>0
+        #invalidated tiles are sent again:
+        tc.invalidate(0, 0, 10, 10)
+        assert tc.update(make_image(pixels), 0, 0)==[(0, 0, 64, 64)]
+        tc.reset()
+        assert tc.update(make_image(pixels), 0, 0)==[(0, 0, W, H)]
+
+    def test_sub_region(self):
+        if not TileChecksums:
+            return
+        tc = TileChecksums(64)
+        tc.resize(W, H)
+        pixels = bytearray(W*H*4)
+        tc.update(make_image(pixels), 0, 0)
+        #a damaged area which doesn't cover whole tiles
+        #must not match the checksums of the full tiles:
+        sub = crop_image(make_image(pixels), 10, 10, 100, 20)
+        assert sub.get_width()==100 and sub.get_rowstride()==400
+        assert tc.update(sub, 10, 10)==[(10, 10, 100, 20)]
+        assert tc.update(sub, 10, 10)==[]
+        #the full tiles no longer match the partial checksums:
+        assert tc.update(make_image(pixels), 0, 0)==[(0, 0, 128, 64)]
+        #lossy updates are not recorded:
+        pixels[0] = 1
+        assert tc.update(make_image(pixels), 0, 0, False)==[(0, 0, 64, 64)]
+        assert tc.update(make_image(pixels), 0, 0)==[(0, 0, 64, 64)]
+
+    def test_crop(self):
+        if not TileChecksums:
+            return
+        pixels = bytearray(range(256))*(W*H*4//256)
+        image = make_image(pixels)
+        image.set_target_x(1000)
+        sub = crop_image(image, 5, 7, 10, 3)
+        assert sub.get_target_x()==1005 and sub.get_y()==7
+        data = bytes(sub.get_pixels())
+        for i in range(3):
+            offset = ((7+i)*W+5)*4
+            assert data[i*40:(i+1)*40]==bytes(pixels[offset:offset+40])
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
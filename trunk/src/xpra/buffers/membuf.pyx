@@ -107,3 +107,13 @@ cdef MemBuf MemBuf_init(const void *p, size_t l,
 
 cdef unsigned long long xxh64(const void* input, size_t length, unsigned long long seed) nogil:
     return XXH64(input, length, seed)
+
+def hash64(buf, unsigned long long seed=0):
+    """ the xxh64 hash of a buffer """
+    cdef const void *ptr = NULL
+    cdef Py_ssize_t buf_len = 0
+    assert object_as_buffer(buf, &ptr, &buf_len)==0, "unable to get a buffer from %s" % type(buf)
+    cdef unsigned long long h
+    with nogil:
+        h = xxh64(ptr, buf_len, seed)
+    return h
@@ -992,6 +992,7 @@ class XpraClientBase(ServerInfoMixin, FilePrintMixin):
         if not p or not p.enable_encoder_from_caps(c):
             return False
         p.enable_compressor_from_caps(c)
+        p.parse_remote_caps(c)
         p.accept()
         p.send_aliases = c.dictget("aliases", {})
         return True
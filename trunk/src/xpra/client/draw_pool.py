@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+from time import sleep
+from threading import Lock
+from collections import deque
+
+from xpra.log import Logger
+from xpra.util import envint
+from xpra.os_util import Queue, monotonic_time
+from xpra.make_thread import start_thread
+
+log = Logger("draw")
+
+#the number of threads used for decoding the draw packets,
+#a slow decoder in one window then does not delay the paints of the other windows:
+DRAW_THREADS = max(1, envint("XPRA_DRAW_THREADS", 2))
+
+
+class DrawPool(object):
+    """
+        A small pool of threads which decode the draw packets.
+        The packets are queued with a key, usually the window id:
+        all the packets queued with the same key are processed in order, by the same thread.
+        When a key has no packets pending, its next packet may be moved to a less busy thread.
+        The 'coalesce' function is given each packet and the packets queued after it with the same key,
+        it returns True if it has dealt with the packet without processing it.
+    """
+
+    def __init__(self, process, coalesce=None, size=DRAW_THREADS):
+        assert size>0
+        self.process = process
+        self.coalesce = coalesce
+        self.size = size
+        self.lock = Lock()
+        self.queues = [Queue() for _ in range(size)]
+        #the number of packets queued or being processed by each thread:
+        self.pending = [0]*size
+        #key -> (thread index, packets pending):
+        self.keys = {}
+        #key -> packets not processed yet:
+        self.packets = {}
+        #key -> recent processing times:
+        self.process_time = {}
+        self.threads = []
+        self.exit = False
+
+    def __repr__(self):
+        return "DrawPool(%i threads)" % self.size
+
+    def start(self):
+        for i in range(self.size):
+            self.threads.append(start_thread(self.run, "draw-%i" % i, args=(i, )))
+
+    def stop(self):
+        self.exit = True
+        for q in self.queues:
+            q.put(None)
+
+    def add(self, key, packet):
+        with self.lock:
+            index, count = self.keys.get(key, (-1, 0))
+            if count==0 and (index<0 or self.pending[index]>0):
+                #nothing pending for this key, so we can use the least busy thread:
+                index = min(range(self.size), key=lambda i : self.pending[i])
+            self.keys[key] = index, count+1
+            self.pending[index] += 1
+            self.packets.setdefault(key, deque()).append(packet)
+        self.queues[index].put(key)
+
+    def qsize(self, key=None):
+        with self.lock:
+            if key is None:
+                return sum(self.pending)
+            return self.keys.get(key, (-1, 0))[1]
+
+    def run(self, index):
+        log("DrawPool.run(%i) starting", index)
+        q = self.queues[index]
+        while not self.exit:
+            key = q.get()
+            if key is None:
+                break
+            with self.lock:
+                packets = self.packets[key]
+                packet = packets.popleft()
+                later = tuple(packets)
+                if not packets:
+                    del self.packets[key]
+            start = monotonic_time()
+            skipped = False
+            try:
+                if self.coalesce and later:
+                    skipped = self.coalesce(packet, later)
+                if not skipped:
+                    self.process(packet)
+                    sleep(0)
+            except KeyboardInterrupt:
+                raise
+            except Exception as e:
+                log.error("Error '%s' processing %s packet", e, packet[0], exc_info=True)
+            finally:
+                elapsed = monotonic_time()-start
+                with self.lock:
+                    self.pending[index] -= 1
+                    count = self.keys[key][1]
+                    self.keys[key] = index, count-1
+                    if not skipped:
+                        pt = self.process_time.get(key)
+                        if pt is None:
+                            pt = self.process_time[key] = deque(maxlen=100)
+                        pt.append(elapsed)
+        log("DrawPool.run(%i) ended", index)
+
+    def get_info(self):
+        info = {
+            "threads"   : self.size,
+            "pending"   : tuple(self.pending),
+            }
+        winfo = info.setdefault("window", {})
+        with self.lock:
+            for key, (index, count) in self.keys.items():
+                kinfo = {
+                    "thread"    : index,
+                    "pending"   : count,
+                    }
+                pt = self.process_time.get(key)
+                if pt:
+                    kinfo["decode-time"] = int(1000*1000*sum(pt)/len(pt))
+                winfo[key] = kinfo
+        return info
@@ -67,6 +67,7 @@ class GTK2WindowBacking(WindowBackingBase):
         rowstride = pixbuf.get_rowstride()
         img_data = self.process_delta(raw_data, width, height, rowstride, options)
         n = pixbuf.get_n_channels()
+        self.cache_tile(["RGB", "RGBA"][n==4], img_data, width, height, rowstride, options)
         if n==3:
             self.do_paint_rgb24(img_data, x, y, width, height, rowstride, options, callbacks)
         else:
@@ -453,18 +453,21 @@ class GTKXpraClient(GObjectXpraClient, UIXpraClient):
             return
         filename = dialog.get_filename()
         filelog("file_upload_dialog_response: filename=%s", filename)
+        openit = v==gtk.RESPONSE_ACCEPT
         try:
             filesize = os.stat(filename).st_size
         except:
             pass
         else:
-            if not self.check_file_size("upload", filename, filesize):
-                self.close_file_upload_dialog()
-                return
+            self.close_file_upload_dialog()
+            if self.check_file_size("upload", filename, filesize):
+                #local file, stream it from disk:
+                self.send_file(filename, "", None, filesize=filesize, openit=openit)
+            return
         gfile = dialog.get_file()
         self.close_file_upload_dialog()
         filelog("load_contents: filename=%s, response=%s", filename, v)
-        gfile.load_contents_async(self.file_upload_ready, user_data=(filename, v==gtk.RESPONSE_ACCEPT))
+        gfile.load_contents_async(self.file_upload_ready, user_data=(filename, openit))
 
     def file_upload_ready(self, gfile, result, user_data):
         filelog("file_upload_ready%s", (gfile, result, user_data))
@@ -730,8 +733,11 @@ class GTKXpraClient(GObjectXpraClient, UIXpraClient):
             #lossy protocol means we can't use delta regions:
             log("no delta buckets with udp, since we can drop paint packets")
             window_backing_base.DELTA_BUCKETS = 0
+            #same for the tile cache:
+            window_backing_base.TILE_CACHE_SIZE = 0
         updict(capabilities, "encoding", {
                     "delta_buckets"     : window_backing_base.DELTA_BUCKETS,
+                    "tile-cache"        : window_backing_base.TILE_CACHE_SIZE,
                     })
         return capabilities
 
@@ -303,6 +303,13 @@ class GTKClientWindowBase(ClientWindowBase, gtk.Window):
                 ctype = file_info.get_content_type()
                 size = file_info.get_size()
                 draglog("file_info(%s)=%s ctype=%s, size=%s", filename, file_info, ctype, size)
+                path = gfile.get_path()
+                if path and size>0:
+                    #local file, stream it from disk:
+                    file_done(filename)
+                    draglog.info("sending file %s (%i bytes)", basename, size)
+                    self._client.send_file(path, "", None, filesize=size, openit=self._client.remote_open_files)
+                    return
                 def got_file_data(gfile, result, user_data=None):
                     data, filesize, entity = load_contents_finish(gfile, result)
                     draglog("got_file_data(%s, %s, %s) entity=%s", gfile, result, user_data, entity)
@@ -118,6 +118,9 @@ class NetworkState(StubClientMixin):
         self.server_bandwidth_limit_change = c.boolget("network.bandwidth-limit-change")
         self.server_bandwidth_limit = c.intget("network.bandwidth-limit")
         bandwidthlog("server_bandwidth_limit_change=%s, server_bandwidth_limit=%s", self.server_bandwidth_limit_change, self.server_bandwidth_limit)
+        #used for choosing the compressor when adaptive compression is enabled,
+        #together with the throughput the protocol measures:
+        self._protocol.set_bandwidth_limit(self.server_bandwidth_limit or self.bandwidth_limit)
         return True
 
     def process_ui_capabilities(self):
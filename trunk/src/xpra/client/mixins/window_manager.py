@@ -10,7 +10,6 @@ import time
 import signal
 import datetime
 from collections import deque
-from time import sleep
 
 from xpra.log import Logger
 log = Logger("window")
@@ -34,8 +33,8 @@ from xpra.platform.gui import (
 from xpra.platform.features import SYSTEM_TRAY_SUPPORTED
 from xpra.platform.paths import get_icon_filename
 from xpra.scripts.config import FALSE_OPTIONS
-from xpra.make_thread import make_thread
-from xpra.os_util import BytesIOClass, Queue, bytestostr, monotonic_time, memoryview_to_bytes, OSX, POSIX, PYTHON3, is_Ubuntu
+from xpra.client.draw_pool import DrawPool
+from xpra.os_util import BytesIOClass, bytestostr, monotonic_time, memoryview_to_bytes, OSX, POSIX, PYTHON3, is_Ubuntu
 from xpra.util import iround, envint, envbool, typedict, make_instance, updict
 from xpra.client.mixins.stub_client_mixin import StubClientMixin
 
@@ -69,6 +68,10 @@ SAVE_WINDOW_ICONS = envbool("XPRA_SAVE_WINDOW_ICONS", False)
 SAVE_CURSORS = envbool("XPRA_SAVE_CURSORS", False)
 MODAL_WINDOWS = envbool("XPRA_MODAL_WINDOWS", False)
 SIGNAL_WATCHER = envbool("XPRA_SIGNAL_WATCHER", PYTHON3)
+#skip the draw packets which are entirely covered by a later packet already queued:
+COALESCE_DRAW = envbool("XPRA_COALESCE_DRAW", True)
+#these encodings replace all the pixels of the area they cover:
+COALESCE_ENCODINGS = ("rgb24", "rgb32", "png", "png/P", "png/L", "jpeg", "webp")
 
 
 DRAW_TYPES = {bytes : "bytes", str : "bytes", tuple : "arrays", list : "arrays"}
@@ -89,10 +92,10 @@ class WindowClient(StubClientMixin):
         self.min_window_size = 0, 0
         self.max_window_size = 0, 0
 
-        #draw thread:
-        self._draw_queue = None
-        self._draw_thread = None
+        #draw threads:
+        self._draw_pool = None
         self._draw_counter = 0
+        self._draw_skipped = {}
 
         #statistics and server info:
         self.pixel_counter = deque(maxlen=1000)
@@ -210,8 +213,10 @@ class WindowClient(StubClientMixin):
                 except Exception as e:
                     log.error("Error: failed to load overlay icon '%s':", icon_filename, exc_info=True)
                     log.error(" %s", e)
-        self._draw_queue = Queue()
-        self._draw_thread = make_thread(self._draw_thread_loop, "draw")
+        coalesce = None
+        if COALESCE_DRAW:
+            coalesce = self._coalesce_draw
+        self._draw_pool = DrawPool(self._do_draw, coalesce)
 
 
     def parse_border(self, border_str, extra_args):
@@ -220,16 +225,17 @@ class WindowClient(StubClientMixin):
 
 
     def run(self):
-        #we decode pixel data in this thread
-        self._draw_thread.start()
+        #we decode pixel data in the draw threads
+        self._draw_pool.start()
 
 
     def cleanup(self):
         log("WindowClient.cleanup()")
-        #tell the draw thread to exit:
-        dq = self._draw_queue
-        if dq:
-            dq.put(None)
+        #tell the draw threads to exit:
+        dp = self._draw_pool
+        if dp:
+            drawlog("draw pool: %s", dp.get_info())
+            dp.stop()
         #the protocol has been closed, it is now safe to close all the windows:
         #(cleaner and needed when we run embedded in the client launcher)
         self.destroy_all_windows()
@@ -913,6 +919,8 @@ class WindowClient(StubClientMixin):
             #or the new dimensions, etc
             window = self.make_new_window(wid, x, y, ww, wh, bw, bh, metadata, override_redirect, client_properties)
             window._resize_counter = resize_counter
+            #the tiles cached by the old backing are gone:
+            self.control_refresh(wid, None, False, options={"tile-cache-reset" : True})
             #if we had a backing already,
             #restore the attributes we had saved from it
             if backing:
@@ -1276,32 +1284,82 @@ class WindowClient(StubClientMixin):
     ######################################################################
     # painting windows:
     def _process_draw(self, packet):
-        self._draw_queue.put(packet)
+        self.queue_draw_packet(packet)
 
     def _process_eos(self, packet):
-        self._draw_queue.put(packet)
+        self.queue_draw_packet(packet)
+
+    def queue_draw_packet(self, packet):
+        """
+            Each window's packets are decoded in order by one of the draw threads,
+            so a slow decoder does not delay the other windows.
+        """
+        wid = packet[1]
+        if self.mmap_enabled:
+            #the mmap area must be freed in the order it was written to,
+            #so all the packets are processed by the same thread:
+            wid = 0
+        self._draw_pool.add(wid, packet)
+
+    def get_draw_info(self):
+        dp = self._draw_pool
+        if not dp:
+            return {}
+        info = dp.get_info()
+        info["skipped"] = dict(self._draw_skipped)
+        return info
+
+    def _coalesce_draw(self, packet, later):
+        """
+            Called from the draw thread with the packets queued after this one for the same window,
+            if one of them will repaint the whole area, we don't need to decode this packet:
+            we just ack it as skipped.
+        """
+        if not self.is_draw_superseded(packet, later):
+            return False
+        wid, x, y, width, height, coding = packet[1:7]
+        packet_sequence = packet[8]
+        drawlog("skipping %s draw packet %i for window %i, %ix%i at %i,%i: superseded", bytestostr(coding), packet_sequence, wid, width, height, x, y)
+        self._draw_skipped[wid] = self._draw_skipped.get(wid, 0)+1
+        #keep the acks in the same order as the ones sent after painting:
+        self.idle_add(self.send_damage_sequence, wid, packet_sequence, width, height, 0, "skipped")
+        return True
+
+    def is_draw_superseded(self, packet, later):
+        def can_coalesce(p):
+            if bytestostr(p[0])!="draw" or bytestostr(p[6]) not in COALESCE_ENCODINGS:
+                return False
+            return typedict((len(p)>10 and p[10]) or {})
+        options = can_coalesce(packet)
+        if options is False:
+            return False
+        #the client must keep these pixels for a later packet:
+        if options.intget("store", -1)>=0 or options.intget("cache-store", -1)>=0 or options.boolget("cache-reset"):
+            return False
+        wid, x, y, w, h = packet[1:6]
+        for p in later:
+            if p[1]!=wid:
+                #mmap clients use a single queue for all windows
+                continue
+            if bytestostr(p[0])!="draw" or bytestostr(p[6])=="scroll":
+                #scrolling would move the pixels we skipped,
+                #and we should not skip frames before the end of a stream:
+                return False
+            poptions = can_coalesce(p)
+            if poptions is False or poptions.intget("delta", -1)>=0:
+                continue
+            px, py, pw, ph = p[2:6]
+            if px<=x and py<=y and px+pw>=x+w and py+ph>=y+h:
+                return True
+        return False
 
     def send_damage_sequence(self, wid, packet_sequence, width, height, decode_time, message=""):
         packet = "damage-sequence", packet_sequence, wid, width, height, decode_time, message
         drawlog("sending ack: %s", packet)
         self.send_now(*packet)
 
-    def _draw_thread_loop(self):
-        while self.exit_code is None:
-            packet = self._draw_queue.get()
-            if packet is None:
-                break
-            try:
-                self._do_draw(packet)
-                sleep(0)
-            except KeyboardInterrupt:
-                raise
-            except Exception as e:
-                log.error("Error '%s' processing %s packet", e, packet[0], exc_info=True)
-        log("draw thread ended")
-
     def _do_draw(self, packet):
-        """ this runs from the draw thread above """
+        """ this runs from one of the draw threads """
         wid = packet[1]
         window = self._id_to_window.get(wid)
         if packet[0]==b"eos":
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+"""
+The tile cache lets the server send a reference to pixels the client already has,
+instead of encoding and sending them again.
+The client keeps the decoded tiles in a TileCache,
+the server keeps an identical TileCache (without the pixels) to know what the client has:
+both sides apply the same operations in the same order (the order of the draw packets),
+so they evict the same tiles at the same time.
+"""
+
+import struct
+import hashlib
+from threading import Lock
+from collections import OrderedDict
+
+from xpra.os_util import strtobytes
+
+try:
+    from xpra.buffers.membuf import hash64      #@UnresolvedImport
+except ImportError:
+    def hash64(buf, seed=0):
+        h = hashlib.sha1(struct.pack(b"@Q", seed))
+        h.update(buf)
+        return struct.unpack(b"@Q", h.digest()[:8])[0]
+
+
+def tile_hash(pixels, width, height, pixel_format):
+    """ returns a key for the pixels, which fits in a signed 64-bit integer """
+    seed = hash64(strtobytes(pixel_format)) ^ ((width<<32) | height)
+    return hash64(pixels, seed) & 0x7fffffffffffffff
+
+def tile_cost(width, height):
+    #both ends must agree on the cost of each tile,
+    #so we always count 32 bits per pixel, whatever is actually stored:
+    return width*height*4
+
+
+class TileCache(object):
+    """
+        A bounded LRU of tiles, indexed by their content hash.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.lock = Lock()
+        self.tiles = OrderedDict()      #key -> (cost, value)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.resets = 0
+
+    def __repr__(self):
+        return "TileCache(%i tiles, %iKB)" % (len(self.tiles), self.size//1024)
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def __contains__(self, key):
+        return key in self.tiles
+
+    def can_store(self, cost):
+        #don't let a single tile flush most of the cache:
+        return cost<=self.max_size//4
+
+    def get(self, key):
+        """ returns the value stored for this key and marks it as recently used """
+        with self.lock:
+            entry = self.tiles.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.tiles[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def add(self, key, cost, value=True):
+        with self.lock:
+            old = self.tiles.pop(key, None)
+            if old:
+                self.size -= old[0]
+            self.tiles[key] = (cost, value)
+            self.size += cost
+            self.stores += 1
+            while self.size>self.max_size and self.tiles:
+                _, (ecost, _) = self.tiles.popitem(False)
+                self.size -= ecost
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.tiles = OrderedDict()
+            self.size = 0
+            self.resets += 1
+
+    def get_info(self):
+        return {
+            "tiles"     : len(self.tiles),
+            "size"      : self.size,
+            "max-size"  : self.max_size,
+            "hits"      : self.hits,
+            "misses"    : self.misses,
+            "stores"    : self.stores,
+            "evictions" : self.evictions,
+            "resets"    : self.resets,
+            }
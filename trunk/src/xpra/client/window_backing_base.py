@@ -8,6 +8,7 @@ import hashlib
 from xpra.log import Logger
 log = Logger("paint")
 deltalog = Logger("delta")
+tilelog = Logger("tilecache")
 
 from threading import Lock
 from xpra.net.mmap_pipe import mmap_read
@@ -15,13 +16,16 @@ from xpra.net import compression
 from xpra.util import typedict, csv, envint, envbool, repr_ellipsized
 from xpra.codecs.loader import get_codec, is_loaded
 from xpra.codecs.video_helper import getVideoHelper
-from xpra.os_util import BytesIOClass, bytestostr, _buffer
+from xpra.os_util import BytesIOClass, bytestostr, memoryview_to_bytes, _buffer
+from xpra.client.tile_cache import TileCache, tile_cost
 try:
     from xpra.codecs.xor.cyxor import xor_str   #@UnresolvedImport
 except ImportError:
     from xpra.util import xor as xor_str
 
 DELTA_BUCKETS = envint("XPRA_DELTA_BUCKETS", 5)
+#the memory used for caching decoded tiles, per window:
+TILE_CACHE_SIZE = envint("XPRA_TILE_CACHE_SIZE", 16)*1024*1024
 INTEGRITY_HASH = envbool("XPRA_INTEGRITY_HASH", False)
 PAINT_BOX = envint("XPRA_PAINT_BOX", 0) or envint("XPRA_OPENGL_PAINT_BOX", 0)
 WEBP_PILLOW = envbool("XPRA_WEBP_PILLOW", False)
@@ -83,6 +87,7 @@ class WindowBackingBase(object):
         self._alpha_enabled = window_alpha
         self._backing = None
         self._delta_pixel_data = [None for _ in range(DELTA_BUCKETS)]
+        self._tile_cache = TileCache(TILE_CACHE_SIZE)
         self._video_decoder = None
         self._csc_decoder = None
         self._decoder_lock = Lock()
@@ -113,6 +118,8 @@ class WindowBackingBase(object):
 
     def close(self):
         self._backing = None
+        tilelog("%s.close() tile cache: %s", self, self._tile_cache.get_info())
+        self._tile_cache.clear()
         log("%s.close() video_decoder=%s", self, self._video_decoder)
         #try without blocking, if that fails then
         #the lock is held by the decoding thread,
@@ -216,6 +223,35 @@ class WindowBackingBase(object):
             self._delta_pixel_data[bucket] =  width, height, rgb_format, store, rgb_data
         return rgb_data
 
+    def cache_tile(self, rgb_format, rgb_data, width, height, rowstride, options):
+        """
+            Keeps a copy of the decoded pixels if the server asked us to,
+            so it can tell us to paint them again later.
+        """
+        key = options.intget("cache-store", -1)
+        if key<0:
+            return
+        if options.boolget("cache-reset"):
+            self._tile_cache.clear()
+        tilelog("tile cache: storing %ix%i %s tile %#x", width, height, rgb_format, key)
+        tile = (width, height, rgb_format, memoryview_to_bytes(rgb_data), rowstride)
+        self._tile_cache.add(key, tile_cost(width, height), tile)
+
+    def paint_cached(self, x, y, width, height, options, callbacks):
+        if options.boolget("cache-reset"):
+            self._tile_cache.clear()
+        key = options.intget("cache")
+        tile = self._tile_cache.get(key)
+        if tile is None:
+            tilelog("tile cache: %#x not found in %s", key, self._tile_cache)
+            fire_paint_callbacks(callbacks, False, "tile %#x is missing from the cache" % key)
+            return
+        tw, th, rgb_format, rgb_data, rowstride = tile
+        if (tw, th)!=(width, height):
+            fire_paint_callbacks(callbacks, False, "cached tile %#x is %ix%i, not %ix%i" % (key, tw, th, width, height))
+            return
+        self.idle_add(self.do_paint_rgb, rgb_format, rgb_data, x, y, width, height, rowstride, options, callbacks)
+
 
     def paint_jpeg(self, img_data, x, y, width, height, options, callbacks):
         img = self.jpeg_decoder.decompress_to_rgb("RGBX", img_data, width, height, options)
@@ -294,6 +330,7 @@ class WindowBackingBase(object):
             img_data = self.process_delta(raw_data, width, height, rowstride, options)
         else:
             raise Exception("invalid image mode: %s" % img.mode)
+        self.cache_tile(rgb_format, img_data, width, height, rowstride, options)
         self.idle_add(self.do_paint_rgb, rgb_format, img_data, x, y, width, height, rowstride, paint_options, callbacks)
         return False
 
@@ -329,6 +366,7 @@ class WindowBackingBase(object):
             before calling _do_paint_rgb from the UI thread via idle_add
         """
         rgb_data = self.process_delta(raw_data, width, height, rowstride, options)
+        self.cache_tile(rgb_format, rgb_data, width, height, rowstride, options)
         self.idle_add(self.do_paint_rgb, rgb_format, rgb_data, x, y, width, height, rowstride, options, callbacks)
 
     def do_paint_rgb(self, rgb_format, img_data, x, y, width, height, rowstride, options, callbacks):
@@ -602,6 +640,8 @@ class WindowBackingBase(object):
                 self.paint_image(coding, img_data, x, y, width, height, options, callbacks)
             elif coding == "scroll":
                 self.paint_scroll(img_data, options, callbacks)
+            elif coding == "cache":
+                self.paint_cached(x, y, width, height, options, callbacks)
             else:
                 self.do_draw_region(x, y, width, height, coding, img_data, rowstride, options, callbacks)
         except Exception:
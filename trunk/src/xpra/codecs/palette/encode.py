@@ -0,0 +1,113 @@
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+#lossless encoder for windows with few colours (terminals, editors):
+#we build an exact palette and send the palette indices as a "png/P" image,
+#which all the clients can decode already.
+
+import zlib
+import struct
+
+from xpra.log import Logger
+log = Logger("encoder", "palette")
+
+from xpra.util import envint
+from xpra.os_util import bytestostr
+from xpra.net.compression import Compressed
+from xpra.codecs.palette.palette import get_palette_rows     #@UnresolvedImport
+
+MAX_COLORS = max(2, min(256, envint("XPRA_PALETTE_MAX_COLORS", 256)))
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+#bytes per pixel and the position of the red, green, blue and alpha bytes:
+PIXEL_FORMATS = {
+    "BGRX"  : (4, (2, 1, 0, -1)),
+    "BGRA"  : (4, (2, 1, 0, 3)),
+    "RGBX"  : (4, (0, 1, 2, -1)),
+    "RGBA"  : (4, (0, 1, 2, 3)),
+    "XRGB"  : (4, (1, 2, 3, -1)),
+    "ARGB"  : (4, (1, 2, 3, 0)),
+    "BGR"   : (3, (2, 1, 0, -1)),
+    "RGB"   : (3, (0, 1, 2, -1)),
+    }
+
+
+def get_version():
+    return 1
+
+def get_type():
+    return "palette"
+
+def get_encodings():
+    return ["png/P"]
+
+def get_info():
+    return  {
+            "version"       : get_version(),
+            "encodings"     : get_encodings(),
+            "max-colors"    : MAX_COLORS,
+            }
+
+
+def png_chunk(ctype, data):
+    return struct.pack("!I", len(data)) + ctype + data + struct.pack("!I", zlib.crc32(ctype + data) & 0xffffffff)
+
+def encode(image, speed=50, supports_transparency=False):
+    """
+        Returns None if the image format is not supported
+        or if the image has more than MAX_COLORS distinct colours.
+    """
+    pixel_format = bytestostr(image.get_pixel_format())
+    layout = PIXEL_FORMATS.get(pixel_format)
+    if not layout:
+        log("palette encoder does not handle %s", pixel_format)
+        return None
+    bpp, channels = layout
+    if not supports_transparency:
+        channels = channels[:3]
+    channels = tuple(c for c in channels if c>=0)
+    mask = 0
+    for c in channels:
+        mask |= 0xff << (c*8)
+    w = image.get_width()
+    h = image.get_height()
+    v = get_palette_rows(image.get_pixels(), w, h, image.get_rowstride(), bpp, mask, MAX_COLORS)
+    if v is None:
+        log("palette encoder: more than %i colours in %ix%i %s image", MAX_COLORS, w, h, pixel_format)
+        return None
+    colors, bits, rows = v
+    #convert the pixel values to RGB and alpha:
+    rgb = bytearray()
+    alpha = bytearray()
+    for c in colors:
+        for i in channels[:3]:
+            rgb.append((c >> (i*8)) & 0xff)
+        if len(channels)==4:
+            alpha.append((c >> (channels[3]*8)) & 0xff)
+    client_options = {}
+    chunks = [
+        png_chunk(b"IHDR", struct.pack("!IIBBBBB", w, h, bits, 3, 0, 0, 0)),
+        png_chunk(b"PLTE", bytes(rgb)),
+        ]
+    transparent = [i for i, a in enumerate(alpha) if a<255]
+    if transparent:
+        #only the entries up to the last transparent one are needed:
+        chunks.append(png_chunk(b"tRNS", bytes(alpha[:transparent[-1]+1])))
+        client_options["transparency"] = transparent[0]
+    #same compression levels as the pillow png encoder:
+    level = max(1, min(5, (125-speed)//25))
+    chunks.append(png_chunk(b"IDAT", zlib.compress(rows, level)))
+    chunks.append(png_chunk(b"IEND", b""))
+    data = PNG_SIGNATURE + b"".join(chunks)
+    log("palette encoder: %ix%i %s with %i colours (%i bits) to %i bytes", w, h, pixel_format, len(colors), bits, len(data))
+    return "png/P", Compressed("png/P", data), client_options, w, h, 0, 8
+
+
+def selftest(_full=False):
+    from xpra.codecs.codec_checks import make_test_image
+    for pixel_format in ("BGRA", "BGRX"):
+        img = make_test_image(pixel_format, 32, 32)
+        for alpha in (True, False):
+            encode(img, 50, alpha)
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+#!python
+#cython: auto_pickle=False, boundscheck=False, wraparound=False, cdivision=True, language_level=3
+
+from __future__ import absolute_import
+
+from xpra.buffers.membuf cimport object_as_buffer, object_as_write_buffer
+
+from libc.stdint cimport uint8_t, uint16_t, uint32_t
+from libc.string cimport memset
+
+
+DEF HASH_BITS = 10
+DEF HASH_SIZE = 1<<HASH_BITS
+DEF MAX_COLORS = 256
+
+
+cdef inline unsigned int color_hash(uint32_t v) nogil:
+    return (v*2654435761u) >> (32-HASH_BITS)
+
+
+def get_palette_rows(pixels, unsigned int width, unsigned int height, unsigned int rowstride,
+                     unsigned int bpp=4, uint32_t mask=0xffffffff, unsigned int max_colors=MAX_COLORS):
+    """
+        Builds an exact palette for the image in a single pass,
+        the pixel values are masked with 'mask' so that unused channels are ignored.
+        Returns None if the image has more than 'max_colors' distinct colours,
+        otherwise: (palette, bit depth, rows)
+        * palette: a list of the masked pixel values, read in little endian order
+        * bit depth: 1, 2, 4 or 8 bits per palette index
+        * rows: a bytearray with the palette indices in PNG scanline format,
+          each row starting with a 'None' filter byte
+    """
+    assert bpp in (3, 4), "unsupported number of bytes per pixel: %i" % bpp
+    assert 0<max_colors<=MAX_COLORS, "invalid number of colours: %i" % max_colors
+    cdef const uint8_t *buf = NULL
+    cdef Py_ssize_t buf_len = 0
+    assert object_as_buffer(pixels, <const void**> &buf, &buf_len)==0, "cannot get buffer pointer for %s" % type(pixels)
+    assert width>0 and height>0
+    assert buf_len>=<Py_ssize_t> (rowstride*(height-1)+width*bpp), "buffer is too small: %i bytes for %ix%i with rowstride=%i" % (buf_len, width, height, rowstride)
+    rows = bytearray((width+1)*height)
+    cdef uint8_t *out = NULL
+    cdef Py_ssize_t out_len = 0
+    assert object_as_write_buffer(rows, <void**> &out, &out_len)==0
+    cdef uint32_t keys[HASH_SIZE]
+    cdef uint16_t slots[HASH_SIZE]        #palette index+1, 0 for empty slots
+    cdef uint32_t colors[MAX_COLORS]
+    memset(slots, 0, sizeof(slots))
+    cdef unsigned int count = 0
+    cdef unsigned int x, y, h
+    cdef const uint8_t *p
+    cdef uint8_t *o
+    cdef uint32_t v, last = 0
+    cdef uint8_t last_index = 0
+    cdef int too_many = 0
+    with nogil:
+        if bpp==4:
+            last = (buf[0] | (buf[1]<<8) | (buf[2]<<16) | (<uint32_t> buf[3]<<24)) & mask
+        else:
+            last = (buf[0] | (buf[1]<<8) | (buf[2]<<16)) & mask
+        h = color_hash(last)
+        keys[h] = last
+        slots[h] = 1
+        colors[0] = last
+        count = 1
+        for y in range(height):
+            p = buf+y*rowstride
+            o = out+y*(width+1)
+            o[0] = 0
+            o += 1
+            for x in range(width):
+                if bpp==4:
+                    v = (p[0] | (p[1]<<8) | (p[2]<<16) | (<uint32_t> p[3]<<24)) & mask
+                else:
+                    v = (p[0] | (p[1]<<8) | (p[2]<<16)) & mask
+                p += bpp
+                if v!=last:
+                    #text and backgrounds have long runs of the same colour,
+                    #so we only need to lookup the hash table when the colour changes:
+                    h = color_hash(v)
+                    while slots[h] and keys[h]!=v:
+                        h = (h+1) & (HASH_SIZE-1)
+                    if not slots[h]:
+                        if count==max_colors:
+                            too_many = 1
+                            break
+                        keys[h] = v
+                        colors[count] = v
+                        count += 1
+                        slots[h] = count
+                    last = v
+                    last_index = slots[h]-1
+                o[x] = last_index
+            if too_many:
+                break
+    if too_many:
+        return None
+    cdef unsigned int bits = 8
+    if count<=2:
+        bits = 1
+    elif count<=4:
+        bits = 2
+    elif count<=16:
+        bits = 4
+    if bits<8:
+        pack_rows(out, width, height, bits)
+        del rows[((width*bits+7)//8+1)*height:]
+    return [colors[i] for i in range(count)], bits, rows
+
+
+cdef void pack_rows(uint8_t *buf, unsigned int width, unsigned int height, unsigned int bits) nogil:
+    """
+        Packs the 8-bit palette indices of each row in place,
+        the packed rows are never longer than the unpacked ones
+        so we can write them from the start of the buffer.
+    """
+    cdef unsigned int packed = (width*bits+7)//8
+    cdef unsigned int x, y, i, shift
+    cdef const uint8_t *src
+    cdef uint8_t *dst
+    cdef uint8_t b
+    for y in range(height):
+        src = buf+y*(width+1)+1
+        dst = buf+y*(packed+1)
+        dst[0] = 0
+        dst += 1
+        x = 0
+        for i in range(packed):
+            b = 0
+            shift = 8
+            while shift>0 and x<width:
+                shift -= bits
+                b |= src[x] << shift
+                x += 1
+            dst[i] = b
@@ -26,13 +26,16 @@ import PIL                      #@UnresolvedImport
 from PIL import Image           #@UnresolvedImport
 assert PIL is not None and Image is not None, "failed to load Pillow"
 try:
-    PIL_VERSION = PIL.PILLOW_VERSION
-except:
-    PIL_VERSION = Image.VERSION
+    PIL_VERSION = PIL.__version__
+except AttributeError:
+    try:
+        PIL_VERSION = PIL.PILLOW_VERSION
+    except AttributeError:
+        PIL_VERSION = Image.VERSION
 if hasattr(Image, "DEBUG"):
     #for older versions (pre 3.0), use Image.DEBUG flag:
     Image.DEBUG = int(PIL_DEBUG)
-if PIL_VERSION<'2':
+if int(PIL_VERSION.split(".")[0])<2:
     log = Logger("encoder", "pillow")
     log.warn("Warning: your version of Python Imaging Library is well out of date")
     log.warn(" version %s is not supported, your mileage may vary", PIL_VERSION)
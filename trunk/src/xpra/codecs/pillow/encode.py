@@ -105,13 +105,17 @@ def encode(coding, image, quality, speed, supports_transparency):
                 palette.append((g>>8) & 0xFF)
                 palette.append((b>>8) & 0xFF)
             bpp = 8
-        #PIL cannot use the memoryview directly:
-        if isinstance(pixels, memoryview):
-            pixels = pixels.tobytes()
         #it is safe to use frombuffer() here since the convert()
         #calls below will not convert and modify the data in place
         #and we save the compressed data then discard the image
-        im = Image.frombuffer(rgb, (w, h), pixels, "raw", pixel_format, image.get_rowstride(), 1)
+        try:
+            im = Image.frombuffer(rgb, (w, h), pixels, "raw", pixel_format, image.get_rowstride(), 1)
+        except TypeError:
+            #older versions of PIL cannot use the memoryview directly:
+            if not isinstance(pixels, memoryview):
+                raise
+            pixels = pixels.tobytes()
+            im = Image.frombuffer(rgb, (w, h), pixels, "raw", pixel_format, image.get_rowstride(), 1)
         if palette:
             im.putpalette(palette)
             im.palette = ImagePalette.ImagePalette("RGB", palette = palette, size = len(palette))
@@ -6,8 +6,48 @@
 #cython: wraparound=False, language_level=3
 from __future__ import absolute_import
 
-from libc.stdint cimport uint32_t, uintptr_t
-from xpra.buffers.membuf cimport getbuf, object_as_buffer, MemBuf
+from libc.stdint cimport uint32_t, uint64_t, uintptr_t
+from xpra.buffers.membuf cimport getbuf, object_as_buffer, object_as_write_buffer, MemBuf
+
+
+cdef inline uint64_t xor_block(unsigned char *o, const unsigned char *a, const unsigned char *b, Py_ssize_t l) nogil:
+    """
+        xors 'l' bytes from 'a' and 'b' into 'o',
+        the output may be the same buffer as one of the inputs.
+        Returns a non-zero value if the inputs differ.
+    """
+    cdef Py_ssize_t i = 0
+    cdef uint64_t acc = 0
+    cdef uint64_t *o64
+    cdef const uint64_t *a64
+    cdef const uint64_t *b64
+    if ((<uintptr_t> o) | (<uintptr_t> a) | (<uintptr_t> b)) % 8 == 0:
+        #64 bytes per iteration, which the compiler can vectorize:
+        while i+64<=l:
+            o64 = <uint64_t*> (o+i)
+            a64 = <const uint64_t*> (a+i)
+            b64 = <const uint64_t*> (b+i)
+            o64[0] = a64[0] ^ b64[0]
+            o64[1] = a64[1] ^ b64[1]
+            o64[2] = a64[2] ^ b64[2]
+            o64[3] = a64[3] ^ b64[3]
+            o64[4] = a64[4] ^ b64[4]
+            o64[5] = a64[5] ^ b64[5]
+            o64[6] = a64[6] ^ b64[6]
+            o64[7] = a64[7] ^ b64[7]
+            acc |= o64[0] | o64[1] | o64[2] | o64[3] | o64[4] | o64[5] | o64[6] | o64[7]
+            i += 64
+        while i+8<=l:
+            o64 = <uint64_t*> (o+i)
+            o64[0] = (<const uint64_t*> (a+i))[0] ^ (<const uint64_t*> (b+i))[0]
+            acc |= o64[0]
+            i += 8
+    #unaligned buffers or trailing bytes:
+    while i<l:
+        o[i] = a[i] ^ b[i]
+        acc |= o[i]
+        i += 1
+    return acc
 
 
 def xor_str(a, b):
@@ -15,39 +55,54 @@ def xor_str(a, b):
     cdef Py_ssize_t alen = 0, blen = 0
     cdef uintptr_t ap
     cdef uintptr_t bp
-    cdef uintptr_t op
     assert object_as_buffer(a, <const void **> &ap, &alen)==0, "cannot get buffer pointer for %s" % type(a)
     assert object_as_buffer(b, <const void **> &bp, &blen)==0, "cannot get buffer pointer for %s" % type(b)
     assert alen == blen, "python or cython bug? buffers don't have the same length?"
     cdef MemBuf out_buf = getbuf(alen)
-    op = <uintptr_t> out_buf.get_mem()
-    cdef unsigned char *acbuf = <unsigned char *> ap
-    cdef unsigned char *bcbuf = <unsigned char *> bp
-    cdef unsigned char *ocbuf = <unsigned char *> op
-    cdef uint32_t *obuf = <uint32_t*> op
-    cdef uint32_t *abuf = <uint32_t*> ap
-    cdef uint32_t *bbuf = <uint32_t*> bp
-    cdef unsigned int i, j, steps, char_steps
-    if (ap % 4)!=0 or (bp % 4)!=0:
-        #unaligned access, use byte at a time slow path:
-        char_steps = alen
-        for 0 <= i < char_steps:
-            ocbuf[i] = acbuf[i] ^ bcbuf[i]
-    else:
-        #do 4 bytes at a time:
-        steps = alen // 4
-        if steps>0:
-            for 0 <= i < steps:
-                obuf[i] = abuf[i] ^ bbuf[i]
-        #bytes at a time again at the end:
-        char_steps = alen % 4
-        if char_steps>0:
-            for 0 <= i < char_steps:
-                j = alen-char_steps+i
-                ocbuf[j] = acbuf[j] ^ bcbuf[j]
+    cdef unsigned char *ocbuf = <unsigned char *> out_buf.get_mem()
+    with nogil:
+        xor_block(ocbuf, <const unsigned char *> ap, <const unsigned char *> bp, alen)
     return memoryview(out_buf)
 
 
+def xor_into(a, b, out):
+    """
+        xors 'a' and 'b' into the writable buffer 'out',
+        which can be 'a' or 'b' to xor in place.
+        Returns True if 'a' and 'b' differ.
+    """
+    return 1 in xor_rows(a, b, out, max(1, len(a)))
+
+
+def xor_rows(a, b, out, Py_ssize_t rowstride):
+    """
+        xors 'a' and 'b' into the writable buffer 'out',
+        and returns a bytearray with one value per row of pixels:
+        1 if this row has changed, 0 otherwise.
+    """
+    cdef Py_ssize_t alen = 0, blen = 0, olen = 0
+    cdef uintptr_t ap
+    cdef uintptr_t bp
+    cdef uintptr_t op
+    assert object_as_buffer(a, <const void **> &ap, &alen)==0, "cannot get buffer pointer for %s" % type(a)
+    assert object_as_buffer(b, <const void **> &bp, &blen)==0, "cannot get buffer pointer for %s" % type(b)
+    assert object_as_write_buffer(out, <void **> &op, &olen)==0, "cannot get write buffer pointer for %s" % type(out)
+    assert alen==blen, "cyxor cannot xor buffers of different lengths (%i vs %i)" % (alen, blen)
+    assert olen>=alen, "output buffer is too small: %i bytes, %i needed" % (olen, alen)
+    assert rowstride>0, "invalid rowstride %i" % rowstride
+    cdef Py_ssize_t rows = (alen+rowstride-1) // rowstride
+    changed = bytearray(rows)
+    cdef unsigned char *cbuf = changed
+    cdef Py_ssize_t y, offset, l
+    with nogil:
+        for y in range(rows):
+            offset = y*rowstride
+            l = min(rowstride, alen-offset)
+            if xor_block(<unsigned char *> (op+offset), <const unsigned char *> (ap+offset), <const unsigned char *> (bp+offset), l):
+                cbuf[y] = 1
+    return changed
+
+
 def hybi_unmask(mask, data):
     assert len(mask)==4, "hybi_unmask invalid mask length %i" % len(mask)
     cdef Py_ssize_t mlen = 0, dlen = 0
@@ -85,3 +140,40 @@ def hybi_unmask(mask, data):
                 j = dlen-char_steps+i
                 ocbuf[j] = dcbuf[j] ^ mcbuf[i]
     return memoryview(out_buf)
+
+
+cdef inline void unmask_block(unsigned char *b, const unsigned char *m, Py_ssize_t l) nogil:
+    cdef Py_ssize_t i = 0
+    cdef int j
+    cdef uint64_t mask64 = 0
+    cdef unsigned char *m8 = <unsigned char *> &mask64
+    cdef uint64_t *b64
+    #bytes at a time until we reach an aligned address:
+    while i<l and (<uintptr_t> (b+i)) % 8:
+        b[i] ^= m[i%4]
+        i += 1
+    if i+8<=l:
+        #the mask repeats every 4 bytes, so this stays in phase:
+        for j in range(8):
+            m8[j] = m[(i+j)%4]
+        b64 = <uint64_t*> (b+i)
+        while i+8<=l:
+            b64[0] ^= mask64
+            b64 += 1
+            i += 8
+    while i<l:
+        b[i] ^= m[i%4]
+        i += 1
+
+def hybi_unmask_into(mask, buf):
+    """
+        unmasks the websocket payload found in the writable buffer 'buf', in place
+    """
+    cdef Py_ssize_t mlen = 0, blen = 0
+    cdef uintptr_t mp
+    cdef uintptr_t bp
+    assert object_as_buffer(mask, <const void **> &mp, &mlen)==0, "cannot get buffer pointer for %s" % type(mask)
+    assert mlen==4, "hybi_unmask_into invalid mask length %i" % mlen
+    assert object_as_write_buffer(buf, <void **> &bp, &blen)==0, "cannot get write buffer pointer for %s" % type(buf)
+    with nogil:
+        unmask_block(<unsigned char *> bp, <const unsigned char *> mp, blen)
@@ -213,6 +213,7 @@ STRUCT_KNOWN_FILTERS = OrderedDict([
                 ("encoding"     , "Server side encoding selection and compression"),
                 ("scaling"      , "Picture scaling"),
                 ("delta"        , "Delta pre-compression"),
+                ("tilecache"    , "Tile cache"),
                 ("scroll"       , "Scrolling detection and compression"),
                 ("xor"          , "XOR delta pre-compression"),
                 ("subregion"    , "Video subregion processing"),
@@ -234,6 +235,7 @@ STRUCT_KNOWN_FILTERS = OrderedDict([
                 ("libav"        , "libav common code (used by swscale, avcodec and ffmpeg)"),
                 ("ffmpeg"       , "ffmpeg encoder"),
                 ("pillow"       , "Pillow encoder and decoder"),
+                ("palette"      , "Exact palette encoder"),
                 ("jpeg"         , "JPEG codec"),
                 ("vpx"          , "libvpx encoder and decoder"),
                 ("nvenc"        , "nvenc hardware encoder"),
@@ -23,6 +23,12 @@ SOCKET_TIMEOUT = envint("XPRA_SOCKET_TIMEOUT", 20)
 SSL_PEEK = PYTHON2 and envbool("XPRA_SSL_PEEK", True)
 #this is more proper but would break the proxy server:
 SOCKET_SHUTDOWN = envbool("XPRA_SOCKET_SHUTDOWN", False)
+#send all the buffers of a packet using a single sendmsg call:
+SOCKET_WRITEV = envbool("XPRA_SOCKET_WRITEV", True)
+try:
+    IOV_MAX = os.sysconf("SC_IOV_MAX")
+except:
+    IOV_MAX = 16
 
 #on some platforms (ie: OpenBSD), reading and writing from sockets
 #raises an IOError but we should continue if the error code is EINTR
@@ -153,6 +159,8 @@ class Connection(object):
         self.filename = None            #only used for unix domain sockets!
         self.active = True
         self.timeout = 0
+        #set by connections that implement writev():
+        self.can_writev = False
 
     def set_nodelay(self, nodelay):
         pass
@@ -292,6 +300,17 @@ class SocketConnection(Connection):
             self.filename = remote
         if SOCKET_NODELAY is not None:
             self.do_set_nodelay(SOCKET_NODELAY)
+        self._sendmsg = self.get_sendmsg()
+        self.can_writev = self._sendmsg is not None
+
+    def get_sendmsg(self):
+        #only plain sockets support scatter-gather writes,
+        #ssl sockets and sub-classes may need to process every buffer:
+        if not SOCKET_WRITEV or type(self).write!=SocketConnection.write:
+            return None
+        if type(self._socket)!=socket.socket:
+            return None
+        return getattr(self._socket, "sendmsg", None)
 
     def set_nodelay(self, nodelay):
         if SOCKET_NODELAY is None and self.socktype in ("tcp", "ssl") and self.nodelay!=nodelay:
@@ -312,6 +331,10 @@ class SocketConnection(Connection):
     def write(self, buf):
         return self._write(self._socket.send, buf)
 
+    def writev(self, buffers):
+        """ writes as much as possible from the list of buffers in a single system call """
+        return self._write(self._sendmsg, buffers[:IOV_MAX])
+
     def close(self):
         s = self._socket
         try:
@@ -351,6 +374,7 @@ class SocketConnection(Connection):
         try:
             d["remote"] = self.remote or ""
             d["protocol-type"] = self.protocol_type
+            d["writev"] = self.can_writev
             si = self.get_socket_info()
             if si:
                 d["socket"] = si
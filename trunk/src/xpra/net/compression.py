@@ -5,13 +5,17 @@
 # Xpra is released under the terms of the GNU GPL v2, or, at your option, any
 # later version. See the file COPYING for details.
 
+import os
 import sys
+import threading
+
+from xpra.os_util import strtobytes
 
 def debug(msg, *args, **kwargs):
     from xpra.log import Logger
     logger = Logger("network", "protocol")
     logger.debug(msg, *args, **kwargs)
-from xpra.net.header import LZ4_FLAG, ZLIB_FLAG, LZO_FLAG
+from xpra.net.header import LZ4_FLAG, ZLIB_FLAG, LZO_FLAG, ZSTD_FLAG
 
 
 MAX_SIZE = 256*1024*1024
@@ -91,6 +95,65 @@ except Exception as e:
         raise Exception("lzo is not supported!")
 
 
+python_zstd_version = None
+zstd_dictionary = None
+zstd_dictionary_id = 0
+#the compressor and decompressor objects cannot be shared between threads:
+zstd_contexts = threading.local()
+def get_zstd_dictionary_filename():
+    filename = os.environ.get("XPRA_ZSTD_DICTIONARY")
+    if filename is None:
+        try:
+            from xpra.platform.paths import get_resources_dir
+            filename = os.path.join(get_resources_dir(), "zstd", "packets.dict")
+        except Exception:
+            debug("no resources directory", exc_info=True)
+    return filename
+
+def load_zstd_dictionary(filename):
+    global zstd_dictionary, zstd_dictionary_id
+    if not filename or not os.path.exists(filename):
+        debug("zstd dictionary '%s' not found", filename)
+        return False
+    with open(filename, "rb") as f:
+        zstd_dictionary = zstandard.ZstdCompressionDict(f.read())
+    zstd_dictionary_id = zstd_dictionary.dict_id()
+    debug("loaded zstd dictionary %#x from '%s'", zstd_dictionary_id, filename)
+    return True
+
+try:
+    import zstandard
+    has_zstd = True
+    python_zstd_version = zstandard.__version__
+    try:
+        load_zstd_dictionary(get_zstd_dictionary_filename())
+    except Exception as e:
+        debug("failed to load the zstd dictionary: %s", e, exc_info=True)
+    def get_zstd_compressor(level):
+        cctx = getattr(zstd_contexts, "compressors", None)
+        if cctx is None:
+            cctx = zstd_contexts.compressors = {}
+        c = cctx.get(level)
+        if c is None:
+            c = cctx[level] = zstandard.ZstdCompressor(level=level, dict_data=zstd_dictionary)
+        return c
+    def zstd_compress(packet, level):
+        level = max(1, min(15, level))
+        return level | ZSTD_FLAG, get_zstd_compressor(level).compress(packet)
+    def zstd_decompress(data):
+        d = getattr(zstd_contexts, "decompressor", None)
+        if d is None:
+            d = zstd_contexts.decompressor = zstandard.ZstdDecompressor(dict_data=zstd_dictionary)
+        return d.decompress(data, max_output_size=MAX_SIZE)
+except Exception as e:
+    debug("zstd not found: %s", e)
+    del e
+    has_zstd = False
+    zstd_decompress = None
+    def zstd_compress(packet, level):
+        raise Exception("zstd is not supported!")
+
+
 try:
     import zlib
     has_zlib = True
@@ -123,18 +186,23 @@ else:
 use_zlib = has_zlib
 use_lzo = has_lzo
 use_lz4 = has_lz4
+use_zstd = has_zstd
 
 #all the compressors we know about, in best compatibility order:
-ALL_COMPRESSORS = ["zlib", "lz4", "lzo"]
+ALL_COMPRESSORS = ["zlib", "lz4", "lzo", "zstd"]
 
 #order for performance:
-PERFORMANCE_ORDER = ["lz4", "lzo", "zlib"]
+PERFORMANCE_ORDER = ["lz4", "lzo", "zstd", "zlib"]
+if zstd_dictionary:
+    #the dictionary makes zstd the best choice for the small packets we send most:
+    PERFORMANCE_ORDER = ["zstd", "lz4", "lzo", "zlib"]
 
 
 _COMPRESSORS = {
         "zlib"  : zcompress,
         "lz4"   : lz4_compress,
         "lzo"   : lzo_compress,
+        "zstd"  : zstd_compress,
         "none"  : nocompress,
                }
 
@@ -156,6 +224,13 @@ def get_compression_caps():
                               ""            : True,
                               "version"     : python_lz4_version,
                               }
+    _zstd = {
+             ""             : use_zstd,
+             #both ends must use the same dictionary:
+             "dictionary"   : zstd_dictionary_id,
+             }
+    if python_zstd_version:
+        _zstd["version"] = python_zstd_version
     _zlib = {
              ""             : use_zlib,
              }
@@ -164,6 +239,7 @@ def get_compression_caps():
     caps.update({
                  "lz4"                   : _lz4,
                  "lzo"                   : _lzo,
+                 "zstd"                  : _zstd,
                  "zlib"                  : _zlib,
                  })
     return caps
@@ -172,11 +248,95 @@ def get_enabled_compressors(order=ALL_COMPRESSORS):
     enabled = [x for x,b in {
             "lz4"                   : use_lz4,
             "lzo"                   : use_lzo,
+            "zstd"                  : use_zstd,
             "zlib"                  : use_zlib,
             }.items() if b]
     #order them:
     return [x for x in order if x in enabled]
 
+#adaptive compression:
+#rough single core compression speeds in bytes per second,
+#used for estimating the cpu cost of each option:
+COMPRESSOR_SPEED = {
+    "lz4"   : 400*1024*1024,
+    "lzo"   : 300*1024*1024,
+    "zlib"  : 80*1024*1024,
+    }
+SAMPLE_SIZE = 1024
+#don't bother compressing data if we don't expect to save more than this:
+INCOMPRESSIBLE_RATIO = 0.95
+
+def sample_compressibility(data):
+    """
+        Estimates the compression ratio we can expect for this data,
+        by compressing three small samples (start, middle and end) with zlib level 1.
+        Returns a value between 0 (very compressible) and 1 (incompressible)
+    """
+    size = len(data)
+    if size<=SAMPLE_SIZE*3:
+        sample = data
+    else:
+        mid = size//2
+        sample = b"".join((data[:SAMPLE_SIZE], data[mid:mid+SAMPLE_SIZE], data[-SAMPLE_SIZE:]))
+    if type(sample)!=bytes:
+        sample = memoryview(sample).tobytes() if isinstance(sample, memoryview) else strtobytes(sample)
+    if not sample:
+        return 1.0
+    return min(1.0, float(len(zlib.compress(sample, 1)))/len(sample))
+
+def estimate_compressed_size(size, ratio, algo, level):
+    if algo=="zlib":
+        #higher levels squeeze a little bit more out of compressible data:
+        return int(size*ratio*(1-0.015*(level-1)*(1-ratio)))
+    #lz4 and lzo are faster but compress less:
+    return int(size*min(1.0, ratio*1.25+0.02))
+
+def estimate_compression_time(size, algo, level):
+    speed = COMPRESSOR_SPEED.get(algo, 0)
+    if not speed:
+        return 0
+    if algo=="zlib":
+        #each level is slower than the previous one:
+        speed = speed/(1+(level-1)*0.4)
+    return float(size)/speed
+
+def choose_compressor(data, level, bandwidth, compressors=ALL_COMPRESSORS, cpu_budget=50, ratio=None):
+    """
+        Picks the compressor and compression level which should take the least time
+        to compress and send this data over a link with the given bandwidth (in bits per second).
+        The cpu_budget is a percentage: the compression time is scaled by 100/cpu_budget,
+        so lower values favour faster compressors or no compression at all.
+        The compression level is used as an upper limit.
+        Returns the compressor name and the compression level to use.
+    """
+    if level<=0:
+        return "none", 0
+    size = len(data)
+    if ratio is None:
+        ratio = sample_compressibility(data)
+    if ratio>=INCOMPRESSIBLE_RATIO:
+        return "none", 0
+    assert bandwidth>0, "the bandwidth must be known"
+    cpu_factor = 100.0/max(1, cpu_budget)
+    def send_time(csize):
+        return csize*8.0/bandwidth
+    best = ("none", 0)
+    best_cost = send_time(size)
+    options = []
+    for c in ("lz4", "lzo"):
+        if c in compressors and c in get_enabled_compressors():
+            options.append((c, level))
+    if "zlib" in compressors and use_zlib:
+        for zlevel in sorted(set((1, min(6, level), level))):
+            options.append(("zlib", zlevel))
+    for algo, l in options:
+        cost = send_time(estimate_compressed_size(size, ratio, algo, l)) + estimate_compression_time(size, algo, l)*cpu_factor
+        if cost<best_cost:
+            best = (algo, l)
+            best_cost = cost
+    return best
+
+
 def get_compressor(c):
     assert c=="none" or c in ALL_COMPRESSORS
     return _COMPRESSORS[c]
@@ -190,7 +350,7 @@ def get_compressor_name(c):
 
 
 def sanity_checks():
-    if not use_lzo and not use_lz4:
+    if not use_lzo and not use_lz4 and not use_zstd:
         from xpra.log import Logger
         logger = Logger("network", "protocol")
         if not use_zlib:
@@ -271,6 +431,8 @@ def get_compression_type(level):
         return "lz4"
     elif level & LZO_FLAG:
         return "lzo"
+    elif level & ZSTD_FLAG:
+        return "zstd"
     else:
         return "zlib"
 
@@ -295,11 +457,20 @@ def decompress(data, level):
             raise InvalidCompressionException("lzo is not available")
         if not use_lzo:
             raise InvalidCompressionException("lzo is not enabled")
+        if isinstance(data, memoryview):
+            data = data.tobytes()
         return LZO_decompress(data)
+    elif level & ZSTD_FLAG:
+        if not has_zstd:
+            raise InvalidCompressionException("zstd is not available")
+        if not use_zstd:
+            raise InvalidCompressionException("zstd is not enabled")
+        return zstd_decompress(data)
     else:
         if not use_zlib:
             raise InvalidCompressionException("zlib is not enabled")
-        if isinstance(data, memoryview):
+        #python3's zlib can decompress straight from a memoryview:
+        if isinstance(data, memoryview) and sys.version < '3':
             data = data.tobytes()
         return zlib.decompress(data)
 
@@ -307,6 +478,7 @@ NAME_TO_FLAG = {
                 "lz4"   : LZ4_FLAG,
                 "zlib"  : 0,
                 "lzo"   : LZO_FLAG,
+                "zstd"  : ZSTD_FLAG,
                 }
 
 def decompress_by_name(data, algo):
@@ -14,7 +14,7 @@ printlog = Logger("printing")
 filelog = Logger("file")
 
 from xpra.child_reaper import getChildReaper
-from xpra.os_util import monotonic_time, bytestostr, strtobytes, POSIX, WIN32
+from xpra.os_util import monotonic_time, bytestostr, strtobytes, load_binary_file, POSIX, WIN32
 from xpra.util import typedict, csv, nonl, envint, envbool, engs
 from xpra.scripts.config import parse_bool
 from xpra.simple_stats import std_unit
@@ -22,6 +22,10 @@ from xpra.make_thread import start_thread
 
 DELETE_PRINTER_FILE = envbool("XPRA_DELETE_PRINTER_FILE", True)
 FILE_CHUNKS_SIZE = max(0, envint("XPRA_FILE_CHUNKS_SIZE", 65536))
+#how many chunks we send without waiting for their acknowledgement:
+FILE_CHUNKS_WINDOW = max(1, envint("XPRA_FILE_CHUNKS_WINDOW", 16))
+#read size used when calculating the digest of a file:
+FILE_READ_SIZE = max(4096, envint("XPRA_FILE_READ_SIZE", 1024*1024))
 MAX_CONCURRENT_FILES = max(1, envint("XPRA_MAX_CONCURRENT_FILES", 10))
 PRINT_JOB_TIMEOUT = max(60, envint("XPRA_PRINT_JOB_TIMEOUT", 3600))
 SEND_REQUEST_TIMEOUT = max(300, envint("XPRA_SEND_REQUEST_TIMEOUT", 3600))
@@ -68,6 +72,122 @@ def safe_open_download_file(basefilename, mimetype):
     return filename, fd
 
 
+def file_digest(filename, algo=hashlib.sha1):
+    """ calculates the digest of a file without loading it all in memory """
+    u = algo()
+    with open(filename, "rb") as f:
+        while True:
+            data = f.read(FILE_READ_SIZE)
+            if not data:
+                break
+            u.update(data)
+    return u.hexdigest()
+
+
+class SendChunksState(object):
+    """
+        A chunked file transfer we are sending:
+        the chunks are read from the file as they are needed,
+        (or sliced from the data if the file is already in memory)
+        and up to 'window' chunks can be waiting for their acknowledgement.
+    """
+
+    def __init__(self, filename, data, filesize, chunk_size, window, digest=None):
+        self.start_time = monotonic_time()
+        self.filename = filename
+        self.data = data
+        self.file = None
+        if data is None:
+            self.file = open(filename, "rb")
+        self.filesize = filesize
+        self.chunk_size = chunk_size
+        self.window = window
+        #when set, we calculate the digest as we send the chunks:
+        self.digest = digest
+        self.timer = 0
+        self.position = 0       #number of bytes read
+        self.chunk = 0          #the last chunk number sent
+        self.acked = -1         #the last chunk number acknowledged
+
+    def __repr__(self):
+        return "SendChunksState(%s: %i of %i bytes)" % (self.filename, self.position, self.filesize)
+
+    def has_more(self):
+        return self.position<self.filesize
+
+    def can_send(self):
+        return self.has_more() and self.chunk-self.acked<self.window
+
+    def read_chunk(self):
+        size = min(self.chunk_size, self.filesize-self.position)
+        if self.file:
+            data = self.file.read(size)
+        else:
+            data = self.data[self.position:self.position+size]
+        if len(data)!=size:
+            raise Exception("expected %i bytes at offset %i but got %i" % (size, self.position, len(data)))
+        self.position += size
+        if self.digest:
+            self.digest.update(data)
+        return data
+
+    def close(self):
+        f = self.file
+        if f:
+            self.file = None
+            f.close()
+        self.data = None
+
+    def get_info(self):
+        elapsed = max(0.001, monotonic_time()-self.start_time)
+        #chunk 0 is the 'send-file' packet, which does not carry any data:
+        sent = min(self.filesize, max(0, self.acked)*self.chunk_size)
+        return {
+            "filename"      : self.filename,
+            "size"          : self.filesize,
+            "sent"          : sent,
+            "in-flight"     : max(0, self.chunk-max(0, self.acked)),
+            "progress"      : 100*sent//max(1, self.filesize),
+            "elapsed"       : int(1000*elapsed),
+            "throughput"    : int(sent/elapsed),
+            }
+
+
+class ReceiveChunksState(object):
+    """
+        A chunked file transfer we are receiving:
+        the chunks are written to the file as they arrive.
+    """
+
+    def __init__(self, fd, filename, mimetype, printit, openit, filesize, options, timer):
+        self.start_time = monotonic_time()
+        self.fd = fd
+        self.filename = filename
+        self.mimetype = mimetype
+        self.printit = printit
+        self.openit = openit
+        self.filesize = filesize
+        self.options = options
+        self.digest = hashlib.sha1()
+        self.written = 0
+        self.timer = timer
+        self.chunk = 0          #the last chunk number received
+
+    def __repr__(self):
+        return "ReceiveChunksState(%s: %i of %i bytes)" % (self.filename, self.written, self.filesize)
+
+    def get_info(self):
+        elapsed = max(0.001, monotonic_time()-self.start_time)
+        return {
+            "filename"      : self.filename,
+            "size"          : self.filesize,
+            "received"      : self.written,
+            "progress"      : 100*self.written//max(1, self.filesize),
+            "elapsed"       : int(1000*elapsed),
+            "throughput"    : int(self.written/elapsed),
+            }
+
+
 class FileTransferAttributes(object):
 
     def __init__(self):
@@ -116,6 +236,8 @@ class FileTransferAttributes(object):
                 "open-url"          : self.open_url,
                 "open-url-ask"      : self.open_url_ask,
                 "file-ask-timeout"  : self.file_ask_timeout,
+                #we accept the digest with the last chunk:
+                "file-chunks-digest": True,
                 }
 
     def get_info(self):
@@ -155,6 +277,7 @@ class FileTransferHandler(FileTransferAttributes):
         self.remote_file_ask_timeout = SEND_REQUEST_TIMEOUT
         self.remote_file_size_limit = 0
         self.remote_file_chunks = 0
+        self.remote_file_chunks_digest = False
         self.pending_send_data = {}
         self.pending_send_data_timers = {}
         self.send_chunks_in_progress = {}
@@ -171,9 +294,14 @@ class FileTransferHandler(FileTransferAttributes):
         for t in self.pending_send_data_timers.values():
             self.source_remove(t)
         self.pending_send_data_timers = {}
-        for v in self.receive_chunks_in_progress.values():
-            t = v[-2]
-            self.source_remove(t)
+        for chunk_state in self.send_chunks_in_progress.values():
+            if chunk_state.timer:
+                self.source_remove(chunk_state.timer)
+            chunk_state.close()
+        self.send_chunks_in_progress = {}
+        for chunk_state in self.receive_chunks_in_progress.values():
+            if chunk_state.timer:
+                self.source_remove(chunk_state.timer)
         self.receive_chunks_in_progress = {}
         for x in tuple(self.file_descriptors):
             try:
@@ -195,6 +323,7 @@ class FileTransferHandler(FileTransferAttributes):
         self.remote_file_ask_timeout = c.intget("file-ask-timeout")
         self.remote_file_size_limit = c.intget("file-size-limit")
         self.remote_file_chunks = max(0, min(self.remote_file_size_limit*1024*1024, c.intget("file-chunks")))
+        self.remote_file_chunks_digest = c.boolget("file-chunks-digest")
         self.dump_remote_caps()
 
     def dump_remote_caps(self):
@@ -217,7 +346,12 @@ class FileTransferHandler(FileTransferAttributes):
                           "printing"        : self.remote_printing,
                           "printing-ask"    : self.remote_printing_ask,
                           "file-ask-timeout" : self.remote_file_ask_timeout,
+                          "file-chunks-digest" : self.remote_file_chunks_digest,
                           }
+        def chunks_info(chunks):
+            return dict((bytestostr(chunk_id), chunk_state.get_info()) for chunk_id, chunk_state in tuple(chunks.items()))
+        info["sending"] = chunks_info(self.send_chunks_in_progress)
+        info["receiving"] = chunks_info(self.receive_chunks_in_progress)
         return info
 
     def check_digest(self, filename, digest, expected_digest, algo="sha1"):
@@ -233,35 +367,40 @@ class FileTransferHandler(FileTransferAttributes):
         chunk_state = self.receive_chunks_in_progress.get(chunk_id)
         filelog("_check_chunk_receiving(%s, %s) chunk_state=%s", chunk_id, chunk_no, chunk_state)
         if chunk_state:
-            chunk_state[-2] = 0     #this timer has been used
-            if chunk_state[-1]==0:
+            chunk_state.timer = 0   #this timer has been used
+            if chunk_state.chunk==chunk_no:
                 filelog.error("Error: chunked file transfer timed out")
                 del self.receive_chunks_in_progress[chunk_id]
+                try:
+                    os.close(chunk_state.fd)
+                except OSError:
+                    pass
 
     def _process_send_file_chunk(self, packet):
         chunk_id, chunk, file_data, has_more = packet[1:5]
-        filelog("_process_send_file_chunk%s", (chunk_id, chunk, "%i bytes" % len(file_data), has_more))
+        #the digest may be sent with the last chunk:
+        chunk_options = {}
+        if len(packet)>=6:
+            chunk_options = typedict(packet[5])
+        filelog("_process_send_file_chunk%s", (chunk_id, chunk, "%i bytes" % len(file_data), has_more, chunk_options))
         chunk_state = self.receive_chunks_in_progress.get(chunk_id)
         if not chunk_state:
             filelog.error("Error: cannot find the file transfer id '%s'", nonl(bytestostr(chunk_id)))
             self.send("ack-file-chunk", chunk_id, False, "file transfer id not found", chunk)
             return
-        fd = chunk_state[1]
-        if chunk_state[-1]+1!=chunk:
-            filelog.error("Error: chunk number mismatch, expected %i but got %i", chunk_state[-1]+1, chunk)
+        fd = chunk_state.fd
+        if chunk_state.chunk+1!=chunk:
+            filelog.error("Error: chunk number mismatch, expected %i but got %i", chunk_state.chunk+1, chunk)
             self.send("ack-file-chunk", chunk_id, False, "chunk number mismatch", chunk)
             del self.receive_chunks_in_progress[chunk_id]
             os.close(fd)
             return
         #update chunk number:
-        chunk_state[-1] = chunk
-        digest = chunk_state[8]
-        written = chunk_state[9]
+        chunk_state.chunk = chunk
         try:
             os.write(fd, file_data)
-            digest.update(file_data)
-            written += len(file_data)
-            chunk_state[9] = written
+            chunk_state.digest.update(file_data)
+            chunk_state.written += len(file_data)
         except OSError as e:
             filelog.error("Error: cannot write file chunk")
             filelog.error(" %s", e)
@@ -273,26 +412,26 @@ class FileTransferHandler(FileTransferAttributes):
                 pass
             return
         self.send("ack-file-chunk", chunk_id, True, "", chunk)
+        timer = chunk_state.timer
+        if timer:
+            chunk_state.timer = 0
+            self.source_remove(timer)
         if has_more:
-            timer = chunk_state[-2]
-            if timer:
-                self.source_remove(timer)
             #remote end will send more after receiving the ack
-            timer = self.timeout_add(CHUNK_TIMEOUT, self._check_chunk_receiving, chunk_id, chunk)
-            chunk_state[-2] = timer
+            chunk_state.timer = self.timeout_add(CHUNK_TIMEOUT, self._check_chunk_receiving, chunk_id, chunk)
             return
         del self.receive_chunks_in_progress[chunk_id]
         os.close(fd)
         #check file size and digest then process it:
-        filename, mimetype, printit, openit, filesize, options = chunk_state[2:8]
-        if written!=filesize:
-            filelog.error("Error: expected a file of %i bytes, got %i", filesize, written)
+        filename, mimetype, printit, openit, filesize, options = (chunk_state.filename, chunk_state.mimetype,
+            chunk_state.printit, chunk_state.openit, chunk_state.filesize, chunk_state.options)
+        if chunk_state.written!=filesize:
+            filelog.error("Error: expected a file of %i bytes, got %i", filesize, chunk_state.written)
             return
-        expected_digest = options.get("sha1")
+        expected_digest = chunk_options.get("sha1") or options.get("sha1")
         if expected_digest:
-            self.check_digest(filename, digest.hexdigest(), expected_digest)
-        start_time = chunk_state[0]
-        elapsed = monotonic_time()-start_time
+            self.check_digest(filename, chunk_state.digest.hexdigest(), expected_digest)
+        elapsed = monotonic_time()-chunk_state.start_time
         filelog("%i bytes received in %i chunks, took %ims", filesize, chunk, elapsed*1000)
         t = start_thread(self.do_process_downloaded_file, "process-download", daemon=False, args=(filename, mimetype, printit, openit, filesize, options))
         filelog("started process-download thread: %s", t)
@@ -346,10 +485,9 @@ class FileTransferHandler(FileTransferAttributes):
                 self.send("ack-file-chunk", chunk_id, False, "too many file transfers in progress", 0)
                 os.close(fd)
                 return
-            digest = hashlib.sha1()
             chunk = 0
             timer = self.timeout_add(CHUNK_TIMEOUT, self._check_chunk_receiving, chunk_id, chunk)
-            chunk_state = [monotonic_time(), fd, filename, mimetype, printit, openit, filesize, options, digest, 0, timer, chunk]
+            chunk_state = ReceiveChunksState(fd, filename, mimetype, printit, openit, filesize, options, timer)
             self.receive_chunks_in_progress[chunk_id] = chunk_state
             self.send("ack-file-chunk", chunk_id, True, "", chunk)
             return
@@ -539,6 +677,10 @@ class FileTransferHandler(FileTransferAttributes):
         self.send("open-url", url, send_id)
 
     def send_file(self, filename, mimetype, data, filesize=0, printit=False, openit=False, options={}):
+        """
+            Sends the file to the remote end,
+            if 'data' is None the file contents are read from disk as needed.
+        """
         if printit:
             l = printlog
             if not self.printing:
@@ -568,8 +710,11 @@ class FileTransferHandler(FileTransferAttributes):
                 else:
                     ask |= self.remote_open_files_ask
                     action = "open"
-        assert len(data)>=filesize, "data is smaller then the given file size!"
-        data = data[:filesize]          #gio may null terminate it
+        if data is None:
+            filesize = filesize or os.path.getsize(filename)
+        else:
+            assert len(data)>=filesize, "data is smaller then the given file size!"
+            data = data[:filesize]          #gio may null terminate it
         l("send_file%s action=%s, ask=%s", (filename, mimetype, type(data), "%i bytes" % filesize, printit, openit, options), action, ask)
         self.dump_remote_caps()
         if not self.check_file_size(action, filename, filesize):
@@ -701,25 +846,38 @@ class FileTransferHandler(FileTransferAttributes):
         l("do_send_file%s", (filename, mimetype, type(data), "%i bytes" % filesize, printit, openit, options))
         if not self.check_file_size(action, filename, filesize):
             return False
-        u = hashlib.sha1()
-        u.update(data)
-        absfile = os.path.abspath(filename)
-        filelog("sha1 digest(%s)=%s", absfile, u.hexdigest())
-        options["sha1"] = u.hexdigest()
+        options = dict(options)
         chunk_size = min(self.file_chunks, self.remote_file_chunks)
         if chunk_size>0 and filesize>chunk_size:
             if len(self.send_chunks_in_progress)>=MAX_CONCURRENT_FILES:
                 raise Exception("too many file transfers in progress: %i" % len(self.send_chunks_in_progress))
             #chunking is supported and the file is big enough
+            digest = hashlib.sha1()
+            if not self.remote_file_chunks_digest:
+                #the digest must be sent upfront:
+                if data is None:
+                    options["sha1"] = file_digest(filename)
+                else:
+                    digest.update(data)
+                    options["sha1"] = digest.hexdigest()
+                digest = None
             chunk_id = uuid.uuid4().hex
             options["file-chunk-id"] = chunk_id
-            #timer to check that the other end is requesting more chunks:
-            timer = self.timeout_add(CHUNK_TIMEOUT, self._check_chunk_sending, chunk_id, 0)
-            chunk_state = [monotonic_time(), data, chunk_size, timer, 0]
+            chunk_state = SendChunksState(filename, data, filesize, chunk_size, FILE_CHUNKS_WINDOW, digest)
+            #timer to check that the other end is acknowledging the chunks:
+            chunk_state.timer = self.timeout_add(CHUNK_TIMEOUT, self._check_chunk_sending, chunk_id, -1)
             self.send_chunks_in_progress[chunk_id] = chunk_state
             cdata = ""
         else:
             #send everything now:
+            if data is None:
+                data = load_binary_file(filename)
+                if len(data)!=filesize:
+                    raise Exception("expected %i bytes but read %i from '%s'" % (filesize, len(data), filename))
+            u = hashlib.sha1()
+            u.update(data)
+            filelog("sha1 digest(%s)=%s", os.path.abspath(filename), u.hexdigest())
+            options["sha1"] = u.hexdigest()
             cdata = self.compressed_wrapper("file-data", data)
             assert len(cdata)<=filesize     #compressed wrapper ensures this is true
         basefilename = os.path.basename(filename)
@@ -735,44 +893,65 @@ class FileTransferHandler(FileTransferAttributes):
         chunk_state = self.send_chunks_in_progress.get(chunk_id)
         filelog("_check_chunk_sending(%s, %s) chunk_state found: %s", chunk_id, chunk_no, bool(chunk_state))
         if chunk_state:
-            chunk_state[-2] = 0         #timer has fired
-            if chunk_state[-1]==chunk_no:
-                filelog.error("Error: chunked file transfer timed out on chunk %i", chunk_no)
-                del self.send_chunks_in_progress[chunk_id]
+            chunk_state.timer = 0       #timer has fired
+            if chunk_state.acked==chunk_no:
+                filelog.error("Error: chunked file transfer timed out on chunk %i", chunk_no+1)
+                self.cancel_send_chunks(chunk_id)
+
+    def cancel_send_chunks(self, chunk_id):
+        chunk_state = self.send_chunks_in_progress.pop(chunk_id, None)
+        if chunk_state:
+            if chunk_state.timer:
+                self.source_remove(chunk_state.timer)
+                chunk_state.timer = 0
+            chunk_state.close()
 
     def _process_ack_file_chunk(self, packet):
         #the other end received our send-file or send-file-chunk,
         #send some more file data
         filelog("ack-file-chunk: %s", packet[1:])
         chunk_id, state, error_message, chunk = packet[1:5]
+        chunk_id = bytestostr(chunk_id)
         if not state:
             filelog.error("Error: remote end is cancelling the file transfer:")
             filelog.error(" %s", error_message)
-            del self.send_chunks_in_progress[chunk_id]
+            self.cancel_send_chunks(chunk_id)
             return
-        chunk_id = bytestostr(chunk_id)
         chunk_state = self.send_chunks_in_progress.get(chunk_id)
         if not chunk_state:
             filelog.error("Error: cannot find the file transfer id '%s'", nonl(chunk_id))
             return
-        if chunk_state[-1]!=chunk:
-            filelog.error("Error: chunk number mismatch (%i vs %i)", chunk_state, chunk)
-            del self.send_chunks_in_progress[chunk_id]
+        #the chunks are acknowledged in order:
+        if chunk_state.acked+1!=chunk:
+            filelog.error("Error: chunk number mismatch (%i vs %i)", chunk_state.acked+1, chunk)
+            self.cancel_send_chunks(chunk_id)
             return
-        start_time, data, chunk_size, timer, chunk = chunk_state
-        if not data:
+        chunk_state.acked = chunk
+        if chunk_state.timer:
+            self.source_remove(chunk_state.timer)
+            chunk_state.timer = 0
+        if chunk==chunk_state.chunk and not chunk_state.has_more():
             #all sent!
-            elapsed = monotonic_time()-start_time
-            filelog("%i chunks of %i bytes sent in %ims (%sB/s)", chunk, chunk_size, elapsed*1000, std_unit(chunk*chunk_size/elapsed))
-            del self.send_chunks_in_progress[chunk_id]
+            elapsed = max(0.001, monotonic_time()-chunk_state.start_time)
+            filelog("%i chunks of %i bytes sent in %ims (%sB/s)",
+                    chunk, chunk_state.chunk_size, elapsed*1000, std_unit(chunk_state.filesize/elapsed))
+            self.cancel_send_chunks(chunk_id)
             return
-        assert chunk_size>0
-        #carve out another chunk:
-        cdata = self.compressed_wrapper("file-data", data[:chunk_size])
-        data = data[chunk_size:]
-        chunk += 1
-        if timer:
-            self.source_remove(timer)
-        timer = self.timeout_add(CHUNK_TIMEOUT, self._check_chunk_sending, chunk_id, chunk)
-        self.send_chunks_in_progress[chunk_id] = [start_time, data, chunk_size, timer, chunk]
-        self.send("send-file-chunk", chunk_id, chunk, cdata, bool(data))
+        #keep up to 'window' chunks in flight:
+        while chunk_state.can_send():
+            try:
+                data = chunk_state.read_chunk()
+            except Exception as e:
+                filelog("read_chunk()", exc_info=True)
+                filelog.error("Error: failed to read file '%s'", chunk_state.filename)
+                filelog.error(" %s", e)
+                self.cancel_send_chunks(chunk_id)
+                return
+            cdata = self.compressed_wrapper("file-data", data)
+            chunk_state.chunk += 1
+            has_more = chunk_state.has_more()
+            if not has_more and chunk_state.digest:
+                self.send("send-file-chunk", chunk_id, chunk_state.chunk, cdata, has_more, {"sha1" : chunk_state.digest.hexdigest()})
+            else:
+                self.send("send-file-chunk", chunk_id, chunk_state.chunk, cdata, has_more)
+        chunk_state.timer = self.timeout_add(CHUNK_TIMEOUT, self._check_chunk_sending, chunk_id, chunk)
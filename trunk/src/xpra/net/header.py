@@ -16,12 +16,13 @@ FLAGS_YAML      = 0x4
 ZLIB_FLAG       = 0x0       #assume zlib if no other compression flag is set
 LZ4_FLAG        = 0x10
 LZO_FLAG        = 0x20
+ZSTD_FLAG       = 0x80
 FLAGS_NOHEADER  = 0x40
 
 
 _header_unpack_struct = struct.Struct(b'!cBBBL')
-def unpack_header(buf):
-    return _header_unpack_struct.unpack_from(buf)
+def unpack_header(buf, offset=0):
+    return _header_unpack_struct.unpack_from(buf, offset)
 
 #'P' + protocol-flags + compression_level + packet_index + data_size
 _header_pack_struct = struct.Struct(b'!BBBBL')
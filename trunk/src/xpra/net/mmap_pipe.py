@@ -7,7 +7,7 @@ import os
 
 from ctypes import c_ubyte, c_char, c_uint32
 from xpra.util import roundup
-from xpra.os_util import memoryview_to_bytes, shellsub, get_group_id, get_groups, WIN32, POSIX
+from xpra.os_util import memoryview_to_bytes, shellsub, get_group_id, get_groups, WIN32, POSIX, PYTHON3
 from xpra.scripts.config import FALSE_OPTIONS, TRUE_OPTIONS
 from xpra.simple_stats import std_unit
 
@@ -260,11 +260,12 @@ def mmap_read(mmap_area, *descr_data):
     return b"".join(data)
 
 
-def mmap_write(mmap_area, mmap_size, data):
+def mmap_reserve(mmap_area, mmap_size, l):
     """
-        Sends 'data' to the client via the mmap shared memory region,
-        returns the chunks of the mmap area used (or None if it failed)
+        Reserves 'l' bytes of free space in the mmap_area,
+        returns the chunks of the mmap area to use (or None if it failed)
         and the mmap area's free memory.
+        The caller must fill the chunks before sending them to the client.
     """
     #This is best explained using diagrams:
     #mmap_area=[&S&E-------------data-------------]
@@ -273,13 +274,12 @@ def mmap_write(mmap_area, mmap_size, data):
     #E=data_end index is only updated here and marks where we have written up to (matches current seek)
     # '-' denotes unused/available space
     # '+' is for data we have written
-    # '*' is for data we have just written in this call
+    # '*' is for data we are reserving in this call
     # E and S show the location pointed to by data_start/data_end
     mmap_data_start = int_from_buffer(mmap_area, 0)
     mmap_data_end = int_from_buffer(mmap_area, 4)
     start = max(8, mmap_data_start.value)
     end = max(8, mmap_data_end.value)
-    l = len(data)
     log("mmap: start=%i, end=%i, size of data to write=%i", start, end, l)
     if end<start:
         #we have wrapped around but the client hasn't yet:
@@ -313,30 +313,77 @@ def mmap_write(mmap_area, mmap_size, data):
         #or if data already existed:
         #[+++++++++E------------------------]
         #[+++++++++**********E--------------]
-        mmap_area.seek(end)
-        mmap_area.write(memoryview_to_bytes(data))
         chunks = [(end, l)]
         mmap_data_end.value = end+l
+    elif available>=(mmap_size/2) and available>=(l*3) and l<(start-8):
+        """ still plenty of free space, don't wrap around: just start again """
+        #[------------------S+++++++++E------]
+        #[*******E----------S+++++++++-------]
+        chunks = [(8, l)]
+        mmap_data_end.value = 8+l
     else:
-        """ data does not fit in first chunk alone """
-        if available>=(mmap_size/2) and available>=(l*3) and l<(start-8):
-            """ still plenty of free space, don't wrap around: just start again """
-            #[------------------S+++++++++E------]
-            #[*******E----------S+++++++++-------]
-            mmap_area.seek(8)
-            mmap_area.write(memoryview_to_bytes(data))
-            chunks = [(8, l)]
-            mmap_data_end.value = 8+l
-        else:
-            """ split in 2 chunks: wrap around the end of the mmap buffer """
-            #[------------------S+++++++++E------]
-            #[******E-----------S+++++++++*******]
-            mmap_area.seek(end)
-            mmap_area.write(memoryview_to_bytes(data[:chunk]))
-            mmap_area.seek(8)
-            mmap_area.write(memoryview_to_bytes(data[chunk:]))
-            l2 = l-chunk
-            chunks = [(end, chunk), (8, l2)]
-            mmap_data_end.value = 8+l2
-    log("sending damage with mmap: %s", data)
+        """ split in 2 chunks: wrap around the end of the mmap buffer """
+        #[------------------S+++++++++E------]
+        #[******E-----------S+++++++++*******]
+        l2 = l-chunk
+        chunks = [(end, chunk), (8, l2)]
+        mmap_data_end.value = 8+l2
+    return chunks, mmap_free_size
+
+
+def mmap_write(mmap_area, mmap_size, data):
+    """
+        Sends 'data' to the client via the mmap shared memory region,
+        returns the chunks of the mmap area used (or None if it failed)
+        and the mmap area's free memory.
+    """
+    chunks, mmap_free_size = mmap_reserve(mmap_area, mmap_size, len(data))
+    if chunks is None:
+        return None, mmap_free_size
+    pos = 0
+    for offset, length in chunks:
+        mmap_area.seek(offset)
+        mmap_area.write(memoryview_to_bytes(data[pos:pos+length]))
+        pos += length
+    log("sending damage with mmap: %s", chunks)
+    return chunks, mmap_free_size
+
+
+def mmap_write_rows(mmap_area, mmap_size, pixels, rowstride, row_length, height, newstride):
+    """
+        Copies 'height' rows of 'row_length' bytes from the 'pixels' buffer
+        straight into free space of the mmap area, using 'newstride' for the copy.
+        (so the padding of the source buffer is not copied)
+        This avoids the intermediate copies made by 'mmap_write'.
+        Returns the chunks of the mmap area used (or None if it failed)
+        and the mmap area's free memory.
+    """
+    assert PYTHON3, "direct mmap writes require Python 3"
+    assert row_length<=rowstride and row_length<=newstride
+    l = newstride*height
+    chunks, mmap_free_size = mmap_reserve(mmap_area, mmap_size, l)
+    if chunks is None:
+        return None, mmap_free_size
+    src = memoryview(pixels).cast("B")
+    assert len(src)>=rowstride*(height-1)+row_length, "pixel buffer is too small: %i bytes" % len(src)
+    if rowstride==newstride==row_length:
+        #contiguous: copy it all at once
+        row_length = l
+        height = 1
+    with memoryview(mmap_area) as dst:
+        chunk_offset, chunk_length = chunks[0]
+        for y in range(height):
+            line = src[y*rowstride:y*rowstride+row_length]
+            pos = y*newstride
+            if pos+row_length<=chunk_length:
+                #the whole row fits in the first chunk:
+                dst[chunk_offset+pos:chunk_offset+pos+row_length] = line
+                continue
+            #the row is in the second chunk, or straddles both:
+            n = max(0, chunk_length-pos)
+            if n>0:
+                dst[chunk_offset+pos:chunk_offset+chunk_length] = line[:n]
+            offset2 = chunks[1][0]+pos+n-chunk_length
+            dst[offset2:offset2+row_length-n] = line[n:]
+    log("sending %i rows with mmap: %s", height, chunks)
     return chunks, mmap_free_size
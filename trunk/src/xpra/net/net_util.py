@@ -387,6 +387,8 @@ def get_network_caps():
                 "compressors"           : get_enabled_compressors(),
                 "encoders"              : get_enabled_encoders(),
                 "mmap"                  : MMAP_SUPPORTED,
+                #selective acks, "udp-control" options and control packet header flag:
+                "udp"                   : {"sack" : True},
                }
     caps.update(get_crypto_caps())
     caps.update(get_compression_caps())
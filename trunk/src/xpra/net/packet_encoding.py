@@ -7,7 +7,7 @@
 
 from xpra.log import Logger
 log = Logger("network", "protocol")
-from xpra.os_util import PYTHON3
+from xpra.os_util import PYTHON3, memoryview_to_bytes
 from xpra.net.header import FLAGS_RENCODE, FLAGS_YAML, FLAGS_BENCODE
 
 from xpra.util import envbool
@@ -157,6 +157,48 @@ def get_packet_encoding_type(protocol_flags):
         return "bencode"
 
 
+#rencode type codes we need for parsing the start of a packet:
+RENCODE_CHR_LIST = 59
+RENCODE_STR_FIXED_START = 128
+RENCODE_STR_FIXED_COUNT = 64
+RENCODE_LIST_FIXED_START = RENCODE_STR_FIXED_START+RENCODE_STR_FIXED_COUNT
+RENCODE_LIST_FIXED_COUNT = 64
+
+def peek_string(head, pos):
+    #a string encoded as "length:value", used by both bencode and rencode:
+    sep = head.find(b":", pos)
+    if sep<=pos or not head[pos:sep].isdigit():
+        return None
+    end = sep+1+int(head[pos:sep])
+    if end>len(head):
+        return None
+    return head[sep+1:end]
+
+def peek_packet_type(data, protocol_flags):
+    """
+        Returns the packet type without decoding the whole packet,
+        or None if it cannot be found (ie: yaml, integer aliases or very long names).
+    """
+    head = memoryview_to_bytes(data[:64])
+    if len(head)<2:
+        return None
+    if protocol_flags & FLAGS_RENCODE:
+        c0, c1 = bytearray(head[:2])
+        if not (c0==RENCODE_CHR_LIST or RENCODE_LIST_FIXED_START<=c0<RENCODE_LIST_FIXED_START+RENCODE_LIST_FIXED_COUNT):
+            return None
+        if RENCODE_STR_FIXED_START<=c1<RENCODE_STR_FIXED_START+RENCODE_STR_FIXED_COUNT:
+            end = 2+c1-RENCODE_STR_FIXED_START
+            if end>len(head):
+                return None
+            return head[2:end]
+        return peek_string(head, 1)
+    elif protocol_flags & FLAGS_YAML:
+        return None
+    if head[:1]!=b"l":
+        return None
+    return peek_string(head, 1)
+
+
 def sanity_checks():
     if not use_rencode:
         log.warn("Warning: 'rencode' packet encoder not found")
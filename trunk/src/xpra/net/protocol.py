@@ -10,14 +10,15 @@
 
 import os
 from socket import error as socket_error
-from threading import Lock, Event
+from threading import Lock, Event, Condition
+from collections import deque
 
 
 from xpra.log import Logger
 log = Logger("network", "protocol")
 cryptolog = Logger("network", "crypto")
 
-from xpra.os_util import PYTHON3, Queue, memoryview_to_bytes, strtobytes, bytestostr, hexstr
+from xpra.os_util import PYTHON3, Queue, Empty, monotonic_time, memoryview_to_bytes, strtobytes, bytestostr, hexstr
 from xpra.util import repr_ellipsized, csv, envint, envbool
 from xpra.make_thread import make_thread, start_thread
 from xpra.net.common import ConnectionClosedException          #@UndefinedVariable (pydev false positive)
@@ -26,8 +27,9 @@ from xpra.net import compression
 from xpra.net import packet_encoding
 from xpra.net.compression import decompress, sanity_checks as compression_sanity_checks,\
         InvalidCompressionException, Compressed, LevelCompressed, Compressible, LargeStructure
-from xpra.net.packet_encoding import decode, sanity_checks as packet_encoding_sanity_checks, InvalidPacketEncodingException
+from xpra.net.packet_encoding import decode, peek_packet_type, sanity_checks as packet_encoding_sanity_checks, InvalidPacketEncodingException
 from xpra.net.header import unpack_header, pack_header, FLAGS_CIPHER, FLAGS_NOHEADER
+from xpra.net.read_buffer import ReadBuffer
 from xpra.net.crypto import get_encryptor, get_decryptor, pad, INITIAL_PADDING
 
 
@@ -49,8 +51,32 @@ LOG_RAW_PACKET_SIZE = envbool("XPRA_LOG_RAW_PACKET_SIZE", False)
 INLINE_SIZE = envint("XPRA_INLINE_SIZE", 32768)
 FAKE_JITTER = envint("XPRA_FAKE_JITTER", 0)
 MIN_COMPRESS_SIZE = envint("XPRA_MIN_COMPRESS_SIZE", 378)
+#with a trained dictionary, even very small packets compress well:
+ZSTD_DICT_MIN_COMPRESS_SIZE = envint("XPRA_ZSTD_DICT_MIN_COMPRESS_SIZE", 32)
+#records the packets we send (uncompressed), for training the zstd dictionary:
+PACKET_CAPTURE = os.environ.get("XPRA_PACKET_CAPTURE", "")
+#only these packet types are recorded, never the ones that may contain
+#credentials or user data (hello, challenge, clipboard, keyboard, files, etc):
+CAPTURE_PACKET_TYPES = os.environ.get("XPRA_PACKET_CAPTURE_TYPES",
+                                      "draw,ping,ping_echo,damage-sequence,cursor,window-icon,"+
+                                      "new-window,new-override-redirect,new-tray,lost-window,window-metadata,"+
+                                      "configure-override-redirect,window-move-resize,window-resized,raise-window").split(",")
 SEND_INVALID_PACKET = envint("XPRA_SEND_INVALID_PACKET", 0)
 SEND_INVALID_PACKET_DATA = strtobytes(os.environ.get("XPRA_SEND_INVALID_PACKET_DATA", b"ZZinvalid-packetZZ"))
+#pipelined mode: allow the format thread to encode and compress packets
+#while the previous ones are being written, up to this many bytes:
+WRITE_QUEUE_BYTES = envint("XPRA_WRITE_QUEUE_BYTES", 0)
+#choose the compressor for each packet by sampling its compressibility:
+ADAPTIVE_COMPRESSION = envbool("XPRA_ADAPTIVE_COMPRESSION", False)
+#packets smaller than this always use the compressor chosen at handshake time:
+ADAPTIVE_MIN_SIZE = envint("XPRA_ADAPTIVE_MIN_SIZE", 16*1024)
+#only writes at least this big are used for measuring the throughput,
+#smaller ones usually just fill the socket buffer:
+THROUGHPUT_MIN_WRITE = envint("XPRA_THROUGHPUT_MIN_WRITE", 64*1024)
+#how many writes we need before using the throughput measured:
+THROUGHPUT_MIN_RECORDS = envint("XPRA_THROUGHPUT_MIN_RECORDS", 4)
+#percentage, lower values favour faster compressors:
+ADAPTIVE_CPU_BUDGET = envint("XPRA_ADAPTIVE_CPU_BUDGET", 50)
 
 
 def sanity_checks():
@@ -78,6 +104,86 @@ def force_flush_queue(q):
         pass
 
 
+class ByteQueue(object):
+    """
+        A queue bounded by the total size of the items it holds
+        rather than by the number of items.
+        An item is always accepted when the queue is empty,
+        even if it is larger than the limit.
+    """
+
+    def __init__(self, maxbytes, sizeof=len):
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.items = deque()
+        self.size = 0
+        self.condition = Condition()
+
+    def __repr__(self):
+        return "ByteQueue(%i items, %i bytes)" % (len(self.items), self.size)
+
+    def put(self, item, block=True):
+        size = self.sizeof(item)
+        with self.condition:
+            while block and self.items and self.size+size>self.maxbytes:
+                self.condition.wait()
+            self.items.append((item, size))
+            self.size += size
+            self.condition.notify_all()
+
+    def put_nowait(self, item):
+        self.put(item, False)
+
+    def get(self, block=True):
+        with self.condition:
+            while block and not self.items:
+                self.condition.wait()
+            if not self.items:
+                raise Empty()
+            item, size = self.items.popleft()
+            self.size -= size
+            self.condition.notify_all()
+            return item
+
+    def qsize(self):
+        return len(self.items)
+
+    def empty(self):
+        return not self.items
+
+    def get_info(self):
+        return {
+            "items"     : len(self.items),
+            "bytes"     : self.size,
+            "limit"     : self.maxbytes,
+            }
+
+class RawPacket(list):
+    """
+        A packet received as chunks which can be sent as they are,
+        without decoding and re-encoding them (see Protocol.forward_filter).
+        Only the packet type is available.
+    """
+    def __init__(self, packet_type, chunks):
+        list.__init__(self, [packet_type])
+        self.chunks = chunks        #(proto_flags, index, level, data)
+
+    def __repr__(self):
+        return "RawPacket(%s: %i bytes)" % (bytestostr(self[0]), sum(len(x[3]) for x in self.chunks))
+
+
+def buffers_size(buffers):
+    #the udp protocol queues a single buffer:
+    if isinstance(buffers, (bytes, bytearray, memoryview)):
+        return len(buffers)
+    return sum(len(x) for x in buffers)
+
+def write_item_size(item):
+    if not item:
+        return 0
+    return buffers_size(item[0])
+
+
 def verify_packet(packet):
     """ look for None values which may have caused the packet to fail encoding """
     if type(packet)!=list:
@@ -142,7 +248,10 @@ class Protocol(object):
             self._process_packet_cb =  fj.process_packet_cb
         else:
             self._process_packet_cb = process_packet_cb
-        self._write_queue = Queue(1)
+        if WRITE_QUEUE_BYTES>0:
+            self._write_queue = ByteQueue(WRITE_QUEUE_BYTES, write_item_size)
+        else:
+            self._write_queue = Queue(1)
         self._read_queue = Queue(20)
         self._process_read = self.read_queue_put
         self._read_queue_put = self.read_queue_put
@@ -168,6 +277,17 @@ class Protocol(object):
         self.compressor = "none"
         self._compress = compression.nocompress
         self.compression_level = 0
+        self.min_compress_size = MIN_COMPRESS_SIZE
+        self._capture = None
+        self._capture_lock = Lock()
+        #for adaptive compression:
+        self.compressors = []                   #the compressors supported by the peer
+        self.bandwidth_limit = 0                #bits per second, 0 if there is no limit
+        self.write_throughput = deque(maxlen=20)    #(bytes, elapsed time) of large writes
+        self.adaptive_stats = {}
+        #when set, called with the packet type, protocol flags and the compression levels
+        #of all the chunks of each packet we receive, to decide if it can be passed on without being decoded:
+        self.forward_filter = None
         self.cipher_in = None
         self.cipher_in_name = None
         self.cipher_in_block_size = 0
@@ -182,11 +302,12 @@ class Protocol(object):
         self._read_parser_thread = None         #started when needed
         self._write_format_thread = None        #started when needed
         self._source_has_more = Event()
+        self._read_buffer = ReadBuffer()
 
     STATE_FIELDS = ("max_packet_size", "large_packets", "send_aliases", "receive_aliases",
                     "cipher_in", "cipher_in_name", "cipher_in_block_size", "cipher_in_padding",
                     "cipher_out", "cipher_out_name", "cipher_out_block_size", "cipher_out_padding",
-                    "compression_level", "encoder", "compressor")
+                    "compression_level", "encoder", "compressor", "compressors")
     def save_state(self):
         state = {}
         for x in Protocol.STATE_FIELDS:
@@ -258,6 +379,7 @@ class Protocol(object):
                        "packetcount"            : self.input_packetcount,
                        "raw_packetcount"        : self.input_raw_packetcount,
                        "count"                  : self.input_stats,
+                       "read-buffer"            : self._read_buffer.get_info(),
                        "cipher"                 : {"": self.cipher_in_name or "",
                                                    "padding"        : self.cipher_in_padding,
                                                    },
@@ -267,6 +389,12 @@ class Protocol(object):
                         "large-packet-size"     : LARGE_PACKET_SIZE,
                         "inline-size"           : INLINE_SIZE,
                         "min-compress-size"     : MIN_COMPRESS_SIZE,
+                        "adaptive-compression"  : {
+                            ""                  : ADAPTIVE_COMPRESSION,
+                            "bandwidth-limit"   : self.bandwidth_limit,
+                            "throughput"        : self.get_measured_throughput(),
+                            "count"             : self.adaptive_stats,
+                            },
                         "packetcount"           : self.output_packetcount,
                         "raw_packetcount"       : self.output_raw_packetcount,
                         "count"                 : self.output_stats,
@@ -275,6 +403,9 @@ class Protocol(object):
                                                    },
                         },
             }
+        wq = self._write_queue
+        if isinstance(wq, ByteQueue):
+            info["output"]["write-queue"] = wq.get_info()
         c = self._compress
         if c:
             info["compressor"] = compression.get_compressor_name(self._compress)
@@ -361,7 +492,10 @@ class Protocol(object):
         if packet is None:
             return
         log("add_packet_to_queue(%s ... %s, %s, %s)", packet[0], synchronous, has_more, wait_for_more)
-        chunks = self.encode(packet)
+        if isinstance(packet, RawPacket):
+            chunks = packet.chunks
+        else:
+            chunks = self.encode(packet)
         with self._write_lock:
             if self._closed:
                 return
@@ -448,25 +582,84 @@ class Protocol(object):
         else:
             self.enable_compressor("none")
 
+    def parse_remote_caps(self, caps):
+        """ sub-classes can override this method to enable the transport features supported by the peer """
+        pass
+
     def enable_compressor_from_caps(self, caps):
         if self.compression_level==0:
             self.enable_compressor("none")
             return
         opts = compression.get_enabled_compressors(order=compression.PERFORMANCE_ORDER)
         log("enable_compressor_from_caps(..) options=%s", opts)
-        for c in opts:      #ie: [zlib, lz4, lzo]
-            if caps.boolget(c):
-                self.enable_compressor(c)
-                return
+        def peer_supports(c):
+            if not caps.boolget(c):
+                return False
+            #zstd can only be used if both ends have the same dictionary (or none):
+            return c!="zstd" or caps.intget("zstd.dictionary", 0)==compression.zstd_dictionary_id
+        self.compressors = [c for c in opts if peer_supports(c)]     #ie: [zlib, lz4, lzo]
+        if self.compressors:
+            self.enable_compressor(self.compressors[0])
+            return
         log.warn("compression disabled: no matching compressor found")
         self.enable_compressor("none")
 
     def enable_compressor(self, compressor):
         self._compress = compression.get_compressor(compressor)
         self.compressor = compressor
+        if compressor=="zstd" and compression.zstd_dictionary:
+            self.min_compress_size = ZSTD_DICT_MIN_COMPRESS_SIZE
+        else:
+            self.min_compress_size = MIN_COMPRESS_SIZE
         log("enable_compressor(%s): %s", compressor, self._compress)
 
 
+    def set_bandwidth_limit(self, bandwidth_limit):
+        #used by adaptive compression, in bits per second
+        self.bandwidth_limit = bandwidth_limit or 0
+
+    def get_measured_throughput(self):
+        """
+            The speed at which we have been able to write large buffers to the connection,
+            in bits per second, or 0 if we don't have enough data yet.
+            When the link is saturated, the writes block and this converges on the link speed.
+        """
+        records = tuple(self.write_throughput)
+        if len(records)<THROUGHPUT_MIN_RECORDS:
+            return 0
+        total = sum(size for size, _ in records)
+        elapsed = sum(t for _, t in records)
+        return int(total*8/max(0.0001, elapsed))
+
+    def get_bandwidth_estimate(self):
+        """ in bits per second, or None if we don't know yet """
+        values = [x for x in (self.bandwidth_limit, self.get_measured_throughput()) if x>0]
+        if not values:
+            return None
+        return min(values)
+
+    def compress(self, data, level):
+        """
+            Compresses using the compressor chosen at handshake time,
+            or when adaptive compression is enabled, using the compressor and level
+            which should give the lowest total time to compress and send this data.
+        """
+        if not ADAPTIVE_COMPRESSION or not self.compressors or len(data)<ADAPTIVE_MIN_SIZE:
+            return self._compress(data, level)
+        bandwidth = self.get_bandwidth_estimate()
+        if bandwidth is None:
+            #we don't know how fast the connection is yet,
+            #so only skip compression for data that would not compress:
+            if level>0 and compression.sample_compressibility(data)<compression.INCOMPRESSIBLE_RATIO:
+                algo, compress = self.compressor, self._compress
+            else:
+                algo, level, compress = "none", 0, compression.nocompress
+        else:
+            algo, level = compression.choose_compressor(data, level, bandwidth, self.compressors, ADAPTIVE_CPU_BUDGET)
+            compress = compression.get_compressor(algo)
+        self.adaptive_stats[algo] = self.adaptive_stats.get(algo, 0)+1
+        return compress(data, level)
+
     def noencode(self, data):
         #just send data as a string for clients that don't understand xpra packet format:
         if PYTHON3:
@@ -499,7 +692,7 @@ class Protocol(object):
         packet = list(packet_in)
         level = self.compression_level
         size_check = LARGE_PACKET_SIZE
-        min_comp_size = MIN_COMPRESS_SIZE
+        min_comp_size = self.min_compress_size
         for i in range(1, len(packet)):
             item = packet[i]
             if item is None:
@@ -542,7 +735,7 @@ class Protocol(object):
             elif ti in (str, bytes) and level>0 and l>LARGE_PACKET_SIZE:
                 log.warn("found a large uncompressed item in packet '%s' at position %s: %s bytes", packet[0], i, len(item))
                 #add new binary packet with large item:
-                cl, cdata = self._compress(item, level)
+                cl, cdata = self.compress(item, level)
                 packets.append((0, i, cl, cdata))
                 #replace this item with an empty string placeholder:
                 packet[i] = ''
@@ -567,10 +760,12 @@ class Protocol(object):
         if len(main_packet)>size_check and strtobytes(packet_in[0]) not in self.large_packets:
             log.warn("found large packet (%s bytes): %s, argument types:%s, sizes: %s, packet head=%s",
                      len(main_packet), packet_in[0], [type(x) for x in packet[1:]], [len(str(x)) for x in packet[1:]], repr_ellipsized(packet))
+        if PACKET_CAPTURE and proto_flags!=FLAGS_NOHEADER and bytestostr(packet_type) in CAPTURE_PACKET_TYPES:
+            self.capture_packet(proto_flags, main_packet)
         #compress, but don't bother for small packets:
         if level>0 and len(main_packet)>min_comp_size:
             try:
-                cl, cdata = self._compress(main_packet, level)
+                cl, cdata = self.compress(main_packet, level)
             except Exception:
                 log.error("Error compressing '%s' packet", packet_type)
                 raise
@@ -579,6 +774,21 @@ class Protocol(object):
             packets.append((proto_flags, 0, 0, main_packet))
         return packets
 
+    def capture_packet(self, proto_flags, data):
+        #saves the packet in xpra's wire format, without compression:
+        if self.cipher_out:
+            #the data would be written to disk in plain text:
+            return
+        with self._capture_lock:
+            if self._closed:
+                return
+            if not self._capture:
+                filename = "%s-%i-%i.xpra" % (PACKET_CAPTURE, os.getpid(), id(self))
+                log.info("recording packets to '%s'", filename)
+                self._capture = open(filename, "wb")
+            self._capture.write(pack_header(proto_flags, 0, 0, len(data)))
+            self._capture.write(memoryview_to_bytes(data))
+
     def set_compression_level(self, level):
         #this may be used next time encode() is called
         assert level>=0 and level<=10, "invalid compression level: %s (must be between 0 and 10" % level
@@ -628,7 +838,11 @@ class Protocol(object):
             except:
                 if not self._closed:
                     log.error("Error on write start callback %s", start_cb, exc_info=True)
+        size = buffers_size(buf_data)
+        start = monotonic_time()
         self.write_buffers(buf_data, fail_cb, synchronous)
+        if size>=THROUGHPUT_MIN_WRITE:
+            self.write_throughput.append((size, monotonic_time()-start))
         if end_cb:
             try:
                 end_cb(self._conn.output_bytecount)
@@ -641,6 +855,9 @@ class Protocol(object):
         con = self._conn
         if not con:
             return 0
+        if con.can_writev:
+            self.writev_buffers(con, buf_data)
+            return
         for buf in buf_data:
             while buf and not self._closed:
                 written = con.write(buf)
@@ -653,6 +870,24 @@ class Protocol(object):
                     self.output_raw_packetcount += 1
         self.output_packetcount += 1
 
+    def writev_buffers(self, con, buf_data):
+        #send the header and all the chunks with as few system calls as possible,
+        #partial writes advance through memoryviews rather than copying the data:
+        buffers = [memoryview(buf).cast("B") for buf in buf_data if buf]
+        while buffers and not self._closed:
+            written = con.writev(buffers)
+            if not written:
+                continue
+            self.output_raw_packetcount += 1
+            while written>0:
+                l = len(buffers[0])
+                if written<l:
+                    buffers[0] = buffers[0][written:]
+                    break
+                written -= l
+                buffers.pop(0)
+        self.output_packetcount += 1
+
 
     def _read_thread_loop(self):
         self._io_thread_loop("read", self._read)
@@ -741,6 +976,13 @@ class Protocol(object):
                 return
             self._internal_error("error in network packet reading/parsing", e, exc_info=True)
 
+    def append_read_data(self, read_buffer, data):
+        """
+            Adds the data we have received to the read buffer,
+            sub-classes can override this method to remove a transport's framing.
+        """
+        read_buffer.append(data)
+
     def do_read_parse_thread_loop(self):
         """
             Process the individual network packets placed in _read_queue.
@@ -753,7 +995,7 @@ class Protocol(object):
             this will be called from this parsing thread so any calls that need to be made
             from the UI thread will need to use a callback (usually via 'idle_add')
         """
-        read_buffer = None
+        read_buffer = self._read_buffer
         packet_size = 0
         payload_size = -1
         padding_size = 0
@@ -761,41 +1003,39 @@ class Protocol(object):
         compression_level = False
         packet = None
         raw_packets = {}
+        raw_payloads = {}
         while not self._closed:
             buf = self._read_queue.get()
             if not buf:
                 log("parse thread: empty marker, exiting")
                 self.idle_add(self.close)
                 return
-            if read_buffer:
-                read_buffer = read_buffer + buf
-            else:
-                read_buffer = buf
-            bl = len(read_buffer)
+            self.append_read_data(read_buffer, buf)
             while not self._closed:
-                packet = None
+                #drop any references to the previous packet's buffer views:
+                packet = raw_string = data = payload = None
                 bl = len(read_buffer)
                 if bl<=0:
                     break
                 if payload_size<0:
-                    if read_buffer[0] not in ("P", ord("P")):
-                        self._invalid_header(read_buffer, "invalid packet header byte %s" % read_buffer[0])
+                    if read_buffer.peek_byte(0)!=ord("P"):
+                        self._invalid_header(read_buffer.getvalue(), "invalid packet header byte %s" % read_buffer.peek_byte(0))
                         return
                     if bl<8:
                         break   #packet still too small
                     #packet format: struct.pack(b'cBBBL', ...) - 8 bytes
-                    _, protocol_flags, compression_level, packet_index, data_size = unpack_header(read_buffer[:8])
+                    _, protocol_flags, compression_level, packet_index, data_size = unpack_header(read_buffer.peek(8))
 
                     #sanity check size (will often fail if not an xpra client):
                     if data_size>self.abs_max_packet_size:
-                        self._invalid_header(read_buffer, "invalid size in packet header: %s" % data_size)
+                        self._invalid_header(read_buffer.getvalue(), "invalid size in packet header: %s" % data_size)
                         return
 
                     bl = len(read_buffer)-8
                     if protocol_flags & FLAGS_CIPHER:
                         if self.cipher_in_block_size==0 or not self.cipher_in_name:
                             cryptolog.warn("received cipher block but we don't have a cipher to decrypt it with, not an xpra client?")
-                            self._invalid_header(read_buffer, "invalid encryption packet flag (no cipher configured)")
+                            self._invalid_header(read_buffer.getvalue(), "invalid encryption packet flag (no cipher configured)")
                             return
                         padding_size = self.cipher_in_block_size - (data_size % self.cipher_in_block_size)
                         payload_size = data_size + padding_size
@@ -804,7 +1044,7 @@ class Protocol(object):
                         padding_size = 0
                         payload_size = data_size
                     assert payload_size>0, "invalid payload size: %i" % payload_size
-                    read_buffer = read_buffer[8:]
+                    read_buffer.skip(8)
 
                     if payload_size>self.max_packet_size:
                         #this packet is seemingly too big, but check again from the main UI thread
@@ -818,19 +1058,15 @@ class Protocol(object):
                                               (size_to_check, self.max_packet_size)
                                 self.invalid(msg, packet_header)
                             return False
-                        self.timeout_add(1000, check_packet_size, payload_size, read_buffer[:32])
+                        self.timeout_add(1000, check_packet_size, payload_size, memoryview_to_bytes(read_buffer.peek(32)))
 
                 if bl<payload_size:
                     # incomplete packet, wait for the rest to arrive
                     break
 
-                #chop this packet from the buffer:
-                if len(read_buffer)==payload_size:
-                    raw_string = read_buffer
-                    read_buffer = ''
-                else:
-                    raw_string = read_buffer[:payload_size]
-                    read_buffer = read_buffer[payload_size:]
+                #chop this packet from the buffer,
+                #this is a view of the buffer and not a copy (when supported):
+                raw_string = read_buffer.read(payload_size)
                 packet_size += 8+payload_size
                 #decrypt if needed:
                 data = raw_string
@@ -856,12 +1092,14 @@ class Protocol(object):
                             self._internal_error("%s encryption padding error - wrong key?" % self.cipher_in_name)
                             return
                         data = data[:-padding_size]
+                #keep the payload in case we forward it as-is:
+                payload = data
                 #uncompress if needed:
                 if compression_level>0:
                     try:
                         data = decompress(data, compression_level)
                     except InvalidCompressionException as e:
-                        self.invalid("invalid compression: %s" % e, data)
+                        self.invalid("invalid compression: %s" % e, memoryview_to_bytes(data))
                         return
                     except Exception as e:
                         ctype = compression.get_compression_type(compression_level)
@@ -874,41 +1112,63 @@ class Protocol(object):
                             #as this may leak crypto information:
                             msg += " %s" % e
                         del e
-                        return self.gibberish(msg, data)
+                        return self.gibberish(msg, memoryview_to_bytes(data))
 
                 if self.cipher_in and not (protocol_flags & FLAGS_CIPHER):
-                    self.invalid("unencrypted packet dropped", data)
+                    self.invalid("unencrypted packet dropped", memoryview_to_bytes(data))
                     return
 
                 if self._closed:
                     return
                 if packet_index>0:
-                    #raw packet, store it and continue:
-                    raw_packets[packet_index] = data
+                    #raw packet, store it and continue
+                    #(this is the only copy made when the data is not compressed,
+                    # the packet handlers may hold on to it)
+                    raw_packets[packet_index] = memoryview_to_bytes(data)
+                    if self.forward_filter:
+                        #keep the chunk as we received it, in case we forward it:
+                        if compression_level>0:
+                            payload = memoryview_to_bytes(payload)
+                        else:
+                            payload = raw_packets[packet_index]
+                        raw_payloads[packet_index] = (compression_level, payload)
                     payload_size = -1
                     packet_index = 0
                     if len(raw_packets)>=4:
-                        self.invalid("too many raw packets: %s" % len(raw_packets), data)
+                        self.invalid("too many raw packets: %s" % len(raw_packets), memoryview_to_bytes(data))
                         return
                     continue
-                #final packet (packet_index==0), decode it:
-                try:
-                    packet = decode(data, protocol_flags)
-                except InvalidPacketEncodingException as e:
-                    self.invalid("invalid packet encoding: %s" % e, data)
-                    return
-                except ValueError as e:
-                    etype = packet_encoding.get_packet_encoding_type(protocol_flags)
-                    log.error("Error parsing %s packet:", etype)
-                    log.error(" %s", e)
-                    if self._closed:
+                ff = self.forward_filter
+                if ff:
+                    packet_type = peek_packet_type(data, protocol_flags)
+                    levels = [level for level, _ in raw_payloads.values()]+[compression_level]
+                    if packet_type and len(raw_payloads)==len(raw_packets) and ff(packet_type, protocol_flags, levels):
+                        #no need to decode it, just pass on the chunks as we received them:
+                        flags = protocol_flags & ~FLAGS_CIPHER
+                        chunks = [(flags, index, level, raw_payload) for index, (level, raw_payload) in raw_payloads.items()]
+                        chunks.append((flags, 0, compression_level, memoryview_to_bytes(payload)))
+                        packet = RawPacket(packet_type, chunks)
+                        raw_packets = {}
+                raw_payloads = {}
+                if packet is None:
+                    #final packet (packet_index==0), decode it:
+                    try:
+                        packet = decode(data, protocol_flags)
+                    except InvalidPacketEncodingException as e:
+                        self.invalid("invalid packet encoding: %s" % e, memoryview_to_bytes(data))
+                        return
+                    except ValueError as e:
+                        etype = packet_encoding.get_packet_encoding_type(protocol_flags)
+                        log.error("Error parsing %s packet:", etype)
+                        log.error(" %s", e)
+                        if self._closed:
+                            return
+                        log("failed to parse %s packet: %s", etype, hexstr(data[:128]))
+                        log(" %s", e)
+                        log(" data: %s", repr_ellipsized(data))
+                        log(" packet index=%i, packet size=%i, buffer size=%s", packet_index, payload_size, bl)
+                        self.gibberish("failed to parse %s packet" % etype, memoryview_to_bytes(data))
                         return
-                    log("failed to parse %s packet: %s", etype, hexstr(data[:128]))
-                    log(" %s", e)
-                    log(" data: %s", repr_ellipsized(data))
-                    log(" packet index=%i, packet size=%i, buffer size=%s", packet_index, payload_size, bl)
-                    self.gibberish("failed to parse %s packet" % etype, data)
-                    return
 
                 if self._closed:
                     return
@@ -1047,6 +1307,12 @@ class Protocol(object):
             except:
                 log.error("error closing %s", c, exc_info=True)
         self.terminate_queue_threads()
+        #the format thread may still be writing to it:
+        with self._capture_lock:
+            capture = self._capture
+            self._capture = None
+        if capture:
+            capture.close()
         self.idle_add(self.clean)
         log("Protocol.close() done")
 
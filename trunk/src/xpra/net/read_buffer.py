@@ -0,0 +1,99 @@
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+from xpra.os_util import PYTHON3
+
+
+class ReadBuffer(object):
+    """
+        A growable receive buffer backed by a single bytearray.
+        New data is appended at the end and packets are consumed from the front
+        by moving a read offset, so parsing a header or chopping a payload
+        does not copy the rest of the buffer.
+        With python3, the payloads are returned as memoryviews of the buffer,
+        which can be handed to the decompressor or decoder without any copying.
+        If one of those views is still in use when more data arrives,
+        the buffer is left untouched and a new one is started instead.
+    """
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.pos = 0
+        #statistics:
+        self.total = 0
+        self.max_size = 0
+        self.copies = 0
+
+    def __repr__(self):
+        return "ReadBuffer(%i bytes)" % len(self)
+
+    def __len__(self):
+        return len(self.buf)-self.pos
+
+    def append(self, data):
+        buf = self.buf
+        pos = self.pos
+        try:
+            if pos:
+                #deleting from the front of a bytearray just moves its start pointer:
+                del buf[:pos]
+                self.pos = 0
+            buf += data
+        except BufferError:
+            #some views of the current buffer are still in use:
+            self.copies += 1
+            buf = buf[self.pos:]
+            buf += data
+            self.buf = buf
+            self.pos = 0
+        self.total += len(data)
+        self.max_size = max(self.max_size, len(buf))
+
+    def peek_byte(self, offset=0):
+        return self.buf[self.pos+offset]
+
+    def view(self, start, end):
+        if PYTHON3:
+            return memoryview(self.buf)[start:end]
+        return bytes(self.buf[start:end])
+
+    def tail(self, size):
+        """
+            returns a writable view of the last 'size' bytes,
+            so that data can be modified in place after being appended
+        """
+        return memoryview(self.buf)[len(self.buf)-size:]
+
+    def peek(self, size):
+        """ returns up to 'size' bytes without consuming them """
+        return self.view(self.pos, self.pos+size)
+
+    def skip(self, size):
+        assert size<=len(self), "cannot skip %i bytes, only %i available" % (size, len(self))
+        self.pos += size
+
+    def read(self, size):
+        """ consumes 'size' bytes from the front of the buffer """
+        assert size<=len(self), "cannot read %i bytes, only %i available" % (size, len(self))
+        start = self.pos
+        self.pos += size
+        return self.view(start, self.pos)
+
+    def getvalue(self):
+        """ returns a copy of all the data not consumed yet """
+        return bytes(self.buf[self.pos:])
+
+    def clear(self):
+        self.buf = bytearray()
+        self.pos = 0
+
+    def get_info(self):
+        return {
+            "size"      : len(self),
+            "allocated" : len(self.buf),
+            "max-size"  : self.max_size,
+            "total"     : self.total,
+            "copies"    : self.copies,
+            }
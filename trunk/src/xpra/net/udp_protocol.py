@@ -16,7 +16,7 @@ from xpra.log import Logger
 log = Logger("network", "protocol", "udp")
 
 from xpra.os_util import LINUX, monotonic_time, memoryview_to_bytes
-from xpra.util import envint, repr_ellipsized
+from xpra.util import envint, envbool, repr_ellipsized, typedict
 from xpra.make_thread import start_thread
 from xpra.net.protocol import Protocol, READ_BUFFER_SIZE
 from xpra.net.bytestreams import SocketConnection, can_retry
@@ -26,23 +26,52 @@ DROP_FIRST = envint("XPRA_UDP_DROP_FIRST", 0)
 MIN_MTU = envint("XPRA_UDP_MIN_MTU", 576)
 MAX_MTU = envint("XPRA_UDP_MAX_MTU", 65536)
 assert MAX_MTU>MIN_MTU
+#how long we can wait before acknowledging new data:
+ACK_DELAY = envint("XPRA_UDP_ACK_DELAY", 10)
+#request a missing chunk as soon as this many chunks have arrived after it:
+REORDER_THRESHOLD = envint("XPRA_UDP_REORDER_THRESHOLD", 3)
+#retransmission timeout limits, in milliseconds:
+INITIAL_RTO = envint("XPRA_UDP_INITIAL_RTO", 1000)
+MIN_RTO = envint("XPRA_UDP_MIN_RTO", 50)
+MAX_RTO = envint("XPRA_UDP_MAX_RTO", 2000)
+assert MAX_RTO>=MIN_RTO
+MAX_SACK_RANGES = envint("XPRA_UDP_MAX_SACK_RANGES", 16)
+#send one parity chunk for every FEC_GROUP chunks of pixel data:
+FEC = envbool("XPRA_UDP_FEC", False)
+FEC_GROUP = max(1, envint("XPRA_UDP_FEC_GROUP", 8))
+
+try:
+    from xpra.codecs.xor.cyxor import xor_into    #@UnresolvedImport
+except ImportError as e:
+    log("no forward error correction: %s", e)
+    xor_into = None
 
 def clamp_mtu(mtu):
     return max(MIN_MTU, min(MAX_MTU, mtu))
 
 
-#UUID, seqno, synchronous, chunk, chunks
+#UUID, seqno, flags, chunk, chunks
 _header_struct = struct.Struct(b'!QQHHH')
 _header_size = _header_struct.size
+#header flags:
+FLAG_SYNCHRONOUS = 0x1
+FLAG_CONTROL = 0x2          #udp-control packets, which are never acknowledged
+
+#prefix of parity chunks: group size, xor of the length of the chunks in the group
+_fec_struct = struct.Struct(b'!HH')
+_fec_size = _fec_struct.size
 
 
 class PendingPacket(object):
-    def __init__(self, seqno, start_time, chunks=None):
+    def __init__(self, seqno, start_time, chunks=None, count=0):
         self.seqno = seqno
         self.start_time = start_time
         self.last_time = start_time
+        self.last_count = count     #the number of chunks we had received when we last updated this packet
         self.chunk_gap = 0
         self.chunks = chunks
+        self.fec_group = 0
+        self.parity = {}
     def __repr__(self):
         return ("PendingPacket(%i: %s chunks)" % (self.seqno, len(self.chunks or [])))
 
@@ -116,7 +145,11 @@ class UDPProtocol(Protocol):
         to fit in the MTU.
         We keep track of the function which can be used to handle send failures
         (or the packet data if no function is supplied).
-        "udp-control" packets are used to synchronize both ends.
+        "udp-control" packets are used to synchronize both ends,
+        they acknowledge the data received (cumulative sequence and selective ranges)
+        and request the chunks that are missing.
+        Packets which are not acknowledged within the retransmission timeout
+        (derived from the round trip time) are probed again.
     """
 
     def __init__(self, *args):
@@ -133,6 +166,23 @@ class UDPProtocol(Protocol):
         self.cancel = set()         #tell the other end to forget those
         self.control_timer = None
         self.control_timer_due = 0
+        self.chunks_received = 0
+        #sender state:
+        self.send_time = {}         #seqno: time of the last transmission, for packets not acknowledged yet
+        self.resend_time = {}       #seqno: {chunk: time it was re-sent}
+        self.retransmitted = set()  #don't use those for rtt samples
+        self.srtt = 0
+        self.rttvar = 0
+        self.rto = INITIAL_RTO
+        self.rto_timer = None
+        self.echo = None            #the timestamp of the last control packet received, and when it arrived
+        self.remote_sack = False    #the peer understands selective acks and the control header flag
+        self.remote_fec = False
+        #counters:
+        self.nack_resent = 0
+        self.rto_resent = 0
+        self.fec_sent = 0
+        self.fec_recovered = 0
         self.asynchronous_send_enabled = False
         self.asynchronous_receive_enabled = False
         self._process_read = self.process_read
@@ -141,6 +191,12 @@ class UDPProtocol(Protocol):
     def close(self):
         Protocol.close(self)
         self.cancel_control_timer()
+        self.cancel_rto_timer()
+
+    def parse_remote_caps(self, caps):
+        #older peers only understand the original "udp-control" packet:
+        self.remote_sack = caps.boolget("udp.sack")
+        log("parse_remote_caps(..) sack=%s", self.remote_sack)
 
     def accept(self):
         log("accept() enabling asynchronous packet reception")
@@ -175,16 +231,50 @@ class UDPProtocol(Protocol):
             return False
         missing = self._get_missing()
         packet = ("udp-control", self.mtu, self.asynchronous_receive_enabled, self.last_sequence, self.highest_sequence, missing, tuple(self.cancel))
+        flags = 0
+        if self.remote_sack:
+            now = monotonic_time()
+            options = {
+                "fec"       : xor_into is not None,
+                "timestamp" : int(now*1000),
+                }
+            echo = self.echo
+            if echo:
+                #so the other end can measure the round trip time, even when packets are being re-sent:
+                self.echo = None
+                ts, received = echo
+                options["echo"] = (ts, int((now-received)*1000))
+            packet += (self._get_sack(), options)
+            flags = FLAG_CONTROL
         log("send_control() packet(%s)=%s", self.pending_packets, packet)
         def send_control_failed():
             #resend a new one
             self.cancel_control_timer()
             self.send_control()
-        self._send_async(packet, False, send_control_failed)
+        self._send_async(packet, flags, send_control_failed)
         self.cancel = set()
-        self.schedule_control()
+        #keep asking for the missing data until it arrives,
+        #older peers re-send everything we ask for, so don't ask them as often:
+        if self.pending_packets and self.remote_sack:
+            self.schedule_control(self.jitter)
+        else:
+            self.schedule_control()
         return False
 
+    def _get_sack(self):
+        """ the ranges of sequence numbers above last_sequence which we have received in full """
+        received = set(self.can_skip)
+        for seqno, ip in tuple(self.pending_packets.items()):
+            if ip.chunks and all(x is not None for x in ip.chunks):
+                received.add(seqno)
+        ranges = []
+        for seqno in sorted(received):
+            if ranges and ranges[-1][1]==seqno-1:
+                ranges[-1][1] = seqno
+            else:
+                ranges.append([seqno, seqno])
+        return ranges[:MAX_SACK_RANGES]
+
     def _get_missing(self):
         """ the packets and chunks we are missing """
         if not self.pending_packets:
@@ -192,12 +282,15 @@ class UDPProtocol(Protocol):
         now = monotonic_time()
         max_time = now-self.jitter/1000.0
         missing = {}
-        for seqno, ip in self.pending_packets.items():
+        for seqno, ip in tuple(self.pending_packets.items()):
             start = ip.start_time
-            if start>=max_time:
-                continue        #too recent, may still arrive
+            #chunks received since this packet was last updated:
+            later = self.chunks_received-ip.last_count
             missing_chunks = []     #by default, we don't know what is missing
-            if ip.chunks is not None:
+            if ip.chunks is None:
+                if start>=max_time and later<REORDER_THRESHOLD:
+                    continue        #too recent, may still arrive
+            else:
                 #we have some chunks already,
                 #so we know how many we are expecting in total,
                 #and which ones should have arrived by now
@@ -212,40 +305,42 @@ class UDPProtocol(Protocol):
                     if highest>0:
                         chunk_gap = (ip.last_time - start) / highest
                         ip.chunk_gap = chunk_gap
-                for index in chunks:
+                #walk backwards so we can count the chunks received after each missing one:
+                for index in reversed(range(len(ip.chunks))):
+                    if ip.chunks[index] is not None:
+                        later += 1
+                        continue
                     #when should it have been received
                     eta = start + chunk_gap*index
-                    if eta<=max_time:
+                    if eta<=max_time or later>=REORDER_THRESHOLD:
                         missing_chunks.append(index)
+                missing_chunks.reverse()
                 if not missing_chunks:
                     #nothing is overdue yet, so don't request anything:
                     continue
             missing[seqno] = missing_chunks
         return missing
 
-    def process_control(self, mtu, remote_async_receive, last_seq, high_seq, missing, cancel):
-        log("process_control(%i, %i, %i, %i, %s, %s) current seq=%i", mtu, remote_async_receive, last_seq, high_seq, missing, cancel, self.output_packetcount)
+    def process_control(self, mtu, remote_async_receive, last_seq, high_seq, missing, cancel, sack=(), options=None, *_args):
+        log("process_control(%i, %i, %i, %i, %s, %s, %s) current seq=%i", mtu, remote_async_receive, last_seq, high_seq, missing, cancel, sack, self.output_packetcount)
         con = self._conn
         if not con:
             return
         if mtu and self.mtu==0:
             self.mtu = clamp_mtu(mtu)
         self.asynchronous_send_enabled = remote_async_receive
+        if options:
+            self.process_control_options(typedict(options))
         #first, we can free all the packets that have been processed by the other end:
         #(resend cache and fail callback)
+        acked = set()
         if last_seq>=0:
-            done = [x for x in self.fail_cb.keys() if x<=last_seq]
-            for x in done:
-                try:
-                    del self.fail_cb[x]
-                except:
-                    pass
-            done = [x for x in self.resend_cache.keys() if x<=last_seq]
-            for x in done:
-                try:
-                    del self.resend_cache[x]
-                except:
-                    pass
+            for d in (self.fail_cb, self.resend_cache, self.send_time):
+                acked.update(x for x in tuple(d.keys()) if x<=last_seq)
+        for start, end in sack:
+            acked.update(x for x in tuple(self.resend_cache.keys()) if start<=x<=end)
+        if acked:
+            self.acknowledged(acked)
         #next we can forget about sequence numbers that have been cancelled:
         #we don't need to request a re-send, and we can skip over them:
         if cancel:
@@ -260,6 +355,9 @@ class UDPProtocol(Protocol):
             if self.pending_packets and (self.last_sequence+1) in self.can_skip:
                 self.process_pending()
         #re-send the missing ones:
+        now = monotonic_time()
+        #a chunk we have re-sent recently may still be in flight:
+        resend_interval = max(self.jitter, self.srtt)/1000.0
         for seqno, missing_chunks in missing.items():
             resend_cache = self.resend_cache.get(seqno)
             fail_cb_seq = self.fail_cb.get(seqno)
@@ -271,27 +369,23 @@ class UDPProtocol(Protocol):
             if len(missing_chunks)==0:
                 #the other end only knows it is missing the seqno,
                 #not how many chunks are missing, so send them all
-                missing_chunks = resend_cache.keys()
+                missing_chunks = tuple((resend_cache or {}).keys())
             if fail_cb_seq:
-                log("fail_cb[%i]=%s, missing_chunks=%s, len(resend_cache)=%i", seqno, repr_ellipsized(str(fail_cb_seq)), missing_chunks, len(resend_cache))
+                log("fail_cb[%i]=%s, missing_chunks=%s, len(resend_cache)=%i", seqno, repr_ellipsized(str(fail_cb_seq)), missing_chunks, len(resend_cache or {}))
                 #we have a fail callback for this packet,
                 #we have to decide if we send the missing chunks or use the callback,
                 #resend if the other end is missing less than 25% of the chunks:
                 #TODO: if the latency is low, resending becomes cheaper..
-                if len(missing_chunks)>=len(resend_cache)//4:
+                if len(missing_chunks)>=len(resend_cache or {})//4:
                     #too many are missing, forget about it
-                    try:
-                        del self.resend_cache[seqno]
-                    except:
-                        pass
-                    try:
-                        del self.fail_cb[seqno]
-                    except:
-                        pass
+                    self.forget(seqno)
                     self.cancel.add(seqno)
                     fail_cb_seq()
                     continue
+            resend_times = self.resend_time.setdefault(seqno, {})
             for c in missing_chunks:
+                if now-resend_times.get(c, 0)<resend_interval:
+                    continue
                 data = resend_cache.get(c)
                 log("resend data[%i][%i]=%s", seqno, c, repr_ellipsized(str(data)))
                 if data is None:
@@ -302,12 +396,113 @@ class UDPProtocol(Protocol):
                 #TODO: if the mtu is now lower, we should re-send the whole packet,
                 # with the new chunk size..
                 con.write(data)
+                resend_times[c] = now
+                self.retransmitted.add(seqno)
+                self.nack_resent += 1
+                if seqno in self.send_time:
+                    #this packet is being repaired, don't probe it yet:
+                    self.send_time[seqno] = now
+        if self.cancel:
+            #the other end may be waiting for those:
+            self.schedule_control(ACK_DELAY)
         #make sure we keep telling the client it has packets to catch up on:
-        if high_seq<self.output_packetcount:
+        elif high_seq<self.output_packetcount:
             self.schedule_control()
 
+    def process_control_options(self, options):
+        self.remote_fec = options.boolget("fec")
+        now = monotonic_time()
+        ts = options.intget("timestamp")
+        if ts:
+            self.echo = (ts, now)
+        echo = options.listget("echo")
+        if echo and len(echo)==2:
+            #our timestamp, and how long the other end held on to it:
+            ts, held = echo
+            rtt = now*1000-ts-held
+            if rtt>=0:
+                self.update_rtt(rtt)
+
+    def acknowledged(self, seqnos):
+        """ the other end has received those packets in full """
+        now = monotonic_time()
+        #only use the most recent packet for measuring the round trip time,
+        #and never one which has been re-sent since we can't tell which copy arrived:
+        sample = None
+        for seqno in sorted(seqnos, reverse=True):
+            send_time = self.send_time.get(seqno)
+            if send_time and seqno not in self.retransmitted:
+                sample = now-send_time
+                break
+        for seqno in seqnos:
+            self.forget(seqno)
+        if sample is not None:
+            self.update_rtt(sample*1000)
+
+    def forget(self, seqno):
+        """ we won't be re-sending this packet """
+        for d in (self.fail_cb, self.resend_cache, self.send_time, self.resend_time):
+            try:
+                del d[seqno]
+            except KeyError:
+                pass
+        self.retransmitted.discard(seqno)
+
+    def update_rtt(self, rtt):
+        """ RFC 6298 estimator, the values are in milliseconds """
+        if self.srtt==0:
+            self.srtt = rtt
+            self.rttvar = rtt/2.0
+        else:
+            self.rttvar = 0.75*self.rttvar + 0.25*abs(self.srtt-rtt)
+            self.srtt = 0.875*self.srtt + 0.125*rtt
+        #the other end may delay its acknowledgement:
+        rto = self.srtt + max(1, 4*self.rttvar) + ACK_DELAY
+        self.rto = int(max(MIN_RTO, min(MAX_RTO, rto)))
+
+
+    def schedule_rto(self):
+        if not self.rto_timer and not self._closed:
+            self.rto_timer = self.timeout_add(self.rto, self.check_rto)
+
+    def cancel_rto_timer(self):
+        rt = self.rto_timer
+        if rt:
+            self.rto_timer = None
+            self.source_remove(rt)
 
-    def process_udp_data(self, uuid, seqno, synchronous, chunk, chunks, data, _bfrom):
+    def check_rto(self):
+        """
+            re-send the last chunk of the packets which have not been acknowledged in time,
+            the other end will then know exactly which chunks it is missing.
+        """
+        self.rto_timer = None
+        con = self._conn
+        if self._closed or not con:
+            return False
+        now = monotonic_time()
+        expired = sorted(seqno for seqno, t in tuple(self.send_time.items()) if (now-t)*1000>=self.rto)
+        log("check_rto() rto=%i, expired=%s", self.rto, expired)
+        for seqno in expired:
+            resend_cache = self.resend_cache.get(seqno)
+            if not resend_cache:
+                self.forget(seqno)
+                continue
+            chunk = max(resend_cache.keys())
+            con.write(resend_cache[chunk])
+            self.send_time[seqno] = now
+            self.resend_time.setdefault(seqno, {})[chunk] = now
+            self.retransmitted.add(seqno)
+            self.rto_resent += 1
+        if expired:
+            #back off until we get a new rtt sample:
+            self.rto = min(MAX_RTO, self.rto*2)
+        if self.send_time:
+            self.schedule_rto()
+        return False
+
+
+    def process_udp_data(self, uuid, seqno, flags, chunk, chunks, data, _bfrom):
         """
             process a udp chunk:
             * if asynchronous or if this is the next sequence: process it immediately
@@ -315,9 +510,14 @@ class UDPProtocol(Protocol):
             * otherwise queue it up and keep track of any missing sequence numbers,
               schedule a udp-control packet to notify the other end of what we're missing
         """
-        #log("process_udp_data%s %i bytes", (uuid, seqno, synchronous, chunk, chunks, repr_ellipsized(data), bfrom), len(data))
+        #log("process_udp_data%s %i bytes", (uuid, seqno, flags, chunk, chunks, repr_ellipsized(data), bfrom), len(data))
         assert uuid==self.uuid
-        if seqno<=self.last_sequence:
+        synchronous = flags & FLAG_SYNCHRONOUS
+        if self.remote_sack and not flags & FLAG_CONTROL:
+            #acknowledge it soon, even if it is a duplicate:
+            #our previous acknowledgement may have been lost
+            self.schedule_control(ACK_DELAY)
+        if seqno<=self.last_sequence or seqno in self.can_skip:
             log("skipping duplicate packet %5i.%i", seqno, chunk)
             return
         global DROP_FIRST, DROP_PCT
@@ -330,8 +530,10 @@ class UDPProtocol(Protocol):
                 log.warn("Warning: dropping udp packet %5i.%i", seqno, chunk)
                 return
         self.highest_sequence = max(self.highest_sequence, seqno)
+        self.chunks_received += 1
         if self.pending_packets or (synchronous and seqno!=self.last_sequence+1) or chunk!=0 or chunks!=1:
-            assert chunk>=0 and chunks>0 and chunk<chunks, "invalid chunk: %i/%i" % (chunk, chunks)
+            #parity chunks are numbered after the data chunks:
+            assert chunk>=0 and chunks>0 and chunk<chunks*2, "invalid chunk: %i/%i" % (chunk, chunks)
             #slow path: add chunk to incomplete packet
             now = monotonic_time()
             ip = self.pending_packets.get(seqno)
@@ -342,13 +544,20 @@ class UDPProtocol(Protocol):
                 self.pending_packets[seqno] = ip
             else:
                 ip.last_time = now
-            ip.chunks[chunk] = data
+            ip.last_count = self.chunks_received
+            if chunk<chunks:
+                ip.chunks[chunk] = data
+            else:
+                ip.fec_group = _fec_struct.unpack_from(data)[0]
+                ip.parity[chunk-chunks] = data
+            if ip.parity:
+                self.fec_recover(ip, chunk)
             if seqno!=self.last_sequence+1:
                 #we're waiting for a packet and this is not it,
                 #make sure any gaps are marked as incomplete:
                 for i in range(self.last_sequence+1, seqno):
                     if i not in self.pending_packets and i not in self.can_skip:
-                        self.pending_packets[i] = PendingPacket(i, now)
+                        self.pending_packets[i] = PendingPacket(i, now, None, self.chunks_received)
                 #make sure we request the missing packets:
                 self.schedule_control(self.jitter)
                 if synchronous:
@@ -373,6 +582,36 @@ class UDPProtocol(Protocol):
         #if self.pending_packets or (seqno+1) in self.can_skip:
         self.process_pending()
 
+    def fec_recover(self, ip, chunk):
+        """
+            if a single chunk is missing from the group this chunk belongs to,
+            we can rebuild it from the parity chunk of the group
+        """
+        nchunks = len(ip.chunks)
+        if chunk>=nchunks:
+            group = chunk-nchunks
+        else:
+            group = chunk//ip.fec_group
+        parity = ip.parity.get(group)
+        if parity is None or not xor_into:
+            return
+        group_size, length = _fec_struct.unpack_from(parity)
+        start = group*group_size
+        end = min(nchunks, start+group_size)
+        missing = [i for i in range(start, end) if ip.chunks[i] is None]
+        if len(missing)!=1:
+            return
+        buf = bytearray(parity[_fec_size:])
+        for i in range(start, end):
+            data = ip.chunks[i]
+            if data is not None:
+                length ^= len(data)
+                v = memoryview(buf)[:len(data)]
+                xor_into(v, data, v)
+        log("fec_recover: rebuilt chunk %i of packet %i from group %i", missing[0], ip.seqno, group)
+        ip.chunks[missing[0]] = bytes(buf[:length])
+        self.fec_recovered += 1
+
     def process_pending(self):
         """
             because of a new packet (bumped sequence number),
@@ -423,7 +662,7 @@ class UDPProtocol(Protocol):
         with self._write_lock:
             if self._write_thread is None:
                 self.start_write_thread()
-            self._write_queue.put((header_and_data, None, None, fail_cb, sync))
+            self._write_queue.put(([header_and_data], None, None, fail_cb, sync))
 
     def raw_write(self, items, start_cb=None, end_cb=None, fail_cb=None, synchronous=True, _more=False):
         """ make sure we don't enable asynchronous mode until the other end is read """
@@ -458,6 +697,11 @@ class UDPProtocol(Protocol):
         mtu = self.mtu or MIN_MTU
         l = len(data)
         maxpayload = mtu-_header_size
+        #only pixel data has a fail callback,
+        #and it is only worth adding parity chunks to packets that need more than one chunk:
+        fec = FEC and self.remote_fec and xor_into and fail_cb is not None and l>maxpayload
+        if fec:
+            maxpayload -= _fec_size
         chunks = l // maxpayload
         if l % maxpayload > 0:
             chunks += 1
@@ -467,6 +711,8 @@ class UDPProtocol(Protocol):
         if fail_cb:
             self.fail_cb[seqno] = fail_cb
         chunk_resend_cache = self.resend_cache.setdefault(seqno, {})
+        parity = None
+        parity_length = 0
         while offset<l:
             assert chunk<chunks
             pl = min(maxpayload, l-offset)
@@ -478,9 +724,27 @@ class UDPProtocol(Protocol):
             offset += pl
             if chunk_resend_cache is not None:
                 chunk_resend_cache[chunk] = udp_data
+            if fec:
+                if chunk % FEC_GROUP==0:
+                    parity = bytearray(maxpayload)
+                    parity_length = 0
+                v = memoryview(parity)[:pl]
+                xor_into(v, data_chunk, v)
+                parity_length ^= pl
+                if chunk % FEC_GROUP==FEC_GROUP-1 or offset>=l:
+                    #send the parity chunk for this group:
+                    parity_chunk = chunks + chunk//FEC_GROUP
+                    header = _header_struct.pack(self.uuid, seqno, synchronous, parity_chunk, chunks)
+                    con.write(header + _fec_struct.pack(FEC_GROUP, parity_length) + bytes(parity))
+                    self.output_raw_packetcount += 1
+                    self.fec_sent += 1
             chunk += 1
         assert chunk==chunks, "wrote %i chunks but expected %i" % (chunk, chunks)
         self.output_packetcount += 1
+        if self.remote_sack and not synchronous & FLAG_CONTROL:
+            #older peers don't acknowledge promptly, and control packets are never acknowledged:
+            self.send_time[seqno] = monotonic_time()
+            self.schedule_rto()
         if not self.control_timer:
             self.schedule_control()
         return offset
@@ -494,6 +758,20 @@ class UDPProtocol(Protocol):
                 "min"   : MIN_MTU,
                 "max"   : MAX_MTU,
                 },
+            "rtt"   : {
+                ""      : int(self.srtt),
+                "var"   : int(self.rttvar),
+                "rto"   : self.rto,
+                },
+            "resent" : {
+                "nack"  : self.nack_resent,
+                "rto"   : self.rto_resent,
+                },
+            "fec"   : {
+                ""          : bool(FEC and self.remote_fec and xor_into),
+                "sent"      : self.fec_sent,
+                "recovered" : self.fec_recovered,
+                },
             })
         return i
 
@@ -527,10 +805,10 @@ class UDPClientProtocol(UDPProtocol):
             then process the packed using process_udp_data
         """
         #log.info("UDPClientProtocol.read_queue_put(%s)", repr_ellipsized(buf))
-        uuid, seqno, synchronous, chunk, chunks = _header_struct.unpack_from(buf[:_header_size])
+        uuid, seqno, flags, chunk, chunks = _header_struct.unpack_from(buf[:_header_size])
         data = buf[_header_size:]
         bfrom = None        #not available here..
-        self.process_udp_data(uuid, seqno, synchronous, chunk, chunks, data, bfrom)
+        self.process_udp_data(uuid, seqno, flags, chunk, chunks, data, bfrom)
 
 
 class UDPSocketConnection(SocketConnection):
@@ -0,0 +1,82 @@
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+# Websocket frame headers, see RFC 6455 section 5.2
+
+import struct
+
+OPCODE_CONTINUATION = 0
+OPCODE_TEXT = 1
+OPCODE_BINARY = 2
+OPCODE_CLOSE = 8
+OPCODE_PING = 9
+OPCODE_PONG = 10
+
+OPCODES = {
+    OPCODE_CONTINUATION : "continuation",
+    OPCODE_TEXT         : "text",
+    OPCODE_BINARY       : "binary",
+    OPCODE_CLOSE        : "close",
+    OPCODE_PING         : "ping",
+    OPCODE_PONG         : "pong",
+    }
+
+#the largest header: 2 bytes, 8 bytes of extended payload length and a 4 byte mask
+MAX_HEADER_SIZE = 14
+
+#the magic string used for computing the "Sec-WebSocket-Accept" value:
+GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+_short = struct.Struct(b"!BB")
+_medium = struct.Struct(b"!BBH")
+_long = struct.Struct(b"!BBQ")
+
+
+def encode_hybi_header(opcode, payload_len, has_mask=False, fin=True):
+    """ the mask itself must be added after this header by the caller """
+    b1 = (opcode & 0x0f) | (0x80 if fin else 0)
+    mask_bit = 0x80 if has_mask else 0
+    if payload_len<=125:
+        return _short.pack(b1, payload_len | mask_bit)
+    if payload_len<=65535:
+        return _medium.pack(b1, 126 | mask_bit, payload_len)
+    return _long.pack(b1, 127 | mask_bit, payload_len)
+
+
+def decode_hybi_header(buf):
+    """
+        Parses the header found at the start of 'buf',
+        returns (opcode, fin, mask, payload_len, header_len)
+        or None if we don't have the whole header yet.
+        Raises ValueError if the reserved bits are set,
+        since we never negotiate any extensions.
+    """
+    blen = len(buf)
+    if blen<2:
+        return None
+    b1, b2 = _short.unpack_from(buf)
+    if b1 & 0x70:
+        raise ValueError("invalid websocket frame header: reserved bits set in %#x" % b1)
+    opcode = b1 & 0x0f
+    fin = bool(b1 & 0x80)
+    payload_len = b2 & 0x7f
+    header_len = 2
+    if payload_len==126:
+        header_len = 4
+        if blen<header_len:
+            return None
+        payload_len = _medium.unpack_from(buf)[2]
+    elif payload_len==127:
+        header_len = 10
+        if blen<header_len:
+            return None
+        payload_len = _long.unpack_from(buf)[2]
+    mask = None
+    if b2 & 0x80:
+        if blen<header_len+4:
+            return None
+        mask = bytes(buf[header_len:header_len+4])
+        header_len += 4
+    return opcode, fin, mask, payload_len, header_len
@@ -0,0 +1,147 @@
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+from xpra.log import Logger
+log = Logger("network", "websocket")
+
+from xpra.os_util import memoryview_to_bytes, hexstr
+from xpra.net.protocol import Protocol, buffers_size, PACKET_JOIN_SIZE
+from xpra.net.websocket_header import (
+    encode_hybi_header, decode_hybi_header, MAX_HEADER_SIZE, OPCODES,
+    OPCODE_CONTINUATION, OPCODE_TEXT, OPCODE_BINARY, OPCODE_CLOSE, OPCODE_PING, OPCODE_PONG,
+    )
+from xpra.codecs.xor.cyxor import hybi_unmask_into   #@UnresolvedImport
+
+DATA_OPCODES = (OPCODE_CONTINUATION, OPCODE_TEXT, OPCODE_BINARY)
+
+
+class WebSocketProtocol(Protocol):
+    """
+        Sends and receives xpra packets wrapped in websocket frames,
+        without going through websockify:
+        each packet is sent as a single binary frame,
+        the frame header is prepended to the buffers of the packet.
+        The payload of the frames we receive is appended straight into
+        the read buffer and unmasked in place, frames can span any number of reads.
+    """
+
+    def __init__(self, *args):
+        Protocol.__init__(self, *args)
+        #the state of the frame we are receiving:
+        self.ws_header = b""
+        self.ws_opcode = 0
+        self.ws_mask = None
+        self.ws_remaining = 0
+        self.ws_offset = 0
+        self.ws_control = b""
+        #counters:
+        self.ws_frames_in = 0
+        self.ws_frames_out = 0
+
+    def __repr__(self):
+        return "WebSocketProtocol(%s)" % self._conn
+
+    def get_info(self, alias_info=True):
+        info = Protocol.get_info(self, alias_info)
+        info["websocket"] = {
+            "frames"    : {
+                "in"    : self.ws_frames_in,
+                "out"   : self.ws_frames_out,
+                },
+            }
+        return info
+
+
+    def raw_write(self, items, start_cb=None, end_cb=None, fail_cb=None, synchronous=True, more=False):
+        header = encode_hybi_header(OPCODE_BINARY, buffers_size(items))
+        items = list(items)
+        if items and len(items[0])<PACKET_JOIN_SIZE:
+            items[0] = header+memoryview_to_bytes(items[0])
+        else:
+            items.insert(0, header)
+        self.ws_frames_out += 1
+        Protocol.raw_write(self, items, start_cb, end_cb, fail_cb, synchronous, more)
+
+    def send_control_frame(self, opcode, payload=b"", end_cb=None):
+        frame = encode_hybi_header(opcode, len(payload))+payload
+        self.ws_frames_out += 1
+        Protocol.raw_write(self, [frame], None, end_cb)
+
+
+    def append_read_data(self, read_buffer, data):
+        """
+            Parses the websocket frames found in 'data',
+            the payload of data frames is added to the read buffer.
+        """
+        view = memoryview(data)
+        pos = 0
+        size = len(view)
+        while pos<size and not self._closed:
+            if self.ws_remaining==0:
+                #parse a new frame header, which may have been split across reads:
+                header = self.ws_header+memoryview_to_bytes(view[pos:pos+MAX_HEADER_SIZE])
+                try:
+                    frame = decode_hybi_header(header)
+                except ValueError as e:
+                    self._invalid_header(header, str(e))
+                    return
+                if frame is None:
+                    self.ws_header = header
+                    return
+                opcode, _, mask, payload_len, header_len = frame
+                pos += header_len-len(self.ws_header)
+                self.ws_header = b""
+                self.ws_opcode = opcode
+                self.ws_mask = mask
+                self.ws_remaining = payload_len
+                self.ws_offset = 0
+                self.ws_frames_in += 1
+                if opcode not in DATA_OPCODES and payload_len>125:
+                    self._invalid_header(header, "invalid websocket %s frame size: %i" % (OPCODES.get(opcode, opcode), payload_len))
+                    return
+                if payload_len==0:
+                    self.frame_complete()
+                    continue
+            n = min(self.ws_remaining, size-pos)
+            chunk = view[pos:pos+n]
+            mask = self.ws_mask
+            if mask:
+                #the mask may not start with its first byte if the payload spans multiple reads:
+                o = self.ws_offset % 4
+                mask = mask[o:]+mask[:o]
+            if self.ws_opcode in DATA_OPCODES:
+                read_buffer.append(chunk)
+                if mask:
+                    hybi_unmask_into(mask, read_buffer.tail(n))
+            else:
+                chunk = bytearray(chunk)
+                if mask:
+                    hybi_unmask_into(mask, chunk)
+                self.ws_control += bytes(chunk)
+            chunk = None
+            pos += n
+            self.ws_offset += n
+            self.ws_remaining -= n
+            if self.ws_remaining==0:
+                self.frame_complete()
+
+    def frame_complete(self):
+        opcode = self.ws_opcode
+        if opcode in DATA_OPCODES:
+            return
+        payload = self.ws_control
+        self.ws_control = b""
+        log("websocket %s frame: %s", OPCODES.get(opcode, opcode), hexstr(payload))
+        if opcode==OPCODE_PING:
+            self.send_control_frame(OPCODE_PONG, payload)
+        elif opcode==OPCODE_PONG:
+            pass
+        elif opcode==OPCODE_CLOSE:
+            #echo the status code, then close the connection once it has been sent:
+            def closed(*_args):
+                self.idle_add(self.close)
+            self.send_control_frame(OPCODE_CLOSE, payload[:2], closed)
+        else:
+            log.warn("Warning: unknown websocket opcode %#x", opcode)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+"""
+Trains the zstd dictionary used for compressing xpra packets.
+
+Record some packets by running a client or server with:
+ XPRA_PACKET_CAPTURE=/tmp/capture
+then train a dictionary from the capture files:
+ python -m xpra.net.zstd_dictionary packets.dict /tmp/capture-*.xpra
+and install it as 'zstd/packets.dict' in the resources directory
+of both the client and the server (or use XPRA_ZSTD_DICTIONARY).
+"""
+
+import sys
+
+from xpra.net.header import unpack_header, FLAGS_CIPHER
+
+DICTIONARY_SIZE = 16*1024
+#larger packets compress well enough without a dictionary:
+MAX_SAMPLE_SIZE = 4096
+
+
+def read_capture(filename):
+    """ returns the main packets found in a capture file """
+    samples = []
+    with open(filename, "rb") as f:
+        data = f.read()
+    pos = 0
+    while pos+8<=len(data):
+        _, protocol_flags, level, index, size = unpack_header(data, pos)
+        pos += 8
+        if level==0 and index==0 and not (protocol_flags & FLAGS_CIPHER):
+            samples.append(data[pos:pos+size])
+        pos += size
+    return samples
+
+def train(filenames, dict_size=DICTIONARY_SIZE):
+    import zstandard
+    samples = []
+    for filename in filenames:
+        samples += [x for x in read_capture(filename) if len(x)<=MAX_SAMPLE_SIZE]
+    if not samples:
+        raise Exception("no packets found in %s" % (filenames, ))
+    return zstandard.train_dictionary(dict_size, samples), len(samples)
+
+
+def main(argv):
+    if len(argv)<3:
+        print("usage: %s OUTPUT CAPTURE [CAPTURE..]" % argv[0])
+        return 1
+    output = argv[1]
+    d, count = train(argv[2:])
+    with open(output, "wb") as f:
+        f.write(d.as_bytes())
+    print("trained dictionary %#x from %i packets, saved to '%s'" % (d.dict_id(), count, output))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -20,9 +20,9 @@ except:
     import thread                       #@Reimport @UnusedImport
 
 try:
-    from queue import Queue             #@UnresolvedImport @UnusedImport (python3)
+    from queue import Queue, PriorityQueue, Empty   #@UnresolvedImport @UnusedImport (python3)
 except ImportError:
-    from Queue import Queue             #@Reimport @UnusedImport
+    from Queue import Queue, PriorityQueue, Empty   #@Reimport @UnusedImport
 
 try:
     import builtins                     #@UnresolvedImport @UnusedImport (python3)
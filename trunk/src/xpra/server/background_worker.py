@@ -1,70 +1,208 @@
 # -*- coding: utf-8 -*-
 # This file is part of Xpra.
-# Copyright (C) 2013, 2014 Antoine Martin <antoine@xpra.org>
+# Copyright (C) 2013-2018 Antoine Martin <antoine@xpra.org>
 # Xpra is released under the terms of the GNU GPL v2, or, at your option, any
 # later version. See the file COPYING for details.
 
 
-from threading import Thread, Lock
-from xpra.os_util import Queue
+from threading import Lock
+from collections import deque
+
+from xpra.util import envint
+from xpra.os_util import PriorityQueue, monotonic_time
+from xpra.simple_stats import get_list_stats
+from xpra.make_thread import start_thread
 
 from xpra.log import Logger
 log = Logger("util")
 debug = log.debug
 
+WORKER_THREADS = max(1, envint("XPRA_WORKER_THREADS", 2))
+QUEUE_WARN = envint("XPRA_WORKER_QUEUE_WARN", 10)
+#warn when a single item takes longer than this (in milliseconds):
+SLOW_ITEM = envint("XPRA_WORKER_SLOW_ITEM", 1000)
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+PRIORITY_LOW = 20
+#the end of queue markers must come after everything else:
+PRIORITY_EXIT = 1000
+#unless we are not waiting for the items to complete:
+PRIORITY_FORCE_EXIT = -1
+
+#upper bounds of the queue latency histogram, in milliseconds:
+LATENCY_BUCKETS = (1, 10, 100, 1000, 10000)
+NRECS = 100
+
+
+def get_item_name(item):
+    return getattr(item, "__name__", None) or repr(item)
 
-class Worker_Thread(Thread):
+
+class Worker(object):
     """
-        A background thread which calls the functions we post to it.
-        The functions are placed in a queue and only called once,
-        when this thread gets around to it.
+        A small pool of background threads which call the functions we post to them.
+        The functions are placed in a priority queue and only called once,
+        when one of the threads gets around to it.
+        Items which are not marked as 'parallel' are called one at a time,
+        in the order they were added, like they would be with a single worker thread.
+        Items marked as 'parallel' can run at the same time as any other item.
     """
 
-    def __init__(self):
-        Thread.__init__(self, name="Worker_Thread")
-        self.items = Queue()
+    def __init__(self, size=WORKER_THREADS):
+        assert size>0
+        self.size = size
+        self.items = PriorityQueue()
+        self.lock = Lock()
+        self.counter = 0
+        self.serial = deque()       #the non-parallel items waiting for their turn
+        self.serial_scheduled = False
+        self.threads = []
         self.exit = False
-        self.setDaemon(True)
+        self.busy = 0
+        self.processed = 0
+        self.latency = deque(maxlen=NRECS)
+        self.run_time = deque(maxlen=NRECS)
+        self.histogram = [0]*(len(LATENCY_BUCKETS)+1)
+        self.slowest = (0, "")
 
     def __repr__(self):
-        return "Worker_Thread(items=%s, exit=%s)" % (self.items.qsize(), self.exit)
+        return "Worker(threads=%i, items=%s, exit=%s)" % (self.size, self.items.qsize(), self.exit)
+
+    def start(self):
+        for i in range(self.size):
+            self.threads.append(start_thread(self.run, "worker-%i" % i, daemon=True))
+
+    def qsize(self):
+        return self.items.qsize()+len(self.serial)
 
     def stop(self, force=False):
         if self.exit:
             return
         if force:
-            if self.items.qsize()>0:
-                log.warn("Worker stop: %s items in the queue will not be run!", self.items.qsize())
-                self.items.put(None)
-                self.items = Queue()
+            if self.qsize()>0:
+                log.warn("Worker stop: %s items in the queue will not be run!", self.qsize())
+                with self.lock:
+                    self.serial = deque()
             self.exit = True
+            #the threads must pick up the exit markers before any of the items left:
+            priority = PRIORITY_FORCE_EXIT
         else:
-            if self.items.qsize()>0:
-                log.info("waiting for %s items in work queue to complete", self.items.qsize())
-        debug("Worker_Thread.stop(%s) %s items in work queue", force, self.items)
-        self.items.put(None)
+            if self.qsize()>0:
+                log.info("waiting for %s items in work queue to complete", self.qsize())
+            priority = PRIORITY_EXIT
+        debug("Worker.stop(%s) %s items in work queue", force, self.qsize())
+        for _ in self.threads:
+            self.put(self.items, priority, None)
 
-    def add(self, item):
-        if self.items.qsize()>10:
-            log.warn("Worker_Thread.items queue size is %s", self.items.qsize())
-        self.items.put(item)
+    def put(self, items, priority, entry):
+        with self.lock:
+            self.counter += 1
+            #the counter keeps the order of items with the same priority:
+            items.put((priority, self.counter, monotonic_time(), entry))
+
+    def add(self, item, priority=PRIORITY_NORMAL, parallel=False):
+        qsize = self.qsize()
+        if qsize>QUEUE_WARN:
+            log.warn("Worker queue size is %s", qsize)
+        if parallel:
+            self.put(self.items, priority, item)
+            return
+        with self.lock:
+            self.serial.append((priority, monotonic_time(), item))
+            if self.serial_scheduled:
+                #the item will be picked up in turn:
+                return
+            self.serial_scheduled = True
+        self.put(self.items, priority, self.run_serial)
+
+    def run_serial(self):
+        with self.lock:
+            if not self.serial:
+                self.serial_scheduled = False
+                return
+            _, queued, item = self.serial.popleft()
+        self.record_latency(int(1000*(monotonic_time()-queued)))
+        self.call(item)
+        with self.lock:
+            if not self.serial:
+                self.serial_scheduled = False
+                return
+            priority = self.serial[0][0]
+        #schedule the next one:
+        self.put(self.items, priority, self.run_serial)
+
+    def call(self, item):
+        start = monotonic_time()
+        try:
+            debug("Worker calling %s (queue size=%s)", item, self.qsize())
+            item()
+        except:
+            log.error("Error in worker thread processing item %s", item, exc_info=True)
+        elapsed = int(1000*(monotonic_time()-start))
+        self.run_time.append(elapsed)
+        if elapsed>self.slowest[0]:
+            self.slowest = (elapsed, get_item_name(item))
+        if elapsed>SLOW_ITEM:
+            log.warn("Warning: worker item %s took %ims", get_item_name(item), elapsed)
+
+    def record_latency(self, latency):
+        self.latency.append(latency)
+        for i, limit in enumerate(LATENCY_BUCKETS):
+            if latency<limit:
+                break
+        else:
+            i = len(LATENCY_BUCKETS)
+        with self.lock:
+            self.histogram[i] += 1
 
     def run(self):
-        debug("Worker_Thread.run() starting")
+        debug("Worker.run() starting")
         while not self.exit:
-            item = self.items.get()
+            _, _, queued, item = self.items.get()
             if item is None:
-                debug("Worker_Thread.run() found end of queue marker")
-                self.exit = True
+                debug("Worker.run() found end of queue marker")
                 break
+            with self.lock:
+                self.busy += 1
             try:
-                debug("Worker_Thread.run() calling %s (queue size=%s)", item, self.items.qsize())
-                item()
-            except:
-                log.error("Error in worker thread processing item %s", item, exc_info=True)
-        debug("Worker_Thread.run() ended (queue size=%s)", self.items.qsize())
+                if item==self.run_serial:
+                    #records its own latency:
+                    item()
+                else:
+                    self.record_latency(int(1000*(monotonic_time()-queued)))
+                    self.call(item)
+            finally:
+                with self.lock:
+                    self.busy -= 1
+                    self.processed += 1
+        debug("Worker.run() ended (queue size=%s)", self.qsize())
 
-#only one worker thread for now:
+    def get_info(self):
+        #the number of items in each latency bucket, by upper bound (in ms):
+        hinfo = {}
+        for i, limit in enumerate(LATENCY_BUCKETS):
+            hinfo["%i" % limit] = self.histogram[i]
+        hinfo["inf"] = self.histogram[-1]
+        slowest_time, slowest_item = self.slowest
+        return {
+            "threads"   : self.size,
+            "busy"      : self.busy,
+            "queue"     : self.qsize(),
+            "processed" : self.processed,
+            "latency"   : {
+                ""          : get_list_stats(self.latency),
+                "histogram" : hinfo,
+                },
+            "run-time"  : get_list_stats(self.run_time),
+            "slowest"   : {
+                "time"      : slowest_time,
+                "item"      : slowest_item,
+                },
+            }
+
+
+#only one worker pool:
 singleton = None
 #locking to ensure multi-threaded code doesn't create more than one
 lock = Lock()
@@ -76,14 +214,18 @@ def get_worker(create=True):
         return singleton
     with lock:
         if not singleton:
-            singleton = Worker_Thread()
+            singleton = Worker()
             singleton.start()
     return singleton
 
-def add_work_item(item):
+def add_work_item(item, priority=PRIORITY_NORMAL, parallel=False):
+    """
+        Runs the item in a background thread.
+        Use 'parallel' for items which do not need to wait for the previous ones to complete.
+    """
     w = get_worker(True)
-    debug("add_work_item(%s) worker=%s", item, w)
-    w.add(item)
+    debug("add_work_item(%s, %s, %s) worker=%s", item, priority, parallel, w)
+    w.add(item, priority, parallel)
 
 def stop_worker(force=False):
     w = get_worker(False)
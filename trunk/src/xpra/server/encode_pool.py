@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+from threading import Lock
+from collections import deque
+
+from xpra.log import Logger
+from xpra.util import envint
+from xpra.os_util import Queue, monotonic_time
+from xpra.make_thread import start_thread
+
+log = Logger("encoding")
+
+#the number of threads used for encoding, shared by all the clients and windows,
+#the default (1) uses a single encode thread per client,
+#use a higher value (ie: half the number of cpus) to encode separate windows in parallel:
+ENCODE_THREADS = envint("XPRA_ENCODE_THREADS", 1)
+
+
+class EncodePool(object):
+    """
+        A bounded pool of threads which run the encoding work items.
+        Each item is queued with a key: (owner, wid), where the owner is usually the client.
+        Items with the same key are always called one at a time and in order,
+        so the packets of a window are generated in sequence,
+        but the work queued for different windows can run in parallel.
+        Keys take turns, one item at a time, so a busy window does not starve the others.
+        Items queued with a window id of 0 (not for a specific window, ie: clipboard)
+        act as a barrier for their owner: they run once all the items queued before them
+        have completed, and the items queued after them wait for them,
+        just like they would with a single encode thread.
+    """
+
+    def __init__(self, size=ENCODE_THREADS):
+        assert size>0
+        self.size = size
+        self.lock = Lock()
+        #owner -> deque of segments, only the first segment of each owner is active,
+        #each segment is a dictionary of wid -> deque of items not processed yet,
+        #barrier segments only contain wid 0:
+        self.owners = {}
+        self.running = set()        #keys being processed
+        self.ready = Queue()        #keys of active segments which have items and no thread processing them
+        self.threads = []
+        self.exit = False
+        self.start_time = monotonic_time()
+        self.busy = 0
+        self.busy_time = 0
+        self.items = 0
+
+    def __repr__(self):
+        return "EncodePool(%i threads)" % self.size
+
+    def start(self):
+        for i in range(self.size):
+            self.threads.append(start_thread(self.run, "encode-%i" % i, daemon=True))
+
+    def stop(self):
+        self.exit = True
+        for _ in self.threads:
+            self.ready.put(None)
+
+    def add(self, key, fn, *args):
+        owner, wid = key
+        item = (fn, args)
+        with self.lock:
+            segments = self.owners.setdefault(owner, deque())
+            barrier = wid==0
+            if segments and (0 in segments[-1])==barrier:
+                segment = segments[-1]
+            else:
+                segment = {}
+                segments.append(segment)
+            q = segment.get(wid)
+            if q is not None:
+                #this key is already scheduled or being processed,
+                #or its segment is not active yet,
+                #either way the item will be picked up in turn:
+                q.append(item)
+                return
+            segment[wid] = deque([item])
+            if segment is not segments[0]:
+                #this key will be scheduled when the previous segments have completed
+                return
+        self.ready.put(key)
+
+    def qsize(self, owner=None):
+        """ the number of items waiting, for all owners or just the given owner """
+        with self.lock:
+            n = 0
+            for o, segments in self.owners.items():
+                if owner is None or o==owner:
+                    n += sum(len(q) for segment in segments for q in segment.values())
+            return n-len([k for k in self.running if owner is None or k[0]==owner])
+
+    def run(self):
+        log("EncodePool.run() starting")
+        while not self.exit:
+            key = self.ready.get()
+            if key is None:
+                break
+            owner, wid = key
+            with self.lock:
+                segments = self.owners[owner]
+                segment = segments[0]
+                q = segment[wid]
+                fn, args = q[0]
+                self.running.add(key)
+                self.busy += 1
+            start = monotonic_time()
+            try:
+                fn(*args)
+            except Exception:
+                log.error("Error in encode thread processing %s", fn, exc_info=True)
+            end = monotonic_time()
+            with self.lock:
+                self.running.discard(key)
+                self.busy -= 1
+                self.busy_time += end-start
+                self.items += 1
+                q.popleft()
+                if q:
+                    #more items for this key, give the other keys a turn first:
+                    self.ready.put(key)
+                    continue
+                del segment[wid]
+                if segment:
+                    continue
+                #this segment is complete, activate the next one:
+                segments.popleft()
+                if not segments:
+                    del self.owners[owner]
+                    continue
+                for k in segments[0].keys():
+                    self.ready.put((owner, k))
+        log("EncodePool.run() ended")
+
+    def get_info(self, owner=None):
+        elapsed = max(0.001, monotonic_time()-self.start_time)
+        info = {
+            "threads"       : self.size,
+            "busy"          : self.busy,
+            "items"         : self.items,
+            "utilization"   : int(100*self.busy_time/elapsed/self.size),
+            }
+        if owner is not None:
+            with self.lock:
+                queue = {}
+                for segment in self.owners.get(owner, ()):
+                    for wid, q in segment.items():
+                        queue[wid] = queue.get(wid, 0)+len(q)-int((owner, wid) in self.running)
+                info["queue"] = queue
+        return info
+
+
+pool = None
+lock = Lock()
+
+def get_encode_pool(create=True):
+    global pool
+    if pool is not None or not create:
+        return pool
+    with lock:
+        if not pool:
+            pool = EncodePool()
+            pool.start()
+    return pool
+
+def stop_encode_pool():
+    p = get_encode_pool(False)
+    log("stop_encode_pool() pool=%s", p)
+    if p:
+        p.stop()
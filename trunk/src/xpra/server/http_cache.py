@@ -0,0 +1,226 @@
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+"""
+The html5 client is made of static files which every browser downloads when it connects.
+The StaticFileCache keeps these files in memory, already compressed,
+so that reconnecting clients don't cost us any disk access or compression.
+Entries are validated against the file's mtime and size on every request.
+"""
+
+import os
+import zlib
+from threading import Lock
+from collections import OrderedDict
+
+from xpra.log import Logger
+from xpra.util import envint, envbool
+from xpra.os_util import monotonic_time
+
+log = Logger("network", "http")
+
+HTTP_CACHE = envbool("XPRA_HTTP_CACHE", True)
+#maximum amount of memory used by the cache, in MB:
+HTTP_CACHE_SIZE = envint("XPRA_HTTP_CACHE_SIZE", 64)*1024*1024
+HTTP_ACCEPT_ENCODING = os.environ.get("XPRA_HTTP_ACCEPT_ENCODING", "br,gzip").split(",")
+HTTP_GZIP_LEVEL = max(1, min(9, envint("XPRA_HTTP_GZIP_LEVEL", 9)))
+#don't bother compressing small files or formats which are already compressed:
+GZIP_MIN_SIZE = 128
+#the file extension used by setup_html5.py for each encoding:
+ENCODING_EXTENSIONS = {"gzip" : "gz"}
+GZIP_SKIP_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".ico", ".woff", ".woff2", ".gz", ".br")
+
+
+def read_file(path):
+    #always read in binary mode,
+    #text mode may translate newlines and change the content length:
+    with open(path, "rb") as f:
+        return f.read()
+
+def load_precompressed(path, enc):
+    """ returns the contents of a pre-compressed file, ie: "/path/to/index.html.br" """
+    compressed_path = "%s.%s" % (path, ENCODING_EXTENSIONS.get(enc, enc))
+    if not os.path.exists(compressed_path):
+        return None
+    if not os.path.isfile(compressed_path):
+        log.warn("Warning: '%s' is not a file!", compressed_path)
+        return None
+    if not os.access(compressed_path, os.R_OK):
+        log.warn("Warning: '%s' is not readable", compressed_path)
+        return None
+    content = read_file(compressed_path)
+    if not content:
+        log.warn("Warning: '%s' is empty", compressed_path)
+        return None
+    log("loaded pre-compressed file '%s'", compressed_path)
+    return content
+
+def gzip_compress(path, content):
+    _, ext = os.path.splitext(path)
+    if len(content)<=GZIP_MIN_SIZE or ext.lower() in GZIP_SKIP_EXTENSIONS:
+        return None
+    gzip = zlib.compressobj(HTTP_GZIP_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    compressed = gzip.compress(content) + gzip.flush()
+    if len(compressed)>=len(content):
+        return None
+    log("gzip compressed '%s': %i down to %i bytes", path, len(content), len(compressed))
+    return compressed
+
+
+class StaticFile(object):
+    """
+        The contents of a file and the encoded versions we have loaded so far,
+        None is used for the encodings which are not available for this file.
+    """
+
+    def __init__(self, path, mtime, size):
+        self.path = path
+        self.mtime = mtime
+        self.size = size
+        self.etag = "%x-%x" % (int(mtime*1000*1000), size)
+        self.data = {}
+        #the size accounted for by the cache:
+        self.cached_size = 0
+
+    def __repr__(self):
+        return "StaticFile(%s)" % self.path
+
+    def get_etag(self, enc=""):
+        #each encoding is a different representation of the file:
+        if enc:
+            return '"%s-%s"' % (self.etag, enc)
+        return '"%s"' % self.etag
+
+    def get_size(self):
+        return sum(len(v) for v in self.data.values() if v)
+
+    def get_data(self, enc=""):
+        """ loads the data for the given encoding on demand """
+        if enc in self.data:
+            return self.data[enc]
+        if enc=="":
+            content = read_file(self.path)
+            if len(content)!=self.size:
+                raise IOError("expected %s to contain %i bytes but read %i bytes" % (self.path, self.size, len(content)))
+        else:
+            content = load_precompressed(self.path, enc)
+            if not content and enc=="gzip":
+                content = gzip_compress(self.path, self.get_data())
+        self.data[enc] = content
+        return content
+
+
+def load_static_file(path, encodings=(), st=None, sf=None):
+    if not sf:
+        st = st or os.stat(path)
+        sf = StaticFile(path, st.st_mtime, st.st_size)
+    for enc in encodings:
+        sf.get_data(enc)
+    return sf
+
+
+class StaticFileCache(object):
+
+    def __init__(self, max_size=HTTP_CACHE_SIZE):
+        self.max_size = max_size
+        self.lock = Lock()
+        self.files = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return "StaticFileCache(%i files, %iKB)" % (len(self.files), self.size//1024)
+
+    def get_file(self, path, encodings=()):
+        """
+            Returns the StaticFile for this path,
+            with the data loaded for the encodings given.
+            Raises IOError if the file cannot be read.
+        """
+        st = os.stat(path)
+        with self.lock:
+            sf = self.files.get(path)
+            if sf and sf.mtime==st.st_mtime and sf.size==st.st_size:
+                #most recently used goes last:
+                self.files.pop(path)
+                self.files[path] = sf
+                if all(enc in sf.data for enc in encodings):
+                    self.hits += 1
+                    return sf
+            else:
+                sf = None
+        self.misses += 1
+        #load the data outside the lock,
+        #another thread may be doing the same thing, which is harmless:
+        sf = load_static_file(path, encodings, st, sf)
+        self.add(sf)
+        return sf
+
+    def add(self, sf):
+        size = sf.get_size()
+        with self.lock:
+            old = self.files.pop(sf.path, None)
+            if old:
+                self.size -= old.cached_size
+            if size>self.max_size//8:
+                log("'%s' is too big to be cached: %iKB", sf.path, size//1024)
+                return
+            sf.cached_size = size
+            self.files[sf.path] = sf
+            self.size += size
+            while self.size>self.max_size and self.files:
+                _, evicted = self.files.popitem(last=False)
+                self.size -= evicted.cached_size
+                log("evicted %s from the cache", evicted)
+
+    def preload(self, root, encodings=HTTP_ACCEPT_ENCODING):
+        """ loads all the files found in the root directory, with all the encodings """
+        start = monotonic_time()
+        count = 0
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                if os.path.splitext(filename)[1] in (".gz", ".br"):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    self.get_file(path, [""]+list(encodings))
+                    count += 1
+                except (IOError, OSError) as e:
+                    log("preload(%s) failed to load '%s': %s", root, path, e)
+        log("preload(%s) %i files loaded in %ims, %s", root, count, (monotonic_time()-start)*1000, self)
+
+    def get_info(self):
+        return {
+            "files" : len(self.files),
+            "size"  : self.size,
+            "limit" : self.max_size,
+            "hits"  : self.hits,
+            "misses": self.misses,
+            }
+
+
+cache = None
+lock = Lock()
+
+def get_static_file_cache(create=True):
+    global cache
+    if cache is not None or not create or not HTTP_CACHE:
+        return cache
+    with lock:
+        if not cache:
+            cache = StaticFileCache()
+    return cache
+
+def get_static_file(path, encodings=()):
+    c = get_static_file_cache()
+    if c:
+        return c.get_file(path, encodings)
+    return load_static_file(path, encodings)
+
+def preload_static_files(root):
+    c = get_static_file_cache()
+    if c:
+        c.preload(root)
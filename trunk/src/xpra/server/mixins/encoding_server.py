@@ -119,6 +119,10 @@ class EncodingServer(StubServerMixin):
                 add_encodings(["webp"])
                 if "webp" not in self.lossless_mode_encodings:
                     self.lossless_mode_encodings.append("webp")
+        #exact palette encoder, sent as "png/P":
+        enc_palette = get_codec("enc_palette")
+        if enc_palette:
+            add_encodings(enc_palette.get_encodings())
         #look for video encodings with lossless mode:
         for e in ve:
             for colorspace,especs in getVideoHelper().get_encoder_specs(e).items():
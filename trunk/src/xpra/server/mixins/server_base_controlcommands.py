@@ -11,7 +11,6 @@ log = Logger("command")
 
 from xpra.util import parse_scaling_value, from0to100
 from xpra.server.control_command import ArgsControlCommand, ControlError
-from xpra.os_util import load_binary_file
 from xpra.util import csv
 from xpra.scripts.config import parse_bool, FALSE_OPTIONS, TRUE_OPTIONS
 from xpra.server.mixins.stub_server_mixin import StubServerMixin
@@ -264,9 +263,8 @@ class ServerBaseControlCommands(StubServerMixin):
             log("os.stat(%s)", actual_filename, exc_info=True)
         if not os.path.exists(actual_filename):
             raise ControlError("file '%s' does not exist" % filename)
-        data = load_binary_file(actual_filename)
         #verify size:
-        file_size = len(data)
+        file_size = os.path.getsize(actual_filename)
         file_size_MB = file_size//1024//1024
         if file_size_MB>self.file_transfer.file_size_limit:
             raise ControlError("file '%s' is too large: %iMB (limit is %iMB)" % (filename, file_size_MB, self.file_transfer.file_size_limit))
@@ -280,7 +278,8 @@ class ServerBaseControlCommands(StubServerMixin):
                 log.warn("Warning: cannot %s '%s'", command_type, filename)
                 log.warn(" client %s file size limit is %iMB (file is %iMB)", ss, ss.file_size_limit, file_size_MB)
             else:
-                ss.send_file(filename, "", data, file_size, *send_file_args)
+                #the file contents will be read from disk as they are sent:
+                ss.send_file(actual_filename, "", None, file_size, *send_file_args)
         return "%s of '%s' to %s initiated" % (command_type, filename, client_uuids)
 
 
@@ -266,6 +266,12 @@ class WindowServer(StubServerMixin):
             log("invalid window specified for refresh: %s", wid)
             return
         log("process_buffer_refresh for windows: %s options=%s, client_properties=%s", wid_windows, options, client_properties)
+        if options.boolget("tile-cache-reset"):
+            #the client has discarded the backing that held its tile cache:
+            ss = self._server_sources.get(proto)
+            if ss:
+                for wid in wid_windows.keys():
+                    ss.clear_tile_cache(wid)
         batch_props = options.dictget("batch", {})
         if batch_props or client_properties:
             #change batch config and/or client properties
@@ -9,17 +9,30 @@ log = Logger("window", "encoding")
 
 from xpra.net import compression
 from xpra.codecs.loader import get_codec
-from xpra.util import envbool, first_time
+from xpra.util import envbool, first_time, roundup
 from xpra.codecs.rgb_transform import rgb_reformat
-from xpra.os_util import memoryview_to_bytes, strtobytes, monotonic_time
+from xpra.os_util import memoryview_to_bytes, strtobytes, monotonic_time, PYTHON3
 #"pixels_to_bytes" gets patched up by the OSX shadow server
 pixels_to_bytes = memoryview_to_bytes
 try:
-    from xpra.net.mmap_pipe import mmap_write
+    from xpra.net.mmap_pipe import mmap_write, mmap_write_rows
 except:
-    mmap_write = None               #no mmap
+    mmap_write = mmap_write_rows = None     #no mmap
 
 WEBP_PILLOW = envbool("XPRA_WEBP_PILLOW", False)
+#copy the pixels straight from the captured image into the mmap area:
+MMAP_DIRECT = envbool("XPRA_MMAP_DIRECT", PYTHON3)
+MMAP_DIRECT_BPP = {
+    "RGB"   : 3,
+    "BGR"   : 3,
+    "BGRX"  : 4,
+    "BGRA"  : 4,
+    "RGBX"  : 4,
+    "RGBA"  : 4,
+    "XRGB"  : 4,
+    "ARGB"  : 4,
+    "r210"  : 4,
+    }
 
 
 def webp_encode(image, supports_transparency, quality, speed, content_type):
@@ -135,10 +148,22 @@ def mmap_send(mmap, mmap_size, image, rgb_formats, supports_transparency):
     start = monotonic_time()
     data = image.get_pixels()
     assert data, "failed to get pixels from %s" % image
-    mmap_data, mmap_free_size = mmap_write(mmap, mmap_size, data)
+    rowstride = image.get_rowstride()
+    row_length = image.get_width()*MMAP_DIRECT_BPP.get(image.get_pixel_format(), 0)
+    if MMAP_DIRECT and mmap_write_rows and 0<row_length<=rowstride:
+        #no need to restride or copy the image first,
+        #the rows are copied once, straight into the client's mmap area:
+        height = image.get_height()
+        newstride = roundup(row_length, 4)
+        mmap_data, mmap_free_size = mmap_write_rows(mmap, mmap_size, data, rowstride, row_length, height, newstride)
+        rowstride = newstride
+        size = newstride*height
+    else:
+        mmap_data, mmap_free_size = mmap_write(mmap, mmap_size, data)
+        size = len(data)
     elapsed = monotonic_time()-start+0.000000001 #make sure never zero!
-    log("%s MBytes/s - %s bytes written to mmap in %.1f ms", int(len(data)/elapsed/1024/1024), len(data), 1000*elapsed)
+    log("%s MBytes/s - %s bytes written to mmap in %.1f ms", int(size/elapsed/1024/1024), size, 1000*elapsed)
     if mmap_data is None:
         return None
     #replace pixels with mmap info:
-    return mmap_data, mmap_free_size, len(data)
+    return mmap_data, mmap_free_size, size, rowstride
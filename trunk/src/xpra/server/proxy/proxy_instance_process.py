@@ -20,7 +20,8 @@ from xpra.scripts.server import deadly_signal
 from xpra.net import compression
 from xpra.net.net_util import get_network_caps
 from xpra.net.compression import Compressed, compressed_wrapper
-from xpra.net.protocol import Protocol
+from xpra.net.protocol import Protocol, RawPacket
+from xpra.net.packet_encoding import get_packet_encoding_type
 from xpra.codecs.loader import load_codecs, get_codec
 from xpra.codecs.image_wrapper import ImageWrapper
 from xpra.codecs.video_helper import getVideoHelper, PREFERRED_ENCODER_ORDER
@@ -49,6 +50,28 @@ PASSTHROUGH = envbool("XPRA_PROXY_PASSTHROUGH", False)
 MAX_CONCURRENT_CONNECTIONS = 20
 VIDEO_TIMEOUT = 5                  #destroy video encoder after N seconds of idle state
 LEGACY_SALT_DIGEST = envbool("XPRA_LEGACY_SALT_DIGEST", True)
+#pass on the server packets we don't need to modify without decoding and re-encoding them:
+FORWARD = envbool("XPRA_PROXY_FORWARD", True)
+#the server packets we always decode:
+PARSE_SERVER_PACKETS = (b"hello", b"challenge", b"info-response", b"lost-window", b"disconnect")
+
+
+video_helper_modules = None
+def init_video_helper(video_encoder_modules):
+    """
+        Loads the codecs and initializes the video helper,
+        this is only done once per process so the proxy pool workers
+        can do it before they fork the proxy instances.
+    """
+    global video_helper_modules
+    load_codecs(decoders=False)
+    video_helper = getVideoHelper()
+    if video_helper_modules is None:
+        #only use video encoders (no CSC supported in proxy)
+        video_helper.set_modules(video_encoders=video_encoder_modules)
+        video_helper.init()
+        video_helper_modules = video_encoder_modules
+    return video_helper
 
 
 def set_blocking(conn):
@@ -99,6 +122,9 @@ class ProxyInstanceProcess(Process):
         self.video_encoder_types = None
         self.video_helper = None
         self.lost_windows = None
+        self.parse_server_packets = PARSE_SERVER_PACKETS
+        self.forwarded_packets = 0
+        self.forwarded_bytes = 0
         #for handling the local unix domain socket:
         self.control_socket_cleanup = None
         self.control_socket = None
@@ -260,6 +286,11 @@ class ProxyInstanceProcess(Process):
                 self.client_protocol.large_packets.append(x)
         self.server_protocol.set_compression_level(self.session_options.get("compression_level", 0))
         self.server_protocol.enable_default_encoder()
+        if FORWARD:
+            if self.video_encoding_defs or PASSTHROUGH:
+                #draw packets may need re-encoding:
+                self.parse_server_packets = PARSE_SERVER_PACKETS+(b"draw", )
+            self.server_protocol.forward_filter = self.may_forward_server_packet
 
         self.lost_windows = set()
         self.encode_queue = Queue()
@@ -280,13 +311,8 @@ class ProxyInstanceProcess(Process):
             log("ProxyProcess.run() ending %s", os.getpid())
 
     def video_init(self):
-        enclog("video_init() loading codecs")
-        load_codecs(decoders=False)
         enclog("video_init() will try video encoders: %s", csv(self.video_encoder_modules) or "none")
-        self.video_helper = getVideoHelper()
-        #only use video encoders (no CSC supported in proxy)
-        self.video_helper.set_modules(video_encoders=self.video_encoder_modules)
-        self.video_helper.init()
+        self.video_helper = init_video_helper(self.video_encoder_modules)
 
         self.video_encoding_defs = {}
         self.video_encoders = {}
@@ -448,6 +474,11 @@ class ProxyInstanceProcess(Process):
             "proxy" : {
                 "version"    : XPRA_VERSION,
                 ""           : sinfo,
+                "forwarded"  : {
+                    "enabled"   : self.server_protocol is not None and self.server_protocol.forward_filter is not None,
+                    "packets"   : self.forwarded_packets,
+                    "bytes"     : self.forwarded_bytes,
+                    },
                 },
             "window" : self.get_window_info(),
             }
@@ -643,7 +674,33 @@ class ProxyInstanceProcess(Process):
                 #prevent warnings about large uncompressed data
                 packet[index] = Compressed("raw %s" % name, data, can_inline=True)
 
+    def may_forward_server_packet(self, packet_type, protocol_flags, compression_levels):
+        """
+            Called from the server protocol's parse thread:
+            packets can be forwarded without being decoded
+            if we don't need to look at them and if the client can decode
+            all of their chunks as they are.
+        """
+        if packet_type in self.parse_server_packets:
+            return False
+        encoder = get_packet_encoding_type(protocol_flags)
+        if not self.caps.boolget(encoder, encoder=="bencode"):
+            return False
+        for level in compression_levels:
+            if level>0:
+                compressor = compression.get_compression_type(level)
+                #zstd may be using a dictionary the client does not have:
+                if compressor=="zstd" or not self.caps.boolget(compressor, compressor=="zlib"):
+                    return False
+        return True
+
     def process_server_packet(self, proto, packet):
+        if isinstance(packet, RawPacket):
+            log("process_server_packet: forwarding %s", packet)
+            self.forwarded_packets += 1
+            self.forwarded_bytes += sum(len(chunk[3]) for chunk in packet.chunks)
+            self.queue_client_packet(packet)
+            return
         packet_type = packet[0]
         log("process_server_packet: %s", packet_type)
         if packet_type==Protocol.CONNECTION_LOST:
@@ -0,0 +1,440 @@
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+"""
+A pool of pre-forked proxy worker processes.
+
+Starting a new ProxyInstanceProcess for each client connection
+means forking the proxy server and loading the codecs every time.
+Pool workers are forked ahead of time and load the codecs once,
+they receive the client and server sockets via file descriptor passing
+and fork a session process from this pre-initialized state.
+Each worker is replaced after it has started 'max_sessions' sessions,
+so that they don't accumulate state over time.
+Only plain socket connections can be passed this way,
+the proxy server falls back to forking a new process for everything else.
+"""
+
+import os
+import socket
+import signal
+from threading import Event, Lock
+from multiprocessing import Process, Pipe, Queue as MQueue #@UnresolvedImport
+
+from xpra.log import Logger
+from xpra.util import envint, AtomicInteger
+from xpra.os_util import POSIX
+from xpra.net.bytestreams import SocketConnection
+from xpra.make_thread import start_thread
+
+log = Logger("proxy")
+
+
+PROXY_POOL_SIZE = envint("XPRA_PROXY_POOL_SIZE", 2*int(POSIX))
+#recycle the worker after this many sessions:
+PROXY_POOL_MAX_SESSIONS = envint("XPRA_PROXY_POOL_MAX_SESSIONS", 50)
+#how often the workers check for terminated sessions (in milliseconds):
+PROXY_POOL_REAP_DELAY = envint("XPRA_PROXY_POOL_REAP_DELAY", 1000)
+
+SOCKET_TYPE_FLAGS = getattr(socket, "SOCK_NONBLOCK", 0) | getattr(socket, "SOCK_CLOEXEC", 0)
+
+
+def get_connection_state(conn):
+    """
+        Returns the attributes we need to re-create this connection
+        in another process from its file descriptor,
+        or None if this type of connection cannot be passed on that way.
+    """
+    if type(conn)!=SocketConnection:
+        #ssl, websockets, ssh, etc: the state is not in the socket
+        return None
+    s = conn._socket
+    if type(s)!=socket.socket:
+        return None
+    return {
+        "family"            : int(s.family),
+        "type"              : int(s.type) & ~SOCKET_TYPE_FLAGS,
+        "proto"             : s.proto,
+        "local"             : conn.local,
+        "remote"            : conn.remote,
+        "endpoint"          : conn.endpoint,
+        "socktype"          : conn.socktype,
+        "socktype-wrapped"  : conn.socktype_wrapped,
+        "info"              : conn.info,
+        "filename"          : conn.filename,
+        "input-bytecount"   : conn.input_bytecount,
+        "input-readcount"   : conn.input_readcount,
+        "output-bytecount"  : conn.output_bytecount,
+        "output-writecount" : conn.output_writecount,
+        }
+
+def make_socket_connection(state, fd):
+    """ re-creates a connection from the state returned by get_connection_state """
+    try:
+        sock = socket.fromfd(fd, state["family"], state["type"], state["proto"])
+    finally:
+        #fromfd duplicates the file descriptor:
+        os.close(fd)
+    conn = SocketConnection(sock, state["local"], state["remote"], state["endpoint"], state["socktype"], state["info"])
+    conn.socktype_wrapped = state["socktype-wrapped"]
+    conn.filename = state["filename"]
+    conn.input_bytecount = state["input-bytecount"]
+    conn.input_readcount = state["input-readcount"]
+    conn.output_bytecount = state["output-bytecount"]
+    conn.output_writecount = state["output-writecount"]
+    return conn
+
+
+class ProxyPoolWorker(Process):
+    """
+        The worker process: loads the codecs,
+        then forks a ProxyInstanceProcess for each session it is given.
+    """
+
+    def __init__(self, index, conn, video_encoder_modules, max_sessions):
+        Process.__init__(self, name="proxy-pool-worker-%i" % index)
+        self.conn = conn
+        self.video_encoder_modules = video_encoder_modules
+        self.max_sessions = max_sessions
+        self.sessions = {}          #pid -> message queue
+        self.started = 0
+        self.exit = False
+
+    def run(self):
+        #the proxy server's SIGCHLD handler would reap our sessions:
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        #the proxy server tells us when to exit:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        from xpra.server.proxy.proxy_instance_process import init_video_helper
+        init_video_helper(self.video_encoder_modules)
+        log("proxy pool worker %s ready", os.getpid())
+        self.send("ready")
+        while not self.exit or self.sessions:
+            try:
+                if self.conn.poll(PROXY_POOL_REAP_DELAY/1000.0):
+                    self.process_message(self.conn.recv())
+            except (EOFError, IOError, OSError):
+                log("proxy pool worker %s: connection to the proxy server lost", os.getpid())
+                self.exit = True
+            self.reap()
+            if not self.exit and self.started>=self.max_sessions:
+                log("proxy pool worker %s retiring after %i sessions", os.getpid(), self.started)
+                self.send("retired")
+                self.exit = True
+        log("proxy pool worker %s exiting", os.getpid())
+
+    def send(self, *message):
+        try:
+            self.conn.send(message)
+        except (EOFError, IOError, OSError):
+            log("failed to send %s", message, exc_info=True)
+
+    def process_message(self, message):
+        log("proxy pool worker %s: %s", os.getpid(), message[0])
+        mtype = message[0]
+        if mtype=="session":
+            self.start_session(*message[1:])
+        elif mtype=="message":
+            pid, msg = message[1:3]
+            mq = self.sessions.get(pid)
+            if mq:
+                mq.put(msg)
+        elif mtype=="exit":
+            self.exit = True
+        else:
+            log.error("Error: unexpected proxy pool message '%s'", mtype)
+
+    def start_session(self, sid, kwargs, client_state, server_state):
+        from multiprocessing.reduction import recv_handle
+        client_fd = recv_handle(self.conn)
+        server_fd = recv_handle(self.conn)
+        try:
+            client_conn = make_socket_connection(client_state, client_fd)
+            server_conn = make_socket_connection(server_state, server_fd)
+        except Exception as e:
+            log("start_session failed to re-create the connections", exc_info=True)
+            self.send("failed", sid, str(e))
+            return
+        message_queue = MQueue()
+        pid = os.fork()
+        if pid==0:
+            #session process:
+            code = 0
+            try:
+                self.conn.close()
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                from xpra.server.proxy.proxy_instance_process import ProxyInstanceProcess
+                process = ProxyInstanceProcess(client_conn=client_conn, server_conn=server_conn,
+                                               message_queue=message_queue, **kwargs)
+                process.run()
+            except Exception:
+                log.error("Error running proxy instance", exc_info=True)
+                code = 1
+            finally:
+                os._exit(code)
+        self.started += 1
+        self.sessions[pid] = message_queue
+        #the session process has its own copy of the sockets,
+        #don't close the connections as this would change the socket flags:
+        client_conn._socket.close()
+        server_conn._socket.close()
+        self.send("started", sid, pid)
+
+    def reap(self):
+        while self.sessions:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except OSError:
+                break
+            if pid==0:
+                break
+            self.sessions.pop(pid, None)
+            self.send("exited", pid)
+
+
+class PoolSession(object):
+    """
+        Represents a session process started by a pool worker,
+        it can be used in place of the ProxyInstanceProcess.
+    """
+
+    def __init__(self, worker, pid):
+        self.worker = worker
+        self.pid = pid
+        self.alive = True
+
+    def __repr__(self):
+        return "PoolSession(%i from %s)" % (self.pid, self.worker)
+
+    def is_alive(self):
+        return self.alive
+
+    def put(self, message):
+        #emulates the message queue of the process:
+        try:
+            self.worker.send("message", self.pid, message)
+        except (IOError, OSError) as e:
+            log("put(%s)", message, exc_info=True)
+            log.warn("Warning: cannot send '%s' to proxy session %i:", message, self.pid)
+            log.warn(" %s", e)
+
+
+class PoolWorker(object):
+    """ the proxy server's handle on a worker process """
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.lock = Lock()
+        self.ready = False
+        self.retired = False
+        self.sessions = {}          #pid -> PoolSession
+        self.pending = {}           #sid -> [Event, result]
+
+    def __repr__(self):
+        return "PoolWorker(%s)" % self.process.pid
+
+    def send(self, *message):
+        with self.lock:
+            self.conn.send(message)
+
+    def get_info(self):
+        return {
+            "pid"       : self.process.pid,
+            "ready"     : self.ready,
+            "retired"   : self.retired,
+            "sessions"  : len(self.sessions),
+            }
+
+
+class ProxyPool(object):
+
+    def __init__(self, video_encoder_modules, size=PROXY_POOL_SIZE, max_sessions=PROXY_POOL_MAX_SESSIONS, exited_cb=None):
+        self.video_encoder_modules = video_encoder_modules
+        self.size = size
+        self.max_sessions = max_sessions
+        self.exited_cb = exited_cb
+        self.workers = []
+        self.lock = Lock()
+        self.counter = AtomicInteger()
+        self.worker_counter = AtomicInteger()
+        self.sessions = 0
+        self.fallbacks = 0
+        self.recycled = 0
+        self.closed = False
+
+    def __repr__(self):
+        return "ProxyPool(%i)" % self.size
+
+    def start(self):
+        for _ in range(self.size):
+            self.add_worker()
+
+    def add_worker(self):
+        parent_conn, child_conn = Pipe()
+        index = self.worker_counter.increase()
+        process = ProxyPoolWorker(index, child_conn, self.video_encoder_modules, self.max_sessions)
+        process.start()
+        child_conn.close()
+        worker = PoolWorker(process, parent_conn)
+        with self.lock:
+            self.workers.append(worker)
+        start_thread(self.worker_loop, "proxy-pool-worker-%i" % index, daemon=True, args=(worker,))
+        log("add_worker() %s", worker)
+        return worker
+
+    def worker_loop(self, worker):
+        try:
+            while True:
+                try:
+                    message = worker.conn.recv()
+                except (EOFError, IOError, OSError):
+                    log("worker_loop(%s) connection closed", worker)
+                    break
+                self.process_worker_message(worker, message)
+        finally:
+            self.worker_ended(worker)
+
+    def process_worker_message(self, worker, message):
+        log("process_worker_message(%s, %s)", worker, message)
+        mtype = message[0]
+        if mtype=="ready":
+            worker.ready = True
+        elif mtype in ("started", "failed"):
+            sid, result = message[1:3]
+            pending = worker.pending.get(sid)
+            if pending:
+                if mtype=="started":
+                    session = PoolSession(worker, result)
+                    worker.sessions[result] = session
+                    pending[1] = session
+                else:
+                    log.warn("Warning: proxy pool worker failed to start the session:")
+                    log.warn(" %s", result)
+                pending[0].set()
+        elif mtype=="exited":
+            session = worker.sessions.pop(message[1], None)
+            if session:
+                self.session_exited(session)
+        elif mtype=="retired":
+            self.retire(worker)
+        else:
+            log.error("Error: unexpected message from proxy pool worker: %s", mtype)
+
+    def session_exited(self, session):
+        log("session_exited(%s)", session)
+        session.alive = False
+        cb = self.exited_cb
+        if cb:
+            cb(session)
+
+    def retire(self, worker):
+        with self.lock:
+            if worker.retired:
+                return
+            worker.retired = True
+            if self.closed:
+                return
+            self.recycled += 1
+        self.add_worker()
+
+    def worker_ended(self, worker):
+        log("worker_ended(%s)", worker)
+        #sessions from this worker can no longer be tracked:
+        for session in tuple(worker.sessions.values()):
+            self.session_exited(session)
+        worker.sessions = {}
+        for pending in tuple(worker.pending.values()):
+            pending[0].set()
+        self.retire(worker)
+        with self.lock:
+            if worker in self.workers:
+                self.workers.remove(worker)
+        try:
+            worker.conn.close()
+        except (IOError, OSError):
+            pass
+        worker.process.join(1)
+
+    def get_worker(self):
+        with self.lock:
+            workers = [w for w in self.workers if w.ready and not w.retired]
+        if not workers:
+            return None
+        #spread the sessions:
+        return min(workers, key=lambda w : len(w.sessions))
+
+    def start_session(self, kwargs, client_conn, server_conn):
+        """
+            Hands over the connections to a pool worker,
+            returns a PoolSession if that succeeded,
+            or None if the caller must start the ProxyInstanceProcess itself.
+        """
+        client_state = get_connection_state(client_conn)
+        server_state = get_connection_state(server_conn)
+        cstate = kwargs.get("client_state") or {}
+        worker = self.get_worker()
+        log("start_session(..) client state=%s, server state=%s, worker=%s", client_state, server_state, worker)
+        if not client_state or not server_state or cstate.get("cipher_in") or cstate.get("cipher_out") or not worker:
+            #cipher objects cannot be passed on to another process
+            self.fallbacks += 1
+            return None
+        from multiprocessing.reduction import send_handle
+        sid = self.counter.increase()
+        pending = worker.pending[sid] = [Event(), None]
+        try:
+            with worker.lock:
+                #the message is pickled before anything is sent,
+                #so this fails cleanly if the session arguments cannot be pickled:
+                worker.conn.send(("session", sid, kwargs, client_state, server_state))
+                try:
+                    send_handle(worker.conn, client_conn._socket.fileno(), worker.process.pid)
+                    send_handle(worker.conn, server_conn._socket.fileno(), worker.process.pid)
+                except Exception:
+                    #the worker is now out of sync with us, get rid of it:
+                    worker.process.terminate()
+                    raise
+            #once the worker has the sockets, we must not start another process for them:
+            #wait until it tells us if it started the session or not,
+            #(worker_ended also releases us if the worker dies)
+            pending[0].wait()
+        except Exception as e:
+            log("start_session(..) failed", exc_info=True)
+            log.warn("Warning: failed to hand over the connection to the proxy pool:")
+            log.warn(" %s", e)
+        finally:
+            worker.pending.pop(sid, None)
+        session = pending[1]
+        if session:
+            self.sessions += 1
+        else:
+            self.fallbacks += 1
+        return session
+
+    def cleanup(self):
+        self.closed = True
+        with self.lock:
+            workers = list(self.workers)
+        for worker in workers:
+            try:
+                worker.send("exit")
+            except (IOError, OSError):
+                log("failed to send exit to %s", worker, exc_info=True)
+
+    def get_info(self):
+        with self.lock:
+            workers = list(self.workers)
+        info = {
+            "size"          : self.size,
+            "max-sessions"  : self.max_sessions,
+            "sessions"      : self.sessions,
+            "fallbacks"     : self.fallbacks,
+            "recycled"      : self.recycled,
+            "idle"          : len([w for w in workers if w.ready and not w.retired]),
+            }
+        for i, worker in enumerate(workers):
+            info[i] = worker.get_info()
+        return info
@@ -6,6 +6,7 @@
 
 import os
 import sys
+from collections import deque
 
 from xpra.gtk_common.gobject_compat import import_glib, import_gobject
 glib = import_glib()
@@ -21,8 +22,10 @@ authlog = Logger("proxy", "auth")
 
 
 from xpra.util import LOGIN_TIMEOUT, AUTHENTICATION_ERROR, SESSION_NOT_FOUND, SERVER_ERROR, repr_ellipsized, print_nested_dict, csv, envfloat, envbool, typedict
-from xpra.os_util import get_username_for_uid, get_groups, get_home_for_uid, bytestostr, getuid, getgid, WIN32, POSIX
+from xpra.os_util import get_username_for_uid, get_groups, get_home_for_uid, bytestostr, getuid, getgid, monotonic_time, WIN32, POSIX
 from xpra.server.proxy.proxy_instance_process import ProxyInstanceProcess
+from xpra.server.proxy.proxy_pool import ProxyPool, PROXY_POOL_SIZE
+from xpra.simple_stats import get_list_stats
 from xpra.server.server_core import ServerCore
 from xpra.server.control_command import ArgsControlCommand, ControlError
 from xpra.child_reaper import getChildReaper
@@ -64,6 +67,14 @@ class ProxyServer(ServerCore):
         #the display they're on and the message queue we can
         # use to communicate with them
         self.processes = {}
+        #pre-forked proxy instance workers:
+        self.proxy_pool = None
+        #how long it took to hand over the connections to a proxy instance,
+        #for the pool workers and for new processes:
+        self.setup_latency = {
+            "pool"  : deque(maxlen=100),
+            "fork"  : deque(maxlen=100),
+            }
         #connections used exclusively for requests:
         self._requests = set()
         self.idle_add = glib.idle_add
@@ -115,6 +126,9 @@ class ProxyServer(ServerCore):
         pass
 
     def do_run(self):
+        if PROXY_POOL_SIZE>0:
+            self.proxy_pool = ProxyPool(self.video_encoders, exited_cb=self.pool_session_exited)
+            self.proxy_pool.start()
         self.main_loop = glib.MainLoop()
         self.main_loop.run()
 
@@ -144,8 +158,16 @@ class ProxyServer(ServerCore):
             mq.put("stop")
         log("stop_all_proxies() done")
 
+    def pool_session_exited(self, session):
+        log("pool_session_exited(%s)", session)
+        self.idle_add(self.reap)
+
     def cleanup(self):
         self.stop_all_proxies()
+        pp = self.proxy_pool
+        if pp:
+            self.proxy_pool = None
+            pp.cleanup()
         ServerCore.cleanup(self)
 
     def do_quit(self):
@@ -245,6 +267,7 @@ class ProxyServer(ServerCore):
         self.proxy_session(client_proto, c, auth_caps, sessions)
 
     def proxy_session(self, client_proto, c, auth_caps, sessions):
+        start = monotonic_time()
         def disconnect(reason, *extras):
             log("disconnect(%s, %s)", reason, extras)
             self.send_disconnect(client_proto, reason, *extras)
@@ -386,6 +409,30 @@ class ProxyServer(ServerCore):
                     log.error("Error: some network IO threads have failed to terminate")
                     return
                 client_conn.set_active(True)
+                pp = self.proxy_pool
+                if pp:
+                    kwargs = {
+                        "uid"                   : uid,
+                        "gid"                   : gid,
+                        "env_options"           : env_options,
+                        "session_options"       : session_options,
+                        "socket_dir"            : self._socket_dir,
+                        "video_encoder_modules" : self.video_encoders,
+                        "csc_modules"           : self.csc_modules,
+                        "disp_desc"             : disp_desc,
+                        "client_state"          : client_state,
+                        "cipher"                : cipher,
+                        "encryption_key"        : encryption_key,
+                        "caps"                  : c,
+                        }
+                    session = pp.start_session(kwargs, client_conn, server_conn)
+                    log("proxy pool session=%s", session)
+                    if session:
+                        #the session forwards the messages to the proxy instance:
+                        message_queue = session
+                        self.processes[session] = (display, message_queue)
+                        self.setup_latency["pool"].append(int(1000*(monotonic_time()-start)))
+                        return
                 process = ProxyInstanceProcess(uid, gid, env_options, session_options, self._socket_dir,
                                                self.video_encoders, self.csc_modules,
                                                client_conn, disp_desc, client_state, cipher, encryption_key, server_conn, c, message_queue)
@@ -393,6 +440,7 @@ class ProxyServer(ServerCore):
                 self.processes[process] = (display, message_queue)
                 process.start()
                 log("process started")
+                self.setup_latency["fork"].append(int(1000*(monotonic_time()-start)))
                 popen = process._popen
                 assert popen
                 #when this process dies, run reap to update our list of proxy processes:
@@ -566,4 +614,8 @@ class ProxyServer(ServerCore):
                                    }
                         i += 1
                     info["proxies"] = len(self.processes)
+                    if self.proxy_pool:
+                        info["pool"] = self.proxy_pool.get_info()
+                    #in milliseconds:
+                    info["setup-latency"] = dict((k, get_list_stats(v)) for k,v in self.setup_latency.items() if v)
         return info
@@ -41,6 +41,8 @@ from xpra.platform import set_name
 from xpra.os_util import load_binary_file, get_machine_id, get_user_uuid, platform_name, strtobytes, bytestostr, get_hex_uuid, \
     getuid, monotonic_time, get_peercred, hexstr, SIGNAMES, WIN32, POSIX, PYTHON3, BITS
 from xpra.server.background_worker import stop_worker, get_worker
+from xpra.server.encode_pool import stop_encode_pool
+from xpra.server.window.strip_encode import stop_strip_pool
 from xpra.make_thread import start_thread
 from xpra.util import csv, merge_dicts, typedict, notypedict, flatten_dict, parse_simple_dict, repr_ellipsized, dump_all_frames, nonl, envint, envbool, envfloat, \
         SERVER_SHUTDOWN, SERVER_UPGRADE, LOGIN_TIMEOUT, DONE, PROTOCOL_ERROR, SERVER_ERROR, VERSION_ERROR, CLIENT_REQUEST, SERVER_EXIT
@@ -114,24 +116,26 @@ def get_thread_info(proto=None, protocols=[]):
             }
     w = get_worker(False)
     if w:
-        thread_ident[w.ident] = "worker"
+        for t in w.threads:
+            thread_ident[t.ident] = t.name
+        info["worker"] = w.get_info()
 
     it = info.setdefault("info", {})
     #threads used by the "info" client:
     for i, t in enumerate(info_threads):
-        it[i] = t.getName()
-        thread_ident[t.ident] = t.getName()
+        it[i] = t.name
+        thread_ident[t.ident] = t.name
     for p in protocols:
         try:
             threads = p.get_threads()
             for t in threads:
-                thread_ident[t.ident] = t.getName()
+                thread_ident[t.ident] = t.name
         except:
             pass
     #all non-info threads:
     anit = info.setdefault("thread", {})
     for i, t in enumerate(x for x in threading.enumerate() if x not in info_threads):
-        anit[i] = t.getName()
+        anit[i] = t.name
     #platform specific bits:
     try:
         from xpra.platform.info import get_sys_info
@@ -297,6 +301,8 @@ class ServerCore(object):
         def quit_timer():
             log.debug("quit_timer()")
             stop_worker(True)
+            stop_encode_pool()
+            stop_strip_pool()
             self.quit(upgrading)
         #if from a signal, just force quit:
         stop_worker()
@@ -480,6 +486,9 @@ class ServerCore(object):
             self._html = False
         if self._html:
             httplog.info("serving html content from: %s", self._www_dir)
+            #load the static files in the background, before the first client needs them:
+            from xpra.server.http_cache import preload_static_files
+            start_thread(preload_static_files, "http-cache-preload", daemon=True, args=(self._www_dir,))
         if self._html and self._tcp_proxy:
             httplog.warn("Warning: the built in html server is enabled,")
             httplog.warn(" disabling the tcp-proxy option")
@@ -1153,6 +1162,9 @@ class ServerCore(object):
             def new_websocket_client(wsh):
                 wslog("new_websocket_client(%s) socket=%s", wsh, sock)
                 newsocktype = "ws%s" % ["","s"][int(is_ssl)]
+                if wsh.native:
+                    self.make_websocket_protocol(newsocktype, socktype, sock, conn)
+                    return
                 wsc = WebSocketConnection(sock, conn.local, conn.remote, conn.endpoint, newsocktype, wsh)
                 wsc.socktype_wrapped = socktype
                 # we need this workaround for non-blocking sockets
@@ -1185,6 +1197,28 @@ class ServerCore(object):
         except Exception as ce:
             wslog("error closing connection following error: %s", ce)
 
+    def get_http_cache_info(self):
+        from xpra.server.http_cache import get_static_file_cache
+        cache = get_static_file_cache(False)
+        if not cache:
+            return {}
+        return cache.get_info()
+
+    def make_websocket_protocol(self, socktype, socktype_wrapped, sock, conn):
+        from xpra.net.websocket_protocol import WebSocketProtocol
+        if socktype=="wss":
+            wsc = SSLSocketConnection(sock, conn.local, conn.remote, conn.endpoint, socktype)
+        else:
+            wsc = SocketConnection(sock, conn.local, conn.remote, conn.endpoint, socktype)
+        wsc.protocol_type = "websocket"
+        wsc.socktype_wrapped = socktype_wrapped
+        def websocket_protocol_class(conn):
+            protocol = WebSocketProtocol(self, conn, self.process_packet)
+            protocol.large_packets.append(b"info-response")
+            protocol.receive_aliases.update(self._aliases)
+            return protocol
+        return self.do_make_protocol(socktype, wsc, websocket_protocol_class)
+
     def http_info_request(self, handler):
         import json
         ji = json.dumps(self.get_http_info())
@@ -1387,6 +1421,7 @@ class ServerCore(object):
             #(maybe the client used an encoding it claims not to support?)
             self.disconnect_client(proto, PROTOCOL_ERROR, "failed to negotiate a packet encoder")
             return
+        proto.parse_remote_caps(c)
 
         log("process_hello: capabilities=%s", capabilities)
         if c.boolget("version_request"):
@@ -1817,6 +1852,7 @@ class ServerCore(object):
                        ""                   : self._html,
                        "dir"                : self._www_dir or "",
                        "http-headers-dir"   : self._http_headers_dir or "",
+                       "cache"              : self.get_http_cache_info(),
                        }
                    })
         up("network", ni)
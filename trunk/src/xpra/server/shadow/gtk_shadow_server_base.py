@@ -95,7 +95,10 @@ class GTKShadowServerBase(ShadowServerBase, GTKServerBase):
                 self.recreate_window_models()
                 return False
         for window in self._id_to_window.values():
-            self.refresh_window(window)
+            ww, wh = window.get_dimensions()
+            #the client already has what we captured last time,
+            #so unchanged tiles can be skipped:
+            self.refresh_window_area(window, 0, 0, ww, wh, {"polling" : True})
         return True
 
 
@@ -27,6 +27,7 @@ from xpra.make_thread import start_thread
 from xpra.os_util import Queue, monotonic_time
 from xpra.util import merge_dicts, flatten_dict, notypedict, envbool, envint, typedict, AtomicInteger
 from xpra.server.source.source_stats import GlobalPerformanceStatistics
+from xpra.server.encode_pool import get_encode_pool, ENCODE_THREADS
 
 from xpra.server.source.clientinfo_mixin import ClientInfoMixin
 CC_BASES = [ClientInfoMixin]
@@ -101,6 +102,10 @@ The UI thread calls damage(), which goes into WindowSource and eventually (batch
 adds the damage pixels ready for processing to the encode_work_queue,
 items are picked off by the separate 'encode' thread (see 'encode_loop')
 and added to the damage_packet_queue.
+When XPRA_ENCODE_THREADS is greater than 1, the work is handed to the shared encode pool instead,
+which processes the items of each window in order but encodes separate windows in parallel.
+The work which is not for a specific window (ie: clipboard) still runs in the order it was queued,
+after all the window items queued before it and before any of the window items queued after it.
 """
 
 class ClientConnection(ClientConnectionClass):
@@ -135,6 +140,7 @@ class ClientConnection(ClientConnectionClass):
                                                     #items placed in this queue are picked off by the "encode" thread,
                                                     #the functions should add the packets they generate to the 'packet_queue'
         self.encode_thread = None
+        self.encode_pool = None                     #used instead of the encode thread when ENCODE_THREADS>1
         self.ordinary_packets = []
         self.socket_dir = socket_dir
         self.unix_socket_paths = unix_socket_paths
@@ -198,6 +204,10 @@ class ClientConnection(ClientConnectionClass):
 
 
     def update_bandwidth_limits(self):
+        p = self.protocol
+        if p:
+            #adaptive compression combines this limit with the throughput it measures:
+            p.set_bandwidth_limit(self.bandwidth_limit)
         if not self.bandwidth_detection:
             return
         mmap_size = getattr(self, "mmap_size", 0)
@@ -313,6 +323,11 @@ class ClientConnection(ClientConnectionClass):
     # The encode thread loop management:
     #
     def queue_encode(self, item):
+        if ENCODE_THREADS>1:
+            self.encode_pool = get_encode_pool()
+            self.queue_encode = self.pool_encode
+            self.pool_encode(item)
+            return
         #start the encode work queue:
         self.encode_work_queue = Queue()            #holds functions to call to compress data (pixels, clipboard)
                                                     #items placed in this queue are picked off by the "encode" thread,
@@ -321,7 +336,17 @@ class ClientConnection(ClientConnectionClass):
         self.encode_work_queue.put(item)
         self.encode_thread = start_thread(self.encode_loop, "encode")
 
+    def pool_encode(self, item, wid=0):
+        if item is None:
+            #the end of queue marker is not needed with the pool:
+            #the items already queued will still be called
+            return
+        self.encode_pool.add((self.counter, wid), self.call_encode_item, item)
+
     def encode_queue_size(self):
+        pool = self.encode_pool
+        if pool:
+            return pool.qsize(self.counter)
         ewq = self.encode_work_queue
         if ewq is None:
             return 0
@@ -335,6 +360,22 @@ class ClientConnection(ClientConnectionClass):
         self.statistics.compression_work_qsizes.append((monotonic_time(), self.encode_queue_size()))
         self.queue_encode(fn_and_args)
 
+    def call_in_window_encode_thread(self, wid, *fn_and_args):
+        """
+            Same as call_in_encode_thread, but the work may run in parallel
+            with the work queued for other windows when using the encode pool.
+            With mmap, all the windows share the same mmap area,
+            so their work must still be processed one item at a time.
+        """
+        if ENCODE_THREADS<=1 or getattr(self, "mmap_size", 0)>0:
+            self.call_in_encode_thread(*fn_and_args)
+            return
+        if not self.encode_pool:
+            self.encode_pool = get_encode_pool()
+            self.queue_encode = self.pool_encode
+        self.statistics.compression_work_qsizes.append((monotonic_time(), self.encode_queue_size()))
+        self.pool_encode(fn_and_args, wid)
+
     def queue_packet(self, packet, wid=0, pixels=0, start_send_cb=None, end_send_cb=None, fail_cb=None, wait_for_more=False):
         """
             Add a new 'draw' packet to the 'packet_queue'.
@@ -361,22 +402,25 @@ class ClientConnection(ClientConnectionClass):
             fn_and_args = self.encode_work_queue.get(True)
             if fn_and_args is None:
                 return              #empty marker
-            #some function calls are optional and can be skipped when closing:
-            #(but some are not, like encoder clean functions)
-            optional_when_closing = fn_and_args[0]
-            if optional_when_closing and self.is_closed():
-                continue
-            try:
-                fn_and_args[1](*fn_and_args[2:])
-            except Exception as e:
-                if self.is_closed():
-                    log("ignoring encoding error in %s as source is already closed:", fn_and_args[0])
-                    log(" %s", e)
-                else:
-                    log.error("Error during encoding:", exc_info=True)
-                del e
+            self.call_encode_item(fn_and_args)
             NOYIELD or sleep(0)
 
+    def call_encode_item(self, fn_and_args):
+        #some function calls are optional and can be skipped when closing:
+        #(but some are not, like encoder clean functions)
+        optional_when_closing = fn_and_args[0]
+        if optional_when_closing and self.is_closed():
+            return
+        try:
+            fn_and_args[1](*fn_and_args[2:])
+        except Exception as e:
+            if self.is_closed():
+                log("ignoring encoding error in %s as source is already closed:", fn_and_args[0])
+                log(" %s", e)
+            else:
+                log.error("Error during encoding:", exc_info=True)
+            del e
+
     ######################################################################
     # network:
     def next_packet(self):
@@ -444,6 +488,9 @@ class ClientConnection(ClientConnectionClass):
             info.update({
                          "connection"       : p.get_info(),
                          })
+        pool = self.encode_pool
+        if pool:
+            info["encode-pool"] = pool.get_info(self.counter)
         info.update(self.get_features_info())
         for bc in CC_BASES:
             try:
@@ -6,6 +6,7 @@
 # later version. See the file COPYING for details.
 
 import os
+from functools import partial
 
 from xpra.log import Logger
 log = Logger("server")
@@ -445,6 +446,11 @@ class WindowsMixin(StubSourceMixin):
         if ws:
             ws.unmap()
 
+    def clear_tile_cache(self, wid):
+        ws = self.window_sources.get(wid)
+        if ws:
+            ws.clear_tile_cache()
+
 
     def raise_window(self, wid, window):
         if not self.can_send_window(window):
@@ -510,7 +516,7 @@ class WindowsMixin(StubSourceMixin):
             ws = WindowVideoSource(
                               self.idle_add, self.timeout_add, self.source_remove,
                               ww, wh,
-                              self.record_congestion_event, self.encode_queue_size, self.call_in_encode_thread, self.queue_packet, self.compressed_wrapper,
+                              self.record_congestion_event, self.encode_queue_size, partial(self.call_in_window_encode_thread, wid), self.queue_packet, self.compressed_wrapper,
                               self.statistics,
                               wid, window, batch_config, self.auto_refresh_delay,
                               av_sync, av_sync_delay,
@@ -5,19 +5,24 @@
 
 import os
 import warnings
+from base64 import b64encode
+from hashlib import sha1
 import posixpath
 import mimetypes
 try:
     from urllib import unquote          #python2 @UnusedImport
+    from urlparse import parse_qs       #python2 @UnusedImport
 except:
-    from urllib.parse import unquote    #python3 @Reimport @UnresolvedImport
+    from urllib.parse import unquote, parse_qs    #python3 @Reimport @UnresolvedImport
 
 from xpra.log import Logger
 log = Logger("network", "websocket")
 
-from xpra.util import envbool, std, AdHocStruct
-from xpra.os_util import memoryview_to_bytes, nomodule_context, PYTHON2, Queue, DummyContextManager
+from xpra.util import envbool, envint, std, AdHocStruct
+from xpra.os_util import memoryview_to_bytes, strtobytes, bytestostr, nomodule_context, PYTHON2, Queue, DummyContextManager
 from xpra.net.bytestreams import SocketConnection
+from xpra.net.websocket_header import GUID
+from xpra.server.http_cache import get_static_file, HTTP_ACCEPT_ENCODING
 
 
 WEBSOCKIFY_NUMPY = envbool("XPRA_WEBSOCKIFY_NUMPY", False)
@@ -65,7 +70,22 @@ WEBSOCKET_TCP_NODELAY = envbool("WEBSOCKET_TCP_NODELAY", True)
 WEBSOCKET_TCP_KEEPALIVE = envbool("WEBSOCKET_TCP_KEEPALIVE", True)
 WEBSOCKET_DEBUG = envbool("XPRA_WEBSOCKET_DEBUG", False)
 
-HTTP_ACCEPT_ENCODING = os.environ.get("XPRA_HTTP_ACCEPT_ENCODING", "br,gzip").split(",")
+#use our own websocket framing code instead of websockify's:
+WEBSOCKET_NATIVE = envbool("XPRA_WEBSOCKET_NATIVE", True)
+#how long browsers can cache the files requested with a version string:
+HTTP_VERSIONED_MAX_AGE = envint("XPRA_HTTP_VERSIONED_MAX_AGE", 365*24*3600)
+
+
+def is_versioned_url(url):
+    """
+        Resources loaded with a version parameter, ie: "/js/Client.js?v=2.5",
+        can be cached for a long time since the url changes with the file.
+        Documents are always revalidated: "connect.html" loads "index.html?server=..."
+    """
+    path, _, query = url.split("#", 1)[0].partition("?")
+    if path.endswith(("/", ".html", ".htm")):
+        return False
+    return bool(parse_qs(query).get("v"))
 
 
 class WSRequestHandler(WebSocketRequestHandler):
@@ -82,6 +102,8 @@ class WSRequestHandler(WebSocketRequestHandler):
         self.http_headers_dir = http_headers_dir
         self._new_websocket_client = new_websocket_client
         self.script_paths = script_paths
+        #set when the websocket frames are handled by xpra instead of websockify:
+        self.native = False
         server = AdHocStruct()
         server.logger = log
         server.run_once = True
@@ -92,6 +114,39 @@ class WSRequestHandler(WebSocketRequestHandler):
     def new_websocket_client(self):
         self._new_websocket_client(self)
 
+    def handle_websocket(self):
+        """
+            Upgrades the connection to a websocket.
+            Unless disabled, clients which support the "binary" sub-protocol
+            are handed over to our own framing code (see WebSocketProtocol),
+            websockify is only used for the legacy "base64" sub-protocol.
+        """
+        upgrade = self.headers.get("upgrade")
+        if not upgrade or upgrade.lower()!="websocket":
+            return False
+        protocols = [x.strip() for x in self.headers.get("Sec-WebSocket-Protocol", "").split(",") if x.strip()]
+        log("handle_websocket() protocols=%s", protocols)
+        if not WEBSOCKET_NATIVE or (protocols and "binary" not in protocols):
+            return WebSocketRequestHandler.handle_websocket(self)
+        version = self.headers.get("Sec-WebSocket-Version")
+        key = self.headers.get("Sec-WebSocket-Key")
+        if version!="13" or not key:
+            self.send_error(400, "Unsupported websocket version %s" % version)
+            return True
+        accept = b64encode(sha1(strtobytes(key.strip()+GUID)).digest())
+        self.send_response(101, "Switching Protocols")
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", bytestostr(accept))
+        if protocols:
+            self.send_header("Sec-WebSocket-Protocol", "binary")
+        self.end_headers()
+        self.wfile.flush()
+        self.native = True
+        log("native websocket connection from %s", self.client_address)
+        self.new_websocket_client()
+        return True
+
     def translate_path(self, path):
         #code duplicated from superclass since we can't easily inject the web_root..
         s = path
@@ -145,8 +200,10 @@ class WSRequestHandler(WebSocketRequestHandler):
             accept = self.headers.get("Accept-Language")
             if accept:
                 self.send_header("Echo-Accept-Language", std(accept, extras="-,./:;="))
+        response_headers = getattr(self, "response_headers", ())
         for k,v in self.get_headers().items():
-            self.send_header(k, v)
+            if k.lower() not in response_headers:
+                self.send_header(k, v)
         WebSocketRequestHandler.end_headers(self)
 
     def get_headers(self):
@@ -242,73 +299,13 @@ class WSRequestHandler(WebSocketRequestHandler):
             else:
                 #self.send_error(403, "Directory listing forbidden")
                 return self.list_directory(path).read()
-        _, ext = os.path.splitext(path)
-        f = None
         try:
-            # Always read in binary mode. Opening files in text mode may cause
-            # newline translations, making the actual size of the content
-            # transmitted *less* than the content-length!
-            f = open(path, 'rb')
-            fs = os.fstat(f.fileno())
-            content_length = fs[6]
-            headers = {}
-            ctype = mimetypes.guess_type(path, False)
-            log("guess_type(%s)=%s", path, ctype)
-            if ctype and ctype[0]:
-                headers["Content-type"] = ctype[0]
             accept = self.headers.get('accept-encoding', '').split(",")
             accept = [x.split(";")[0].strip() for x in accept]
-            content = None
             log("accept-encoding=%s", accept)
-            for enc in HTTP_ACCEPT_ENCODING:
-                #find a matching pre-compressed file:
-                if enc not in accept:
-                    continue
-                compressed_path = "%s.%s" % (path, enc)     #ie: "/path/to/index.html.br"
-                if not os.path.exists(compressed_path):
-                    continue
-                if not os.path.isfile(compressed_path):
-                    log.warn("Warning: '%s' is not a file!", compressed_path)
-                    continue
-                if not os.access(compressed_path, os.R_OK):
-                    log.warn("Warning: '%s' is not readable", compressed_path)
-                    continue
-                st = os.stat(compressed_path)
-                if st.st_size==0:
-                    log.warn("Warning: '%s' is empty", compressed_path)
-                    continue
-                log("sending pre-compressed file '%s'", compressed_path)
-                #read pre-gzipped file:
-                f.close()
-                f = None
-                f = open(compressed_path, 'rb')
-                content = f.read()
-                assert content, "no data in %s" % compressed_path
-                headers["Content-Encoding"] = enc
-                break
-            if not content:
-                content = f.read()
-                assert len(content)==content_length, "expected %s to contain %i bytes but read %i bytes" % (path, content_length, len(content))
-                if content_length>128 and ("gzip" in accept) and ("gzip" in HTTP_ACCEPT_ENCODING) and (ext not in (".png", )):
-                    #gzip it on the fly:
-                    import zlib
-                    assert len(content)==content_length, "expected %s to contain %i bytes but read %i bytes" % (path, content_length, len(content))
-                    gzip_compress = zlib.compressobj(9, zlib.DEFLATED, zlib.MAX_WBITS | 16)
-                    compressed_content = gzip_compress.compress(content) + gzip_compress.flush()
-                    if len(compressed_content)<content_length:
-                        log("gzip compressed '%s': %i down to %i bytes", path, content_length, len(compressed_content))
-                        headers["Content-Encoding"] = "gzip"
-                        content = compressed_content
-            f.close()
-            f = None
-            headers["Content-Length"] = len(content)
-            headers["Last-Modified"] = self.date_time_string(fs.st_mtime)
-            #send back response headers:
-            self.send_response(200)
-            for k,v in headers.items():
-                self.send_header(k, v)
-            self.end_headers()
-        except IOError as e:
+            encodings = [enc for enc in HTTP_ACCEPT_ENCODING if enc in accept]
+            sf = get_static_file(path, encodings+[""])
+        except (IOError, OSError) as e:
             log("send_head()", exc_info=True)
             log.error("Error sending '%s':", path)
             emsg = str(e)
@@ -320,14 +317,65 @@ class WSRequestHandler(WebSocketRequestHandler):
                 self.send_error(404, "File not found")
             except:
                 log("failed to send 404 error - maybe some of the headers were already sent?")
-            if f:
-                try:
-                    f.close()
-                except:
-                    pass
             return None
+        #use the first encoding available for this file:
+        for enc in encodings:
+            content = sf.get_data(enc)
+            if content:
+                break
+        else:
+            enc = ""
+            content = sf.get_data()
+        etag = sf.get_etag(enc)
+        headers = {
+            "ETag"          : etag,
+            "Last-Modified" : self.date_time_string(sf.mtime),
+            "Vary"          : "Accept-Encoding",
+            }
+        if self.is_versioned():
+            #the url changes whenever the file does:
+            headers["Cache-Control"] = "public, max-age=%i, immutable" % HTTP_VERSIONED_MAX_AGE
+        if self.etag_matches(etag):
+            log("send_head() '%s' not modified", path)
+            self.send_response(304)
+            self.send_headers(headers)
+            return None
+        ctype = mimetypes.guess_type(path, False)
+        log("guess_type(%s)=%s", path, ctype)
+        if ctype and ctype[0]:
+            headers["Content-type"] = ctype[0]
+        if enc:
+            log("sending %s encoded '%s'", enc, path)
+            headers["Content-Encoding"] = enc
+        headers["Content-Length"] = len(content)
+        #send back response headers:
+        self.send_response(200)
+        self.send_headers(headers)
         return content
 
+    def send_headers(self, headers):
+        for k,v in headers.items():
+            self.send_header(k, v)
+        #these take precedence over the ones from the http headers directory:
+        self.response_headers = tuple(k.lower() for k in headers.keys())
+        self.end_headers()
+        self.response_headers = ()
+
+    def is_versioned(self):
+        return is_versioned_url(self.path)
+
+    def etag_matches(self, etag):
+        if_none_match = self.headers.get("If-None-Match")
+        if not if_none_match:
+            return False
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag.startswith("W/"):
+                tag = tag[2:]
+            if tag in (etag, "*"):
+                return True
+        return False
+
 
 class WebSocketConnection(SocketConnection):
 
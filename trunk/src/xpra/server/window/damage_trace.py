@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+# Records the damage events of a window and the pixels we capture for it,
+# so that the encoding pipeline can be replayed without a display:
+# see tests/xpra/server/damage_replay.py
+#
+# The file starts with a magic string, followed by records,
+# each one is a bencoded list prefixed with its length:
+# ["window", version, wid, width, height, info]
+# ["damage", time, window-width, window-height, x, y, w, h, options]
+# ["pixels", time, x, y, w, h, pixel-format, depth, bytesperpixel, rowstride, zlib-compressed-pixels]
+# (times are in microseconds since the start of the recording)
+
+import os
+import zlib
+import struct
+import itertools
+
+from xpra.log import Logger
+from xpra.util import envint
+from xpra.os_util import monotonic_time, memoryview_to_bytes, bytestostr
+from xpra.net.bencode import bencode, bdecode
+
+log = Logger("window", "damage")
+
+#directory where the traces are saved, one file per window source:
+DAMAGE_TRACE = os.environ.get("XPRA_DAMAGE_TRACE", "")
+DAMAGE_TRACE_LEVEL = max(0, min(9, envint("XPRA_DAMAGE_TRACE_LEVEL", 1)))
+
+TRACE_MAGIC = b"xpra-damage-trace\n"
+TRACE_VERSION = 1
+HEADER = struct.Struct("!I")
+
+
+#the same window can be shown to more than one client:
+trace_counter = itertools.count(1)
+
+def get_damage_trace_filename(wid):
+    return os.path.join(DAMAGE_TRACE, "damage-%i-%i-%i.trace" % (os.getpid(), wid, next(trace_counter)))
+
+
+class DamageTraceWriter(object):
+    """
+        Saves the damage events and the captured pixels of a single window.
+        This runs in the UI thread.
+    """
+
+    def __init__(self, filename, wid, width, height, info={}):
+        self.filename = filename
+        self.file = open(filename, "wb")
+        self.file.write(TRACE_MAGIC)
+        self.start = monotonic_time()
+        self.records = 0
+        self.bytes = 0
+        self.write_record(["window", TRACE_VERSION, wid, width, height, info])
+        log("recording damage trace for window %i to '%s'", wid, filename)
+
+    def __repr__(self):
+        return "DamageTraceWriter(%s)" % self.filename
+
+    def get_time(self):
+        return int((monotonic_time()-self.start)*1000*1000)
+
+    def write_record(self, record):
+        f = self.file
+        if not f:
+            return
+        data = bencode(record)
+        f.write(HEADER.pack(len(data)))
+        f.write(data)
+        self.records += 1
+        self.bytes += HEADER.size+len(data)
+
+    def damage(self, ww, wh, x, y, w, h, options):
+        #only keep the options we can serialize:
+        opts = dict((k, v) for k,v in (options or {}).items() if isinstance(v, (int, str, bytes)))
+        self.write_record(["damage", self.get_time(), ww, wh, x, y, w, h, opts])
+
+    def pixels(self, x, y, image):
+        w = image.get_width()
+        h = image.get_height()
+        data = zlib.compress(memoryview_to_bytes(image.get_pixels()), DAMAGE_TRACE_LEVEL)
+        self.write_record(["pixels", self.get_time(), x, y, w, h,
+                           image.get_pixel_format(), image.get_depth(), image.get_bytesperpixel(), image.get_rowstride(),
+                           data])
+
+    def close(self):
+        f = self.file
+        if f:
+            self.file = None
+            f.close()
+            log("damage trace '%s': %i records, %iKB", self.filename, self.records, self.bytes//1024)
+
+
+def load_damage_trace(filename):
+    """
+        Generator for the records found in a damage trace file,
+        the pixel data is returned uncompressed.
+    """
+    with open(filename, "rb") as f:
+        magic = f.read(len(TRACE_MAGIC))
+        if magic!=TRACE_MAGIC:
+            raise Exception("'%s' is not a damage trace file" % filename)
+        while True:
+            header = f.read(HEADER.size)
+            if len(header)<HEADER.size:
+                break
+            size = HEADER.unpack(header)[0]
+            data = f.read(size)
+            if len(data)<size:
+                log.warn("Warning: damage trace '%s' is truncated", filename)
+                break
+            record = list(bdecode(data)[0])
+            rtype = bytestostr(record[0])
+            record[0] = rtype
+            if rtype=="window":
+                if record[1]!=TRACE_VERSION:
+                    raise Exception("unsupported damage trace version %s" % record[1])
+                record[5] = dict((bytestostr(k), v) for k,v in record[5].items())
+            elif rtype=="damage":
+                record[8] = dict((bytestostr(k), v) for k,v in record[8].items())
+            elif rtype=="pixels":
+                record[6] = bytestostr(record[6])
+                record[10] = zlib.decompress(record[10])
+            yield record
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 # This file is part of Xpra.
-# Copyright (C) 2013-2016 Antoine Martin <antoine@xpra.org>
+# Copyright (C) 2013-2018 Antoine Martin <antoine@xpra.org>
 # Xpra is released under the terms of the GNU GPL v2, or, at your option, any
 # later version. See the file COPYING for details.
 
@@ -33,7 +33,7 @@ cdef class rectangle:
         self.y = y
         self.width = w
         self.height = h
-        self.hash = (self.x+self.y)<<16 + (self.width + self.height)
+        self.hash = hash((x, y, w, h))
 
     def __hash__(self):
         return self.hash
@@ -163,7 +163,8 @@ def add_rectangle(object regions, rectangle region):
     cdef int w = region.width
     cdef int h = region.height
     cdef rectangle r
-    for r in tuple(regions):
+    cdef list keep = []
+    for r in regions:
         #unroll contains() call:
         #if r.contains_rect(region):
         if r.x<=x and r.y<=y and r.x+r.width>=x+w and r.y+r.height>=y+h:
@@ -171,22 +172,24 @@ def add_rectangle(object regions, rectangle region):
         if r.intersects(x, y, w, h):
             #only keep the parts
             #that do not intersect with the new region we add:
-            regions.remove(r)
-            regions += r.substract(x, y, w, h)
-    regions.append(region)
+            keep += r.substract(x, y, w, h)
+        else:
+            keep.append(r)
+    keep.append(region)
+    #single pass, update the list in place:
+    regions[:] = keep
     return True
 
 def remove_rectangle(object regions, rectangle region):
-    copy = regions[:]
-    regions[:] = []
     cdef int x = region.x               #
     cdef int y = region.y               #
     cdef int w = region.width           #
     cdef int h = region.height          #
-    cdef int l = len(copy)
     cdef rectangle r
-    for r in copy:
-        regions += r.substract(x, y, w, h)
+    cdef list keep = []
+    for r in regions:
+        keep += r.substract(x, y, w, h)
+    regions[:] = keep
 
 def merge_all(rectangles):
     cdef rectangle r               #
@@ -211,3 +214,364 @@ def merge_all(rectangles):
         if y2>ry2:
             ry2 = y2
     return rectangle(rx, ry, rx2-rx, ry2-ry)
+
+
+#operations on the spans of a band:
+DEF UNION = 0
+DEF SUBTRACT = 1
+DEF INTERSECT = 2
+#above this number of rectangles, merge them all at once:
+DEF MERGE_PAIRWISE = 16
+
+cdef tuple span_op(tuple xa, tuple xb, const int op):
+    """
+        Combines two sorted lists of spans: (x1, x2, x1, x2, ..)
+        by walking their edges in order.
+    """
+    cdef int na = len(xa)
+    cdef int nb = len(xb)
+    if op==UNION:
+        if na==0:
+            return xb
+        if nb==0:
+            return xa
+    elif op==SUBTRACT:
+        if na==0 or nb==0:
+            return xa
+    elif na==0 or nb==0:
+        return ()
+    cdef int i = 0, j = 0, x
+    cdef bint ina = False, inb = False, inside = False, v
+    cdef list out = []
+    while i<na or j<nb:
+        if j>=nb or (i<na and xa[i]<=xb[j]):
+            x = xa[i]
+        else:
+            x = xb[j]
+        while i<na and xa[i]==x:
+            ina = not ina
+            i += 1
+        while j<nb and xb[j]==x:
+            inb = not inb
+            j += 1
+        if op==UNION:
+            v = ina or inb
+        elif op==SUBTRACT:
+            v = ina and not inb
+        else:
+            v = ina and inb
+        if v!=inside:
+            out.append(x)
+            inside = v
+    return tuple(out)
+
+cdef inline void append_band(list bands, const int y1, const int y2, tuple xs):
+    if not xs:
+        return
+    cdef int n = len(bands)
+    cdef tuple last
+    if n>0:
+        last = bands[n-1]
+        if last[1]==y1 and last[2]==xs:
+            #same spans as the band above, extend it:
+            bands[n-1] = (last[0], y2, xs)
+            return
+    bands.append((y1, y2, xs))
+
+cdef list band_op(list a, list b, const int op):
+    """
+        Combines two lists of bands: (y1, y2, spans),
+        sorted by y and not overlapping.
+    """
+    if op==UNION:
+        if not a:
+            return b
+        if not b:
+            return a
+    elif op==SUBTRACT:
+        if not a or not b:
+            return a
+    elif not a or not b:
+        return []
+    cdef list ys = sorted(set([band[0] for band in a]+[band[1] for band in a]+[band[0] for band in b]+[band[1] for band in b]))
+    cdef list bands = []
+    cdef int na = len(a)
+    cdef int nb = len(b)
+    cdef int i = 0, j = 0, k, y1, y2
+    cdef tuple band, xa, xb
+    for k in range(len(ys)-1):
+        y1 = ys[k]
+        y2 = ys[k+1]
+        while i<na and a[i][1]<=y1:
+            i += 1
+        while j<nb and b[j][1]<=y1:
+            j += 1
+        xa = xb = ()
+        if i<na:
+            band = a[i]
+            if band[0]<=y1:
+                xa = band[2]
+        if j<nb:
+            band = b[j]
+            if band[0]<=y1:
+                xb = band[2]
+        append_band(bands, y1, y2, span_op(xa, xb, op))
+    return bands
+
+
+cdef int first_band(list bands, const int y):
+    """ index of the first band which ends below y """
+    cdef int lo = 0
+    cdef int hi = len(bands)
+    cdef int mid
+    while lo<hi:
+        mid = (lo+hi)//2
+        if bands[mid][1]<=y:
+            lo = mid+1
+        else:
+            hi = mid
+    return lo
+
+cdef list rect_op(list bands, const int x1, const int y1, const int x2, const int y2, const int op):
+    """
+        Combines a list of bands with a single rectangle,
+        only the bands within the rectangle's vertical range are modified.
+    """
+    cdef int n = len(bands)
+    cdef int i = first_band(bands, y1)
+    cdef list out
+    if op==INTERSECT:
+        out = []
+    else:
+        out = bands[:i]
+    cdef tuple rx = (x1, x2)
+    cdef tuple band, xs
+    cdef int y = y1
+    while i<n:
+        band = bands[i]
+        if band[0]>=y2:
+            break
+        xs = band[2]
+        if op==UNION and band[0]>y:
+            #fill the gap above this band:
+            append_band(out, y, band[0], rx)
+        if band[0]<y1 and op!=INTERSECT:
+            #top part is unchanged:
+            append_band(out, band[0], y1, xs)
+        append_band(out, MAX(band[0], y1), MIN(band[1], y2), span_op(xs, rx, op))
+        if band[1]>y2 and op!=INTERSECT:
+            #bottom part is unchanged:
+            append_band(out, y2, band[1], xs)
+        y = band[1]
+        i += 1
+    if op==UNION and y<y2:
+        append_band(out, y, y2, rx)
+    if i<n and op!=INTERSECT:
+        #the first band left may need to be joined with the last one we added:
+        band = bands[i]
+        append_band(out, band[0], band[1], band[2])
+        out += bands[i+1:]
+    return out
+
+
+cdef class region_set:
+    """
+        A set of pixels stored as horizontal bands of non-overlapping rectangles,
+        like pixman / X11 regions: the bands are sorted by y, do not overlap,
+        and the spans within each band are sorted by x.
+        Rectangles are accumulated cheaply by 'add' and merged the next time the set is used:
+        a few at a time by only updating the bands they touch,
+        or all at once by merging them pairwise (so in O(n log n)).
+        Iterating yields the rectangles, which never overlap.
+    """
+
+    cdef list bands         #(y1, y2, (x1, x2, x1, x2, ..))
+    cdef list pending       #rectangles not merged yet: (x1, y1, x2, y2)
+    cdef tuple rects        #cached rectangles
+
+    def __init__(self, rects=()):
+        self.bands = []
+        self.pending = []
+        self.rects = None
+        cdef rectangle r
+        for r in rects:
+            self.add(r.x, r.y, r.width, r.height)
+
+    def __repr__(self):
+        return "region_set(%s)" % (self.get_rectangles(), )
+
+    cdef list get_bands(self):
+        cdef list pending = self.pending
+        cdef list bands, merge
+        cdef tuple r
+        if pending:
+            #rectangles may still be added from another thread while we merge:
+            self.pending = []
+            bands = self.bands
+            if len(pending)<=MERGE_PAIRWISE:
+                for r in pending:
+                    bands = rect_op(bands, r[0], r[1], r[2], r[3], UNION)
+            else:
+                merge = [[(r[1], r[3], (r[0], r[2]))] for r in pending]
+                if bands:
+                    merge.append(bands)
+                while len(merge)>1:
+                    merge = [band_op(merge[i], merge[i+1], UNION) if i+1<len(merge) else merge[i] for i in range(0, len(merge), 2)]
+                bands = merge[0]
+            self.bands = bands
+            self.rects = None
+        return self.bands
+
+    cdef void set_bands(self, list bands):
+        self.bands = bands
+        self.rects = None
+
+    def add(self, const int x, const int y, const int w, const int h):
+        if w<=0 or h<=0:
+            return
+        self.pending.append((x, y, x+w, y+h))
+        self.rects = None
+
+    def add_rect(self, rectangle rect):
+        self.add(rect.x, rect.y, rect.width, rect.height)
+
+    def union(self, region_set other):
+        self.set_bands(band_op(self.get_bands(), other.get_bands(), UNION))
+
+    def subtract(self, const int x, const int y, const int w, const int h):
+        if w<=0 or h<=0:
+            return
+        self.set_bands(rect_op(self.get_bands(), x, y, x+w, y+h, SUBTRACT))
+
+    def subtract_rect(self, rectangle rect):
+        self.subtract(rect.x, rect.y, rect.width, rect.height)
+
+    def subtract_set(self, region_set other):
+        self.set_bands(band_op(self.get_bands(), other.get_bands(), SUBTRACT))
+
+    def intersect(self, const int x, const int y, const int w, const int h):
+        if w<=0 or h<=0:
+            self.clear()
+            return
+        self.set_bands(rect_op(self.get_bands(), x, y, x+w, y+h, INTERSECT))
+
+    def intersect_rect(self, rectangle rect):
+        self.intersect(rect.x, rect.y, rect.width, rect.height)
+
+    def intersect_set(self, region_set other):
+        self.set_bands(band_op(self.get_bands(), other.get_bands(), INTERSECT))
+
+    def contains(self, const int x, const int y, const int w, const int h):
+        if w<=0 or h<=0:
+            return True
+        cdef int top = y
+        cdef int i, n
+        cdef tuple band, xs
+        cdef bint found
+        for band in self.get_bands():
+            if band[1]<=top:
+                continue
+            if band[0]>top:
+                #gap above this band
+                return False
+            xs = band[2]
+            n = len(xs)
+            found = False
+            for i in range(0, n, 2):
+                if xs[i]<=x and xs[i+1]>=x+w:
+                    found = True
+                    break
+            if not found:
+                return False
+            top = band[1]
+            if top>=y+h:
+                return True
+        return False
+
+    def contains_rect(self, rectangle rect):
+        return self.contains(rect.x, rect.y, rect.width, rect.height)
+
+    def __contains__(self, rectangle rect):
+        return self.contains(rect.x, rect.y, rect.width, rect.height)
+
+    def intersects(self, const int x, const int y, const int w, const int h):
+        if w<=0 or h<=0:
+            return False
+        cdef int i, n
+        cdef tuple band, xs
+        for band in self.get_bands():
+            if band[1]<=y:
+                continue
+            if band[0]>=y+h:
+                break
+            xs = band[2]
+            n = len(xs)
+            for i in range(0, n, 2):
+                if xs[i]<x+w and xs[i+1]>x:
+                    return True
+        return False
+
+    def intersects_rect(self, rectangle rect):
+        return self.intersects(rect.x, rect.y, rect.width, rect.height)
+
+    def get_rectangles(self):
+        cdef list bands = self.get_bands()
+        cdef list rects
+        cdef tuple band, xs
+        cdef int i, n
+        if self.rects is None:
+            rects = []
+            for band in bands:
+                xs = band[2]
+                n = len(xs)
+                for i in range(0, n, 2):
+                    rects.append(rectangle(xs[i], band[0], xs[i+1]-xs[i], band[1]-band[0]))
+            self.rects = tuple(rects)
+        return self.rects
+
+    def get_extents(self):
+        """ the smallest rectangle containing the whole set, or None """
+        cdef list bands = self.get_bands()
+        if not bands:
+            return None
+        cdef tuple band = bands[0]
+        cdef int y1 = band[0]
+        cdef int x1 = band[2][0]
+        cdef int x2 = band[2][len(band[2])-1]
+        cdef tuple xs
+        for band in bands:
+            xs = band[2]
+            x1 = MIN(x1, xs[0])
+            x2 = MAX(x2, xs[len(xs)-1])
+        return rectangle(x1, y1, x2-x1, band[1]-y1)
+
+    def get_area(self):
+        cdef long area = 0
+        cdef tuple band, xs
+        cdef int i, n
+        for band in self.get_bands():
+            xs = band[2]
+            n = len(xs)
+            for i in range(0, n, 2):
+                area += (xs[i+1]-xs[i]) * (band[1]-band[0])
+        return area
+
+    def copy(self):
+        cdef region_set c = region_set()
+        c.bands = self.get_bands()
+        c.rects = self.rects
+        return c
+
+    def clear(self):
+        self.bands = []
+        self.pending = []
+        self.rects = None
+
+    def __bool__(self):
+        return bool(self.pending) or bool(self.bands)
+
+    def __len__(self):
+        return len(self.get_rectangles())
+
+    def __iter__(self):
+        return iter(self.get_rectangles())
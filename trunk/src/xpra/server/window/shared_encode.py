@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+"""
+When the same window is shown to multiple clients (sharing mode),
+each client's window source captures and encodes the same damage.
+The SharedEncodeCache lets them re-use each other's encoding results
+when the pixels and all the encoding parameters are identical.
+"""
+
+from threading import Lock, Event
+from collections import OrderedDict
+
+from xpra.util import envint
+from xpra.log import Logger
+
+log = Logger("encoding")
+
+#the number of recent encoding results we keep for each window:
+SHARED_ENCODE_SIZE = envint("XPRA_SHARED_ENCODE_SIZE", 8)
+#how long to wait for another client's encoder to complete (in milliseconds),
+#this blocks our encode thread so we keep it short and encode locally on timeout:
+SHARED_ENCODE_WAIT = envint("XPRA_SHARED_ENCODE_WAIT", 20)
+
+
+def copy_result(result):
+    #the client options are modified by each client's window source:
+    coding, data, client_options, outw, outh, outstride, bpp = result
+    return coding, data, dict(client_options), outw, outh, outstride, bpp
+
+
+class SharedEncodeCache(object):
+
+    def __init__(self, wid, size=SHARED_ENCODE_SIZE, wait=SHARED_ENCODE_WAIT):
+        self.wid = wid
+        self.size = size
+        self.wait = wait
+        self.lock = Lock()
+        self.results = OrderedDict()        #key -> encoding result
+        self.pending = {}                   #key -> Event, for the results being encoded
+        self.users = 0
+        self.hits = 0
+        self.misses = 0
+        self.timeouts = 0
+
+    def __repr__(self):
+        return "SharedEncodeCache(%i : %i users)" % (self.wid, self.users)
+
+    def claim(self, key):
+        """
+            Returns the encoding result for this key if we have it,
+            or waits for it if another client is encoding it right now.
+            Otherwise, returns None and the caller must encode it
+            and call 'add' (or 'abort' if that fails).
+        """
+        with self.lock:
+            result = self.results.get(key)
+            if result is not None:
+                self.hits += 1
+                return copy_result(result)
+            event = self.pending.get(key)
+            if event is None:
+                self.pending[key] = Event()
+                self.misses += 1
+                return None
+        #the encoder is already running in another thread, so this cannot deadlock:
+        event.wait(self.wait/1000.0)
+        with self.lock:
+            result = self.results.get(key)
+            if result is not None:
+                self.hits += 1
+                return copy_result(result)
+            #timed out: the caller will encode it locally
+            self.misses += 1
+            self.timeouts += 1
+            return None
+
+    def add(self, key, result):
+        with self.lock:
+            self.results[key] = copy_result(result)
+            while len(self.results)>self.size:
+                self.results.popitem(False)
+            event = self.pending.pop(key, None)
+        if event:
+            event.set()
+
+    def abort(self, key):
+        with self.lock:
+            event = self.pending.pop(key, None)
+        if event:
+            event.set()
+
+    def get_info(self):
+        total = self.hits+self.misses
+        return {
+            "users"     : self.users,
+            "hits"      : self.hits,
+            "misses"    : self.misses,
+            "timeouts"  : self.timeouts,
+            #the percentage of the encoding results we did not have to generate:
+            "ratio"     : (100*self.hits//total) if total else 0,
+            }
+
+
+caches = {}
+lock = Lock()
+
+def get_shared_encode_cache(wid):
+    with lock:
+        sec = caches.get(wid)
+        if not sec:
+            sec = caches[wid] = SharedEncodeCache(wid)
+        sec.users += 1
+        log("get_shared_encode_cache(%i)=%s", wid, sec)
+        return sec
+
+def release_shared_encode_cache(sec):
+    with lock:
+        sec.users -= 1
+        log("release_shared_encode_cache(%s)", sec)
+        if sec.users<=0 and caches.get(sec.wid) is sec:
+            del caches[sec.wid]
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+"""
+Large lossless refreshes can take hundreds of milliseconds to compress
+in a single call on the window's encode thread.
+The StripEncodePool compresses horizontal strips of the same image in parallel,
+the png, webp and jpeg encoders release the GIL whilst they compress.
+"""
+
+from threading import Lock
+
+from xpra.log import Logger
+from xpra.util import envint
+from xpra.os_util import Queue, monotonic_time
+from xpra.make_thread import start_thread
+from xpra.codecs.image_wrapper import ImageWrapper
+
+log = Logger("encoding")
+
+#the number of extra threads used for encoding strips,
+#the default (0) disables strip encoding:
+STRIP_THREADS = envint("XPRA_STRIP_THREADS", 0)
+#the number of strips, the encode thread compresses one of them itself:
+STRIP_COUNT = max(2, envint("XPRA_STRIP_COUNT", STRIP_THREADS+1))
+#only split regions at least this big:
+STRIP_MIN_PIXELS = envint("XPRA_STRIP_MIN_PIXELS", 512*1024)
+STRIP_MIN_HEIGHT = max(1, envint("XPRA_STRIP_MIN_HEIGHT", 64))
+STRIP_ENCODINGS = ("png", "png/P", "png/L", "webp", "jpeg")
+
+
+def get_strips(height, count=STRIP_COUNT, min_height=STRIP_MIN_HEIGHT):
+    """
+        Returns a list of (y, height) for splitting the given height
+        into 'count' strips no smaller than 'min_height',
+        the first strips get the extra rows.
+    """
+    count = max(1, min(count, height//min_height))
+    strip, extra = divmod(height, count)
+    strips = []
+    y = 0
+    for i in range(count):
+        h = strip+int(i<extra)
+        strips.append((y, h))
+        y += h
+    return strips
+
+def split_image(image, count=STRIP_COUNT, min_height=STRIP_MIN_HEIGHT):
+    """
+        Splits the image into horizontal strips,
+        the strips use the pixel buffer of the image without copying it,
+        so the image must not be freed before the strips are.
+        Returns None if the image cannot be split this way.
+    """
+    if image.get_planes()!=ImageWrapper.PACKED:
+        return None
+    strips = get_strips(image.get_height(), count, min_height)
+    if len(strips)<2:
+        return None
+    pixels = image.get_pixels()
+    try:
+        mv = memoryview(pixels)
+    except TypeError:
+        return None
+    if mv.ndim!=1 or mv.itemsize!=1:
+        return None
+    rowstride = image.get_rowstride()
+    x = image.get_x()
+    y = image.get_y()
+    w = image.get_width()
+    subs = []
+    for sy, sh in strips:
+        sub = ImageWrapper(x, y+sy, w, sh, mv[sy*rowstride:(sy+sh)*rowstride],
+                           image.get_pixel_format(), image.get_depth(), rowstride, image.get_bytesperpixel(),
+                           thread_safe=True, palette=image.get_palette())
+        sub.set_target_x(image.get_target_x())
+        sub.set_target_y(image.get_target_y()+sy)
+        sub.set_timestamp(image.get_timestamp())
+        subs.append(sub)
+    return subs
+
+
+class StripEncodePool(object):
+    """
+        A pool of threads used for calling the same encoding function
+        on the strips of an image.
+        The caller's thread processes the first item itself,
+        then waits for the others to complete.
+    """
+
+    def __init__(self, size=STRIP_THREADS):
+        assert size>0
+        self.size = size
+        self.queue = Queue()
+        self.threads = []
+        self.exit = False
+        self.lock = Lock()
+        self.calls = 0
+        self.items = 0
+        self.elapsed = 0
+
+    def __repr__(self):
+        return "StripEncodePool(%i threads)" % self.size
+
+    def start(self):
+        for i in range(self.size):
+            self.threads.append(start_thread(self.run, "strip-encode-%i" % i, daemon=True))
+
+    def stop(self):
+        self.exit = True
+        for _ in self.threads:
+            self.queue.put(None)
+
+    def encode(self, fn, items):
+        """
+            Calls fn(*args) for each item and returns the results in the same order,
+            re-raises the first exception if any of the calls failed.
+        """
+        start = monotonic_time()
+        n = len(items)
+        results = [None]*n
+        errors = [None]*n
+        done = Queue()
+        for i in range(1, n):
+            self.queue.put((fn, items[i], i, results, errors, done))
+        self.call(fn, items[0], 0, results, errors, None)
+        for _ in range(1, n):
+            done.get()
+        with self.lock:
+            self.calls += 1
+            self.items += n
+            self.elapsed += monotonic_time()-start
+        for e in errors:
+            if e:
+                raise e
+        return results
+
+    def call(self, fn, args, index, results, errors, done):
+        try:
+            results[index] = fn(*args)
+        except Exception as e:
+            log("%s%s failed", fn, args, exc_info=True)
+            errors[index] = e
+        finally:
+            if done:
+                done.put(index)
+
+    def run(self):
+        log("StripEncodePool.run() starting")
+        while not self.exit:
+            item = self.queue.get()
+            if item is None:
+                break
+            self.call(*item)
+        log("StripEncodePool.run() ended")
+
+    def get_info(self):
+        info = {
+            "threads"   : self.size,
+            "strips"    : STRIP_COUNT,
+            "calls"     : self.calls,
+            "items"     : self.items,
+            }
+        if self.calls:
+            info["time"] = int(1000*self.elapsed/self.calls)
+        return info
+
+
+pool = None
+lock = Lock()
+
+def get_strip_pool(create=True):
+    global pool
+    if pool is not None or not create or STRIP_THREADS<=0:
+        return pool
+    with lock:
+        if not pool:
+            pool = StripEncodePool()
+            pool.start()
+    return pool
+
+def stop_strip_pool():
+    p = get_strip_pool(False)
+    log("stop_strip_pool() pool=%s", p)
+    if p:
+        p.stop()
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+#!python
+#cython: auto_pickle=False, boundscheck=False, wraparound=False, cdivision=True, language_level=3
+
+from __future__ import absolute_import
+
+from xpra.log import Logger
+log = Logger("encoding", "damage")
+
+from xpra.buffers.membuf cimport memalign, getbuf, object_as_buffer, xxh64, MemBuf
+from xpra.codecs.image_wrapper import ImageWrapper
+
+from libc.stdint cimport uint64_t, uintptr_t
+from libc.stdlib cimport free
+from libc.string cimport memset, memcpy
+
+
+cdef inline unsigned int imin(unsigned int a, unsigned int b) nogil:
+    if a<b:
+        return a
+    return b
+
+cdef inline unsigned int imax(unsigned int a, unsigned int b) nogil:
+    if a>b:
+        return a
+    return b
+
+
+cdef class TileChecksums:
+    """
+        Keeps a checksum for each tile of a window,
+        matching the pixels the client has (0 if unknown),
+        so we can skip the tiles which have not changed when the window is damaged.
+        Partial tiles are hashed with their position within the tile,
+        so they only match the same area of the same tile.
+    """
+
+    cdef uint64_t *checksums
+    cdef readonly unsigned int tile_size
+    cdef readonly unsigned int columns
+    cdef readonly unsigned int rows
+    cdef readonly unsigned long long skipped
+    cdef readonly unsigned long long sent
+
+    def __cinit__(self, unsigned int tile_size=64):
+        assert tile_size>0 and tile_size<65536, "invalid tile size %i" % tile_size
+        self.tile_size = tile_size
+        self.checksums = NULL
+        self.columns = 0
+        self.rows = 0
+        self.skipped = 0
+        self.sent = 0
+
+    def __dealloc__(self):
+        self.free()
+
+    def __repr__(self):
+        return "TileChecksums(%ix%i tiles of %i pixels)" % (self.columns, self.rows, self.tile_size)
+
+    cdef free(self):
+        if self.checksums!=NULL:
+            free(self.checksums)
+            self.checksums = NULL
+
+    def resize(self, unsigned int width, unsigned int height):
+        """ allocates the tiles for a window of the given size, all unknown """
+        self.free()
+        self.columns = (width+self.tile_size-1)//self.tile_size
+        self.rows = (height+self.tile_size-1)//self.tile_size
+        cdef size_t l = self.columns*self.rows*sizeof(uint64_t)
+        if l>0:
+            self.checksums = <uint64_t*> memalign(l)
+            assert self.checksums!=NULL, "failed to allocate %i bytes for tile checksums" % l
+            memset(self.checksums, 0, l)
+
+    def reset(self):
+        if self.checksums!=NULL:
+            memset(self.checksums, 0, self.columns*self.rows*sizeof(uint64_t))
+
+    def invalidate(self, int x, int y, int w, int h):
+        """ the client may not have the pixels of this area """
+        if self.checksums==NULL or w<=0 or h<=0:
+            return
+        cdef unsigned int ts = self.tile_size
+        cdef unsigned int x0 = imax(0, x)//ts
+        cdef unsigned int y0 = imax(0, y)//ts
+        cdef unsigned int x1 = imin(self.columns, imax(0, x+w+ts-1)//ts)
+        cdef unsigned int y1 = imin(self.rows, imax(0, y+h+ts-1)//ts)
+        cdef unsigned int row, col
+        for row in range(y0, y1):
+            for col in range(x0, x1):
+                self.checksums[row*self.columns+col] = 0
+
+    def update(self, image, unsigned int x, unsigned int y, int lossless=True):
+        """
+            Compares the tiles of the image (found at x,y in the window) with the checksums,
+            records the new checksums if the image is going to be sent losslessly
+            (or forgets them if not),
+            and returns the list of rectangles which need to be sent, in window coordinates.
+        """
+        cdef unsigned int width = image.get_width()
+        cdef unsigned int height = image.get_height()
+        cdef unsigned int rowstride = image.get_rowstride()
+        cdef unsigned int Bpp = image.get_bytesperpixel()
+        pixels = image.get_pixels()
+        cdef const unsigned char *buf = NULL
+        cdef Py_ssize_t buf_len = 0
+        assert object_as_buffer(pixels, <const void**> &buf, &buf_len)==0, "cannot get buffer pointer for %s" % type(pixels)
+        assert buf_len>=rowstride*(height-1)+width*Bpp, "image buffer is too small"
+        cdef unsigned int ts = self.tile_size
+        cdef unsigned int col0 = x//ts
+        cdef unsigned int row0 = y//ts
+        cdef unsigned int col1 = (x+width+ts-1)//ts
+        cdef unsigned int row1 = (y+height+ts-1)//ts
+        cdef unsigned int row, col, i
+        cdef unsigned int tx0, ty0, tx1, ty1         #tile area clipped to the image, in window coordinates
+        cdef unsigned int min_col, max_col
+        cdef uint64_t checksum
+        cdef uint64_t *stored
+        cdef int band_start = -1
+        cdef unsigned int band_min_col = 0, band_max_col = 0
+        rectangles = []
+        def add_band(int start, unsigned int end, unsigned int cmin, unsigned int cmax):
+            bx0 = imax(x, cmin*ts)
+            by0 = imax(y, start*ts)
+            bx1 = imin(x+width, (cmax+1)*ts)
+            by1 = imin(y+height, end*ts)
+            rectangles.append((bx0, by0, bx1-bx0, by1-by0))
+        for row in range(row0, row1):
+            ty0 = imax(y, row*ts)
+            ty1 = imin(y+height, (row+1)*ts)
+            min_col = col1
+            max_col = 0
+            for col in range(col0, col1):
+                tx0 = imax(x, col*ts)
+                tx1 = imin(x+width, (col+1)*ts)
+                #the seed identifies the area of the tile we hash:
+                checksum = ((<uint64_t> (tx0-col*ts))<<48) | ((<uint64_t> (ty0-row*ts))<<32) | ((tx1-tx0)<<16) | (ty1-ty0)
+                with nogil:
+                    for i in range(ty0-y, ty1-y):
+                        checksum = xxh64(buf + i*rowstride + (tx0-x)*Bpp, (tx1-tx0)*Bpp, checksum)
+                if checksum==0:
+                    checksum = 1
+                if row<self.rows and col<self.columns:
+                    stored = self.checksums + row*self.columns + col
+                    if stored[0]==checksum:
+                        self.skipped += 1
+                        continue
+                    if lossless:
+                        stored[0] = checksum
+                    else:
+                        stored[0] = 0
+                self.sent += 1
+                min_col = imin(min_col, col)
+                max_col = imax(max_col, col)
+            if min_col>max_col:
+                #nothing changed in this row of tiles:
+                if band_start>=0:
+                    add_band(band_start, row, band_min_col, band_max_col)
+                    band_start = -1
+                continue
+            if band_start<0:
+                band_start = row
+                band_min_col = min_col
+                band_max_col = max_col
+            else:
+                band_min_col = imin(band_min_col, min_col)
+                band_max_col = imax(band_max_col, max_col)
+        if band_start>=0:
+            add_band(band_start, row1, band_min_col, band_max_col)
+        return rectangles
+
+    def get_info(self):
+        return {
+            "tile-size" : self.tile_size,
+            "tiles"     : (self.columns, self.rows),
+            "skipped"   : self.skipped,
+            "sent"      : self.sent,
+            }
+
+
+def crop_image(image, unsigned int x, unsigned int y, unsigned int w, unsigned int h):
+    """
+        Returns a copy of an area of the image,
+        which does not depend on the original image's pixel buffer.
+    """
+    cdef unsigned int width = image.get_width()
+    cdef unsigned int height = image.get_height()
+    assert w>0 and h>0 and x+w<=width and y+h<=height, "invalid area %s for %ix%i image" % ((x, y, w, h), width, height)
+    cdef unsigned int rowstride = image.get_rowstride()
+    cdef unsigned int Bpp = image.get_bytesperpixel()
+    pixels = image.get_pixels()
+    cdef const unsigned char *buf = NULL
+    cdef Py_ssize_t buf_len = 0
+    assert object_as_buffer(pixels, <const void**> &buf, &buf_len)==0, "cannot get buffer pointer for %s" % type(pixels)
+    cdef unsigned int newstride = w*Bpp
+    cdef MemBuf out_buf = getbuf(newstride*h)
+    cdef unsigned char *out = <unsigned char*> out_buf.get_mem()
+    cdef unsigned int i
+    with nogil:
+        for i in range(h):
+            memcpy(out+i*newstride, buf+(y+i)*rowstride+x*Bpp, newstride)
+    sub = ImageWrapper(image.get_x()+x, image.get_y()+y, w, h, memoryview(out_buf), image.get_pixel_format(), image.get_depth(), newstride, Bpp, thread_safe=True)
+    sub.set_target_x(image.get_target_x()+x)
+    sub.set_target_y(image.get_target_y()+y)
+    sub.set_timestamp(image.get_timestamp())
+    return sub
@@ -8,7 +8,7 @@ import math
 
 from xpra.os_util import monotonic_time
 from xpra.util import envint, envbool
-from xpra.server.window.region import rectangle, add_rectangle, remove_rectangle, merge_all    #@UnresolvedImport
+from xpra.server.window.region import rectangle, region_set, merge_all    #@UnresolvedImport
 from xpra.log import Logger
 
 sslog = Logger("regiondetect")
@@ -74,9 +74,9 @@ class VideoSubregion(object):
         self.counter = 0        #value of the "damage event count" recorded at "time"
         self.time = 0           #see above
         self.refresh_timer = 0
-        self.refresh_regions = []
+        self.refresh_regions = region_set()
         self.last_scores = {}
-        self.nonvideo_regions = []
+        self.nonvideo_regions = region_set()
         self.nonvideo_refresh_timer = 0
         #keep track of how much extra we batch non-video regions (milliseconds):
         self.non_max_wait = 150
@@ -179,8 +179,8 @@ class VideoSubregion(object):
 
 
     def remove_refresh_region(self, region):
-        remove_rectangle(self.refresh_regions, region)
-        remove_rectangle(self.nonvideo_regions, region)
+        self.refresh_regions.subtract_rect(region)
+        self.nonvideo_regions.subtract_rect(region)
         refreshlog("remove_refresh_region(%s) updated refresh regions=%s, nonvideo regions=%s", region, self.refresh_regions, self.nonvideo_regions)
 
 
@@ -194,23 +194,20 @@ class VideoSubregion(object):
         #so we re-schedule the subregion refresh:
         self.cancel_refresh_timer()
         #add the new region to what we already have:
-        add_rectangle(self.refresh_regions, region)
+        self.refresh_regions.add_rect(region)
         #do refresh any regions which are now outside the current video region:
         #(this can happen when the region moves or changes size)
-        nonvideo = []
-        for r in self.refresh_regions:
-            if not rect.contains_rect(r):
-                nonvideo += r.substract_rect(rect)
+        nonvideo = self.refresh_regions.copy()
+        nonvideo.subtract_rect(rect)
         delay = max(150, self.auto_refresh_delay)
         refreshlog("add_video_refresh(%s) rectangle=%s, delay=%ims", region, rect, delay)
-        self.nonvideo_regions += nonvideo
+        self.nonvideo_regions.union(nonvideo)
         if self.nonvideo_regions:
             if not self.nonvideo_refresh_timer:
                 #refresh via timeout_add so this will run in the UI thread:
                 self.nonvideo_refresh_timer = self.timeout_add(delay, self.nonvideo_refresh)
             #only keep the regions still in the video region:
-            inrect = (rect.intersection_rect(r) for r in self.refresh_regions)
-            self.refresh_regions = [r for r in inrect if r is not None]
+            self.refresh_regions.intersect_rect(rect)
         #re-schedule the video region refresh (if we have regions to fresh):
         if self.refresh_regions:
             self.refresh_timer = self.timeout_add(delay, self.refresh)
@@ -221,7 +218,7 @@ class VideoSubregion(object):
         if nvrt:
             self.nonvideo_refresh_timer = 0
             self.source_remove(nvrt)
-            self.nonvideo_regions = []
+            self.nonvideo_regions = region_set()
 
     def nonvideo_refresh(self):
         self.nonvideo_refresh_timer = 0
@@ -230,7 +227,7 @@ class VideoSubregion(object):
         if not nonvideo:
             return
         if self.refresh_cb(nonvideo):
-            self.nonvideo_regions = []
+            self.nonvideo_regions = region_set()
         #if the refresh didn't fire (refresh_cb() returned False),
         #then we should end up re-scheduling the nonvideo refresh
         #from add_video_refresh()
@@ -244,12 +241,12 @@ class VideoSubregion(object):
         if rect and len(regions)>=2:
             #figure out if it makes sense to refresh the whole area,
             #or if we just send the list of smaller rectangles:
-            pixels = sum(r.width*r.height for r in regions)
+            pixels = regions.get_area()
             if pixels>=rect.width*rect.height//2:
                 regions = [rect]
         refreshlog("refresh() calling %s with regions=%s", self.refresh_cb, regions)
         if self.refresh_cb(regions):
-            self.refresh_regions = []
+            self.refresh_regions = region_set()
         else:
             #retry later
             self.refresh_timer = self.timeout_add(1000, self.refresh)
@@ -22,6 +22,7 @@ damagelog = Logger("window", "damage")
 scalinglog = Logger("scaling")
 iconlog = Logger("icon")
 deltalog = Logger("delta")
+tilelog = Logger("tilecache")
 avsynclog = Logger("av-sync")
 statslog = Logger("stats")
 bandwidthlog = Logger("bandwidth")
@@ -43,6 +44,29 @@ DELTA = envbool("XPRA_DELTA", True)
 MIN_DELTA_SIZE = envint("XPRA_MIN_DELTA_SIZE", 1024)
 MAX_DELTA_SIZE = envint("XPRA_MAX_DELTA_SIZE", 32768)
 MAX_DELTA_HITS = envint("XPRA_MAX_DELTA_HITS", 20)
+#don't bother sending a delta if more than this percentage of rows have changed:
+MAX_DELTA_CHANGED = envint("XPRA_MAX_DELTA_CHANGED", 90)
+TILE_CACHE = envbool("XPRA_TILE_CACHE", True)
+TILE_CACHE_MIN_PIXELS = envint("XPRA_TILE_CACHE_MIN_PIXELS", 256)
+#regions are looked up in the tile cache for these encodings:
+TILE_CACHE_ENCODINGS = ("png", "png/P", "png/L", "rgb24", "rgb32", "jpeg", "webp")
+#but we only store lossless tiles:
+TILE_CACHE_STORE_ENCODINGS = ("png", "rgb24", "rgb32")
+#skip the tiles which have not changed since we last sent them (optional, costs a checksum per tile):
+TILE_DAMAGE = envbool("XPRA_TILE_DAMAGE", False)
+TILE_DAMAGE_SIZE = envint("XPRA_TILE_DAMAGE_SIZE", 64)
+#the client has an exact copy of the pixels sent with these encodings:
+TILE_DAMAGE_LOSSLESS_ENCODINGS = ("png", "rgb24", "rgb32", "mmap")
+#re-use the encoding results of other clients showing the same window:
+SHARED_ENCODE = envbool("XPRA_SHARED_ENCODE", True)
+#the encodings which only depend on the pixels and the encoding parameters:
+SHARED_ENCODINGS = ("png", "png/P", "png/L", "jpeg", "webp", "rgb24", "rgb32")
+#use an exact palette for windows with few colours:
+PALETTE_ENCODING = envbool("XPRA_PALETTE_ENCODING", True)
+#the number of recent attempts at an exact palette we keep for each window:
+PALETTE_PROBES = envint("XPRA_PALETTE_PROBES", 10)
+#how long to wait before trying again when the window had too many colours (in seconds):
+PALETTE_PROBE_DELAY = envint("XPRA_PALETTE_PROBE_DELAY", 10)
 MIN_WINDOW_REGION_SIZE = envint("XPRA_MIN_WINDOW_REGION_SIZE", 1024)
 MAX_SOFT_EXPIRED = envint("XPRA_MAX_SOFT_EXPIRED", 5)
 ACK_JITTER = envint("XPRA_ACK_JITTER", 20)
@@ -64,15 +88,23 @@ DAMAGE_STATISTICS = envbool("XPRA_DAMAGE_STATISTICS", False)
 HARDCODED_ENCODING = os.environ.get("XPRA_HARDCODED_ENCODING")
 
 from xpra.server.window.windowicon_source import WindowIconSource
-from xpra.os_util import memoryview_to_bytes, strtobytes
+from xpra.os_util import memoryview_to_bytes, strtobytes, bytestostr
 from xpra.server.window.content_guesser import guess_content_type, get_content_type_properties
 from xpra.server.window.window_stats import WindowPerformanceStatistics
 from xpra.server.window.batch_config import DamageBatchConfig
 from xpra.simple_stats import get_list_stats
 from xpra.server.window.batch_delay_calculator import calculate_batch_delay, get_target_speed, get_target_quality
 from xpra.server.cystats import time_weighted_average, logp #@UnresolvedImport
-from xpra.server.window.region import rectangle, add_rectangle, remove_rectangle, merge_all   #@UnresolvedImport
-from xpra.codecs.xor.cyxor import xor_str           #@UnresolvedImport
+from xpra.server.window.region import rectangle, region_set, merge_all   #@UnresolvedImport
+from xpra.codecs.xor.cyxor import xor_rows          #@UnresolvedImport
+from xpra.client.tile_cache import TileCache, tile_hash, tile_cost
+from xpra.server.window.shared_encode import get_shared_encode_cache, release_shared_encode_cache
+from xpra.server.window.damage_trace import DAMAGE_TRACE, DamageTraceWriter, get_damage_trace_filename
+from xpra.server.window.strip_encode import STRIP_ENCODINGS, STRIP_MIN_PIXELS, get_strip_pool, split_image
+try:
+    from xpra.server.window.tiles import TileChecksums, crop_image  #@UnresolvedImport
+except ImportError:
+    TileChecksums, crop_image = None, None
 from xpra.codecs.argb.argb import argb_swap         #@UnresolvedImport
 from xpra.codecs.rgb_transform import rgb_reformat
 from xpra.server.picture_encode import rgb_encode, webp_encode, mmap_send
@@ -179,6 +211,25 @@ class WindowSource(WindowIconSource):
             if self.supports_delta:
                 self.delta_buckets = min(25, encoding_options.intget("delta_buckets", 1))
                 self.delta_pixel_data = [None for _ in range(self.delta_buckets)]
+        tile_cache_size = encoding_options.intget("tile-cache", 0)
+        if not window.is_tray() and TILE_CACHE and tile_cache_size>0 and not (mmap and mmap_size>0):
+            #mirrors the client's cache of decoded tiles for this window:
+            self.tile_cache = TileCache(tile_cache_size)
+        if not window.is_tray() and TILE_DAMAGE and TileChecksums:
+            self.tile_checksums = TileChecksums(TILE_DAMAGE_SIZE)
+            self.tile_checksums.resize(ww, wh)
+        if not window.is_tray() and SHARED_ENCODE:
+            self.shared_encode = get_shared_encode_cache(wid)
+        if DAMAGE_TRACE:
+            try:
+                info = {
+                    "encoding"      : encoding or "",
+                    "content-type"  : window.get("content-type") or guess_content_type(window) or "",
+                    }
+                self.damage_trace = DamageTraceWriter(get_damage_trace_filename(wid), wid, ww, wh, info)
+            except (OSError, IOError) as e:
+                log.warn("Warning: cannot record the damage trace for window %i:", wid)
+                log.warn(" %s", e)
         self.batch_config = batch_config
         #auto-refresh:
         self.auto_refresh_delay = auto_refresh_delay
@@ -295,6 +346,10 @@ class WindowSource(WindowIconSource):
             for x in self.enc_pillow.get_encodings():
                 if x in self.server_core_encodings:
                     self._encoders[x] = self.pillow_encode
+        #exact palette when the image has few colours, Pillow's approximate palette otherwise:
+        self.enc_palette = get_codec("enc_palette")
+        if PALETTE_ENCODING and self.enc_palette and "png/P" in self.server_core_encodings:
+            self._encoders["png/P"] = self.palette_encode
         #prefer these native encoders over the Pillow version:
         if "webp" in self.server_core_encodings:
             self._encoders["webp"] = self.webp_encode
@@ -326,6 +381,13 @@ class WindowSource(WindowIconSource):
         self.supports_delta = ()
         self.delta_buckets = 0
         self.delta_pixel_data = ()
+        self.tile_cache = None
+        self.tile_cache_clear = False   #requested by other threads, handled by the encode thread
+        self.tile_cache_reset = False   #the client needs to be told to clear its cache
+        self.tile_checksums = None
+        self.shared_encode = None
+        self.damage_trace = None
+        self.palette_probes = deque(maxlen=PALETTE_PROBES)
         self.suspended = False
         self.strict = STRICT_MODE
         #
@@ -340,7 +402,7 @@ class WindowSource(WindowIconSource):
         self.refresh_event_time = 0
         self.refresh_target_time = 0
         self.refresh_timer = None
-        self.refresh_regions = []
+        self.refresh_regions = region_set()
         self.timeout_timer = None
         self.expire_timer = None
         self.soft_timer = None
@@ -381,6 +443,12 @@ class WindowSource(WindowIconSource):
     def cleanup(self):
         self.cancel_damage()
         log("encoding_totals for wid=%s with primary encoding=%s : %s", self.wid, self.encoding, self.statistics.encoding_totals)
+        sec = self.shared_encode
+        if sec:
+            release_shared_encode_cache(sec)
+        dt = self.damage_trace
+        if dt:
+            dt.close()
         self.init_vars()
         #make sure we don't queue any more screen updates for encoding:
         self._damage_cancelled = INFINITY
@@ -479,6 +547,11 @@ class WindowSource(WindowIconSource):
                                            "buckets"        : self.delta_buckets,
                                            "bucket"         : buckets_info,
                                            },
+                "tile-cache"            : self.get_tile_cache_info(),
+                "tile-damage"           : self.get_tile_checksums_info(),
+                "shared"                : self.get_shared_encode_info(),
+                "strips"                : self.get_strip_encode_info(),
+                "palette"               : self.get_palette_info(),
                 "property"              : self.get_property_info(),
                 "content-type"          : self.content_type or "",
                 "batch"                 : self.batch_config.get_info(),
@@ -866,6 +939,8 @@ class WindowSource(WindowIconSource):
         if depth>24 and "rgb32" in co and self.client_bit_depth>24:
             #the only encoding that can do higher bit depth at present
             return "rgb32"
+        if "png/P" in co and self.use_palette():
+            return "png/P"
         if depth in (24, 32) and "webp" in co and w>=2 and h>=2:
             return "webp"
         if "png" in co and ((quality>=80 and speed<80) or depth<=16):
@@ -874,7 +949,34 @@ class WindowSource(WindowIconSource):
             return "jpeg"
         if "jpeg2000" in co and w>=32 and h>=32:
             return "jpeg2000"
-        return (x for x in co if x!="rgb").next()
+        return next(x for x in co if x!="rgb")
+
+    def use_palette(self):
+        """
+            Windows with few colours (ie: terminals) are best sent with an exact palette,
+            the palette encoder finds out if the image has few enough colours,
+            and we use the result of the recent attempts to decide if it is worth trying again.
+        """
+        if self._encoders.get("png/P")!=self.palette_encode:
+            return False
+        if self.content_type in ("video", "picture") or self.image_depth not in (24, 32):
+            return False
+        probes = tuple(self.palette_probes)
+        if not probes:
+            #no data yet, the hint decides:
+            return self.content_type=="text"
+        fits = sum(1 for _, fit in probes if fit)
+        if fits*2>=len(probes):
+            return True
+        #mostly too many colours, only try again once in a while:
+        return monotonic_time()-probes[-1][0]>=PALETTE_PROBE_DELAY
+
+    def get_palette_info(self):
+        probes = tuple(self.palette_probes)
+        return {
+            "probes"    : len(probes),
+            "fits"      : sum(1 for _, fit in probes if fit),
+            }
 
     def get_current_or_rgb(self, pixel_count, *_args):
         if pixel_count<self._rgb_auto_threshold:
@@ -909,9 +1011,10 @@ class WindowSource(WindowIconSource):
         self.cancel_av_sync_timer()
         self.cancel_decode_error_refresh_timer()
         #if a region was delayed, we can just drop it now:
-        self.refresh_regions = []
+        self.refresh_regions = region_set()
         self._damage_delayed = None
         self.delta_pixel_data = [None for _ in range(self.delta_buckets)]
+        self.reset_tile_checksums()
         #make sure we don't account for those as they will get dropped
         #(generally before encoding - only one may still get encoded):
         for sequence in tuple(self.statistics.encoding_pending.keys()):
@@ -1209,17 +1312,28 @@ class WindowSource(WindowIconSource):
         if ww==0 or wh==0:
             damagelog("damage%s window size %ix%i ignored", (x, y, w, h, options), ww, wh)
             return
+        dt = self.damage_trace
+        if dt:
+            dt.damage(ww, wh, x, y, w, h, options)
         now = monotonic_time()
         if options.pop("damage", False):
             damagelog("damage%s wid=%i", (x, y, w, h, options), self.wid)
             self.statistics.last_damage_events.append((now, x,y,w,h))
             self.global_statistics.damage_events_count += 1
             self.statistics.damage_events_count += 1
+        elif not options.pop("polling", False):
+            #not a damage event or a screen poll (shadow servers):
+            #the client may not have the pixels we think it has
+            #(ie: a refresh request), so we have to send this area again:
+            self.invalidate_tile_checksums(x, y, w, h)
         if self.window_dimensions != (ww, wh):
             self.statistics.last_resized = now
             self.window_dimensions = ww, wh
             log("window dimensions changed: %ix%i", ww, wh)
             self.encode_queue_max_size = max(2, min(30, MAX_SYNC_BUFFER_SIZE//(ww*wh*4)))
+            tc = self.tile_checksums
+            if tc:
+                tc.resize(ww, wh)
         if self.full_frames_only:
             x, y, w, h = 0, 0, ww, wh
         self.do_damage(ww, wh, x, y, w, h, options)
@@ -1236,8 +1350,7 @@ class WindowSource(WindowIconSource):
             #use existing delayed region:
             regions = delayed.regions
             if not self.full_frames_only:
-                region = rectangle(x, y, w, h)
-                add_rectangle(regions, region)
+                regions.add(x, y, w, h)
             #merge/override options
             if options is not None:
                 override = options.get("override_options", False)
@@ -1247,8 +1360,9 @@ class WindowSource(WindowIconSource):
                         continue
                     if override or k not in existing_options:
                         existing_options[k] = options[k]
-            damagelog("do_damage%-24s wid=%s, using existing %i delayed regions created %.1fms ago",
-                (x, y, w, h, options), self.wid, len(regions), now-delayed.damage_time)
+            #(don't use len(regions) here, it would force the region set to merge)
+            damagelog("do_damage%-24s wid=%s, using existing delayed regions created %.1fms ago",
+                (x, y, w, h, options), self.wid, now-delayed.damage_time)
             if not self.expire_timer and not self.soft_timer and self.soft_expired==0:
                 log.error("Error: bug, found a delayed region without a timer!")
                 self.expire_timer = self.timeout_add(0, self.expire_delayed_region)
@@ -1297,7 +1411,8 @@ class WindowSource(WindowIconSource):
             return
 
         #create a new delayed region:
-        regions = [rectangle(x, y, w, h)]
+        regions = region_set()
+        regions.add(x, y, w, h)
         actual_encoding = options.get("encoding", self.encoding)
         self._damage_delayed = DelayedRegions(now, regions, actual_encoding, options)
         damagelog("do_damage%-24s wid=%s, scheduling batching expiry for sequence %s in %i ms", (x, y, w, h, options), self.wid, self._sequence, delay)
@@ -1691,21 +1806,152 @@ class WindowSource(WindowIconSource):
             return
         self.pixel_format = image.get_pixel_format()
         self.image_depth = image.get_depth()
+        self.record_damage_pixels(x, y, image)
 
+        rectangles = self.get_changed_tiles(image, x, y, coding)
         now = monotonic_time()
-        item = (w, h, damage_time, now, image, coding, sequence, options, flush)
-        self.call_in_encode_thread(True, self.make_data_packet_cb, *item)
+        if rectangles is None:
+            item = (w, h, damage_time, now, image, coding, sequence, options, flush)
+            self.call_in_encode_thread(True, self.make_data_packet_cb, *item)
+        else:
+            self.send_changed_tiles(image, x, y, rectangles, damage_time, now, coding, options, flush or 0)
         log("process_damage_region: wid=%i, adding pixel data to encode queue (%4ix%-4i - %5s), elapsed time: %.1f ms, request time: %.1f ms",
                 self.wid, w, h, coding, 1000*(now-damage_time), 1000*(now-rgb_request_time))
 
+    def record_damage_pixels(self, x, y, image):
+        """ saves the pixels we have just captured to the damage trace, if we are recording one """
+        dt = self.damage_trace
+        if dt:
+            dt.pixels(x, y, image)
+
+    def get_changed_tiles(self, image, x, y, coding):
+        """
+            Returns the list of rectangles which have changed since we last sent them,
+            or None if the whole image must be sent.
+            This runs in the UI thread.
+        """
+        tc = self.tile_checksums
+        if not tc:
+            return None
+        if self.full_frames_only:
+            #the client needs the whole window every time:
+            return None
+        rectangles = tc.update(image, x, y, self.is_lossless_tile_coding(coding))
+        if len(rectangles)==1 and rectangles[0]==(x, y, image.get_width(), image.get_height()):
+            return None
+        log("get_changed_tiles: %i changed areas in %s: %s", len(rectangles), (x, y, image.get_width(), image.get_height()), rectangles)
+        return rectangles
+
+    def is_lossless_tile_coding(self, coding):
+        #the client must end up with exactly the pixels we have checksums for,
+        #so no lossy compression and no bit depth conversion:
+        if coding not in TILE_DAMAGE_LOSSLESS_ENCODINGS:
+            return False
+        if coding=="mmap":
+            return True
+        return self.client_bit_depth>16 and (self.image_depth<=24 or self.image_depth==32)
+
+    def send_changed_tiles(self, image, x, y, rectangles, damage_time, process_damage_time, coding, options, flush):
+        """
+            Queues a copy of each changed area of the image for encoding,
+            and frees the image.
+        """
+        n = len(rectangles)
+        for i, (rx, ry, rw, rh) in enumerate(rectangles):
+            self._sequence += 1
+            sub = crop_image(image, rx-x, ry-y, rw, rh)
+            item = (rw, rh, damage_time, process_damage_time, sub, coding, self._sequence, options, flush+n-1-i)
+            self.call_in_encode_thread(True, self.make_data_packet_cb, *item)
+        image.free()
+
+    def invalidate_tile_checksums(self, x, y, w, h):
+        tc = self.tile_checksums
+        if tc:
+            tc.invalidate(x, y, w, h)
+
+    def reset_tile_checksums(self):
+        tc = self.tile_checksums
+        if tc:
+            tc.reset()
+
+    def get_shared_encode_key(self, coding, image, options):
+        """
+            Returns a key which identifies the pixels and all the parameters
+            which can affect the output of the encoder,
+            so that clients with the same key can share the encoding result.
+            This is called from the encode thread.
+        """
+        if coding not in SHARED_ENCODINGS:
+            return None
+        w = image.get_width()
+        h = image.get_height()
+        pixel_format = image.get_pixel_format()
+        q = options.get("quality") or self.get_quality(coding)
+        s = options.get("speed") or self.get_speed(coding)
+        #include every per-client setting the encoders use,
+        #even the ones which do not apply to this encoding:
+        #it is cheaper to miss a few shared results than to send the wrong pixel format
+        params = [
+            coding, pixel_format, image.get_depth(), image.get_rowstride(),
+            q, s, self.supports_transparency,
+            self.client_bit_depth, self.image_depth,
+            tuple(self.rgb_formats or ()), self.rgb_zlib, self.rgb_lz4, self.rgb_lzo,
+            tuple(self.full_csc_modes.strlistget(coding, ())),
+            self.content_type,
+            repr(sorted(options.items())),
+            ]
+        pixels = image.get_pixels()
+        if not pixels:
+            return None
+        return tile_hash(pixels, w, h, pixel_format), tuple(params)
+
+    def get_shared_encode_info(self):
+        sec = self.shared_encode
+        if not sec:
+            return {}
+        return sec.get_info()
+
+    def get_tile_checksums_info(self):
+        tc = self.tile_checksums
+        if not tc:
+            return {}
+        return tc.get_info()
+
+    def use_strips(self, w, h, coding, options):
+        """
+            Large refreshes are split into strips which are encoded in parallel,
+            see make_strip_packets.
+        """
+        if w*h<STRIP_MIN_PIXELS or coding not in STRIP_ENCODINGS or coding not in self._encoders:
+            return False
+        if not options.get("auto_refresh") or self.full_frames_only:
+            return False
+        return get_strip_pool() is not None
+
+    def get_strip_encode_info(self):
+        p = get_strip_pool(False)
+        if not p:
+            return {}
+        return p.get_info()
+
 
     def make_data_packet_cb(self, w, h, damage_time, process_damage_time, image, coding, sequence, options, flush):
         """ This function is called from the damage data thread!
             Extra care must be taken to prevent access to X11 functions on window.
         """
+        if self.use_strips(w, h, coding, options):
+            strips = split_image(image)
+            if strips:
+                self.make_strip_packets(w, h, damage_time, process_damage_time, image, strips, coding, sequence, options, flush)
+                return
         self.statistics.encoding_pending[sequence] = (damage_time, w, h)
         try:
             packet = self.make_data_packet(damage_time, process_damage_time, image, coding, sequence, options, flush)
+        except Exception:
+            #the client won't get the pixels we have recorded checksums for,
+            #forget them now, before more damage is compared against them:
+            self.reset_tile_checksums()
+            raise
         finally:
             self.free_image_wrapper(image)
             del image
@@ -1717,10 +1963,49 @@ class WindowSource(WindowIconSource):
         #NOTE: we MUST send it (even if the window is cancelled by now..)
         #because the code may rely on the client having received this frame
         if not packet:
+            #the client won't get the pixels we have recorded checksums for:
+            self.reset_tile_checksums()
             return
         #queue packet for sending:
         self.queue_damage_packet(packet, damage_time, process_damage_time, options)
 
+    def make_strip_packets(self, w, h, damage_time, process_damage_time, image, strips, coding, sequence, options, flush):
+        """ This function is called from the damage data thread!
+            Encodes the horizontal strips of the image in parallel,
+            and sends each strip as a separate draw packet for the same damage sequence.
+        """
+        self.statistics.encoding_pending[sequence] = (damage_time, w, h)
+        packets = []
+        try:
+            encoder = self._encoders.get(coding)
+            if encoder is None or self.is_cancelled(sequence) or self.suspended:
+                log("make_strip_packets: dropping data packet for window %s with sequence=%s", self.wid, sequence)
+            else:
+                results = get_strip_pool().encode(encoder, [(coding, strip, options) for strip in strips])
+                n = len(strips)
+                for i, (strip, ret) in enumerate(zip(strips, results)):
+                    packet = self.make_data_packet(damage_time, process_damage_time, strip, coding, sequence, options, (flush or 0)+n-1-i, ret)
+                    if packet:
+                        packets.append(packet)
+        except Exception:
+            self.reset_tile_checksums()
+            raise
+        finally:
+            #the strips use the image's pixel buffer, so free them first:
+            for strip in strips:
+                strip.free()
+            self.free_image_wrapper(image)
+            del image
+            try:
+                del self.statistics.encoding_pending[sequence]
+            except KeyError:
+                pass
+        if len(packets)<len(strips):
+            #the client won't get all the pixels we have recorded checksums for:
+            self.reset_tile_checksums()
+        for packet in packets:
+            self.queue_damage_packet(packet, damage_time, process_damage_time, options)
+
 
     def schedule_auto_refresh(self, packet, options):
         if not self.can_refresh():
@@ -1729,7 +2014,7 @@ class WindowSource(WindowIconSource):
         encoding = strtobytes(packet[6])
         region = rectangle(*packet[2:6])    #x,y,w,h
         client_options = packet[10]     #info about this packet from the encoder
-        if (encoding.startswith(b"png") and (self.image_depth<=24 or self.image_depth==32)) or encoding.startswith(b"rgb"):
+        if (encoding.startswith(b"png") and (self.image_depth<=24 or self.image_depth==32)) or encoding.startswith(b"rgb") or encoding==b"cache":
             actual_quality = 100
             lossy = False
         else:
@@ -1768,9 +2053,7 @@ class WindowSource(WindowIconSource):
         now = monotonic_time()
         if schedule:
             #figure out the proportion of pixels that need refreshing:
-            #(some of those rectangles may overlap,
-            # so the value may be greater than the size of the window)
-            pixels = sum(rect.width*rect.height for rect in self.refresh_regions)
+            pixels = self.refresh_regions.get_area()
             ww, wh = self.window_dimensions
             pct = int(min(100, 100*pixels//(ww*wh)) * (1+self.global_statistics.congestion_value))
             if not self.refresh_timer:
@@ -1793,14 +2076,14 @@ class WindowSource(WindowIconSource):
     def remove_refresh_region(self, region):
         #removes the given region from the refresh list
         #(also overriden in window video source)
-        remove_rectangle(self.refresh_regions, region)
+        self.refresh_regions.subtract_rect(region)
 
     def add_refresh_region(self, region):
         #adds the given region to the refresh list
         #returns the number of pixels in the region update
         #(overriden in window video source to exclude the video region)
         #Note: this does not run in the UI thread!
-        add_rectangle(self.refresh_regions, region)
+        self.refresh_regions.add_rect(region)
         return region.width*region.height
 
     def can_refresh(self):
@@ -1849,12 +2132,14 @@ class WindowSource(WindowIconSource):
         ret = self.refresh_event_time
         self.refresh_event_time = 0
         regions = self.refresh_regions
-        self.refresh_regions = []
+        self.refresh_regions = region_set()
         if self.can_refresh() and regions and ret>0:
             now = monotonic_time()
             options = self.get_refresh_options()
             refresh_exclude = self.get_refresh_exclude()
             refreshlog("timer_full_refresh() after %ims, auto_refresh_encodings=%s, options=%s, regions=%s, refresh_exclude=%s", 1000.0*(monotonic_time()-ret), self.auto_refresh_encodings, options, regions, refresh_exclude)
+            for r in regions:
+                self.invalidate_tile_checksums(r.x, r.y, r.width, r.height)
             WindowSource.do_send_delayed_regions(self, now, regions, self.auto_refresh_encodings[0], options, exclude_region=refresh_exclude, get_best_encoding=self.get_refresh_encoding)
         return False
 
@@ -1889,7 +2174,7 @@ class WindowSource(WindowIconSource):
         refresh_regions = self.refresh_regions
         #since we're going to refresh the whole window,
         #we don't need to track what needs refreshing:
-        self.refresh_regions = []
+        self.refresh_regions = region_set()
         w, h = self.window_dimensions
         refreshlog("full_quality_refresh() for %sx%s window with pending refresh regions: %s", w, h, refresh_regions)
         new_options = damage_options.copy()
@@ -1898,6 +2183,7 @@ class WindowSource(WindowIconSource):
         refreshlog("full_quality_refresh() using %s with options=%s", encoding, new_options)
         #just refresh the whole window:
         regions = [rectangle(0, 0, w, h)]
+        self.reset_tile_checksums()
         now = monotonic_time()
         damage = DelayedRegions(now, regions, encoding, new_options)
         self.send_delayed_regions(damage)
@@ -2085,6 +2371,20 @@ class WindowSource(WindowIconSource):
             #call via idle_add to prevent race conditions:
             self.idle_add(call_may_send_delayed)
 
+    def get_tile_cache_info(self):
+        tc = self.tile_cache
+        if not tc:
+            return {"" : False}
+        info = tc.get_info()
+        info[""] = True
+        return info
+
+    def clear_tile_cache(self):
+        #the encode thread will clear the cache before its next lookup,
+        #so a packet can never reference a tile which has just been discarded:
+        if self.tile_cache:
+            self.tile_cache_clear = True
+
     def client_decode_error(self, error, message):
         #don't print error code -1, which is just a generic code for error
         emsg = {-1 : ""}.get(error, error)
@@ -2098,6 +2398,8 @@ class WindowSource(WindowIconSource):
         self.global_statistics.decode_errors += 1
         #something failed client-side, so we can't rely on the delta being available
         self.delta_pixel_data = [None for _ in range(self.delta_buckets)]
+        self.clear_tile_cache()
+        self.reset_tile_checksums()
         if self.window:
             delay = min(1000, 250+self.global_statistics.decode_errors*100)
             self.decode_error_refresh_timer = self.timeout_add(delay, self.decode_error_refresh)
@@ -2113,12 +2415,13 @@ class WindowSource(WindowIconSource):
             self.source_remove(dert)
 
 
-    def make_data_packet(self, damage_time, process_damage_time, image, coding, sequence, options, flush):
+    def make_data_packet(self, damage_time, process_damage_time, image, coding, sequence, options, flush, encoded=None):
         """
             Picture encoding - non-UI thread.
             Converts a damage item picked from the 'compression_work_queue'
             by the 'encode' thread and returns a packet
             ready for sending by the network layer.
+            'encoded' is the result of the encoder if it has already been called.
 
             * 'mmap' will use 'mmap_encode'
             * 'jpeg' and 'png' are handled by 'pillow_encode'
@@ -2143,21 +2446,37 @@ class WindowSource(WindowIconSource):
         start = monotonic_time()
         delta, store, bucket, hits = -1, -1, -1, 0
         pixel_format = image.get_pixel_format()
+        #the client may have these exact pixels in its tile cache already:
+        #(keep a reference: cleanup() may clear the attribute while we encode)
+        tile_key, tile_hit = None, False
+        tc = self.tile_cache
+        if tc and self.tile_cache_clear:
+            self.tile_cache_clear = False
+            tc.clear()
+            #tell the client to do the same, with the next tile we ask it to store:
+            self.tile_cache_reset = True
+        if tc and encoded is None and coding in TILE_CACHE_ENCODINGS and isize>=TILE_CACHE_MIN_PIXELS:
+            image.may_restride()
+            tile_key = tile_hash(image.get_pixels(), w, h, pixel_format)
+            #until the client has cleared its cache, it cannot paint anything from it:
+            tile_hit = not self.tile_cache_reset and tile_key in tc
+            tilelog("tile cache %s for %ix%i %s pixels on wid=%i: %#x", ["miss", "hit"][tile_hit], w, h, pixel_format, self.wid, tile_key)
         #use delta pre-compression for this encoding if:
         #* client must support delta (at least one bucket)
         #* encoding must be one that supports delta (usually rgb24/rgb32 or png)
         #* size is worth xoring (too small is pointless, too big is too expensive)
         #* the pixel format is supported by the client
         # (if we have to rgb_reformat the buffer, it really complicates things)
-        if self.delta_buckets>0 and (coding in self.supports_delta) and self.min_delta_size<isize<self.max_delta_size and \
+        if encoded is None and not tile_hit and self.delta_buckets>0 and (coding in self.supports_delta) and self.min_delta_size<isize<self.max_delta_size and \
             pixel_format in self.rgb_formats:
             #this may save space (and lower the cost of xoring):
             image.may_restride()
             #we need to copy the pixels because some encodings
             #may modify the pixel array in-place!
+            #(and we want a writable copy so we can xor into it next time)
             dpixels = image.get_pixels()
             assert dpixels, "failed to get pixels from %s" % image
-            dpixels = memoryview_to_bytes(dpixels)
+            dpixels = bytearray(dpixels)
             dlen = len(dpixels)
             store = sequence
             deltalog("delta available for %s and %i %s pixels on wid=%i", coding, isize, pixel_format, self.wid)
@@ -2167,34 +2486,59 @@ class WindowSource(WindowIconSource):
                 lw, lh, lpixel_format, lcoding, lsequence, buflen, ldata, hits, _ = dr
                 if lw==w and lh==h and lpixel_format==pixel_format and lcoding==coding and buflen==dlen:
                     bucket = i
+                    #the bucket's pixels will be replaced by the new ones (if the packet is sent),
+                    #so we can clear it and xor into its buffer:
+                    self.delta_pixel_data[i] = None
                     if MAX_DELTA_HITS>0 and hits<MAX_DELTA_HITS:
-                        deltalog("delta: using matching bucket %s: %sx%s (%s, %i bytes, sequence=%i, hit count=%s)", i, lw, lh, lpixel_format, dlen, lsequence, hits)
-                        #xor with this matching delta bucket:
-                        delta = lsequence
-                        xored = xor_str(dpixels, ldata)
-                        image.set_pixels(xored)
-                        dr[-1] = monotonic_time()            #update last used time
-                        hits += 1
-                        dr[-2] = hits               #update hit count
+                        changed = xor_rows(dpixels, ldata, ldata, image.get_rowstride())
+                        nchanged = sum(changed)
+                        if nchanged*100<=len(changed)*MAX_DELTA_CHANGED:
+                            deltalog("delta: using matching bucket %s: %sx%s (%s, %i bytes, sequence=%i, hit count=%s, %i rows changed)", i, lw, lh, lpixel_format, dlen, lsequence, hits, nchanged)
+                            delta = lsequence
+                            image.set_pixels(ldata)
+                            hits += 1
+                            break
+                        deltalog("delta: %i rows out of %i have changed, not using bucket %s", nchanged, len(changed), i)
                     else:
                         deltalog("delta: too many hits for bucket %s: %s, clearing it", bucket, hits)
-                        hits = 0
-                        self.delta_pixel_data[i] = None
-                        delta = -1
+                    hits = 0
                     break
 
-        #by default, don't set rowstride (the container format will take care of providing it):
-        encoder = self._encoders.get(coding)
-        if encoder is None:
-            if self.is_cancelled(sequence):
-                return None
-            else:
-                raise Exception("BUG: no encoder not found for %s" % coding)
-        ret = encoder(coding, image, options)
-        if ret is None:
-            log("%s%s returned None", encoder, (coding, image, options))
-            #something went wrong.. nothing we can do about it here!
-            return  None
+        if tile_hit:
+            #no need to encode anything, the client will paint the tile from its cache:
+            ret = "cache", b"", {"cache" : tile_key}, w, h, 0, 32
+        elif encoded is not None:
+            ret = encoded
+        else:
+            #by default, don't set rowstride (the container format will take care of providing it):
+            encoder = self._encoders.get(coding)
+            if encoder is None:
+                if self.is_cancelled(sequence):
+                    return None
+                else:
+                    raise Exception("BUG: no encoder not found for %s" % coding)
+            ret = None
+            #another client may have encoded these same pixels already:
+            sec = self.shared_encode
+            shared_key = None
+            if sec and sec.users>1 and delta<0:
+                shared_key = self.get_shared_encode_key(coding, image, options)
+                if shared_key is not None:
+                    ret = sec.claim(shared_key)
+                    log("shared encode %s for %s on wid=%i", ["miss", "hit"][ret is not None], coding, self.wid)
+            if ret is None:
+                try:
+                    ret = encoder(coding, image, options)
+                finally:
+                    if shared_key is not None:
+                        if ret:
+                            sec.add(shared_key, ret)
+                        else:
+                            sec.abort(shared_key)
+            if ret is None:
+                log("%s%s returned None", encoder, (coding, image, options))
+                #something went wrong.. nothing we can do about it here!
+                return  None
 
         coding, data, client_options, outw, outh, outstride, bpp = ret
         coding = strtobytes(coding)
@@ -2203,6 +2547,8 @@ class WindowSource(WindowIconSource):
         if coding!="mmap" and (self.is_cancelled(sequence) or self.suspended):
             log("make_data_packet: dropping data packet for window %s with sequence=%s", self.wid, sequence)
             return  None
+        if tile_key is not None:
+            self.update_tile_cache(tc, tile_key, tile_hit, coding, client_options, w, h, outw, outh)
         #tell client about delta/store for this pixmap:
         if delta>=0:
             client_options["delta"] = delta
@@ -2265,6 +2611,22 @@ class WindowSource(WindowIconSource):
         self.statistics.encoding_stats.append((end, coding, w*h, bpp, csize, end-start))
         return self.make_draw_packet(x, y, outw, outh, coding, data, outstride, client_options, options)
 
+    def update_tile_cache(self, tc, key, hit, coding, client_options, w, h, outw, outh):
+        #this must be called in the same order as the packets are sent,
+        #so the client's cache evicts the same tiles as ours:
+        if hit:
+            assert not self.tile_cache_reset
+            tc.get(key)
+        elif bytestostr(coding) in TILE_CACHE_STORE_ENCODINGS and (outw, outh)==(w, h) and \
+            (self.image_depth<=24 or self.image_depth==32) and tc.can_store(tile_cost(w, h)):
+            tc.add(key, tile_cost(w, h))
+            client_options["cache-store"] = key
+        else:
+            return
+        if self.tile_cache_reset:
+            self.tile_cache_reset = False
+            client_options["cache-reset"] = True
+
     def make_draw_packet(self, x, y, outw, outh, coding, data, outstride, client_options={}, _options={}):
         packet = ("draw", self.wid, x, y, outw, outh, strtobytes(coding), data, self._damage_packet_sequence, outstride, client_options)
         self.global_statistics.packet_count += 1
@@ -2317,14 +2679,36 @@ class WindowSource(WindowIconSource):
         transparency = self.supports_transparency and options.get("transparency", True)
         return self.enc_pillow.encode(coding, image, q, s, transparency)
 
+    def palette_encode(self, coding, image, options):
+        s = options.get("speed") or self.get_speed(coding)
+        transparency = self.supports_transparency and options.get("transparency", True)
+        ret = self.enc_palette.encode(image, s, transparency)
+        self.palette_probes.append((monotonic_time(), ret is not None))
+        if ret:
+            return ret
+        #too many colours for an exact palette:
+        if (self.encoding=="png/P" or image.get_pixel_format()=="RLE8") and self.enc_pillow and "png/P" in self.enc_pillow.get_encodings():
+            #use Pillow's approximate palette:
+            return self.pillow_encode(coding, image, options)
+        #otherwise use the encoding we would have chosen without the palette,
+        #the failed attempt we just recorded prevents 'use_palette' from choosing it again:
+        q = options.get("quality") or self._current_quality
+        fallback = WindowSource.get_auto_encoding(self, image.get_width(), image.get_height(), s, q)
+        encoder = self._encoders.get(fallback)
+        if fallback=="png/P" or not encoder:
+            fallback = "rgb24"
+            encoder = self.rgb_encode
+        log("palette_encode: too many colours, using %s", fallback)
+        return encoder(fallback, image, options)
+
     def mmap_encode(self, coding, image, _options):
         assert coding=="mmap"
         assert self._mmap and self._mmap_size>0
         v = mmap_send(self._mmap, self._mmap_size, image, self.rgb_formats, self.supports_transparency)
         if v is None:
             return None
-        mmap_info, mmap_free_size, written = v
+        mmap_info, mmap_free_size, written, rowstride = v
         self.global_statistics.mmap_bytes_sent += written
         self.global_statistics.mmap_free_size = mmap_free_size
         #the data we send is the index within the mmap area:
-        return "mmap", mmap_info, {"rgb_format" : image.get_pixel_format()}, image.get_width(), image.get_height(), image.get_rowstride(), 32
+        return "mmap", mmap_info, {"rgb_format" : image.get_pixel_format()}, image.get_width(), image.get_height(), rowstride, 32
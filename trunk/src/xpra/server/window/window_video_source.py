@@ -13,11 +13,12 @@ from collections import OrderedDict
 
 from xpra.net.compression import Compressed, LargeStructure
 from xpra.codecs.codec_constants import TransientCodecException, RGB_FORMATS, PIXEL_SUBSAMPLING
-from xpra.server.window.window_source import WindowSource, DelayedRegions, STRICT_MODE, AUTO_REFRESH_SPEED, AUTO_REFRESH_QUALITY, MAX_RGB
-from xpra.server.window.region import merge_all          #@UnresolvedImport
+from xpra.server.window.window_source import WindowSource, DelayedRegions, STRICT_MODE, AUTO_REFRESH_SPEED, AUTO_REFRESH_QUALITY, MAX_RGB, crop_image
+from xpra.server.window.region import region_set, merge_all          #@UnresolvedImport
 from xpra.server.window.motion import ScrollData                    #@UnresolvedImport
 from xpra.server.window.video_subregion import VideoSubregion, VIDEO_SUBREGION
 from xpra.server.window.video_scoring import get_pipeline_score
+from xpra.server.background_worker import add_work_item, PRIORITY_LOW
 from xpra.codecs.codec_constants import PREFERED_ENCODING_ORDER, EDGE_ENCODING_ORDER
 from xpra.util import parse_scaling_value, engs, envint, envbool, csv, roundup, print_nested_dict, first_time
 from xpra.os_util import monotonic_time, strtobytes, bytestostr, PYTHON3
@@ -74,6 +75,10 @@ del SCALING_OPTIONS_STR
 scalinglog("scaling options: SCALING=%s, HARDCODED=%s, PPS_TARGET=%i, MIN_PPS=%i, OPTIONS=%s", SCALING, SCALING_HARDCODED, SCALING_PPS_TARGET, SCALING_MIN_PPS, SCALING_OPTIONS)
 
 DEBUG_VIDEO_CLEAN = envbool("XPRA_DEBUG_VIDEO_CLEAN", False)
+#software codecs only free memory when they are cleaned,
+#so we can let the worker threads do it in parallel with other background work:
+PARALLEL_VIDEO_CLEAN = envbool("XPRA_PARALLEL_VIDEO_CLEAN", True)
+PARALLEL_CLEAN_CODECS = ("x264", "x265", "vpx", "libyuv", "swscale")
 
 FORCE_AV_DELAY = envint("XPRA_FORCE_AV_DELAY", 0)
 B_FRAMES = envbool("XPRA_B_FRAMES", True)
@@ -307,18 +312,30 @@ class WindowVideoSource(WindowSource):
             def clean():
                 if DEBUG_VIDEO_CLEAN:
                     log.warn("video_context_clean() done")
-                self.csc_clean(csce)
-                self.ve_clean(ve)
+                #we no longer hold a reference to these codecs,
+                #and the encode thread is done with them:
+                self.csc_clean(csce, PARALLEL_VIDEO_CLEAN)
+                self.ve_clean(ve, PARALLEL_VIDEO_CLEAN)
             self.call_in_encode_thread(False, clean)
 
-    def csc_clean(self, csce):
+    def codec_clean(self, codec, parallel=False):
+        """
+            Hardware codecs (ie: nvenc) must release their context
+            before we create the next pipeline, so they are always cleaned here.
+        """
+        if parallel and codec.get_type() in PARALLEL_CLEAN_CODECS:
+            add_work_item(codec.clean, PRIORITY_LOW, True)
+        else:
+            codec.clean()
+
+    def csc_clean(self, csce, parallel=False):
         if csce:
-            csce.clean()
+            self.codec_clean(csce, parallel)
 
-    def ve_clean(self, ve):
+    def ve_clean(self, ve, parallel=False):
         self.cancel_video_encoder_timer()
         if ve:
-            ve.clean()
+            self.codec_clean(ve, parallel)
             #only send eos if this video encoder is still current,
             #(otherwise, sending the new stream will have taken care of it already,
             # and sending eos then would close the new stream, not the old one!)
@@ -498,6 +515,8 @@ class WindowVideoSource(WindowSource):
                 return "rgb24"
             if "rgb32" in options:
                 return "rgb32"
+        if "png/P" in options and self.use_palette():
+            return "png/P"
         #use sliding scale for lossless threshold
         #(high speed favours switching to lossy sooner)
         #take into account how many pixels need to be encoded:
@@ -759,6 +778,7 @@ class WindowVideoSource(WindowSource):
 
         if actual_vr is None:
             sublog("do_send_delayed_regions: video region %s not found in: %s", vr, regions)
+            regions = region_set(regions)
         else:
             #found the video region:
             #sanity check in case the window got resized since:
@@ -772,9 +792,8 @@ class WindowVideoSource(WindowSource):
             self.process_damage_region(damage_time, actual_vr.x, actual_vr.y, actual_vr.width, actual_vr.height, coding, video_options, 0)
 
             #now substract this region from the rest:
-            trimmed = []
-            for r in regions:
-                trimmed += r.substract_rect(actual_vr)
+            trimmed = region_set(regions)
+            trimmed.subtract_rect(actual_vr)
             if not trimmed:
                 sublog("do_send_delayed_regions: nothing left after removing video region %s", actual_vr)
                 return
@@ -785,7 +804,7 @@ class WindowVideoSource(WindowSource):
         #(this codepath can fire from a video region refresh callback)
         dr = self._damage_delayed
         if dr:
-            regions = dr.regions + regions
+            regions.union(dr.regions)
             damage_time = min(damage_time, dr.damage_time)
             self._damage_delayed = None
             self.cancel_expire_timer()
@@ -846,6 +865,7 @@ class WindowVideoSource(WindowSource):
             return
         self.pixel_format = image.get_pixel_format()
         self.image_depth = image.get_depth()
+        self.record_damage_pixels(x, y, image)
         #image may have been clipped to the new window size during resize:
         w = image.get_width()
         h = image.get_height()
@@ -876,6 +896,17 @@ class WindowVideoSource(WindowSource):
             else:
                 self.encode_queue.append(item)
                 self.schedule_encode_from_queue(av_delay)
+        if coding in self.video_encodings or coding=="auto":
+            #the client won't have the exact pixels:
+            self.invalidate_tile_checksums(x, y, w, h)
+        else:
+            rectangles = self.get_changed_tiles(image, x, y, coding)
+            if rectangles is not None:
+                n = len(rectangles)
+                for i, (rx, ry, rw, rh) in enumerate(rectangles):
+                    call_encode(rw, rh, crop_image(image, rx-x, ry-y, rw, rh), coding, flush+n-1-i)
+                image.free()
+                return
         #now figure out if we need to send edges separately:
         if coding in self.video_encodings and self.edge_encoding and not VIDEO_SKIP_EDGE:
             dw = w - (w & self.width_mask)
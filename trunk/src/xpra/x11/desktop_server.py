@@ -455,7 +455,7 @@ class XpraDesktopServer(DesktopServerBaseClass):
 
     def _contents_changed(self, window, event):
         log("contents changed on %s: %s", window, event)
-        self.refresh_window_area(window, event.x, event.y, event.width, event.height)
+        self.refresh_window_area(window, event.x, event.y, event.width, event.height, options={"damage" : True})
 
 
     def _set_window_state(self, proto, wid, window, new_window_state):
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# This file is part of Xpra.
+# Copyright (C) 2018 Antoine Martin <antoine@xpra.org>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+from xpra.x11.gtk_x11.window_damage import WindowDamageHandler
+from xpra.gtk_common.gobject_compat import import_gobject
+gobject = import_gobject()
+
+from xpra.log import Logger
+log = Logger("x11", "shadow")
+
+
+class RootDamageHandler(WindowDamageHandler, gobject.GObject):
+    """
+        Subscribes to the XDamage events of the root window
+        and passes the damaged rectangles to the callback.
+        (this requires the X11 event filter)
+    """
+    __gsignals__ = WindowDamageHandler.__common_gsignals__.copy()
+
+    def __init__(self, root, callback):
+        WindowDamageHandler.__init__(self, root, use_xshm=False)
+        gobject.GObject.__init__(self)
+        self.callback = callback
+
+    def __repr__(self):
+        return "RootDamageHandler(%#x)" % self.xid
+
+    def do_xpra_damage_event(self, event):
+        log("root damage: %s", (event.x, event.y, event.width, event.height))
+        self.callback(event.x, event.y, event.width, event.height)
+
+gobject.type_register(RootDamageHandler)
@@ -9,6 +9,8 @@ from xpra.x11.gtk_x11.gdk_display_source import init_gdk_display_source
 init_gdk_display_source()
 from xpra.x11.x11_server_core import X11ServerCore
 
+from collections import deque
+
 from xpra.os_util import monotonic_time
 from xpra.util import envbool, envint
 from xpra.gtk_common.gtk_util import get_xwindow, is_gtk3
@@ -25,6 +27,14 @@ USE_XSHM = envbool("XPRA_XSHM", True)
 POLL_CURSOR = envint("XPRA_POLL_CURSOR", 20)
 USE_NVFBC = envbool("XPRA_NVFBC", True)
 USE_NVFBC_CUDA = envbool("XPRA_NVFBC_CUDA", True)
+USE_XDAMAGE = envbool("XPRA_SHADOW_XDAMAGE", True)
+#when the damaged area is smaller than this percentage of the screen,
+#the rectangles are captured with XGetImage instead of a full XShm capture:
+XDAMAGE_XSHM_PCT = envint("XPRA_SHADOW_XDAMAGE_XSHM", 20)
+#the shortest delay between a damage event and the capture:
+XDAMAGE_MIN_DELAY = envint("XPRA_SHADOW_XDAMAGE_MIN_DELAY", 5)
+#the period used for calculating the capture statistics, in seconds:
+CAPTURE_INFO_PERIOD = 10
 if USE_NVFBC:
     try:
         from xpra.codecs.nvfbc.fbc_capture_linux import init_module, NvFBC_SysCapture, NvFBC_CUDACapture    #@UnresolvedImport
@@ -38,6 +48,8 @@ class XImageCapture(object):
     def __init__(self, xwindow):
         self.xshm = None
         self.xwindow = xwindow
+        #(time, elapsed, pixels) for each capture:
+        self.captures = deque(maxlen=1000)
         assert USE_XSHM and XImage.has_XShm(), "no XShm support"
 
     def __repr__(self):
@@ -46,6 +58,20 @@ class XImageCapture(object):
     def clean(self):
         self.close_xshm()
 
+    def get_info(self):
+        now = monotonic_time()
+        recent = [(e, p) for t, e, p in tuple(self.captures) if t>now-CAPTURE_INFO_PERIOD]
+        return {
+            "type"              : self.get_type(),
+            "captures"          : len(recent),
+            #milliseconds spent capturing per second:
+            "time-per-second"   : int(1000*sum(e for e, _ in recent)/CAPTURE_INFO_PERIOD),
+            "pixels-per-second" : sum(p for _, p in recent)//CAPTURE_INFO_PERIOD,
+            }
+
+    def get_type(self):
+        return "XShm"
+
     def close_xshm(self):
         xshm = self.xshm
         if self.xshm:
@@ -91,9 +117,64 @@ class XImageCapture(object):
             return None
         finally:
             end = monotonic_time()
+            self.captures.append((end, end-start, width*height))
             log("X11 shadow captured %s pixels at %i MPixels/s using %s", width*height, (width*height/(end-start))//1024//1024, ["GTK", "XSHM"][USE_XSHM])
 
 
+class XDamageCapture(XImageCapture):
+    """
+        Only captures the areas of the root window reported by XDamage:
+        small updates are retrieved with XGetImage,
+        large ones with a full XShm capture.
+    """
+    def __init__(self, xwindow, width, height):
+        XImageCapture.__init__(self, xwindow)
+        self.width = width
+        self.height = height
+        self.damage = []
+        self.use_xshm = True
+
+    def __repr__(self):
+        return "XDamageCapture(%#x)" % self.xwindow
+
+    def get_type(self):
+        return "XDamage"
+
+    def add_damage(self, x, y, width, height):
+        self.damage.append((x, y, width, height))
+
+    def take_damage(self):
+        """
+            Returns the rectangles damaged since the last call
+            and chooses the capture method for them.
+        """
+        damage = self.damage
+        if not damage:
+            return ()
+        self.damage = []
+        area = sum(w*h for _, _, w, h in damage)
+        self.use_xshm = area*100>=self.width*self.height*XDAMAGE_XSHM_PCT
+        if self.use_xshm:
+            XImageCapture.refresh(self)
+        return damage
+
+    def get_image(self, x, y, width, height):
+        if self.use_xshm:
+            if self.xshm is None:
+                XImageCapture.refresh(self)
+            return XImageCapture.get_image(self, x, y, width, height)
+        start = monotonic_time()
+        try:
+            with xsync:
+                return XImage.get_ximage(self.xwindow, x, y, width, height)
+        except Exception as e:
+            self._err(e)
+            return None
+        finally:
+            end = monotonic_time()
+            self.captures.append((end, end-start, width*height))
+
+
 def setup_capture(window):
     ww, wh = window.get_geometry()[2:4]
     capture = None
@@ -128,6 +209,9 @@ class ShadowX11Server(GTKShadowServerBase, X11ServerCore):
         GTKShadowServerBase.__init__(self)
         X11ServerCore.__init__(self)
         self.session_type = "shadow"
+        self.root_damage = None
+        self.x11_filter = False
+        self.damage_refreshes = deque(maxlen=100)
 
     def init(self, opts):
         GTKShadowServerBase.init(self, opts)
@@ -136,10 +220,87 @@ class ShadowX11Server(GTKShadowServerBase, X11ServerCore):
     def cleanup(self):
         GTKShadowServerBase.cleanup(self)
         X11ServerCore.cleanup(self)
+        if self.x11_filter:
+            self.x11_filter = False
+            from xpra.x11.gtk_x11.gdk_bindings import cleanup_x11_filter #@UnresolvedImport
+            cleanup_x11_filter()
 
 
     def setup_capture(self):
-        return setup_capture(self.root)
+        capture = setup_capture(self.root)
+        if not USE_XDAMAGE or type(capture)!=XImageCapture:
+            return capture
+        try:
+            from xpra.x11.gtk_x11.gdk_bindings import init_x11_filter  #@UnresolvedImport
+            from xpra.x11.root_damage import RootDamageHandler
+            if init_x11_filter():
+                self.x11_filter = True
+            with xsync:
+                root_damage = RootDamageHandler(self.root, self.root_damaged)
+                root_damage.setup()
+        except Exception as e:
+            log("setup_capture()", exc_info=True)
+            log.warn("Warning: cannot use XDamage, the screen will be polled")
+            log.warn(" %s", e)
+            return capture
+        self.root_damage = root_damage
+        capture.clean()
+        w, h = self.root.get_geometry()[2:4]
+        capture = XDamageCapture(get_xwindow(self.root), w, h)
+        log("setup_capture()=%s", capture)
+        return capture
+
+    def cleanup_capture(self):
+        GTKShadowServerBase.cleanup_capture(self)
+        rd = self.root_damage
+        if rd:
+            self.root_damage = None
+            rd.destroy()
+
+
+    def root_damaged(self, x, y, width, height):
+        capture = self.capture
+        if not isinstance(capture, XDamageCapture):
+            return
+        capture.add_damage(x, y, width, height)
+        if self.mapped and not self.refresh_timer:
+            self.refresh_timer = self.timeout_add(self.get_damage_refresh_delay(), self.refresh)
+
+    def get_damage_refresh_delay(self):
+        #capture isolated updates quickly,
+        #and batch them at the configured refresh rate when the screen is busy:
+        now = monotonic_time()
+        n = len([t for t in tuple(self.damage_refreshes) if t>now-1])
+        max_rate = max(1, 1000//self.refresh_delay)
+        return max(XDAMAGE_MIN_DELAY, min(self.refresh_delay, self.refresh_delay*n//max_rate))
+
+    def refresh(self):
+        capture = self.capture
+        if not isinstance(capture, XDamageCapture):
+            #polling:
+            return GTKShadowServerBase.refresh(self)
+        #the timer is re-scheduled by the next damage event:
+        self.refresh_timer = None
+        if not self.mapped:
+            return False
+        #subtract the damage before capturing, so we can't miss any updates:
+        rd = self.root_damage
+        if rd:
+            rd.acknowledge_changes()
+        rectangles = capture.take_damage()
+        log("refresh() damage=%s", rectangles)
+        if not rectangles:
+            return False
+        self.damage_refreshes.append(monotonic_time())
+        for window in self._id_to_window.values():
+            wx, wy, ww, wh = window.geometry
+            for x, y, w, h in rectangles:
+                #clip to this monitor:
+                x1, y1 = max(x, wx), max(y, wy)
+                x2, y2 = min(x+w, wx+ww), min(y+h, wy+wh)
+                if x2>x1 and y2>y1:
+                    self.refresh_window_area(window, x1-wx, y1-wy, x2-x1, y2-y1, {"damage" : True})
+        return False
 
 
     def last_client_exited(self):
@@ -161,6 +322,14 @@ class ShadowX11Server(GTKShadowServerBase, X11ServerCore):
         info = X11ServerCore.get_info(self, proto)
         info.setdefault("features", {})["shadow"] = True
         info.setdefault("server", {})["type"] = "Python/gtk%i/x11-shadow" % (2+is_gtk3())
+        capture = self.capture
+        if isinstance(capture, XImageCapture):
+            cinfo = capture.get_info()
+            if self.root_damage:
+                cinfo["refresh-delay"] = self.get_damage_refresh_delay()
+            else:
+                cinfo["refresh-delay"] = self.refresh_delay
+            info["capture"] = cinfo
         return info
 
     def do_make_screenshot_packet(self):